@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Configure Mellanox network adapters into switchdev mode"""
+
+from mlnx_switchdev_mode.client import TopologyClient  # noqa: F401
+from mlnx_switchdev_mode.representors import (  # noqa: F401
+    RepresentorIndex,
+    VFPort,
+    read_index as read_representor_index,
+)
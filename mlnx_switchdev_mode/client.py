@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Client of the topology query service, see server"""
+
+import json
+import socket
+import typing
+
+from mlnx_switchdev_mode import representors
+from mlnx_switchdev_mode import topology
+
+
+class TopologyClient(object):
+    """Queries the topology kept by a running ``serve`` subcommand"""
+
+    def __init__(self, socket_path: str = None, timeout: float = 5.0):
+        """Initialise a new topology client
+
+        The connection is made on the first query and kept open.
+
+        :param socket_path: path of socket, defaults to server.SOCKET_PATH
+        :type: str
+        :param timeout: seconds to wait for a response
+        :type: float
+        """
+        # NOTE: the package exports the client, the server is only imported
+        # by clients so that the command line tool does not load it
+        from mlnx_switchdev_mode import server
+        self.socket_path = socket_path or server.SOCKET_PATH
+        self._timeout = timeout
+        self._sock = None
+        self._reader = None
+
+    def query(self, query: str, **params) -> typing.Any:
+        """Send a query, see server.TopologyState.query()
+
+        :param query: name of query
+        :type: str
+        :return: result of query
+        :rtype: typing.Any
+        :raises: server.QueryError if the server rejected the query
+        :raises: OSError if the server can not be reached
+        """
+        if self._sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._sock = sock
+            self._reader = sock.makefile("rb")
+        request = dict(params, query=query)
+        try:
+            self._sock.sendall(
+                (json.dumps(request) + "\n").encode("utf-8"))
+            line = self._reader.readline()
+            if not line:
+                raise ConnectionResetError("Server closed the connection")
+        except OSError:
+            self.close()
+            raise
+        response = json.loads(line.decode("utf-8"))
+        if "error" in response:
+            from mlnx_switchdev_mode import server
+            raise server.QueryError(response["error"])
+        return response["result"]
+
+    def status(self) -> typing.Dict:
+        return self.query("status")
+
+    def scan(self) -> topology.Topology:
+        """Snapshot of the PCI function to netdev topology
+
+        :return: topology as known to the server
+        :rtype: topology.Topology
+        """
+        status = self.status()
+        return topology.Topology(
+            (_function(function) for function in self.query("functions")),
+            root=status["sysfs_root"])
+
+    def pfs(self) -> typing.List[topology.PCIFunction]:
+        """SR-IOV Physical Functions
+
+        :return: PFs ordered by PCI address
+        :rtype: typing.List[topology.PCIFunction]
+        """
+        return [_function(pf) for pf in self.query("pfs")]
+
+    def function(self, name: str) -> topology.PCIFunction:
+        """Look up a PCI function
+
+        :param name: PCI address or netdev name
+        :type: str
+        :return: PCI function
+        :rtype: topology.PCIFunction
+        """
+        return _function(self.query("function", name=name))
+
+    def vfs(self, pf: str) -> typing.List[topology.PCIFunction]:
+        """SR-IOV Virtual Functions of a Physical Function
+
+        :param pf: PCI address or netdev name of PF
+        :type: str
+        :return: VFs ordered by VF index
+        :rtype: typing.List[topology.PCIFunction]
+        """
+        return [_function(vf) for vf in self.query("vfs", pf=pf)]
+
+    def eswitch_modes(self) -> typing.Dict[str, typing.Optional[str]]:
+        """eswitch mode of mlx5_core PFs
+
+        :return: PCI address to eswitch mode mappings
+        :rtype: typing.Dict[str, typing.Optional[str]]
+        """
+        return self.query("eswitch")
+
+    def representors(self, pf: str = None) -> representors.RepresentorIndex:
+        """VFs of PFs and their representors
+
+        :param pf: only index the VFs of this PF
+        :type: str
+        :return: index
+        :rtype: representors.RepresentorIndex
+        """
+        return representors.RepresentorIndex(
+            representors.VFPort(**port)
+            for port in self.query("representors", pf=pf))
+
+    def close(self):
+        if self._sock is not None:
+            self._reader.close()
+            self._sock.close()
+            self._sock = None
+            self._reader = None
+
+    def __enter__(self) -> 'TopologyClient':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _function(data: typing.Dict) -> topology.PCIFunction:
+    return topology.PCIFunction(
+        pci_addr=data["pci_addr"],
+        driver=data["driver"],
+        physfn=data["physfn"],
+        vf_addrs=tuple(data["vf_addrs"]),
+        netdevs=tuple(data["netdevs"]),
+        sriov=data["sriov"],
+    )
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Configuration files"""
+
+import collections
+import typing
+
+from mlnx_switchdev_mode import topology
+
+
+VF_CONFIG_PATH = "/etc/mlnx-switchdev-mode/sriov-vfs.conf"
+BIND_POLICY_PATH = "/etc/mlnx-switchdev-mode/bind-vfs.conf"
+
+# Name of the rule of a bind policy applying to PFs not named otherwise
+DEFAULT_PF = "*"
+
+
+class ConfigError(Exception):
+    pass
+
+
+def parse_vf_config(lines: typing.Iterable[str],
+                    name: str = "<config>") -> typing.Dict[str, int]:
+    """Parse a VF provisioning configuration
+
+    Every line names a PF, by PCI address or netdev name, followed by the
+    number of VFs it should have, separated by whitespace. Empty lines and
+    everything following a # are ignored::
+
+        # PF            VFs
+        0000:03:00.0    16
+        enp3s0f1        8
+
+    :param lines: lines of configuration
+    :type: typing.Iterable[str]
+    :param name: name of configuration used in errors
+    :type: str
+    :return: PF to VF count mappings in order of configuration
+    :rtype: typing.Dict[str, int]
+    :raises: ConfigError on invalid lines or PFs configured more than once
+    """
+    vfs = collections.OrderedDict()
+    for lineno, line in enumerate(lines, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        try:
+            pf, count = fields
+            count = int(count)
+            if count < 0:
+                raise ValueError(count)
+        except ValueError:
+            raise ConfigError(
+                "{}:{}: expected a PF and a number of VFs: {!r}"
+                .format(name, lineno, line.strip()))
+        if pf in vfs:
+            raise ConfigError("{}:{}: {} configured more than once"
+                              .format(name, lineno, pf))
+        vfs[pf] = count
+    return vfs
+
+
+def read_vf_config(path: str = None) -> typing.Dict[str, int]:
+    """Read a VF provisioning configuration file, see parse_vf_config()
+
+    :param path: path to configuration, defaults to VF_CONFIG_PATH
+    :type: str
+    :return: PF to VF count mappings in order of configuration
+    :rtype: typing.Dict[str, int]
+    :raises: ConfigError if the file can not be read or is invalid
+    """
+    path = path or VF_CONFIG_PATH
+    try:
+        with open(path, "rt") as f:
+            return parse_vf_config(f, name=path)
+    except OSError as e:
+        raise ConfigError("Unable to read {}: {}".format(path, e))
+
+
+def resolve_pfs(vfs: typing.Dict[str, int],
+                snapshot: topology.Topology
+                ) -> typing.List[typing.Tuple[topology.PCIFunction, int]]:
+    """Look up configured PFs in a topology
+
+    :param vfs: PF to VF count mappings, see parse_vf_config()
+    :type: typing.Dict[str, int]
+    :param snapshot: topology to look PFs up in
+    :type: topology.Topology
+    :return: PFs and their VF counts, ordered by PCI address
+    :rtype: typing.List[typing.Tuple[topology.PCIFunction, int]]
+    :raises: ConfigError if a PF does not exist, is not SR-IOV capable or
+             is configured by both address and netdev name
+    """
+    resolved = {}
+    for name, count in vfs.items():
+        pci_addr = snapshot.netdevs.get(name, name)
+        if pci_addr not in snapshot:
+            raise ConfigError("{}: no such PCI function or netdev"
+                              .format(name))
+        pf = snapshot[pci_addr]
+        if not pf.is_pf:
+            raise ConfigError("{}: {} is not a SR-IOV Physical Function"
+                              .format(name, pci_addr))
+        if pci_addr in resolved:
+            raise ConfigError("{}: {} configured more than once"
+                              .format(name, pci_addr))
+        resolved[pci_addr] = (pf, count)
+    return [resolved[pci_addr] for pci_addr in sorted(resolved)]
+
+
+class VFSelection(collections.namedtuple(
+        "VFSelection", ["first", "indexes"])):
+    """VFs of a PF selected by VF index
+
+    Selected are the VFs with an index below ``first`` which are also in
+    ``indexes``, either constraint applies only when not None.
+    """
+
+    __slots__ = ()
+
+    def selects(self, vf_index: int) -> bool:
+        """Determine if a VF is selected
+
+        :param vf_index: index of VF on its PF
+        :type: int
+        :return: whether VF is selected
+        :rtype: bool
+        """
+        if self.first is not None and vf_index >= self.first:
+            return False
+        return self.indexes is None or vf_index in self.indexes
+
+    def __str__(self) -> str:
+        """String represenation of object
+
+        :return: selection as written in a bind policy
+        :rtype: str
+        """
+        if self.indexes is not None:
+            return "index {}".format(",".join(
+                str(index) for index in sorted(self.indexes)))
+        if self.first == 0:
+            return "none"
+        if self.first is not None:
+            return "first {}".format(self.first)
+        return "all"
+
+
+ALL_VFS = VFSelection(None, None)
+NO_VFS = VFSelection(0, None)
+
+
+def parse_vf_selection(fields: typing.Sequence[str]) -> VFSelection:
+    """Parse the VFs selected by a bind policy rule
+
+    :param fields: all, none, first N or index LIST, where LIST are comma
+                   separated VF indexes and ranges of them, e.g. 0,4-7
+    :type: typing.Sequence[str]
+    :return: selected VFs
+    :rtype: VFSelection
+    :raises: ValueError if fields are invalid
+    """
+    fields = tuple(fields)
+    if fields == ("all",):
+        return ALL_VFS
+    if fields == ("none",):
+        return NO_VFS
+    if len(fields) == 2 and fields[0] == "first":
+        first = int(fields[1])
+        if first < 0:
+            raise ValueError(first)
+        return VFSelection(first, None)
+    if len(fields) == 2 and fields[0] == "index":
+        indexes = set()
+        for part in fields[1].split(","):
+            start, _, end = part.partition("-")
+            start, end = int(start), int(end or start)
+            if start < 0 or end < start:
+                raise ValueError(part)
+            indexes.update(range(start, end + 1))
+        return VFSelection(None, frozenset(indexes))
+    raise ValueError(" ".join(fields))
+
+
+class BindPolicy(object):
+    """VFs of PFs to bind to mlx5_core, all of them by default"""
+
+    def __init__(self,
+                 selections: typing.Dict[str, VFSelection] = None):
+        """Initialise a new bind policy
+
+        :param selections: PF, by PCI address or netdev name, or DEFAULT_PF
+                           to VF selection mappings
+        :type: typing.Dict[str, VFSelection]
+        """
+        self.selections = collections.OrderedDict(selections or ())
+
+    def selection(self, pf: topology.PCIFunction) -> VFSelection:
+        """VFs of a PF selected by the policy
+
+        :param pf: PF
+        :type: topology.PCIFunction
+        :return: selected VFs
+        :rtype: VFSelection
+        """
+        for name in (pf.pci_addr,) + tuple(pf.netdevs):
+            if name in self.selections:
+                return self.selections[name]
+        return self.selections.get(DEFAULT_PF, ALL_VFS)
+
+    def select(self, pf: topology.PCIFunction,
+               vfs: typing.Iterable[topology.PCIFunction]
+               ) -> typing.List[topology.PCIFunction]:
+        """Filter VFs of a PF by the policy
+
+        :param pf: PF
+        :type: topology.PCIFunction
+        :param vfs: VFs of PF
+        :type: typing.Iterable[topology.PCIFunction]
+        :return: selected VFs, in the order of ``vfs``
+        :rtype: typing.List[topology.PCIFunction]
+        """
+        selection = self.selection(pf)
+        indexes = {vf_addr: index for index, vf_addr in enumerate(pf.vf_addrs)}
+        return [vf for vf in vfs
+                if vf.pci_addr in indexes and
+                selection.selects(indexes[vf.pci_addr])]
+
+    def unknown(self, snapshot: topology.Topology) -> typing.List[str]:
+        """PFs named by the policy which are not PFs of a topology
+
+        :param snapshot: topology
+        :type: topology.Topology
+        :return: names of rules matching no PF
+        :rtype: typing.List[str]
+        """
+        names = set()
+        for pf in snapshot.pfs():
+            names.add(pf.pci_addr)
+            names.update(pf.netdevs)
+        return [name for name in self.selections
+                if name != DEFAULT_PF and name not in names]
+
+    def to_dict(self) -> typing.Dict[str, str]:
+        """JSON serialisable representation of the policy
+
+        :return: PF to VF selection mappings
+        :rtype: typing.Dict[str, str]
+        """
+        return {name: str(selection)
+                for name, selection in self.selections.items()}
+
+
+def parse_bind_policy(lines: typing.Iterable[str],
+                      name: str = "<config>") -> BindPolicy:
+    """Parse a VF bind policy
+
+    Every line names a PF, by PCI address or netdev name, or * for all
+    PFs not named otherwise, followed by the VFs of the PF to bind, see
+    parse_vf_selection(). PFs not named at all have all their VFs bound.
+    Empty lines and everything following a # are ignored::
+
+        # PF            VFs
+        *               first 2
+        0000:03:00.0    index 0,4-7
+        enp3s0f1        none
+
+    :param lines: lines of configuration
+    :type: typing.Iterable[str]
+    :param name: name of configuration used in errors
+    :type: str
+    :return: bind policy
+    :rtype: BindPolicy
+    :raises: ConfigError on invalid lines or PFs configured more than once
+    """
+    selections = collections.OrderedDict()
+    for lineno, line in enumerate(lines, 1):
+        fields = line.split("#", 1)[0].split()
+        if not fields:
+            continue
+        pf = fields[0]
+        try:
+            selection = parse_vf_selection(fields[1:])
+        except ValueError:
+            raise ConfigError(
+                "{}:{}: expected a PF and all, none, first N or index LIST: "
+                "{!r}".format(name, lineno, line.strip()))
+        if pf in selections:
+            raise ConfigError("{}:{}: {} configured more than once"
+                              .format(name, lineno, pf))
+        selections[pf] = selection
+    return BindPolicy(selections)
+
+
+def read_bind_policy(path: str = None) -> BindPolicy:
+    """Read a VF bind policy file, see parse_bind_policy()
+
+    :param path: path to policy, defaults to BIND_POLICY_PATH which binds
+                 all VFs when it does not exist
+    :type: str
+    :return: bind policy
+    :rtype: BindPolicy
+    :raises: ConfigError if the file can not be read or is invalid
+    """
+    optional = path is None
+    path = path or BIND_POLICY_PATH
+    try:
+        with open(path, "rt") as f:
+            return parse_bind_policy(f, name=path)
+    except FileNotFoundError as e:
+        if optional:
+            return BindPolicy()
+        raise ConfigError("Unable to read {}: {}".format(path, e))
+    except OSError as e:
+        raise ConfigError("Unable to read {}: {}".format(path, e))
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deadlines bounding the time spent in operations which may hang
+
+A devlink call or a write to a sysfs driver attribute blocks in the kernel
+for as long as the driver, and possibly the device firmware, takes. Such a
+call can not be interrupted. call() instead runs it on a thread of its own
+and stops waiting for it once its timeout expires, abandoning the thread.
+"""
+
+import threading
+import time
+import typing
+
+from mlnx_switchdev_mode import report
+
+
+# Seconds a single devlink call or VF bind or unbind may take, no limit if
+# None
+DEVLINK_TIMEOUT = None
+VF_TIMEOUT = None
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline(object):
+    """Point in time by which a run has to be done"""
+
+    def __init__(self, timeout: float = None):
+        """Initialise a new deadline
+
+        :param timeout: seconds from now, no deadline if None
+        :type: float
+        """
+        self.timeout = timeout
+        self._expires = (time.monotonic() + timeout
+                         if timeout is not None else None)
+
+    def remaining(self) -> typing.Optional[float]:
+        """Time left until the deadline
+
+        :return: seconds left, negative once expired, None without deadline
+        :rtype: typing.Optional[float]
+        """
+        if self._expires is None:
+            return None
+        return self._expires - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def bound(self, timeout: float = None) -> typing.Optional[float]:
+        """Timeout of an operation which has to complete by the deadline
+
+        :param timeout: timeout of operation, None for no timeout
+        :type: float
+        :return: lesser of timeout and the time left, None if neither is
+                 bounded
+        :rtype: typing.Optional[float]
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+
+_active = Deadline()
+
+
+def activate(deadline: Deadline) -> Deadline:
+    """Make a deadline the one bounding all operations
+
+    :param deadline: deadline to activate
+    :type: Deadline
+    :return: the activated deadline
+    :rtype: Deadline
+    """
+    global _active
+    _active = deadline
+    return deadline
+
+
+def current() -> Deadline:
+    """Deadline bounding all operations
+
+    :return: active deadline
+    :rtype: Deadline
+    """
+    return _active
+
+
+def call(name: str, func: typing.Callable, *args,
+         timeout: float = None, **kwargs) -> typing.Any:
+    """Call a function which may hang, bounded by a timeout and the deadline
+
+    Without timeout and deadline func is called directly. Otherwise it runs
+    on a daemon thread, which is abandoned when it does not complete in
+    time. An abandoned thread keeps running until func returns, but no
+    longer holds up the caller, nor the exit of the process.
+
+    :param name: description of the operation used in errors
+    :type: str
+    :param func: function to call
+    :type: typing.Callable
+    :param timeout: seconds func may take, bounded by the active deadline
+    :type: float
+    :return: return value of func
+    :rtype: typing.Any
+    :raises: DeadlineExceeded if func did not complete in time, or the
+             deadline expired before it was called
+    """
+    timeout = _active.bound(timeout)
+    if timeout is None:
+        return func(*args, **kwargs)
+    if timeout <= 0:
+        raise DeadlineExceeded("{}: deadline of {}s exceeded".format(
+            name, _active.timeout))
+    import concurrent.futures
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        if future.done():
+            # NOTE: func itself timed out
+            raise
+        report.count("abandoned")
+        raise DeadlineExceeded("{}: did not complete within {:.1f}s, "
+                               "abandoned".format(name, timeout))
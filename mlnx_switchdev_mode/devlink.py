@@ -0,0 +1,887 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Access to devlink over generic netlink or the devlink command"""
+
+import contextlib
+import errno
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import typing
+
+from mlnx_switchdev_mode import deadline
+from mlnx_switchdev_mode import report
+from mlnx_switchdev_mode import retry
+
+
+DEVLINK_CMD = "/sbin/devlink"
+
+# Backend used by get_backend(), one of 'auto', 'netlink' or 'subprocess'.
+BACKEND = "auto"
+
+NETLINK_GENERIC = 16
+
+NLM_F_REQUEST = 0x1
+NLM_F_ACK = 0x4
+NLM_F_DUMP = 0x300
+
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+
+NLA_TYPE_MASK = 0x3fff
+
+GENL_ID_CTRL = 0x10
+CTRL_CMD_GETFAMILY = 3
+CTRL_ATTR_FAMILY_ID = 1
+CTRL_ATTR_FAMILY_NAME = 2
+
+DEVLINK_GENL_NAME = "devlink"
+DEVLINK_GENL_VERSION = 1
+
+DEVLINK_CMD_GET = 1
+DEVLINK_CMD_ESWITCH_GET = 29
+DEVLINK_CMD_ESWITCH_SET = 30
+
+DEVLINK_ATTR_BUS_NAME = 1
+DEVLINK_ATTR_DEV_NAME = 2
+DEVLINK_ATTR_ESWITCH_MODE = 25
+DEVLINK_ATTR_ESWITCH_INLINE_MODE = 26
+DEVLINK_ATTR_ESWITCH_ENCAP_MODE = 62
+
+# devlink eswitch properties as named by the devlink command, mapped to
+# netlink attribute, attribute format and values.
+ESWITCH_ATTRS = {
+    "mode": (DEVLINK_ATTR_ESWITCH_MODE, "=H",
+             {0: "legacy", 1: "switchdev"}),
+    "inline-mode": (DEVLINK_ATTR_ESWITCH_INLINE_MODE, "=B",
+                    {0: "none", 1: "link", 2: "network", 3: "transport"}),
+    "encap": (DEVLINK_ATTR_ESWITCH_ENCAP_MODE, "=B",
+              {0: "disable", 1: "enable"}),
+}
+
+# Aliases of newer devlink command versions for properties and values
+ESWITCH_ALIASES = {
+    ("encap-mode", "basic"): ("encap", "enable"),
+    ("encap-mode", "none"): ("encap", "disable"),
+}
+
+# eswitch configuration applied by default
+DEFAULT_ESWITCH_CONFIG = {"mode": "switchdev"}
+
+# Number of requests pipelined before replies are read, this keeps the
+# replies well within the default socket receive buffer.
+BULK_BATCH_SIZE = 64
+
+_NLMSGHDR = struct.Struct("=LHHLL")
+_GENLMSGHDR = struct.Struct("=BBH")
+_NLATTR = struct.Struct("=HH")
+_NLMSGERR = struct.Struct("=i")
+
+
+class DevlinkError(OSError):
+    pass
+
+
+def parse_error(stderr: str) -> typing.Optional[int]:
+    """errno of a failed request from the messages of the devlink command
+
+    devlink reports the error the kernel answered a request with by its
+    description, e.g. "kernel answers: Device or resource busy".
+
+    :param stderr: standard error of devlink
+    :type: str
+    :return: errno or None if no message names a known error
+    :rtype: typing.Optional[int]
+    """
+    descriptions = {os.strerror(code): code for code in errno.errorcode}
+    for line in reversed(stderr.splitlines()):
+        description = line.rsplit(": ", 1)[-1].strip().rstrip(".")
+        if description in descriptions:
+            return descriptions[description]
+    return None
+
+
+def run_command(args: typing.List[str]) -> str:
+    """Run the devlink command
+
+    Its standard error is passed on, and parsed for the error of a failed
+    request so that callers can tell transient errors apart.
+
+    :param args: command line
+    :type: typing.List[str]
+    :return: standard output of devlink
+    :rtype: str
+    :raises: DevlinkError if devlink failed with an error of the kernel,
+             subprocess.CalledProcessError if it failed otherwise
+    """
+    # NOTE: only the devlink command backend runs processes
+    import subprocess
+    proc = subprocess.run(args, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.stderr:
+        sys.stderr.write(proc.stderr)
+    if proc.returncode:
+        error = parse_error(proc.stderr)
+        if error is not None:
+            raise DevlinkError(error, "{}: {}".format(" ".join(args),
+                                                      os.strerror(error)))
+        raise subprocess.CalledProcessError(proc.returncode, args,
+                                            output=proc.stdout,
+                                            stderr=proc.stderr)
+    return proc.stdout
+
+
+def normalize_eswitch(props: typing.Dict[str, str]) -> typing.Dict[str, str]:
+    """Name eswitch properties as older devlink command versions do
+
+    :param props: eswitch properties as reported by any devlink version
+    :type: typing.Dict[str, str]
+    :return: eswitch properties named as in ESWITCH_ATTRS
+    :rtype: typing.Dict[str, str]
+    """
+    return dict(ESWITCH_ALIASES.get((prop, value), (prop, value))
+                for prop, value in props.items())
+
+
+def eswitch_changes(current: typing.Dict[str, str],
+                    desired: typing.Dict[str, str]) -> typing.Dict[str, str]:
+    """eswitch properties to set to get a device into a desired state
+
+    All desired properties are set along with a change of mode, as the
+    driver rebuilds the eswitch on a mode change anyway.
+
+    :param current: current eswitch properties
+    :type: typing.Dict[str, str]
+    :param desired: desired eswitch properties
+    :type: typing.Dict[str, str]
+    :return: properties to set in one request, empty if the device already
+             is in the desired state
+    :rtype: typing.Dict[str, str]
+    """
+    changes = {prop: value for prop, value in desired.items()
+               if current.get(prop) != value}
+    if "mode" in changes:
+        return dict(desired)
+    return changes
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def pack_attr(attr_type: int, data: bytes) -> bytes:
+    """Pack a netlink attribute
+
+    :param attr_type: attribute type
+    :type: int
+    :param data: attribute payload
+    :type: bytes
+    :return: packed and padded attribute
+    :rtype: bytes
+    """
+    length = _NLATTR.size + len(data)
+    return (_NLATTR.pack(length, attr_type) + data +
+            b"\0" * (_align(length) - length))
+
+
+def pack_string(attr_type: int, value: str) -> bytes:
+    """Pack a NUL terminated string netlink attribute
+
+    :param attr_type: attribute type
+    :type: int
+    :param value: attribute value
+    :type: str
+    :return: packed and padded attribute
+    :rtype: bytes
+    """
+    return pack_attr(attr_type, value.encode() + b"\0")
+
+
+def parse_attrs(data: bytes) -> typing.Dict[int, bytes]:
+    """Parse a stream of netlink attributes
+
+    :param data: packed attributes
+    :type: bytes
+    :return: attribute type to payload mappings
+    :rtype: typing.Dict[int, bytes]
+    """
+    attrs = {}
+    offset = 0
+    while offset + _NLATTR.size <= len(data):
+        length, attr_type = _NLATTR.unpack_from(data, offset)
+        if length < _NLATTR.size:
+            break
+        attrs[attr_type & NLA_TYPE_MASK] = bytes(
+            data[offset + _NLATTR.size:offset + length])
+        offset += _align(length)
+    return attrs
+
+
+def parse_string(data: bytes) -> str:
+    """Parse a NUL terminated string netlink attribute payload
+
+    :param data: attribute payload
+    :type: bytes
+    :return: attribute value
+    :rtype: str
+    """
+    return data.split(b"\0", 1)[0].decode()
+
+
+def pack_message(msg_type: int, flags: int, seq: int, cmd: int,
+                 version: int, attrs: bytes = b"") -> bytes:
+    """Pack a generic netlink message
+
+    :param msg_type: netlink message type, i.e. the generic netlink family
+    :type: int
+    :param flags: netlink message flags
+    :type: int
+    :param seq: sequence number
+    :type: int
+    :param cmd: generic netlink command
+    :type: int
+    :param version: generic netlink family version
+    :type: int
+    :param attrs: packed attributes
+    :type: bytes
+    :return: packed message
+    :rtype: bytes
+    """
+    payload = _GENLMSGHDR.pack(cmd, version, 0) + attrs
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type, flags,
+                          seq, 0) + payload
+
+
+def parse_messages(data: bytes) -> typing.List[tuple]:
+    """Parse a buffer of netlink messages
+
+    :param data: buffer received from a netlink socket
+    :type: bytes
+    :return: list of (type, flags, seq, payload) tuples
+    :rtype: typing.List[tuple]
+    """
+    messages = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        messages.append((msg_type, flags, seq,
+                         bytes(data[offset + _NLMSGHDR.size:
+                                    offset + length])))
+        offset += _align(length)
+    return messages
+
+
+class NetlinkSocket(object):
+    """Generic netlink socket"""
+
+    def __init__(self, sock: socket.socket = None):
+        """Initialise a new generic netlink socket
+
+        :param sock: already connected socket to use instead of opening a
+                     NETLINK_GENERIC socket, e.g. for testing
+        :type: socket.socket
+        """
+        if sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 NETLINK_GENERIC)
+            sock.bind((0, 0))
+        self._sock = sock
+
+    def send(self, data: bytes):
+        """Send a message to the kernel
+
+        :param data: packed netlink message
+        :type: bytes
+        """
+        self._sock.send(data)
+
+    def recv(self) -> bytes:
+        """Receive messages from the kernel
+
+        :return: buffer of netlink messages
+        :rtype: bytes
+        """
+        return self._sock.recv(65536)
+
+    def close(self):
+        """Close the socket"""
+        self._sock.close()
+
+
+def _merge_pairs(pairs: typing.List[tuple]) -> dict:
+    obj = {}
+    for key, value in pairs:
+        if isinstance(value, dict) and isinstance(obj.get(key), dict):
+            obj[key].update(value)
+        else:
+            obj[key] = value
+    return obj
+
+
+def parse_json_stream(data: str) -> typing.List[dict]:
+    """Parse output of the devlink command in batch mode
+
+    Depending on version, devlink prints one JSON object per command or a
+    single object with a repeated 'dev' key; both are handled.
+
+    :param data: devlink output
+    :type: str
+    :return: parsed objects with repeated keys merged
+    :rtype: typing.List[dict]
+    """
+    decoder = json.JSONDecoder(object_pairs_hook=_merge_pairs)
+    objs = []
+    offset = 0
+    data = data.strip()
+    while offset < len(data):
+        obj, offset = decoder.raw_decode(data, offset)
+        objs.append(obj)
+        while offset < len(data) and data[offset].isspace():
+            offset += 1
+    return objs
+
+
+class SubprocessDevlink(object):
+    """devlink backend running the devlink command"""
+
+    def get(self, obj_name: str, handle: str) -> dict:
+        """Query devlink for information about a device
+
+        :param obj_name: devlink object to query
+        :type: str
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :return: Dictionary of information about the device
+        :rtype: dict
+        """
+        out = run_command(
+            [
+                DEVLINK_CMD,
+                "dev",
+                obj_name,
+                "show",
+                handle,
+                "--json",
+            ]
+        )
+        props = json.loads(out)["dev"][handle]
+        if obj_name == "eswitch":
+            return normalize_eswitch(props)
+        return props
+
+    def dev_list(self) -> typing.List[str]:
+        """List devlink devices
+
+        :return: devlink device handles
+        :rtype: typing.List[str]
+        """
+        import subprocess
+        out = subprocess.check_output([DEVLINK_CMD, "dev", "show", "--json"])
+        return list(json.loads(out)["dev"])
+
+    def eswitch_show_all(self, handles: typing.Iterable[str] = None
+                         ) -> typing.Dict[str, dict]:
+        """Query eswitch configuration of many devices at once
+
+        devlink does not accept 'dev eswitch show' without a device, so all
+        queries are run by a single devlink process in batch mode.
+
+        :param handles: devlink device handles, defaults to all devices
+        :type: typing.Iterable[str]
+        :return: handle to eswitch properties mappings, devices without
+                 eswitch support are left out
+        :rtype: typing.Dict[str, dict]
+        """
+        import subprocess
+        if handles is None:
+            handles = self.dev_list()
+        handles = list(handles)
+        if not handles:
+            return {}
+        batch = "".join("dev eswitch show {}\n".format(handle)
+                        for handle in handles)
+        proc = subprocess.run(
+            [DEVLINK_CMD, "--json", "--force", "--batch", "-"],
+            input=batch.encode(), stdout=subprocess.PIPE)
+        eswitches = {}
+        for obj in parse_json_stream(proc.stdout.decode()):
+            eswitches.update(
+                (handle, normalize_eswitch(props))
+                for handle, props in obj.get("dev", {}).items())
+        return eswitches
+
+    def eswitch_set(self, handle: str, props: typing.Dict[str, str]):
+        """Set eswitch configuration of a device in one request
+
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :param props: eswitch properties as named by the devlink command
+        :type: typing.Dict[str, str]
+        """
+        args = [DEVLINK_CMD, "dev", "eswitch", "set", handle]
+        for prop, value in props.items():
+            args.extend((prop, value))
+        run_command(args)
+
+    def set(self, obj_name: str, handle: str, prop: str, value: str):
+        """Set devlink options for a device
+
+        :param obj_name: devlink object to set options on
+        :type: str
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :param prop: property to set
+        :type: str
+        :param value: value to set for property
+        :type: str
+        """
+        run_command(
+            [
+                DEVLINK_CMD,
+                "dev",
+                obj_name,
+                "set",
+                handle,
+                prop,
+                value,
+            ]
+        )
+
+
+class NetlinkDevlink(object):
+    """devlink backend talking generic netlink to the kernel
+
+    Each request takes a socket of its own from a pool and returns it once
+    the replies are read, so devices can be configured concurrently while
+    no more sockets are opened than requests were in flight at once.
+    Objects other than eswitch are handled by the fallback backend.
+    """
+
+    def __init__(self, socket_factory: typing.Callable = None,
+                 fallback: SubprocessDevlink = None):
+        """Initialise a new netlink devlink backend
+
+        :param socket_factory: callable returning a new NetlinkSocket like
+                               object with send, recv and close methods,
+                               defaults to NetlinkSocket
+        :type: typing.Callable
+        :param fallback: backend for objects not supported over netlink
+        :type: SubprocessDevlink
+        """
+        self._socket_factory = socket_factory or NetlinkSocket
+        self._fallback = fallback or SubprocessDevlink()
+        self._lock = threading.Lock()
+        self._sockets = []
+        self._idle = []
+        self._seq = 0
+        self._family_id = None
+
+    @contextlib.contextmanager
+    def _socket(self):
+        """Take a socket from the pool for the duration of a request
+
+        Requests may run on threads of their own, see deadline.call(), a
+        socket per thread would open a new socket for each of them.
+        """
+        with self._lock:
+            sock = self._idle.pop() if self._idle else None
+        if sock is None:
+            sock = self._socket_factory()
+            with self._lock:
+                self._sockets.append(sock)
+        try:
+            yield sock
+        except BaseException:
+            # NOTE: replies of an interrupted request may still be queued
+            with self._lock:
+                if sock in self._sockets:
+                    self._sockets.remove(sock)
+            sock.close()
+            raise
+        with self._lock:
+            if sock in self._sockets:
+                self._idle.append(sock)
+                return
+        # NOTE: the backend was closed while the request was in flight
+        sock.close()
+
+    def _next_seq(self) -> int:
+        with self._lock:
+            self._seq += 1
+            return self._seq
+
+    def _transact(self, requests: typing.Sequence[tuple]) -> typing.List:
+        """Send a batch of requests and collect the replies
+
+        All requests are sent before any reply is read so the batch costs a
+        single round trip to the kernel.
+
+        :param requests: (msg_type, cmd, version, attrs, flags) tuples
+        :type: typing.Sequence[tuple]
+        :return: for each request either the list of attributes of its
+                 replies or the DevlinkError reported by the kernel
+        :rtype: typing.List
+        """
+        with self._socket() as sock:
+            pending = {}
+            results = [[] for _ in requests]
+            for index, (msg_type, cmd, version, attrs, flags) in enumerate(
+                    requests):
+                seq = self._next_seq()
+                pending[seq] = index
+                sock.send(pack_message(msg_type,
+                                       NLM_F_REQUEST | NLM_F_ACK | flags,
+                                       seq, cmd, version, attrs))
+            while pending:
+                data = sock.recv()
+                if not data:
+                    raise DevlinkError(errno.ECONNRESET,
+                                       os.strerror(errno.ECONNRESET))
+                for reply_type, _, reply_seq, payload in parse_messages(data):
+                    if reply_seq not in pending:
+                        continue
+                    index = pending[reply_seq]
+                    if reply_type == NLMSG_ERROR:
+                        error = -_NLMSGERR.unpack_from(payload)[0]
+                        if error:
+                            results[index] = DevlinkError(error,
+                                                          os.strerror(error))
+                        del pending[reply_seq]
+                    elif reply_type == NLMSG_DONE:
+                        del pending[reply_seq]
+                    else:
+                        results[index].append(
+                            parse_attrs(payload[_GENLMSGHDR.size:]))
+            return results
+
+    def _request(self, msg_type: int, cmd: int, version: int,
+                 attrs: bytes = b"", flags: int = 0) -> typing.List[dict]:
+        """Send a request and collect the replies
+
+        :param msg_type: generic netlink family
+        :type: int
+        :param cmd: generic netlink command
+        :type: int
+        :param version: generic netlink family version
+        :type: int
+        :param attrs: packed attributes
+        :type: bytes
+        :param flags: extra netlink message flags
+        :type: int
+        :return: attributes of each reply
+        :rtype: typing.List[dict]
+        :raises: DevlinkError if the kernel reports an error
+        """
+        result = self._transact([(msg_type, cmd, version, attrs, flags)])[0]
+        if isinstance(result, DevlinkError):
+            raise result
+        return result
+
+    @property
+    def family_id(self) -> int:
+        """Generic netlink family id of devlink
+
+        :return: family id
+        :rtype: int
+        :raises: DevlinkError if devlink is not available
+        """
+        if self._family_id is None:
+            replies = self._request(
+                GENL_ID_CTRL, CTRL_CMD_GETFAMILY, 1,
+                pack_string(CTRL_ATTR_FAMILY_NAME, DEVLINK_GENL_NAME))
+            for attrs in replies:
+                if CTRL_ATTR_FAMILY_ID in attrs:
+                    self._family_id = struct.unpack(
+                        "=H", attrs[CTRL_ATTR_FAMILY_ID][:2])[0]
+                    break
+            else:
+                raise DevlinkError(errno.ENOENT,
+                                   "devlink generic netlink family not found")
+        return self._family_id
+
+    @staticmethod
+    def _handle_attrs(handle: str) -> bytes:
+        bus_name, _, dev_name = handle.partition("/")
+        return (pack_string(DEVLINK_ATTR_BUS_NAME, bus_name) +
+                pack_string(DEVLINK_ATTR_DEV_NAME, dev_name))
+
+    @staticmethod
+    def _eswitch_props(replies: typing.List[dict]) -> dict:
+        eswitch = {}
+        for attrs in replies:
+            for prop, (attr_type, fmt, values) in ESWITCH_ATTRS.items():
+                if attr_type in attrs:
+                    value = struct.unpack_from(fmt, attrs[attr_type])[0]
+                    eswitch[prop] = values.get(value, str(value))
+        return eswitch
+
+    def eswitch_get(self, handle: str) -> dict:
+        """Query eswitch configuration of a device
+
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :return: eswitch properties as reported by the devlink command
+        :rtype: dict
+        """
+        return self._eswitch_props(
+            self._request(self.family_id, DEVLINK_CMD_ESWITCH_GET,
+                          DEVLINK_GENL_VERSION, self._handle_attrs(handle)))
+
+    def dev_list(self) -> typing.List[str]:
+        """List devlink devices
+
+        :return: devlink device handles
+        :rtype: typing.List[str]
+        """
+        return [
+            "{}/{}".format(parse_string(attrs[DEVLINK_ATTR_BUS_NAME]),
+                           parse_string(attrs[DEVLINK_ATTR_DEV_NAME]))
+            for attrs in self._request(self.family_id, DEVLINK_CMD_GET,
+                                       DEVLINK_GENL_VERSION,
+                                       flags=NLM_F_DUMP)
+            if DEVLINK_ATTR_BUS_NAME in attrs and
+            DEVLINK_ATTR_DEV_NAME in attrs
+        ]
+
+    def eswitch_show_all(self, handles: typing.Iterable[str] = None
+                         ) -> typing.Dict[str, dict]:
+        """Query eswitch configuration of many devices at once
+
+        The kernel has no dump operation for eswitch configuration, so one
+        request per device is pipelined over the socket.
+
+        :param handles: devlink device handles, defaults to all devices
+        :type: typing.Iterable[str]
+        :return: handle to eswitch properties mappings, devices without
+                 eswitch support are left out
+        :rtype: typing.Dict[str, dict]
+        """
+        if handles is None:
+            handles = self.dev_list()
+        handles = list(handles)
+        eswitches = {}
+        for start in range(0, len(handles), BULK_BATCH_SIZE):
+            batch = handles[start:start + BULK_BATCH_SIZE]
+            results = self._transact([
+                (self.family_id, DEVLINK_CMD_ESWITCH_GET,
+                 DEVLINK_GENL_VERSION, self._handle_attrs(handle), 0)
+                for handle in batch
+            ])
+            for handle, result in zip(batch, results):
+                if not isinstance(result, DevlinkError):
+                    eswitches[handle] = self._eswitch_props(result)
+        return eswitches
+
+    def eswitch_set(self, handle: str, props: typing.Dict[str, str]):
+        """Set eswitch configuration of a device in one request
+
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :param props: eswitch properties as named by the devlink command
+        :type: typing.Dict[str, str]
+        :raises: ValueError on unknown properties or values
+        """
+        attrs = self._handle_attrs(handle)
+        for prop, value in props.items():
+            try:
+                attr_type, fmt, values = ESWITCH_ATTRS[prop]
+            except KeyError:
+                raise ValueError("unknown eswitch property: {}".format(prop))
+            for number, name in values.items():
+                if name == value:
+                    attrs += pack_attr(attr_type, struct.pack(fmt, number))
+                    break
+            else:
+                raise ValueError("unknown eswitch {}: {}".format(prop, value))
+        self._request(self.family_id, DEVLINK_CMD_ESWITCH_SET,
+                      DEVLINK_GENL_VERSION, attrs)
+
+    def get(self, obj_name: str, handle: str) -> dict:
+        """Query devlink for information about a device
+
+        :param obj_name: devlink object to query
+        :type: str
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :return: Dictionary of information about the device
+        :rtype: dict
+        """
+        if obj_name == "eswitch":
+            return self.eswitch_get(handle)
+        return self._fallback.get(obj_name, handle)
+
+    def set(self, obj_name: str, handle: str, prop: str, value: str):
+        """Set devlink options for a device
+
+        :param obj_name: devlink object to set options on
+        :type: str
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :param prop: property to set
+        :type: str
+        :param value: value to set for property
+        :type: str
+        """
+        if obj_name == "eswitch":
+            return self.eswitch_set(handle, {prop: value})
+        return self._fallback.set(obj_name, handle, prop, value)
+
+    def close(self):
+        """Close all sockets opened by this backend"""
+        with self._lock:
+            sockets, self._sockets = self._sockets, []
+            self._idle = []
+        for sock in sockets:
+            sock.close()
+
+
+class EswitchCache(object):
+    """Per-run cache of the eswitch configuration of devlink devices"""
+
+    def __init__(self, backend=None):
+        """Initialise a new eswitch configuration cache
+
+        :param backend: devlink backend, defaults to get_backend()
+        :type: typing.Union[NetlinkDevlink, SubprocessDevlink]
+        """
+        self._backend = backend
+        self._eswitches = {}
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        """devlink backend the configuration is queried with
+
+        :return: backend given, or the shared one of get_backend()
+        :rtype: typing.Union[NetlinkDevlink, SubprocessDevlink]
+        """
+        if self._backend is None:
+            self._backend = get_backend()
+        return self._backend
+
+    def load(self, handles: typing.Iterable[str] = None):
+        """Fill the cache with a single bulk query
+
+        :param handles: devlink device handles, defaults to all devices
+        :type: typing.Iterable[str]
+        """
+        eswitches = self.backend.eswitch_show_all(handles)
+        with self._lock:
+            self._eswitches.update(eswitches)
+
+    def get(self, handle: str) -> dict:
+        """Get eswitch configuration of a device
+
+        Devices missing from the cache are queried individually, like
+        PCIDevice.devlink_get() does: retried on transient errors, each
+        attempt bounded by DEVLINK_TIMEOUT of the deadline module.
+
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :return: eswitch properties as reported by the devlink command
+        :rtype: dict
+        :raises: deadline.DeadlineExceeded if the query did not complete in
+                 time
+        """
+        with self._lock:
+            eswitch = self._eswitches.get(handle)
+        if eswitch is None:
+            pci_addr = handle.split("/", 1)[-1]
+            name = "{}: devlink eswitch show".format(pci_addr)
+            with report.timer("devlink-get", pf=pci_addr):
+                eswitch = retry.call(
+                    name, deadline.call, name, self.backend.get, "eswitch",
+                    handle, timeout=deadline.DEVLINK_TIMEOUT, pf=pci_addr)
+            with self._lock:
+                self._eswitches[handle] = eswitch
+        return dict(eswitch)
+
+    def peek(self, handle: str) -> typing.Optional[dict]:
+        """Get cached eswitch configuration of a device without querying
+
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :return: eswitch properties or None if not cached
+        :rtype: typing.Optional[dict]
+        """
+        with self._lock:
+            eswitch = self._eswitches.get(handle)
+        return dict(eswitch) if eswitch is not None else None
+
+    def update(self, handle: str, props: typing.Dict[str, str]):
+        """Record a configuration change made to a device
+
+        :param handle: devlink device handle, e.g. pci/0000:03:00.0
+        :type: str
+        :param props: eswitch properties that were set
+        :type: typing.Dict[str, str]
+        """
+        with self._lock:
+            self._eswitches.setdefault(handle, {}).update(props)
+
+    def invalidate(self, handle: str = None):
+        """Drop cached configuration
+
+        :param handle: devlink device handle, defaults to all devices
+        :type: str
+        """
+        with self._lock:
+            if handle is None:
+                self._eswitches.clear()
+            else:
+                self._eswitches.pop(handle, None)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name: str = None):
+    """Get the shared devlink backend
+
+    With 'auto' the netlink backend is used when the devlink generic
+    netlink family is available, the devlink command otherwise.
+
+    :param name: 'auto', 'netlink' or 'subprocess', defaults to BACKEND
+    :type: str
+    :return: devlink backend
+    :rtype: typing.Union[NetlinkDevlink, SubprocessDevlink]
+    :raises: ValueError on unknown backend name
+    """
+    name = name or BACKEND
+    if name not in ("auto", "netlink", "subprocess"):
+        raise ValueError("unknown devlink backend: {}".format(name))
+    with _backends_lock:
+        if name not in _backends:
+            if name == "subprocess":
+                _backends[name] = SubprocessDevlink()
+            elif name == "netlink":
+                _backends[name] = NetlinkDevlink()
+            else:
+                backend = NetlinkDevlink()
+                try:
+                    backend.family_id
+                except OSError:
+                    backend.close()
+                    backend = SubprocessDevlink()
+                _backends[name] = backend
+        return _backends[name]
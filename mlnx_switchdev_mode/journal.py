@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write-ahead journal of the steps of switching PFs to switchdev mode
+
+Before a PF is touched, the steps planned for it are recorded along with
+what is needed to undo them, and each step is marked once it completed.
+The record is dropped as soon as the PF is consistent again, so a record
+only outlives a run which died half way, e.g. when killed by a timeout.
+The next run then completes or rolls back the recorded steps of just the
+PFs concerned, see sriovify.recover().
+"""
+
+import json
+import os
+import typing
+
+from mlnx_switchdev_mode import state
+from mlnx_switchdev_mode import topology
+
+
+JOURNAL_VERSION = 1
+
+# Steps of a switch to switchdev mode, in the order they are taken
+UNBIND = "unbind"
+ESWITCH = "eswitch"
+AUTOPROBE = "autoprobe"
+
+
+def _process_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # NOTE: exists, but runs as another user
+        pass
+    return True
+
+
+class JournalEntry(object):
+    """Record of the steps of the switch of a single PF"""
+
+    def __init__(self, path: str, record: typing.Dict):
+        """Initialise a new journal entry
+
+        :param path: path of the record
+        :type: str
+        :param record: recorded steps, see Journal.begin()
+        :type: typing.Dict
+        """
+        self.path = path
+        self._record = record
+
+    @property
+    def pf(self) -> str:
+        """PCI address of the PF switched
+
+        :return: PCI address of PF
+        :rtype: str
+        """
+        return self._record["pf"]
+
+    @property
+    def command(self) -> str:
+        """Subcommand which switched the PF
+
+        :return: subcommand, e.g. switch
+        :rtype: str
+        """
+        return self._record["command"]
+
+    @property
+    def vfs(self) -> typing.List[str]:
+        """VFs unbound for the switch
+
+        :return: PCI addresses of VFs
+        :rtype: typing.List[str]
+        """
+        return list(self._record["vfs"])
+
+    @property
+    def eswitch(self) -> typing.Dict[str, str]:
+        """eswitch properties set by the switch
+
+        :return: eswitch properties, see devlink.eswitch_changes()
+        :rtype: typing.Dict[str, str]
+        """
+        return dict(self._record["eswitch"])
+
+    @property
+    def rebind(self) -> typing.List[str]:
+        """VFs to bind again after the switch
+
+        :return: PCI addresses of VFs
+        :rtype: typing.List[str]
+        """
+        return list(self._record["rebind"])
+
+    @property
+    def autoprobe(self) -> typing.Optional[str]:
+        """sriov_drivers_autoprobe of the PF to restore after the switch
+
+        :return: value to restore, None if it was not changed
+        :rtype: typing.Optional[str]
+        """
+        return self._record.get("autoprobe")
+
+    @property
+    def completed(self) -> typing.List[str]:
+        """Steps of the switch recorded as completed
+
+        :return: steps in the order they were completed
+        :rtype: typing.List[str]
+        """
+        return list(self._record["completed"])
+
+    def is_done(self, step: str) -> bool:
+        """Determine if a step was completed
+
+        :param step: one of the steps of a switch
+        :type: str
+        :return: whether the step was recorded as completed
+        :rtype: bool
+        """
+        return step in self._record["completed"]
+
+    def done(self, step: str):
+        """Record the completion of a step
+
+        :param step: one of the steps of a switch
+        :type: str
+        """
+        if not self.is_done(step):
+            self._record["completed"].append(step)
+            state.write_json(self.path, self._record)
+
+    def discard(self):
+        """Drop the record once the PF is consistent again"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Journal(object):
+    """Write-ahead journal of the switch of PFs, one record per PF"""
+
+    def __init__(self, journal_dir: str = None):
+        """Initialise a new journal
+
+        :param journal_dir: directory to keep records in, defaults to the
+                            journal directory in state.STATE_DIR
+        :type: str
+        """
+        self._journal_dir = journal_dir
+
+    @property
+    def directory(self) -> str:
+        """Directory the records are kept in
+
+        :return: path of journal directory
+        :rtype: str
+        """
+        return self._journal_dir or os.path.join(state.STATE_DIR, "journal")
+
+    def path(self, pf_addr: str) -> str:
+        """Path of the record of a PF
+
+        :param pf_addr: PCI address of PF
+        :type: str
+        :return: path of record
+        :rtype: str
+        """
+        return os.path.join(self.directory, "{}.json".format(pf_addr))
+
+    def begin(self, pf_addr: str, command: str, vfs: typing.Iterable[str],
+              eswitch: typing.Dict[str, str],
+              rebind: typing.Iterable[str] = (),
+              autoprobe: str = None) -> JournalEntry:
+        """Record the steps planned for a PF before taking the first one
+
+        :param pf_addr: PCI address of PF
+        :type: str
+        :param command: subcommand switching the PF
+        :type: str
+        :param vfs: PCI addresses of VFs to unbind
+        :type: typing.Iterable[str]
+        :param eswitch: eswitch properties to set
+        :type: typing.Dict[str, str]
+        :param rebind: PCI addresses of VFs to bind again after the switch
+        :type: typing.Iterable[str]
+        :param autoprobe: sriov_drivers_autoprobe of the PF to restore after
+                          the switch, if it is changed for the switch
+        :type: str
+        :return: entry to record the completion of steps in
+        :rtype: JournalEntry
+        """
+        record = {
+            "version": JOURNAL_VERSION,
+            "boot_id": state.boot_id(),
+            "pid": os.getpid(),
+            "sysfs_root": topology.SYSFS_ROOT,
+            "pf": pf_addr,
+            "command": command,
+            "vfs": list(vfs),
+            "eswitch": dict(eswitch),
+            "rebind": list(rebind),
+            "completed": [],
+        }
+        if autoprobe is not None:
+            record["autoprobe"] = autoprobe
+        entry = JournalEntry(self.path(pf_addr), record)
+        state.write_json(entry.path, record)
+        return entry
+
+    def entries(self) -> typing.List[JournalEntry]:
+        """Records left behind by runs which died half way
+
+        Records of an earlier boot and unreadable records are dropped,
+        records of runs which are still in progress or were made for
+        another sysfs tree, e.g. a test one, are skipped.
+
+        :return: entries ordered by PCI address of PF
+        :rtype: typing.List[JournalEntry]
+        """
+        try:
+            names = sorted(os.listdir(self.directory))
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        entries = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "rt") as f:
+                    record = json.load(f)
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError):
+                record = None
+            entry = JournalEntry(path, record)
+            if (not isinstance(record, dict) or
+                    record.get("version") != JOURNAL_VERSION or
+                    record.get("boot_id") != state.boot_id()):
+                entry.discard()
+                continue
+            # NOTE: the PCI addresses of a test tree are those of real
+            # devices, its records must not be replayed on them
+            if record.get("sysfs_root") != topology.SYSFS_ROOT:
+                continue
+            pid = record.get("pid")
+            if (isinstance(pid, int) and pid != os.getpid() and
+                    _process_exists(pid)):
+                continue
+            entries.append(entry)
+        return entries
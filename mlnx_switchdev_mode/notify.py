@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Status and readiness notifications to systemd, see sd_notify(3)
+
+Messages are sent to the socket systemd passes to services of Type=notify
+in NOTIFY_SOCKET, no libsystemd binding is needed. Without NOTIFY_SOCKET,
+e.g. when run by hand, nothing is sent.
+"""
+
+import os
+import socket
+
+
+def notify(*assignments: str) -> bool:
+    """Send a notification to the service manager
+
+    Failures are ignored, as the service manager stops a service of
+    Type=notify which does not get ready in time anyway.
+
+    :param assignments: variable assignments, e.g. READY=1
+    :type: str
+    :return: whether the notification was sent
+    :rtype: bool
+    """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address.startswith("@"):
+        # NOTE: abstract namespace socket
+        address = "\0" + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall("\n".join(assignments).encode("utf-8"))
+    except OSError:
+        return False
+    return True
+
+
+def status(message: str) -> bool:
+    """Describe the progress of the service, see systemctl status
+
+    :param message: status to show, single line
+    :type: str
+    :return: whether the notification was sent
+    :rtype: bool
+    """
+    return notify("STATUS={}".format(message))
+
+
+def ready(message: str = None) -> bool:
+    """Tell the service manager that the service is ready
+
+    Units ordered after the service are started once it is ready.
+
+    :param message: status to show along, single line
+    :type: str
+    :return: whether the notification was sent
+    :rtype: bool
+    """
+    if message is None:
+        return notify("READY=1")
+    return notify("READY=1", "STATUS={}".format(message))
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Placement of VF bind and unbind work on the NUMA node of the PF
+
+The driver probe and remove triggered by a write to a driver's bind or
+unbind attribute allocate memory in the context of the writing thread, so
+the memory of VFs of a PF on a remote node ends up on the wrong node. The
+work on the VFs of a PF is therefore run by workers pinned to the CPUs of
+the PF's node. Threads started by a worker, e.g. by deadline.call(),
+inherit its CPU affinity.
+"""
+
+import functools
+import os
+import threading
+import typing
+
+from mlnx_switchdev_mode import topology
+
+
+# numa_node of devices on systems without NUMA, or with firmware not
+# reporting the node
+NO_NODE = -1
+
+_local = threading.local()
+
+
+def parse_cpulist(cpulist: str) -> typing.FrozenSet[int]:
+    """Parse a CPU list as found in sysfs, e.g. 0-3,8-11
+
+    :param cpulist: comma separated CPU numbers and ranges
+    :type: str
+    :return: CPU numbers
+    :rtype: typing.FrozenSet[int]
+    :raises: ValueError if cpulist is malformed
+    """
+    cpus = set()
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return frozenset(cpus)
+
+
+def read_numa_node(pci_addr: str, root: str = None) -> int:
+    """NUMA node a PCI function is attached to
+
+    :param pci_addr: PCI address of function
+    :type: str
+    :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+    :type: str
+    :return: node number, NO_NODE if unknown
+    :rtype: int
+    """
+    try:
+        with open(os.path.join(root or topology.SYSFS_ROOT,
+                               "bus/pci/devices", pci_addr, "numa_node"),
+                  "rt") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return NO_NODE
+
+
+def read_node_cpus(node: int, root: str = None) -> typing.FrozenSet[int]:
+    """CPUs of a NUMA node
+
+    :param node: node number
+    :type: int
+    :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+    :type: str
+    :return: CPU numbers, empty if the node is unknown
+    :rtype: typing.FrozenSet[int]
+    """
+    try:
+        with open(os.path.join(root or topology.SYSFS_ROOT,
+                               "devices/system/node/node{}".format(node),
+                               "cpulist"), "rt") as f:
+            return parse_cpulist(f.read())
+    except (OSError, ValueError):
+        return frozenset()
+
+
+def current_node() -> typing.Optional[int]:
+    """NUMA node the calling thread was pinned to by NodeExecutors
+
+    :return: node number, None outside of pinned workers
+    :rtype: typing.Optional[int]
+    """
+    return getattr(_local, "node", None)
+
+
+def _pin(node: int, cpus: typing.FrozenSet[int]):
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as e:
+        # NOTE: the work is still done, only possibly on the wrong node
+        print("Unable to pin worker to CPUs of NUMA node {}: {}"
+              .format(node, e))
+        return
+    _local.node = node
+
+
+class _PinnedExecutor(object):
+    """Pool of workers pinning themselves to CPUs before their first task
+
+    Pinning happens from within the submitted work rather than from the
+    initializer of the pool, which Python 3.6 does not support.
+    """
+
+    def __init__(self, node: int, cpus: typing.FrozenSet[int],
+                 max_workers: int):
+        import concurrent.futures
+        self.node = node
+        self.cpus = cpus
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="node{}".format(node))
+
+    def _run(self, fn: typing.Callable, *args, **kwargs) -> typing.Any:
+        if not getattr(_local, "pinned", False):
+            _local.pinned = True
+            _pin(self.node, self.cpus)
+        return fn(*args, **kwargs)
+
+    def submit(self, fn: typing.Callable, *args,
+               **kwargs) -> 'concurrent.futures.Future':
+        return self._pool.submit(self._run, fn, *args, **kwargs)
+
+    def map(self, fn: typing.Callable, *iterables,
+            timeout: float = None) -> typing.Iterator:
+        return self._pool.map(functools.partial(self._run, fn), *iterables,
+                              timeout=timeout)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+class NodeExecutors(object):
+    """Pools of workers, one per NUMA node, pinned to the node's CPUs
+
+    Pools are created on first use. Work for devices on an unknown node,
+    or on a node whose CPUs the process may not run on, goes to a shared
+    unpinned pool, as does all work when pinning is disabled.
+    """
+
+    def __init__(self, max_workers: int, pin: bool = True,
+                 root: str = None):
+        """Initialise new NUMA node executors
+
+        :param max_workers: number of workers of each pool
+        :type: int
+        :param pin: whether to pin workers to the CPUs of a node
+        :type: bool
+        :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+        :type: str
+        """
+        self.max_workers = max_workers
+        self.pin = pin
+        self.root = root
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def executor(self, node: int = NO_NODE) -> 'concurrent.futures.Executor':
+        """Pool of workers pinned to the CPUs of a node
+
+        :param node: node number
+        :type: int
+        :return: pool of the node, the shared pool if it can not be pinned
+        :rtype: concurrent.futures.Executor
+        """
+        import concurrent.futures
+        cpus = frozenset()
+        if self.pin and node != NO_NODE:
+            cpus = read_node_cpus(node, self.root).intersection(
+                os.sched_getaffinity(0))
+        if not cpus:
+            node = NO_NODE
+        with self._lock:
+            if node not in self._pools:
+                if node == NO_NODE:
+                    pool = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers)
+                else:
+                    pool = _PinnedExecutor(node, cpus, self.max_workers)
+                self._pools[node] = pool
+            return self._pools[node]
+
+    def executor_for(self, pci_addr: str) -> 'concurrent.futures.Executor':
+        """Pool of workers on the NUMA node of a PCI function
+
+        :param pci_addr: PCI address of function
+        :type: str
+        :return: pool of the node of the function
+        :rtype: concurrent.futures.Executor
+        """
+        if not self.pin:
+            return self.executor()
+        return self.executor(read_numa_node(pci_addr, self.root))
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.shutdown(wait=wait)
+
+    def __enter__(self) -> 'NodeExecutors':
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
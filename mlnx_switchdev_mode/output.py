@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streamed tabular output in text, CSV and JSON formats
+
+Rows are written out as soon as they are produced, no writer holds on to
+more than the row it is writing.
+"""
+
+import json
+import typing
+
+
+class TextWriter(object):
+    """Writes rows as tab separated columns without a header"""
+
+    def __init__(self, stream: typing.TextIO, fields: typing.List[str]):
+        """Initialise a new text writer
+
+        :param stream: stream to write to
+        :type: typing.TextIO
+        :param fields: keys of the row values to write, in column order
+        :type: typing.List[str]
+        """
+        self._stream = stream
+        self._fields = fields
+
+    def write(self, row: typing.Mapping):
+        """Write a row
+
+        :param row: field to value mappings, None is written as empty
+        :type: typing.Mapping
+        """
+        self._stream.write("\t".join(
+            "" if row.get(field) is None else str(row[field])
+            for field in self._fields) + "\n")
+
+    def close(self):
+        self._stream.flush()
+
+
+class CSVWriter(TextWriter):
+    """Writes rows as CSV with a header"""
+
+    def __init__(self, stream: typing.TextIO, fields: typing.List[str]):
+        # NOTE: only imported for --format csv
+        import csv
+        super().__init__(stream, fields)
+        self._writer = csv.DictWriter(stream, fields, extrasaction="ignore",
+                                      lineterminator="\n")
+        self._writer.writeheader()
+
+    def write(self, row: typing.Mapping):
+        self._writer.writerow(row)
+
+
+class JSONWriter(TextWriter):
+    """Writes rows as a JSON array of objects, one object per line"""
+
+    def __init__(self, stream: typing.TextIO, fields: typing.List[str]):
+        super().__init__(stream, fields)
+        self._rows = 0
+        self._stream.write("[")
+
+    def write(self, row: typing.Mapping):
+        self._stream.write("{}\n  {}".format(
+            "," if self._rows else "",
+            json.dumps({field: row.get(field) for field in self._fields},
+                       sort_keys=True)))
+        self._rows += 1
+
+    def close(self):
+        self._stream.write("\n]\n" if self._rows else "]\n")
+        super().close()
+
+
+WRITERS = {
+    "text": TextWriter,
+    "csv": CSVWriter,
+    "json": JSONWriter,
+}
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Explicit plans of the operations of a switch, and their scheduling
+
+A plan is an ordered list of operations on single VFs or PFs derived from
+a topology snapshot. Before a plan is carried out it is pruned against the
+then current state, dropping operations which have become no-ops, and
+scheduled into per PF stages which are run concurrently.
+"""
+
+import collections
+import json
+import time
+import typing
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import topology
+
+
+PLAN_VERSION = 1
+
+UNBIND_VF = "unbind-vf"
+SET_ESWITCH_MODE = "set-eswitch-mode"
+BIND_VF = "bind-vf"
+
+# Order of the stages of the operations on a PF
+STAGES = (UNBIND_VF, SET_ESWITCH_MODE, BIND_VF)
+
+# Phase of a run report timing each kind of operation
+REPORT_PHASES = {
+    UNBIND_VF: "unbind",
+    SET_ESWITCH_MODE: "devlink-set",
+    BIND_VF: "bind",
+}
+
+# Seconds an operation takes when no timings were recorded
+DEFAULT_COSTS = {
+    UNBIND_VF: 0.5,
+    SET_ESWITCH_MODE: 2.0,
+    BIND_VF: 1.5,
+}
+
+
+class PlanError(Exception):
+    pass
+
+
+class Operation(collections.namedtuple(
+        "Operation", ["action", "target", "pf", "value", "cost"])):
+    """A single operation on a VF or PF"""
+
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        """String represenation of object
+
+        :return: action, target and value of operation
+        :rtype: str
+        """
+        if isinstance(self.value, dict):
+            return "{} {} {}".format(self.action, self.target, " ".join(
+                "{} {}".format(prop, value)
+                for prop, value in self.value.items()))
+        if self.value is not None:
+            return "{} {} {}".format(self.action, self.target, self.value)
+        return "{} {}".format(self.action, self.target)
+
+
+def load_costs(paths: typing.Iterable[str] = ()) -> typing.Dict[str, float]:
+    """Cost of operations from the run reports of earlier runs
+
+    The mean duration of the matching phase over all reports is used,
+    DEFAULT_COSTS for operations which were never timed.
+
+    :param paths: paths of JSON reports written with --report
+    :type: typing.Iterable[str]
+    :return: operation to seconds mappings
+    :rtype: typing.Dict[str, float]
+    :raises: PlanError if a report can not be read
+    """
+    totals = collections.Counter()
+    counts = collections.Counter()
+    for path in paths:
+        try:
+            with open(path, "rt") as f:
+                phases = json.load(f)["phases"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise PlanError("Unable to read report {}: {}".format(path, e))
+        for action, phase in REPORT_PHASES.items():
+            if phase in phases and phases[phase]["count"]:
+                totals[action] += phases[phase]["total"]
+                counts[action] += phases[phase]["count"]
+    return {
+        action: (totals[action] / counts[action] if counts[action]
+                 else DEFAULT_COSTS[action])
+        for action in DEFAULT_COSTS
+    }
+
+
+def build_plan(snapshot: topology.Topology,
+               eswitches: devlink.EswitchCache, rebind: bool = False,
+               costs: typing.Dict[str, float] = None,
+               eswitch_config: typing.Dict[str, str] = None
+               ) -> typing.List[Operation]:
+    """Operations switching all mlx5_core PFs with VFs to switchdev mode
+
+    The value of a SET_ESWITCH_MODE operation is the eswitch properties
+    it sets, see devlink.eswitch_changes(). VFs are only unbound and bound
+    for a change of mode.
+
+    :param snapshot: topology to plan for
+    :type: topology.Topology
+    :param eswitches: eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :param rebind: rebind VFs to mlx5_core driver after the switch
+    :type: bool
+    :param costs: operation to seconds mappings, see load_costs()
+    :type: typing.Dict[str, float]
+    :param eswitch_config: eswitch properties to set, defaults to
+                           devlink.DEFAULT_ESWITCH_CONFIG
+    :type: typing.Dict[str, str]
+    :return: operations in the order they would be done serially
+    :rtype: typing.List[Operation]
+    """
+    costs = costs or DEFAULT_COSTS
+    eswitch_config = eswitch_config or devlink.DEFAULT_ESWITCH_CONFIG
+    operations = []
+    for pf in snapshot.pfs(driver="mlx5_core"):
+        vfs = snapshot.vfs(pf)
+        if not vfs:
+            continue
+        changes = devlink.eswitch_changes(eswitches.get(pf.devlink_handle),
+                                          eswitch_config)
+        if not changes:
+            continue
+        bound_vfs = [vf for vf in vfs if vf.bound] if "mode" in changes else []
+        operations.extend(
+            Operation(UNBIND_VF, vf.pci_addr, pf.pci_addr, None,
+                      costs[UNBIND_VF])
+            for vf in bound_vfs)
+        operations.append(
+            Operation(SET_ESWITCH_MODE, pf.pci_addr, pf.pci_addr,
+                      changes, costs[SET_ESWITCH_MODE]))
+        if rebind:
+            operations.extend(
+                Operation(BIND_VF, vf.pci_addr, pf.pci_addr, None,
+                          costs[BIND_VF])
+                for vf in bound_vfs)
+    return operations
+
+
+def prune(operations: typing.Iterable[Operation],
+          snapshot: topology.Topology,
+          eswitches: devlink.EswitchCache) -> typing.List[Operation]:
+    """Drop operations which are no-ops in the current state
+
+    Dropped are duplicate operations, operations on functions which no
+    longer exist, unbinding of unbound VFs, binding of bound VFs which are
+    not unbound first and setting eswitch properties a PF already has. The
+    unbinding and rebinding of VFs of a PF is dropped unless its mode
+    changes, other eswitch properties are set with the VFs left bound.
+
+    :param operations: planned operations
+    :type: typing.Iterable[Operation]
+    :param snapshot: current topology
+    :type: topology.Topology
+    :param eswitches: current eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :return: remaining operations in planned order
+    :rtype: typing.List[Operation]
+    """
+    seen = set()
+    remaining = []
+    for operation in operations:
+        key = (operation.action, operation.target)
+        if key in seen or operation.target not in snapshot:
+            continue
+        seen.add(key)
+        remaining.append(operation)
+    unbinds = {operation.target for operation in remaining
+               if operation.action == UNBIND_VF}
+    changes = {}
+    for operation in remaining:
+        if operation.action == SET_ESWITCH_MODE:
+            handle = snapshot[operation.target].devlink_handle
+            changes[operation.target] = devlink.eswitch_changes(
+                eswitches.get(handle), operation.value)
+    pruned = []
+    for operation in remaining:
+        function = snapshot[operation.target]
+        if operation.action == SET_ESWITCH_MODE:
+            if not changes[operation.target]:
+                continue
+            operation = operation._replace(value=changes[operation.target])
+        elif (operation.pf in changes and
+                "mode" not in changes[operation.pf]):
+            continue
+        if operation.action == UNBIND_VF and not function.bound:
+            continue
+        if (operation.action == BIND_VF and function.bound and
+                operation.target not in unbinds):
+            continue
+        pruned.append(operation)
+    return pruned
+
+
+def schedule(operations: typing.Iterable[Operation]
+             ) -> typing.Dict[str, typing.List[typing.List[Operation]]]:
+    """Group operations into stages per PF
+
+    Stages of a PF have to run one after the other in STAGES order, the
+    operations within a stage and the stages of different PFs are
+    independent and can run concurrently.
+
+    :param operations: operations, see prune()
+    :type: typing.Iterable[Operation]
+    :return: PF address to stages mappings, ordered by PCI address, empty
+             stages are left out
+    :rtype: typing.Dict[str, typing.List[typing.List[Operation]]]
+    """
+    by_pf = collections.defaultdict(lambda: collections.OrderedDict(
+        (action, []) for action in STAGES))
+    for operation in operations:
+        by_pf[operation.pf][operation.action].append(operation)
+    return collections.OrderedDict(
+        (pf, [stage for stage in by_pf[pf].values() if stage])
+        for pf in sorted(by_pf))
+
+
+def estimate(operations: typing.Iterable[Operation],
+             jobs: int = 1) -> typing.Dict[str, float]:
+    """Estimate the duration of carrying out operations
+
+    The parallel estimate assumes ``jobs`` PFs and ``jobs`` VF operations
+    run at once, as by apply. It is bounded by the slowest PF and by the
+    total VF work spread over all workers.
+
+    :param operations: operations, see prune()
+    :type: typing.Iterable[Operation]
+    :param jobs: number of concurrent workers
+    :type: int
+    :return: serial and parallel estimates in seconds
+    :rtype: typing.Dict[str, float]
+    """
+    operations = list(operations)
+    pf_durations = []
+    vf_work = 0.0
+    for stages in schedule(operations).values():
+        duration = 0.0
+        for stage in stages:
+            costs = sorted((operation.cost for operation in stage),
+                           reverse=True)
+            if stage[0].action == SET_ESWITCH_MODE:
+                duration += sum(costs)
+            else:
+                vf_work += sum(costs)
+                # NOTE: slowest operations first, in rounds of jobs
+                duration += sum(costs[::jobs])
+        pf_durations.append(duration)
+    pf_bound = 0.0
+    if pf_durations:
+        rounds = [sum(sorted(pf_durations, reverse=True)[i::jobs])
+                  for i in range(min(jobs, len(pf_durations)))]
+        pf_bound = max(rounds)
+    serial = sum(operation.cost for operation in operations)
+    return {
+        "serial": serial,
+        "parallel": min(serial, max(pf_bound, vf_work / jobs)),
+        "jobs": jobs,
+        "pfs": len(pf_durations),
+        "operations": len(operations),
+    }
+
+
+def write_plan(path: str, operations: typing.Iterable[Operation],
+               jobs: int = 1):
+    """Write a plan as JSON
+
+    :param path: path of file to write
+    :type: str
+    :param operations: operations of plan
+    :type: typing.Iterable[Operation]
+    :param jobs: number of concurrent workers to estimate duration for
+    :type: int
+    """
+    operations = list(operations)
+    with open(path, "wt") as f:
+        json.dump({
+            "version": PLAN_VERSION,
+            "created": time.time(),
+            "sysfs_root": topology.SYSFS_ROOT,
+            "estimate": estimate(operations, jobs=jobs),
+            "operations": [operation._asdict() for operation in operations],
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def read_plan(path: str) -> typing.List[Operation]:
+    """Read a plan written by write_plan()
+
+    :param path: path of plan
+    :type: str
+    :return: operations of plan
+    :rtype: typing.List[Operation]
+    :raises: PlanError if the plan can not be read, is invalid or was made
+             for another sysfs tree
+    """
+    try:
+        with open(path, "rt") as f:
+            data = json.load(f)
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError("unsupported version {!r}"
+                             .format(data.get("version")))
+        if data["sysfs_root"] != topology.SYSFS_ROOT:
+            raise ValueError("made for sysfs at {}, not {}".format(
+                data["sysfs_root"], topology.SYSFS_ROOT))
+        operations = [Operation(**operation)
+                      for operation in data["operations"]]
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        raise PlanError("Unable to read plan {}: {}".format(path, e))
+    for operation in operations:
+        if operation.action not in STAGES:
+            raise PlanError("Unknown operation in plan {}: {}"
+                            .format(path, operation))
+        if (operation.action == SET_ESWITCH_MODE and
+                not isinstance(operation.value, dict)):
+            raise PlanError("Invalid operation in plan {}: {}"
+                            .format(path, operation))
+    return operations
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration for humans
+
+    :param seconds: duration
+    :type: float
+    :return: formatted duration
+    :rtype: str
+    """
+    if seconds < 60:
+        return "{:.1f}s".format(seconds)
+    seconds = int(round(seconds))
+    return "{}m{:02d}s".format(seconds // 60, seconds % 60)
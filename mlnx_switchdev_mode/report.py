@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per phase timing of a run and its machine readable report"""
+
+import collections
+import contextlib
+import json
+import threading
+import time
+import typing
+
+
+Record = collections.namedtuple(
+    "Record", ["phase", "duration", "pf", "vf", "error", "node"])
+
+
+class RunReport(object):
+    """Collects timings and counters of a run"""
+
+    def __init__(self, command: str = None):
+        """Initialise a new run report
+
+        :param command: name of the subcommand being run
+        :type: str
+        """
+        self.command = command
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._records = []
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def records(self) -> typing.List[Record]:
+        """Timings recorded so far
+
+        :return: recorded timings
+        :rtype: typing.List[Record]
+        """
+        with self._lock:
+            return list(self._records)
+
+    def record(self, phase: str, duration: float, pf: str = None,
+               vf: str = None, error: Exception = None, node: int = None):
+        """Record the duration of an operation
+
+        :param phase: name of the phase the operation belongs to
+        :type: str
+        :param duration: duration of operation in seconds
+        :type: float
+        :param pf: PCI address of PF operated on
+        :type: str
+        :param vf: PCI address of VF operated on
+        :type: str
+        :param error: error the operation failed with
+        :type: Exception
+        :param node: NUMA node the operation ran on
+        :type: int
+        """
+        with self._lock:
+            self._records.append(Record(
+                phase, duration, pf, vf,
+                str(error) if error is not None else None, node))
+
+    @contextlib.contextmanager
+    def timer(self, phase: str, pf: str = None, vf: str = None,
+              node: int = None):
+        """Context manager recording the duration of its body
+
+        :param phase: name of the phase the operation belongs to
+        :type: str
+        :param pf: PCI address of PF operated on
+        :type: str
+        :param vf: PCI address of VF operated on
+        :type: str
+        :param node: NUMA node the operation ran on
+        :type: int
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(phase, time.perf_counter() - start, pf, vf, e, node)
+            raise
+        self.record(phase, time.perf_counter() - start, pf, vf, node=node)
+
+    def count(self, name: str, value: int = 1):
+        """Increment a counter
+
+        :param name: name of counter
+        :type: str
+        :param value: amount to increment counter by
+        :type: int
+        """
+        with self._lock:
+            self._counters[name] += value
+
+    def to_dict(self, slowest: int = 10) -> dict:
+        """Summarise the run
+
+        :param slowest: number of slowest operations to include
+        :type: int
+        :return: JSON serialisable summary of the run
+        :rtype: dict
+        """
+        with self._lock:
+            records = list(self._records)
+            counters = dict(self._counters)
+        phases = collections.OrderedDict()
+        pfs = collections.defaultdict(dict)
+        nodes = collections.defaultdict(dict)
+        for rec in records:
+            phase = phases.setdefault(rec.phase, {
+                "count": 0, "failed": 0, "total": 0.0, "max": 0.0})
+            phase["count"] += 1
+            phase["total"] += rec.duration
+            phase["max"] = max(phase["max"], rec.duration)
+            if rec.error is not None:
+                phase["failed"] += 1
+            if rec.pf is not None:
+                pfs[rec.pf][rec.phase] = (
+                    pfs[rec.pf].get(rec.phase, 0.0) + rec.duration)
+            if rec.node is not None:
+                node = nodes[str(rec.node)].setdefault(rec.phase, {
+                    "count": 0, "total": 0.0, "max": 0.0})
+                node["count"] += 1
+                node["total"] += rec.duration
+                node["max"] = max(node["max"], rec.duration)
+        for phase in phases.values():
+            phase["mean"] = phase["total"] / phase["count"]
+        return {
+            "command": self.command,
+            "started": self.started,
+            "duration": time.perf_counter() - self._start,
+            "counters": counters,
+            "phases": phases,
+            "pfs": dict(pfs),
+            "nodes": dict(nodes),
+            "slowest": [
+                rec._asdict() for rec in sorted(
+                    records, key=lambda rec: rec.duration,
+                    reverse=True)[:slowest]
+            ],
+        }
+
+    def write(self, path: str):
+        """Write summary of the run to a file as JSON
+
+        :param path: path of file to write
+        :type: str
+        """
+        with open(path, "wt") as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+_active = RunReport()
+
+
+def activate(run_report: RunReport) -> RunReport:
+    """Make a report the one instrumented code records into
+
+    :param run_report: report to activate
+    :type: RunReport
+    :return: the activated report
+    :rtype: RunReport
+    """
+    global _active
+    _active = run_report
+    return run_report
+
+
+def current() -> RunReport:
+    """Report instrumented code records into
+
+    :return: active report
+    :rtype: RunReport
+    """
+    return _active
+
+
+def timer(phase: str, pf: str = None, vf: str = None, node: int = None):
+    """Time an operation into the active report, see RunReport.timer"""
+    return _active.timer(phase, pf=pf, vf=vf, node=node)
+
+
+def record(phase: str, duration: float, pf: str = None, vf: str = None,
+           error: Exception = None, node: int = None):
+    """Record an operation into the active report, see RunReport.record"""
+    _active.record(phase, duration, pf=pf, vf=vf, error=error, node=node)
+
+
+def count(name: str, value: int = 1):
+    """Increment a counter of the active report, see RunReport.count"""
+    _active.count(name, value)
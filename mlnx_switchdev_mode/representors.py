@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Representor netdevs of PFs in switchdev mode
+
+The representor of a VF is a netdev of its PF's PCI device, next to the
+uplink, whose phys_port_name names the VF index.
+"""
+
+import collections
+import errno
+import os
+import re
+import select
+import socket
+import struct
+import time
+import typing
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import topology
+
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 0x1
+# NOTE: switching a PF creates a representor per VF at once, each announced
+# by several notifications, make room for them.
+LINK_RCVBUF_SIZE = 1 << 22
+
+RTM_NEWLINK = 16
+
+IFLA_IFNAME = 3
+
+# phys_port_name of VF representors, pf<N>vf<M> or just <M> on older kernels
+VF_PORT_NAME_RE = re.compile(r"^(?:pf\d+vf(\d+)|(\d+))$")
+
+_NLMSGHDR = struct.Struct("=LHHLL")
+_IFINFOMSG = struct.Struct("=BxHiII")
+
+
+class RepresentorTimeout(Exception):
+    pass
+
+
+def pack_newlink(ifindex: int, ifname: str, seq: int = 0) -> bytes:
+    """Pack a RTM_NEWLINK notification as the kernel sends it
+
+    :param ifindex: interface index
+    :type: int
+    :param ifname: interface name
+    :type: str
+    :param seq: sequence number
+    :type: int
+    :return: netlink message
+    :rtype: bytes
+    """
+    payload = (_IFINFOMSG.pack(socket.AF_UNSPEC, 0, ifindex, 0, 0) +
+               devlink.pack_string(IFLA_IFNAME, ifname))
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), RTM_NEWLINK, 0, seq,
+                          0) + payload
+
+
+class LinkMonitor(object):
+    """Receives netdev creation notifications from rtnetlink"""
+
+    def __init__(self, sock: socket.socket = None):
+        """Initialise a new link monitor
+
+        :param sock: connected socket to use instead of subscribing to the
+                     rtnetlink link group, used to inject notifications
+        :type: socket.socket
+        """
+        if sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                 NETLINK_ROUTE)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                LINK_RCVBUF_SIZE)
+                sock.bind((0, RTMGRP_LINK))
+            except OSError:
+                sock.close()
+                raise
+        self._sock = sock
+
+    def recv(self, timeout: float = None) -> typing.List[str]:
+        """Receive the names of new or changed netdevs
+
+        Notifications are lost when the socket buffer overflows, callers
+        have to count netdevs in sysfs rather than rely on the names.
+
+        :param timeout: seconds to wait for notifications, forever if None
+        :type: float
+        :return: netdev names, empty if none arrived before the timeout or
+                 notifications were lost
+        :rtype: typing.List[str]
+        """
+        readable, _, _ = select.select([self._sock], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = self._sock.recv(65536)
+        except OSError as e:
+            if e.errno != errno.ENOBUFS:
+                raise
+            return []
+        names = []
+        for msg_type, _, _, payload in devlink.parse_messages(data):
+            if msg_type != RTM_NEWLINK or len(payload) < _IFINFOMSG.size:
+                continue
+            attrs = devlink.parse_attrs(payload[_IFINFOMSG.size:])
+            if IFLA_IFNAME in attrs:
+                names.append(devlink.parse_string(attrs[IFLA_IFNAME]))
+        return names
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self) -> 'LinkMonitor':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def expected_netdevs(pf: topology.PCIFunction) -> int:
+    """Number of netdevs of a PF in switchdev mode
+
+    :param pf: PF in switchdev mode
+    :type: topology.PCIFunction
+    :return: one representor per VF plus the uplink
+    :rtype: int
+    """
+    return len(pf.vf_addrs) + 1
+
+
+def count_netdevs(pf: topology.PCIFunction, root: str = None) -> int:
+    """Number of netdevs of a PF, representors included
+
+    Representors are netdevs of the PF's PCI device, next to the uplink.
+
+    :param pf: PF
+    :type: topology.PCIFunction
+    :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+    :type: str
+    :return: number of netdevs
+    :rtype: int
+    """
+    try:
+        return len(os.listdir(os.path.join(
+            root or topology.SYSFS_ROOT, "bus/pci/devices", pf.pci_addr,
+            "net")))
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+
+
+def wait_for_representors(pfs: typing.Iterable[topology.PCIFunction],
+                          timeout: float, monitor: LinkMonitor = None):
+    """Block until the representors of all VFs of PFs exist
+
+    Netdevs are only counted again when rtnetlink announces a netdev, or
+    notifications were lost, the subscription is made before the first
+    count so none can be missed.
+
+    :param pfs: PFs in switchdev mode
+    :type: typing.Iterable[topology.PCIFunction]
+    :param timeout: seconds to wait at most
+    :type: float
+    :param monitor: link monitor, defaults to a new rtnetlink subscription
+    :type: LinkMonitor
+    :raises: RepresentorTimeout if representors are missing at the deadline
+    """
+    deadline = time.monotonic() + timeout
+    pending = list(pfs)
+    if not pending:
+        return
+    monitor = monitor or LinkMonitor()
+    with monitor:
+        while True:
+            pending = [pf for pf in pending
+                       if count_netdevs(pf) < expected_netdevs(pf)]
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            monitor.recv(timeout=remaining)
+    if pending:
+        raise RepresentorTimeout(
+            "Representors missing after {}s: {}".format(
+                timeout, ", ".join(
+                    "{} ({}/{})".format(pf, count_netdevs(pf),
+                                        expected_netdevs(pf))
+                    for pf in pending)))
+
+
+class VFPort(collections.namedtuple(
+        "VFPort", ["pf", "pf_netdev", "vf_index", "vf_pci_addr", "vf_netdev",
+                   "representor"])):
+    """A VF, its netdev and its representor on the eswitch of its PF"""
+
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        """String represenation of object
+
+        :return: PCI address of VF
+        :rtype: str
+        """
+        return self.vf_pci_addr
+
+
+def read_vf_port_index(netdev: str, root: str = None) -> typing.Optional[int]:
+    """VF index a netdev is the representor of
+
+    :param netdev: name of netdev
+    :type: str
+    :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+    :type: str
+    :return: VF index or None if netdev is not a VF representor
+    :rtype: typing.Optional[int]
+    """
+    try:
+        with open(os.path.join(root or topology.SYSFS_ROOT, "class/net",
+                               netdev, "phys_port_name"), "rt") as f:
+            port_name = f.read().strip()
+    except OSError:
+        # NOTE: EOPNOTSUPP for netdevs without ports, e.g. in legacy mode
+        return None
+    match = VF_PORT_NAME_RE.match(port_name)
+    if not match:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+class RepresentorIndex(object):
+    """Immutable index of the VFs of PFs and of their representors"""
+
+    def __init__(self, ports: typing.Iterable[VFPort]):
+        """Initialise a new representor index
+
+        :param ports: VFs of PFs
+        :type: typing.Iterable[VFPort]
+        """
+        self._ports = tuple(sorted(
+            ports, key=lambda port: (port.pf, port.vf_index)))
+        self._by_pf = collections.OrderedDict()
+        self._by_name = {}
+        for port in self._ports:
+            self._by_pf.setdefault(port.pf, []).append(port)
+            for name in (port.vf_pci_addr, port.vf_netdev, port.representor):
+                if name is not None:
+                    self._by_name[name] = port
+
+    def __iter__(self) -> typing.Iterator[VFPort]:
+        return iter(self._ports)
+
+    def __len__(self) -> int:
+        return len(self._ports)
+
+    def __getitem__(self, name: str) -> VFPort:
+        """Look up a VF
+
+        :param name: PCI address or netdev of the VF, or its representor
+        :type: str
+        :return: VF
+        :rtype: VFPort
+        :raises: KeyError if no VF is known by name
+        """
+        return self._by_name[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def pfs(self) -> typing.List[str]:
+        """PFs with VFs in index
+
+        :return: PCI addresses of PFs, ordered by PCI address
+        :rtype: typing.List[str]
+        """
+        return list(self._by_pf)
+
+    def vfs(self, pf: str) -> typing.List[VFPort]:
+        """VFs of a PF
+
+        :param pf: PCI address of PF
+        :type: str
+        :return: VFs ordered by VF index
+        :rtype: typing.List[VFPort]
+        """
+        return list(self._by_pf.get(pf, ()))
+
+    def representor(self, pf: str, vf_index: int) -> typing.Optional[str]:
+        """Representor of a VF
+
+        :param pf: PCI address of PF
+        :type: str
+        :param vf_index: index of VF on PF
+        :type: int
+        :return: representor netdev, None if the PF is not in switchdev mode
+        :rtype: typing.Optional[str]
+        :raises: IndexError if PF has no such VF
+        """
+        return self._by_pf.get(pf, [])[vf_index].representor
+
+
+def pf_ports(pf: topology.PCIFunction,
+             netdevs: typing.Mapping[str, typing.Sequence[str]],
+             root: str = None) -> typing.Iterator[VFPort]:
+    """VFs of a PF and their representors
+
+    :param pf: PF
+    :type: topology.PCIFunction
+    :param netdevs: PCI address to netdev names mappings of VFs
+    :type: typing.Mapping[str, typing.Sequence[str]]
+    :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+    :type: str
+    :return: VFs ordered by VF index
+    :rtype: typing.Iterator[VFPort]
+    """
+    uplinks = []
+    representors = {}
+    for netdev in pf.netdevs:
+        vf_index = read_vf_port_index(netdev, root)
+        if vf_index is None:
+            uplinks.append(netdev)
+        else:
+            representors[vf_index] = netdev
+    for vf_index, vf_addr in enumerate(pf.vf_addrs):
+        vf_netdevs = netdevs.get(vf_addr)
+        yield VFPort(
+            pf=pf.pci_addr,
+            pf_netdev=uplinks[0] if uplinks else None,
+            vf_index=vf_index,
+            vf_pci_addr=vf_addr,
+            vf_netdev=vf_netdevs[0] if vf_netdevs else None,
+            representor=representors.get(vf_index),
+        )
+
+
+def index_topology(snapshot: topology.Topology) -> RepresentorIndex:
+    """Index the VFs of the PFs of a topology snapshot
+
+    Only the phys_port_name of netdevs of PFs is read from sysfs.
+
+    :param snapshot: topology
+    :type: topology.Topology
+    :return: index
+    :rtype: RepresentorIndex
+    """
+    netdevs = {function.pci_addr: function.netdevs for function in snapshot}
+    return RepresentorIndex(
+        port for pf in snapshot.pfs()
+        for port in pf_ports(pf, netdevs, snapshot.root))
+
+
+def read_index(root: str = None) -> RepresentorIndex:
+    """Index the VFs of all PFs and their representors in one pass
+
+    Netdevs are resolved in a single pass over /sys/class/net. Only PFs and
+    functions which are not yet known as VFs of a PF are read, and only the
+    phys_port_name of netdevs of PFs is read to find representors.
+
+    :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+    :type: str
+    :return: index
+    :rtype: RepresentorIndex
+    """
+    root = root or topology.SYSFS_ROOT
+    netdevs = collections.OrderedDict()
+    for pci_addr, netdev in topology.read_netdevs(root):
+        netdevs.setdefault(pci_addr, []).append(netdev)
+    vf_addrs = set()
+    ports = []
+    for pci_addr, function_netdevs in netdevs.items():
+        if pci_addr in vf_addrs:
+            continue
+        try:
+            pf = topology.read_function(root, pci_addr,
+                                        netdevs=function_netdevs)
+        except (FileNotFoundError, NotADirectoryError):
+            # NOTE: device was removed while scanning
+            continue
+        if not pf.is_pf:
+            continue
+        vf_addrs.update(pf.vf_addrs)
+        ports.extend(pf_ports(pf, netdevs, root))
+    return RepresentorIndex(ports)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retries of operations failing with transient errors
+
+mlx5 rejects requests with EBUSY or EAGAIN while the PF is still being
+reconfigured, e.g. a devlink eswitch set right after the VFs of the PF
+were unbound, or a bind of a VF while the PF rebuilds its eswitch. call()
+retries such failures after a delay growing with each attempt, bounded in
+number of attempts, in total time and by the active deadline. Any other
+error is raised right away.
+"""
+
+import errno
+import time
+import typing
+
+from mlnx_switchdev_mode import deadline
+from mlnx_switchdev_mode import report
+
+
+# Retries of a failed operation after its first attempt, and seconds an
+# operation may spend waiting for retries in total, no limit if None
+RETRIES = 4
+TIMEOUT = 5.0
+
+# Delay in seconds before the first retry of transient errors by errno,
+# doubling with each further retry up to MAX_DELAY. EAGAIN asks to retry
+# right away, EBUSY signals a reconfiguration which takes a while.
+BACKOFF = {
+    errno.EAGAIN: 0.01,
+    errno.EBUSY: 0.05,
+}
+MAX_DELAY = 1.0
+
+
+def backoff(error: Exception, retry: int) -> typing.Optional[float]:
+    """Delay before retrying an operation which failed
+
+    :param error: error the operation failed with
+    :type: Exception
+    :param retry: number of the retry, starting at 1
+    :type: int
+    :return: seconds to wait, None if the error is not transient
+    :rtype: typing.Optional[float]
+    """
+    initial = BACKOFF.get(getattr(error, "errno", None))
+    if initial is None:
+        return None
+    return min(initial * 2 ** (retry - 1), MAX_DELAY)
+
+
+def call(name: str, func: typing.Callable, *args, pf: str = None,
+         vf: str = None, **kwargs) -> typing.Any:
+    """Call a function, retrying it on transient errors
+
+    Every retry is recorded in the active report, as a "retry" phase
+    lasting the delay before it and in the "retries" counter.
+
+    :param name: description of the operation used in messages
+    :type: str
+    :param func: function to call
+    :type: typing.Callable
+    :param pf: PCI address of PF operated on, for the report
+    :type: str
+    :param vf: PCI address of VF operated on, for the report
+    :type: str
+    :return: return value of func
+    :rtype: typing.Any
+    :raises: OSError of the last attempt if it is not transient, retries
+             are exhausted or the next retry would be too late
+    """
+    start = time.monotonic()
+    retry = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except OSError as e:
+            retry += 1
+            delay = backoff(e, retry)
+            if delay is None or retry > RETRIES:
+                raise
+            if (TIMEOUT is not None and
+                    time.monotonic() - start + delay > TIMEOUT):
+                raise
+            remaining = deadline.current().remaining()
+            if remaining is not None and delay >= remaining:
+                raise
+            print("{}: {}, retrying in {:.0f}ms ({}/{})".format(
+                name, e, delay * 1000, retry, RETRIES))
+            report.record("retry", delay, pf=pf, vf=vf, error=e)
+            report.count("retries")
+            time.sleep(delay)
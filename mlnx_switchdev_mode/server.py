@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Topology query service over a Unix socket
+
+The server keeps the PCI function to netdev topology and the eswitch mode
+of PFs in memory. Kernel uevents about PCI functions and their netdevs only
+cause the functions concerned to be read again.
+
+Clients send one JSON object per line, e.g. ``{"query": "pfs"}``, and get
+one JSON object per line in return, ``{"result": ...}`` on success and
+``{"error": "..."}`` otherwise. See client.TopologyClient.
+"""
+
+import contextlib
+import grp
+import json
+import os
+import selectors
+import socket
+import time
+import typing
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import representors
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode import uevent
+
+
+SOCKET_PATH = "/run/mlnx-switchdev-mode/query.sock"
+# NOTE: queries make the service ask the kernel over devlink, only root and
+# members of the group of the socket may connect
+SOCKET_MODE = 0o660
+PROTOCOL_VERSION = 1
+
+# NOTE: a client which does not read its responses is dropped
+CLIENT_TIMEOUT = 5.0
+MAX_REQUEST_SIZE = 1 << 16
+
+
+class QueryError(Exception):
+    pass
+
+
+def function_dict(function: topology.PCIFunction) -> typing.Dict:
+    """JSON representation of a PCI function
+
+    :param function: PCI function
+    :type: topology.PCIFunction
+    :return: PCIFunction fields
+    :rtype: typing.Dict
+    """
+    result = function._asdict()
+    result["vf_addrs"] = list(function.vf_addrs)
+    result["netdevs"] = list(function.netdevs)
+    return result
+
+
+def uevent_function(event: uevent.UEvent) -> typing.Optional[str]:
+    """PCI function whose state is changed by a kernel uevent
+
+    :param event: kernel uevent
+    :type: uevent.UEvent
+    :return: PCI address of the function the event, or the netdev the event
+             is about, belongs to. None for events about other devices.
+    :rtype: typing.Optional[str]
+    """
+    if event.pci_addr is not None:
+        return event.pci_addr
+    if event.subsystem != "net":
+        return None
+    parent, net = os.path.split(os.path.dirname(event.devpath))
+    pci_addr = os.path.basename(parent)
+    if net == "net" and topology.PCI_ADDR_RE.match(pci_addr):
+        return pci_addr
+    return None
+
+
+class TopologyState(object):
+    """Topology kept up to date from kernel uevents, answering queries"""
+
+    def __init__(self, root: str = None,
+                 eswitches: devlink.EswitchCache = None):
+        """Initialise a new topology state
+
+        :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+        :type: str
+        :param eswitches: eswitch configuration cache to use
+        :type: devlink.EswitchCache
+        """
+        self._root = root or topology.SYSFS_ROOT
+        self._eswitches = eswitches or devlink.EswitchCache()
+        self._snapshot = topology.Topology([], root=self._root)
+        self._index = None
+        self.started = time.time()
+        self.uevents = 0
+        self.refreshes = 0
+
+    @property
+    def snapshot(self) -> topology.Topology:
+        return self._snapshot
+
+    def load(self):
+        """Take a full snapshot of the topology"""
+        self._snapshot = topology.scan(self._root)
+        self._index = None
+        self._eswitches.invalidate()
+
+    def handle_uevent(self, event: uevent.UEvent):
+        """Update the topology after a kernel uevent
+
+        The function the event is about is read again, and so is its PF,
+        whose VFs change when VFs are added or removed. The eswitch mode of
+        a PF is queried again when it is next asked for, as a reset or a
+        mode change recreate the PF and its netdevs.
+
+        :param event: kernel uevent
+        :type: uevent.UEvent
+        """
+        self.uevents += 1
+        pci_addr = uevent_function(event)
+        if pci_addr is None:
+            return
+        physfn = (self._snapshot[pci_addr].physfn
+                  if pci_addr in self._snapshot else None)
+        self._snapshot = self._snapshot.refresh([pci_addr])
+        if pci_addr in self._snapshot:
+            physfn = self._snapshot[pci_addr].physfn or physfn
+        if physfn is not None:
+            self._snapshot = self._snapshot.refresh([physfn])
+        else:
+            self._eswitches.invalidate("pci/{}".format(pci_addr))
+        self._index = None
+        self.refreshes += 1
+
+    def _function(self, name: str) -> topology.PCIFunction:
+        # NOTE: names come from clients, e.g. lists would not be hashable
+        if not isinstance(name, str):
+            raise QueryError("{!r}: not a PCI address or netdev name"
+                             .format(name))
+        pci_addr = self._snapshot.netdevs.get(name, name)
+        if pci_addr not in self._snapshot:
+            raise QueryError("{}: no such PCI function or netdev"
+                             .format(name))
+        return self._snapshot[pci_addr]
+
+    def _eswitch_modes(self) -> typing.Dict[str, typing.Optional[str]]:
+        handles = [pf.devlink_handle
+                   for pf in self._snapshot.pfs(driver="mlx5_core")]
+        missing = [handle for handle in handles
+                   if self._eswitches.peek(handle) is None]
+        if missing:
+            self._eswitches.load(missing)
+            for handle in missing:
+                # NOTE: do not query devices without eswitch over and over
+                if self._eswitches.peek(handle) is None:
+                    self._eswitches.update(handle, {})
+        return {
+            handle[len("pci/"):]: self._eswitches.peek(handle).get("mode")
+            for handle in handles
+        }
+
+    def query(self, request: typing.Mapping) -> typing.Any:
+        """Answer a query
+
+        Queries are:
+
+        - ``status``: protocol version, uptime and update counters
+        - ``functions``: all PCI functions
+        - ``pfs``: SR-IOV PFs
+        - ``function``: a single function by ``name``, a PCI address or
+          netdev name
+        - ``vfs``: VFs of the PF ``pf``, by PCI address or netdev name
+        - ``eswitch``: PCI address to eswitch mode mappings of mlx5_core PFs
+        - ``representors``: VFs of PFs and their representors, see
+          representors.RepresentorIndex, of PF ``pf`` only if given
+
+        :param request: query and its parameters
+        :type: typing.Mapping
+        :return: JSON serialisable result
+        :rtype: typing.Any
+        :raises: QueryError on unknown or invalid queries
+        """
+        if not isinstance(request, dict):
+            raise QueryError("Request is not an object")
+        name = request.get("query")
+        if name == "status":
+            return {
+                "version": PROTOCOL_VERSION,
+                "sysfs_root": self._root,
+                "uptime": time.time() - self.started,
+                "functions": len(self._snapshot),
+                "uevents": self.uevents,
+                "refreshes": self.refreshes,
+            }
+        if name == "functions":
+            return [function_dict(function) for function in self._snapshot]
+        if name == "pfs":
+            return [function_dict(pf) for pf in self._snapshot.pfs()]
+        if name == "function":
+            return function_dict(self._function(request.get("name")))
+        if name == "vfs":
+            pf = self._function(request.get("pf"))
+            return [function_dict(vf) for vf in self._snapshot.vfs(pf)]
+        if name == "eswitch":
+            return self._eswitch_modes()
+        if name == "representors":
+            if self._index is None:
+                self._index = representors.index_topology(self._snapshot)
+            if request.get("pf") is None:
+                ports = list(self._index)
+            else:
+                ports = self._index.vfs(self._function(request["pf"]).pci_addr)
+            return [port._asdict() for port in ports]
+        raise QueryError("Unknown query: {!r}".format(name))
+
+    def handle_request(self, line: bytes) -> bytes:
+        """Answer a request line of a client
+
+        :param line: JSON request
+        :type: bytes
+        :return: JSON response line
+        :rtype: bytes
+        """
+        try:
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except ValueError as e:
+                raise QueryError("Invalid request: {}".format(e))
+            response = {"result": self.query(request)}
+        except QueryError as e:
+            response = {"error": str(e)}
+        except Exception as e:
+            # NOTE: e.g. devlink failing, the request fails, not the service
+            response = {"error": "Failed to answer query: {}".format(e)}
+        return (json.dumps(response, sort_keys=True) + "\n").encode("utf-8")
+
+
+def listen(socket_path: str = None, group: str = None) -> socket.socket:
+    """Create the listening socket of the query service
+
+    :param socket_path: path of socket, defaults to SOCKET_PATH
+    :type: str
+    :param group: name of group whose members may connect, only root may
+                  if None
+    :type: str
+    :return: listening socket
+    :rtype: socket.socket
+    :raises: ValueError if the group does not exist
+    """
+    gid = -1
+    if group is not None:
+        try:
+            gid = grp.getgrnam(group).gr_gid
+        except KeyError:
+            raise ValueError("{}: no such group".format(group))
+    socket_path = socket_path or SOCKET_PATH
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(socket_path)
+        os.chown(socket_path, -1, gid)
+        os.chmod(socket_path, SOCKET_MODE)
+        sock.listen(16)
+    except OSError:
+        sock.close()
+        raise
+    sock.setblocking(False)
+    return sock
+
+
+class _Connection(object):
+    """Connection of a client and its pending requests and responses"""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.requests = b""
+        self.responses = b""
+        self.progress = time.monotonic()
+
+
+def serve(socket_path: str = None, source: uevent.UEventSocket = None,
+          state: TopologyState = None, ready: typing.Callable = None,
+          group: str = None):
+    """Answer topology queries until the uevent source is closed
+
+    Responses are written as clients are ready to read them, while a
+    client has responses pending no further requests are read from it.
+
+    :param socket_path: path of socket, defaults to SOCKET_PATH
+    :type: str
+    :param source: uevent source, defaults to the kernel uevent socket
+    :type: uevent.UEventSocket
+    :param state: topology state, defaults to one for topology.SYSFS_ROOT
+    :type: TopologyState
+    :param ready: called once queries are answered
+    :type: typing.Callable
+    :param group: see listen()
+    :type: str
+    """
+    # NOTE: listen to uevents before the scan, so no change goes unnoticed
+    if source is None:
+        source = uevent.UEventSocket()
+    socket_path = socket_path or SOCKET_PATH
+    state = state or TopologyState()
+    selector = selectors.DefaultSelector()
+    connections = {}
+    server = None
+    try:
+        state.load()
+        server = listen(socket_path, group=group)
+        selector.register(server, selectors.EVENT_READ)
+        selector.register(source, selectors.EVENT_READ)
+        if ready is not None:
+            ready()
+        while True:
+            timeout = None
+            if any(conn.responses for conn in connections.values()):
+                timeout = CLIENT_TIMEOUT
+            for key, events in selector.select(timeout):
+                if key.fileobj is source:
+                    try:
+                        event = source.recv(timeout=0)
+                    except EOFError:
+                        return
+                    except uevent.UEventsLost:
+                        # NOTE: changes went unnoticed, start afresh
+                        state.load()
+                        continue
+                    if event is not None:
+                        state.handle_uevent(event)
+                elif key.fileobj is server:
+                    try:
+                        client, _ = server.accept()
+                    except BlockingIOError:
+                        continue
+                    client.setblocking(False)
+                    connections[client] = _Connection(client)
+                    selector.register(client, selectors.EVENT_READ)
+                else:
+                    conn = connections[key.fileobj]
+                    try:
+                        keep = _handle_client(conn, events, state, selector)
+                    except Exception as e:
+                        # NOTE: one client must not take the service down
+                        print("Dropping query client: {!r}".format(e))
+                        keep = False
+                    if not keep:
+                        _drop_client(conn, connections, selector)
+            now = time.monotonic()
+            for conn in list(connections.values()):
+                if conn.responses and now - conn.progress > CLIENT_TIMEOUT:
+                    _drop_client(conn, connections, selector)
+    finally:
+        for conn in list(connections.values()):
+            _drop_client(conn, connections, selector)
+        selector.close()
+        source.close()
+        if server is not None:
+            server.close()
+            # NOTE: do not hide why serving stopped if the socket is gone
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(socket_path)
+
+
+def _handle_client(conn: _Connection, events: int, state: TopologyState,
+                   selector: selectors.BaseSelector) -> bool:
+    """Read the requests of a client and write the responses it can take
+
+    :return: whether to keep the connection
+    :rtype: bool
+    """
+    try:
+        if events & selectors.EVENT_READ:
+            data = conn.sock.recv(MAX_REQUEST_SIZE)
+            if not data:
+                return False
+            conn.requests += data
+            *lines, conn.requests = conn.requests.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    conn.responses += state.handle_request(line)
+            if len(conn.requests) > MAX_REQUEST_SIZE:
+                return False
+            conn.progress = time.monotonic()
+        if conn.responses:
+            sent = conn.sock.send(conn.responses)
+            conn.responses = conn.responses[sent:]
+            conn.progress = time.monotonic()
+    except BlockingIOError:
+        pass
+    except OSError:
+        return False
+    selector.modify(conn.sock, selectors.EVENT_WRITE if conn.responses
+                    else selectors.EVENT_READ)
+    return True
+
+
+def _drop_client(conn: _Connection,
+                 connections: typing.Dict[socket.socket, _Connection],
+                 selector: selectors.BaseSelector):
+    """Close the connection of a client"""
+    if connections.pop(conn.sock, None) is not None:
+        selector.unregister(conn.sock)
+    conn.sock.close()
@@ -15,12 +15,24 @@
 # limitations under the License.
 
 import argparse
-import json
-import logging
+import collections
 import os
-import subprocess
+import sys
+import time
 import typing
 
+from mlnx_switchdev_mode import config
+from mlnx_switchdev_mode import deadline
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import journal
+from mlnx_switchdev_mode import notify
+from mlnx_switchdev_mode import numa
+from mlnx_switchdev_mode import output
+from mlnx_switchdev_mode import report
+from mlnx_switchdev_mode import retry
+from mlnx_switchdev_mode import state
+from mlnx_switchdev_mode import topology
+
 
 class PCIDevice(object):
     """Helper class for interaction with a PCI device"""
@@ -40,7 +52,8 @@ class PCIDevice(object):
         :return: full path to PCI device in /sys filesystem
         :rtype: str
         """
-        return "/sys/bus/pci/devices/{}".format(self.pci_addr)
+        return os.path.join(topology.SYSFS_ROOT, "bus/pci/devices",
+                            self.pci_addr)
 
     def subpath(self, subpath: str) -> str:
         """/sys subpath helper for PCI device
@@ -52,6 +65,30 @@ class PCIDevice(object):
         """
         return os.path.join(self.path, subpath)
 
+    def read_attr(self, attr: str) -> str:
+        """Read a sysfs attribute of the PCI device
+
+        :param attr: name of attribute
+        :type: str
+        :return: value of attribute with trailing whitespace removed
+        :rtype: str
+        """
+        with open(self.subpath(attr), "rt") as f:
+            return f.read().rstrip()
+
+    def write_attr(self, attr: str, value: str):
+        """Write a sysfs attribute of the PCI device
+
+        :param attr: name of attribute
+        :type: str
+        :param value: value to write
+        :type: str
+        :raises: deadline.DeadlineExceeded if the write did not complete by
+                 the deadline
+        """
+        deadline.call("{}: write {}".format(self, attr),
+                      _write_file, self.subpath(attr), value)
+
     @property
     def driver(self) -> str:
         """Kernel driver for PCI device
@@ -121,6 +158,15 @@ class PCIDevice(object):
         """
         return [PCIDevice(addr) for addr in self.vf_addrs]
 
+    @property
+    def devlink_handle(self) -> str:
+        """devlink handle for PCI device
+
+        :return: devlink device handle
+        :rtype: str
+        """
+        return "pci/{}".format(self.pci_addr)
+
     def devlink_get(self, obj_name: str):
         """Query devlink for information about the PCI device
 
@@ -129,17 +175,12 @@ class PCIDevice(object):
         :return: Dictionary of information about the device
         :rtype: dict
         """
-        out = subprocess.check_output(
-            [
-                "/sbin/devlink",
-                "dev",
-                obj_name,
-                "show",
-                "pci/{}".format(self.pci_addr),
-                "--json",
-            ]
-        )
-        return json.loads(out)["dev"]["pci/{}".format(self.pci_addr)]
+        name = "{}: devlink {} show".format(self, obj_name)
+        with report.timer("devlink-get", pf=self.pci_addr):
+            return retry.call(
+                name, deadline.call, name, devlink.get_backend().get,
+                obj_name, self.devlink_handle,
+                timeout=deadline.DEVLINK_TIMEOUT, pf=self.pci_addr)
 
     def devlink_set(self, obj_name: str, prop: str, value: str):
         """Set devlink options for the PCI device
@@ -151,17 +192,31 @@ class PCIDevice(object):
         :param value: value to set for property
         :type: str
         """
-        subprocess.check_call(
-            [
-                "/sbin/devlink",
-                "dev",
-                obj_name,
-                "set",
-                "pci/{}".format(self.pci_addr),
-                prop,
-                value,
-            ]
-        )
+        name = "{}: devlink {} set {} {}".format(self, obj_name, prop, value)
+        with report.timer("devlink-set", pf=self.pci_addr):
+            retry.call(
+                name, deadline.call, name, devlink.get_backend().set,
+                obj_name, self.devlink_handle, prop, value,
+                timeout=deadline.DEVLINK_TIMEOUT, pf=self.pci_addr)
+
+    def eswitch_set(self, props: typing.Dict[str, str]):
+        """Set eswitch properties of the PCI device in one devlink request
+
+        The driver rebuilds the eswitch and its representors once for all
+        properties, rather than once per property.
+
+        :param props: eswitch properties as named by the devlink command,
+                      see devlink.eswitch_changes()
+        :type: typing.Dict[str, str]
+        """
+        name = "{}: devlink eswitch set {}".format(
+            self, " ".join("{} {}".format(prop, value)
+                           for prop, value in props.items()))
+        with report.timer("devlink-set", pf=self.pci_addr):
+            retry.call(
+                name, deadline.call, name, devlink.get_backend().eswitch_set,
+                self.devlink_handle, props,
+                timeout=deadline.DEVLINK_TIMEOUT, pf=self.pci_addr)
 
     def __str__(self) -> str:
         """String represenation of object
@@ -172,6 +227,11 @@ class PCIDevice(object):
         return self.pci_addr
 
 
+def _write_file(path: str, value: str):
+    with open(path, "wt") as f:
+        f.write(value)
+
+
 def netdev_sys(netdev: str, path: str) -> str:
     """Build path to netdev file system for a device
 
@@ -182,7 +242,20 @@ def netdev_sys(netdev: str, path: str) -> str:
     :return: full path to netdev device
     :rtype: str
     """
-    return os.path.join("/sys/class/net", netdev, path)
+    return os.path.join(topology.SYSFS_ROOT, "class/net", netdev, path)
+
+
+def driver_path(driver: str, path: str) -> str:
+    """Build path to sysfs directory of a PCI driver
+
+    :param driver: name of kernel driver
+    :type: str
+    :param path: subpath to use
+    :type: str
+    :return: full path in driver directory
+    :rtype: str
+    """
+    return os.path.join(topology.SYSFS_ROOT, "bus/pci/drivers", driver, path)
 
 
 def build_pci_to_netdev() -> dict:
@@ -192,7 +265,7 @@ def build_pci_to_netdev() -> dict:
     :rtype: dict[str]
     """
     pci_to_netdev = {}
-    for netdev in os.listdir("/sys/class/net"):
+    for netdev in os.listdir(os.path.join(topology.SYSFS_ROOT, "class/net")):
         try:
             pcidev = os.path.basename(
                 os.readlink(netdev_sys(netdev, "device"))
@@ -255,95 +328,1834 @@ def netdev_get_driver(netdev: str) -> str:
     return os.path.basename(os.readlink(netdev_sys(netdev, "device/driver")))
 
 
-def show():
-    """Show details of all installed network adapters"""
-    pci_to_netdev = build_pci_to_netdev()
-    for pci, netdev in sorted(pci_to_netdev.items()):
-        suffix = ""
-        if netdev_is_pf(netdev):
-            suffix = "PF"
-        elif netdev_is_vf(netdev):
-            phys_netdev = pci_to_netdev[netdev_get_pf_pci(netdev)]
-            suffix = "VF of {}".format(phys_netdev)
-        print(
-            "{}\t{}\t{}\t{}".format(
-                pci, netdev, netdev_get_driver(netdev), suffix
-            )
-        )
+# Columns of show output, per PCI function and per PF
+SHOW_TEXT_FIELDS = ["pci_addr", "netdev", "driver", "description"]
+SHOW_FIELDS = ["pci_addr", "netdev", "driver", "function", "physfn",
+               "physfn_netdev"]
+SHOW_ROLLUP_FIELDS = ["pci_addr", "netdev", "driver", "vfs", "bound_vfs",
+                      "eswitch_mode"]
+# NOTE: fields of representors.VFPort, spelled out so that only show
+# --representors imports representors
+SHOW_REPRESENTOR_FIELDS = ["pf", "pf_netdev", "vf_index", "vf_pci_addr",
+                           "vf_netdev", "representor"]
+
+
+def show_rows(rollup: bool = False,
+              eswitches: 'devlink.EswitchCache' = None
+              ) -> typing.Iterator[typing.Dict]:
+    """Describe the installed network adapters
+
+    Netdevs are resolved in a single pass over /sys/class/net, after which
+    each PCI function with netdevs is read once, in address order. Rows are
+    produced as functions are read, only netdev names are kept in memory.
+    The netdevs of a function, e.g. the uplink and representors of a PF in
+    switchdev mode, are listed comma separated in its row.
+
+    :param rollup: produce one row per PF with its VF counts instead of one
+                   row per PCI function
+    :type: bool
+    :param eswitches: eswitch configuration of devices, adds an eswitch mode
+                      to the rows of PFs
+    :type: devlink.EswitchCache
+    :return: rows
+    :rtype: typing.Iterator[typing.Dict]
+    """
+    netdevs = collections.OrderedDict()
+    for pci_addr, netdev in topology.read_netdevs():
+        netdevs.setdefault(pci_addr, []).append(netdev)
+    bound = topology.read_bound("mlx5_core") if rollup else frozenset()
+    for pci_addr, function_netdevs in netdevs.items():
+        try:
+            function = topology.read_function(
+                topology.SYSFS_ROOT, pci_addr, netdevs=function_netdevs,
+                vfs=rollup)
+        except (FileNotFoundError, NotADirectoryError):
+            # NOTE: device was removed while scanning
+            continue
+        eswitch_mode = None
+        if eswitches is not None and function.is_pf:
+            props = eswitches.peek(function.devlink_handle) or {}
+            eswitch_mode = props.get("mode")
+        if rollup:
+            if function.is_pf:
+                yield {
+                    "pci_addr": pci_addr,
+                    "netdev": function_netdevs[0],
+                    "driver": function.driver,
+                    "vfs": len(function.vf_addrs),
+                    "bound_vfs": len(bound.intersection(function.vf_addrs)),
+                    "eswitch_mode": eswitch_mode,
+                }
+            continue
+        row = {
+            "pci_addr": pci_addr,
+            "netdev": ",".join(function_netdevs),
+            "driver": function.driver,
+            "function": None,
+            "physfn": None,
+            "physfn_netdev": None,
+            "description": "",
+            "eswitch_mode": eswitch_mode,
+        }
+        if function.is_pf:
+            row["function"] = row["description"] = "PF"
+        elif function.is_vf:
+            phys_netdevs = netdevs.get(function.physfn)
+            row["function"] = "VF"
+            row["physfn"] = function.physfn
+            row["physfn_netdev"] = phys_netdevs[0] if phys_netdevs else None
+            row["description"] = "VF of {}".format(
+                row["physfn_netdev"] or function.physfn)
+        yield row
+
+
+def show(eswitch=False, fmt="text", rollup=False, stream=None,
+         vf_ports=False):
+    """Show details of all installed network adapters
+
+    :param eswitch: add a column with the eswitch mode of PFs
+    :type: bool
+    :param fmt: output format, one of output.WRITERS
+    :type: str
+    :param rollup: show one row per PF with its VF count, number of VFs
+                   bound to mlx5_core and eswitch mode
+    :type: bool
+    :param stream: stream to write to, defaults to stdout
+    :type: typing.TextIO
+    :param vf_ports: show one row per VF with its index, netdev and
+                     representor instead, see representors.read_index()
+    :type: bool
+    """
+    from mlnx_switchdev_mode import representors
+    if vf_ports:
+        writer = output.WRITERS[fmt](stream or sys.stdout,
+                                     SHOW_REPRESENTOR_FIELDS)
+        try:
+            for port in representors.read_index():
+                writer.write(port._asdict())
+        finally:
+            writer.close()
+        return
+    eswitches = None
+    if eswitch or rollup:
+        eswitches = devlink.EswitchCache()
+        eswitches.load()
+    if rollup:
+        fields = SHOW_ROLLUP_FIELDS
+    elif fmt == "text":
+        fields = SHOW_TEXT_FIELDS
+    else:
+        fields = SHOW_FIELDS
+    if eswitch and not rollup:
+        fields = fields + ["eswitch_mode"]
+    writer = output.WRITERS[fmt](stream or sys.stdout, fields)
+    try:
+        for row in show_rows(rollup=rollup, eswitches=eswitches):
+            writer.write(row)
+    finally:
+        writer.close()
 
 
 class SRIOVModeNotEnabled(Exception):
     pass
 
 
-def bind_vfs(vfs: typing.Iterable[PCIDevice]):
-    """Bind unbound VFs to mlx5_core driver."""
-    bound_vfs = []
-    for vf in vfs:
-        if not vf.bound:
-            with open(
-                "/sys/bus/pci/drivers/mlx5_core/bind", "wt"
-            ) as f:
-                f.write(vf.pci_addr)
-                bound_vfs.append(vf)
-    return bound_vfs
+class VFResult(collections.namedtuple(
+        "VFResult", ["vf", "operation", "error", "duration"])):
+    """Outcome of binding or unbinding a single VF"""
+
+    __slots__ = ()
+
+    @property
+    def ok(self) -> bool:
+        """Determine if the operation succeeded
+
+        :return: whether the operation succeeded
+        :rtype: bool
+        """
+        return self.error is None
+
+
+class VFOperationError(Exception):
+    """Binding or unbinding of one or more VFs failed"""
+
+    def __init__(self, operation: str, results: typing.List[VFResult]):
+        self.operation = operation
+        self.results = results
+        failed = [result for result in results if not result.ok]
+        super().__init__(
+            "Failed to {} {}: {}".format(
+                operation,
+                ", ".join(str(result.vf) for result in failed),
+                failed[0].error))
+
+    @property
+    def completed(self) -> list:
+        """VFs the operation succeeded for
+
+        :return: VFs the operation succeeded for
+        :rtype: list
+        """
+        return [result.vf for result in self.results if result.ok]
+
+
+def driver_operation(operation: str, vf) -> VFResult:
+    """Bind or unbind a single VF to or from the mlx5_core driver
+
+    :param operation: 'bind' or 'unbind'
+    :type: str
+    :param vf: VF to operate on
+    :type: typing.Union[PCIDevice, topology.PCIFunction]
+    :return: outcome and duration of the operation
+    :rtype: VFResult
+    """
+    error = None
+    name = "{}: {}".format(vf.pci_addr, operation)
+    start = time.monotonic()
+    try:
+        retry.call(name, deadline.call, name, _write_file,
+                   driver_path("mlx5_core", operation), vf.pci_addr,
+                   timeout=deadline.VF_TIMEOUT,
+                   pf=getattr(vf, "physfn", None), vf=vf.pci_addr)
+    except OSError as e:
+        error = e
+    duration = time.monotonic() - start
+    report.record(operation, duration, pf=getattr(vf, "physfn", None),
+                  vf=vf.pci_addr, error=error, node=numa.current_node())
+    return VFResult(vf, operation, error, duration)
+
+
+def run_vf_operation(operation: str, vfs: typing.Iterable,
+                     jobs: int = 1,
+                     executor: 'concurrent.futures.Executor' = None
+                     ) -> typing.List[VFResult]:
+    """Bind or unbind VFs with a bounded number of concurrent writes
+
+    Each sysfs write blocks for the duration of the driver probe or remove
+    of the VF, so up to ``jobs`` writes are issued concurrently.
+
+    :param operation: 'bind' or 'unbind'
+    :type: str
+    :param vfs: VFs to operate on
+    :type: typing.Iterable
+    :param jobs: maximum number of concurrent operations
+    :type: int
+    :param executor: executor to run operations on instead of a private
+                     pool of ``jobs`` workers, allows bounding concurrency
+                     across several calls
+    :type: concurrent.futures.Executor
+    :return: per VF outcome and duration, in the order of ``vfs``
+    :rtype: typing.List[VFResult]
+    """
+    import concurrent.futures
+    vfs = list(vfs)
+    if executor is not None:
+        return list(executor.map(
+            lambda vf: driver_operation(operation, vf), vfs))
+    if jobs == 1 or len(vfs) < 2:
+        return [driver_operation(operation, vf) for vf in vfs]
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(jobs, len(vfs))) as pool:
+        return list(pool.map(
+            lambda vf: driver_operation(operation, vf), vfs))
+
+
+def bind_vfs(vfs: typing.Iterable[PCIDevice], jobs: int = 1,
+             executor: 'concurrent.futures.Executor' = None):
+    """Bind unbound VFs to mlx5_core driver.
+
+    :raises: VFOperationError if any VF failed to bind, the VFs which were
+             bound are available from its completed property
+    """
+    results = run_vf_operation(
+        "bind", [vf for vf in vfs if not vf.bound], jobs=jobs,
+        executor=executor)
+    if not all(result.ok for result in results):
+        raise VFOperationError("bind", results)
+    return [result.vf for result in results]
+
+
+def unbind_vfs(vfs: typing.Iterable[PCIDevice], jobs: int = 1,
+               executor: 'concurrent.futures.Executor' = None
+               ) -> typing.Iterable[PCIDevice]:
+    """Unbind bound VFs from mlx5_core driver.
+
+    :raises: VFOperationError if any VF failed to unbind, the VFs which were
+             unbound are available from its completed property
+    """
+    results = run_vf_operation(
+        "unbind", [vf for vf in vfs if vf.bound], jobs=jobs,
+        executor=executor)
+    if not all(result.ok for result in results):
+        raise VFOperationError("unbind", results)
+    return [result.vf for result in results]
+
+
+class BindError(Exception):
+    pass
+
+
+def state_unchanged(state_cache: state.StateCache,
+                    keys: typing.Iterable[str],
+                    config: typing.Dict = None,
+                    pf_addrs: typing.Iterable[str] = None,
+                    eswitches: 'devlink.EswitchCache' = None) -> bool:
+    """Determine if a command has nothing to do since its last run
+
+    The recorded state is dropped when anything changed, so that a failure
+    of the following run does not leave a stale record behind.
+
+    :param state_cache: state of the last successful run of the command
+    :type: state.StateCache
+    :param keys: parts of the fingerprint the command depends on
+    :type: typing.Iterable[str]
+    :param config: configuration the command applies, part of the
+                   fingerprint when set
+    :type: typing.Dict
+    :param pf_addrs: PCI addresses of the PFs a run is limited to, only
+                     these and their VFs are part of the fingerprint
+    :type: typing.Iterable[str]
+    :param eswitches: eswitch configuration cache, the PFs also have to be
+                      in the eswitch mode recorded by the last run when set,
+                      see eswitch_modes_unchanged()
+    :type: devlink.EswitchCache
+    :return: whether the fingerprint matches the last successful run
+    :rtype: bool
+    """
+    with report.timer("fingerprint"):
+        fingerprint = state.read_fingerprint(pf_addrs=pf_addrs)
+    if config is not None:
+        fingerprint["config"] = config
+        keys = tuple(keys) + ("config",)
+    if state_cache.is_current(fingerprint, keys) and (
+            eswitches is None or
+            eswitch_modes_unchanged(state_cache, eswitches)):
+        report.count("cache-hits")
+        print("Nothing changed since last successful {} run, use --no-cache "
+              "to run anyway".format(state_cache.command))
+        return True
+    try:
+        state_cache.invalidate()
+    except OSError as e:
+        print("Unable to drop state of last run: {}".format(e))
+    return False
+
+
+def eswitch_modes_unchanged(state_cache: state.StateCache,
+                            eswitches: 'devlink.EswitchCache') -> bool:
+    """Determine if PFs are still in the eswitch mode recorded by a run
+
+    The mode changes without any change to the PCI topology when it is set
+    with devlink or the driver is reloaded, so the PFs recorded with a mode
+    are queried, in a single bulk query.
+
+    :param state_cache: state of the last successful run of the command
+    :type: state.StateCache
+    :param eswitches: eswitch configuration cache to fill
+    :type: devlink.EswitchCache
+    :return: whether all recorded PFs are in their recorded mode
+    :rtype: bool
+    """
+    recorded = (state_cache.load() or {}).get("pfs", {})
+    modes = {"pci/{}".format(pf_addr): pf_state.get("mode")
+             for pf_addr, pf_state in recorded.items()
+             if isinstance(pf_state, dict) and pf_state.get("mode")}
+    if not modes:
+        return True
+    load_eswitches(eswitches, sorted(modes))
+    changed = [handle for handle, mode in sorted(modes.items())
+               if (eswitches.peek(handle) or {}).get("mode") != mode]
+    for handle in changed:
+        print("{}: eswitch mode changed since last successful {} run"
+              .format(handle[len("pci/"):], state_cache.command))
+    return not changed
+
+
+def pf_state_cache(command: str,
+                   pf_addrs: typing.Iterable[str] = None) -> state.StateCache:
+    """State of a command, of its runs on some PFs when given
+
+    Runs on given PFs, e.g. by the units of single PFs, keep state apart
+    from each other and from runs on all PFs.
+
+    :param command: name of the subcommand
+    :type: str
+    :param pf_addrs: PCI addresses of the PFs a run is limited to
+    :type: typing.Iterable[str]
+    :return: state cache
+    :rtype: state.StateCache
+    """
+    if pf_addrs:
+        command = "{}@{}".format(command, ",".join(sorted(set(pf_addrs))))
+    return state.StateCache(command)
+
+
+def save_state(state_cache: state.StateCache,
+               pfs: typing.Iterable[topology.PCIFunction],
+               eswitches: 'devlink.EswitchCache' = None,
+               config: typing.Dict = None,
+               pf_addrs: typing.Iterable[str] = None):
+    """Record the state after a successful run of a command
+
+    :param state_cache: state of the command
+    :type: state.StateCache
+    :param pfs: PFs handled by the run
+    :type: typing.Iterable[topology.PCIFunction]
+    :param eswitches: eswitch configuration of devices, if known
+    :type: devlink.EswitchCache
+    :param config: configuration applied by the run, see state_unchanged()
+    :type: typing.Dict
+    :param pf_addrs: PCI addresses of the PFs the run was limited to
+    :type: typing.Iterable[str]
+    """
+    fingerprint = state.read_fingerprint(pf_addrs=pf_addrs)
+    if config is not None:
+        fingerprint["config"] = config
+    bound = set(fingerprint["bound"])
+    pf_states = {}
+    for pf in pfs:
+        pf_states[pf.pci_addr] = {
+            "vfs": len(pf.vf_addrs),
+            "bound-vfs": len(bound.intersection(pf.vf_addrs)),
+        }
+        if eswitches is not None:
+            props = eswitches.peek(pf.devlink_handle) or {}
+            pf_states[pf.pci_addr]["mode"] = props.get("mode")
+    try:
+        state_cache.save(fingerprint, pf_states)
+    except OSError as e:
+        print("Unable to record state of run: {}".format(e))
+
+
+def bind(jobs=1, cache=False, pin_numa=False, bind_policy=None,
+         vf_addrs=None, use_journal=False, pf_addrs=None):
+    """Bind VFs of devices in switchdev mode to mlx5_core driver.
+
+    Only the VFs selected by ``bind_policy`` are bound, all of them by
+    default. With ``vf_addrs`` set exactly these VFs are bound instead,
+    e.g. on demand for VFs a bind policy left unbound. With ``cache`` set
+    nothing is done when neither the topology, driver binding nor the bind
+    policy changed since the last successful run. With ``pin_numa`` set
+    the VFs of each PF are bound by ``jobs`` workers pinned to the CPUs of
+    the PF's NUMA node, see numa.NodeExecutors. With ``use_journal`` set,
+    PFs a switch left half done are recovered first, see recover(). With
+    ``pf_addrs`` set only the VFs of these PFs are bound, and only these
+    PFs and their VFs are read from sysfs.
+    """
+    if use_journal:
+        recover(jobs=jobs, pf_addrs=pf_addrs)
+    bind_policy = bind_policy or config.BindPolicy()
+    state_cache = None
+    if cache and not vf_addrs:
+        state_cache = pf_state_cache("bind", pf_addrs)
+    keys = ("boot_id", "sysfs_root", "devices", "bound")
+    if pf_addrs:
+        keys += ("functions",)
+    if state_cache is not None and state_unchanged(
+            state_cache, keys, config={"bind-policy": bind_policy.to_dict()},
+            pf_addrs=pf_addrs or None):
+        return
+    with report.timer("scan"):
+        if pf_addrs:
+            snapshot = topology.scan_pfs(pf_addrs)
+        else:
+            snapshot = topology.scan()
+    if vf_addrs:
+        selected = requested_vfs(snapshot, vf_addrs)
+        pfs = [pf for pf in snapshot.pfs(driver="mlx5_core")
+               if pf.pci_addr in selected]
+    else:
+        if pf_addrs:
+            pfs = requested_pfs(snapshot, pf_addrs)
+        else:
+            pfs = snapshot.pfs(driver="mlx5_core")
+            for name in bind_policy.unknown(snapshot):
+                print("{}: no such PF, ignoring its bind policy"
+                      .format(name))
+        selected = {pf.pci_addr: bind_policy.select(pf, snapshot.vfs(pf))
+                    for pf in pfs}
+    failed = []
+    node_executors = numa.NodeExecutors(jobs) if pin_numa else None
+    try:
+        for index, pf in enumerate(pfs, 1):
+            report.count("pfs")
+            vfs = selected[pf.pci_addr]
+            node = None
+            if node_executors is not None:
+                node = numa.read_numa_node(pf.pci_addr)
+            try:
+                with report.timer("bind-vfs", pf=pf.pci_addr, node=node):
+                    if node_executors is not None:
+                        bound_vfs = bind_vfs(
+                            vfs, executor=node_executors.executor(node))
+                    else:
+                        bound_vfs = bind_vfs(vfs, jobs=jobs)
+            except VFOperationError as e:
+                print("{}: {}".format(pf, e))
+                failed.append(str(pf))
+                bound_vfs = e.completed
+            report.count("vfs-bound", len(bound_vfs))
+            print("{}: bound {} VFs".format(pf, len(bound_vfs)))
+            skipped = len(snapshot.vfs(pf)) - len(vfs)
+            if skipped and not vf_addrs:
+                report.count("vfs-skipped", skipped)
+                print("{}: left {} VFs unbound by policy".format(pf, skipped))
+            notify.status("Bound VFs of {}/{} PFs".format(index, len(pfs)))
+    finally:
+        if node_executors is not None:
+            node_executors.shutdown()
+    if failed:
+        raise BindError('Failed to bind VFs of {}'.format(', '.join(failed)))
+    if state_cache is not None:
+        save_state(state_cache, snapshot.pfs(driver="mlx5_core"),
+                   config={"bind-policy": bind_policy.to_dict()},
+                   pf_addrs=pf_addrs or None)
+
+
+class UnknownPFError(Exception):
+    pass
+
+
+def requested_pfs(snapshot: topology.Topology,
+                  pf_addrs: typing.Iterable[str]
+                  ) -> typing.List[topology.PCIFunction]:
+    """Look up PFs requested by PCI address in a topology
 
+    :param snapshot: topology to look PFs up in
+    :type: topology.Topology
+    :param pf_addrs: PCI addresses of PFs
+    :type: typing.Iterable[str]
+    :return: PFs ordered by PCI address
+    :rtype: typing.List[topology.PCIFunction]
+    :raises: UnknownPFError if a function is not a PF driven by mlx5_core
+    """
+    pfs = {}
+    for pf_addr in pf_addrs:
+        if pf_addr not in snapshot:
+            raise UnknownPFError("{}: no such PCI function".format(pf_addr))
+        pf = snapshot[pf_addr]
+        if pf.driver != "mlx5_core":
+            raise UnknownPFError("{}: not driven by mlx5_core"
+                                 .format(pf_addr))
+        if not pf.is_pf:
+            raise UnknownPFError("{}: not a SR-IOV Physical Function"
+                                 .format(pf_addr))
+        pfs[pf_addr] = pf
+    return [pfs[pf_addr] for pf_addr in sorted(pfs)]
+
+
+def requested_vfs(snapshot: topology.Topology,
+                  vf_addrs: typing.Iterable[str]
+                  ) -> typing.Dict[str, typing.List[topology.PCIFunction]]:
+    """Look up VFs requested by PCI address in a topology
+
+    :param snapshot: topology to look VFs up in
+    :type: topology.Topology
+    :param vf_addrs: PCI addresses of VFs
+    :type: typing.Iterable[str]
+    :return: PCI address of PF to VFs mappings
+    :rtype: typing.Dict[str, typing.List[topology.PCIFunction]]
+    :raises: BindError if a function is not a VF of a mlx5_core PF
+    """
+    selected = collections.OrderedDict()
+    for vf_addr in vf_addrs:
+        if vf_addr not in snapshot or not snapshot[vf_addr].is_vf:
+            raise BindError("{}: not a SR-IOV Virtual Function"
+                            .format(vf_addr))
+        vf = snapshot[vf_addr]
+        if (vf.physfn not in snapshot or
+                snapshot[vf.physfn].driver != "mlx5_core"):
+            raise BindError("{}: PF {} is not driven by mlx5_core"
+                            .format(vf_addr, vf.physfn))
+        vfs = selected.setdefault(vf.physfn, [])
+        if vf not in vfs:
+            vfs.append(vf)
+    return selected
+
+
+class SwitchError(Exception):
+    pass
 
-def unbind_vfs(vfs: typing.Iterable[PCIDevice]) -> typing.Iterable[PCIDevice]:
-    """Unbind bound VFs from mlx5_core driver."""
+
+def _rebind_failed(pf: typing.Any, error: Exception, failed: bool):
+    """Handle a failure to bring VFs back after a switch
+
+    :param pf: PF whose VFs were to be bound again
+    :type: typing.Any
+    :param error: error binding the VFs
+    :type: Exception
+    :param failed: whether the switch itself failed
+    :type: bool
+    :raises: error unless the switch failed, whose error is the one raised
+    """
+    if not failed:
+        raise error
+    # NOTE: the VFs are still recorded in the journal, if there is one
+    print("{}: failed to bind VFs again after failed switch: {}"
+          .format(pf, error))
+
+
+def switch_pf(pf: topology.PCIFunction, snapshot: topology.Topology,
+              eswitches: 'devlink.EswitchCache', rebind: bool = False,
+              executor: 'concurrent.futures.Executor' = None,
+              eswitch_config: typing.Dict[str, str] = None,
+              bind_policy: config.BindPolicy = None,
+              run_journal: journal.Journal = None):
+    """Configure a single PF into switchdev mode
+
+    With ``run_journal`` set, the VFs to unbind and rebind and the eswitch
+    properties to set are recorded before the first VF is unbound, so that
+    recover() can finish the switch if the run dies half way.
+
+    :param pf: PF to configure
+    :type: topology.PCIFunction
+    :param snapshot: topology the PF was discovered in
+    :type: topology.Topology
+    :param eswitches: eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :param rebind: rebind VFs to mlx5_core driver after the switch
+    :type: bool
+    :param executor: executor for VF unbind and bind operations
+    :type: concurrent.futures.Executor
+    :param eswitch_config: eswitch properties to set, defaults to
+                           devlink.DEFAULT_ESWITCH_CONFIG
+    :type: typing.Dict[str, str]
+    :param bind_policy: VFs to rebind, defaults to all
+    :type: config.BindPolicy
+    :param run_journal: journal to record the steps of the switch in
+    :type: journal.Journal
+    """
+    bind_policy = bind_policy or config.BindPolicy()
+    vfs = snapshot.vfs(pf)
+    print("{}: {}".format(pf, [str(vf) for vf in vfs]))
+    if vfs:
+        changes = devlink.eswitch_changes(
+            eswitches.get(pf.devlink_handle),
+            eswitch_config or devlink.DEFAULT_ESWITCH_CONFIG)
+        if changes and "mode" not in changes:
+            # NOTE: already in switchdev mode, VFs can stay bound
+            PCIDevice(pf.pci_addr).eswitch_set(changes)
+            eswitches.update(pf.devlink_handle, changes)
+        elif changes:
+            pcidev = PCIDevice(pf.pci_addr)
+            unbound_vfs = []
+            entry = None
+            if run_journal is not None:
+                entry = run_journal.begin(
+                    pf.pci_addr, "switch",
+                    vfs=[vf.pci_addr for vf in vfs if vf.bound],
+                    eswitch=changes,
+                    rebind=([vf.pci_addr for vf in
+                             bind_policy.select(pf, vfs) if vf.bound]
+                            if rebind else []))
+            failed = False
+            try:
+                try:
+                    with report.timer("unbind-vfs", pf=pf.pci_addr):
+                        unbound_vfs = unbind_vfs(vfs, executor=executor)
+                except VFOperationError as e:
+                    unbound_vfs = e.completed
+                    raise
+                finally:
+                    report.count("vfs-unbound", len(unbound_vfs))
+                if entry is not None:
+                    entry.done(journal.UNBIND)
+                pcidev.eswitch_set(changes)
+                eswitches.update(pf.devlink_handle, changes)
+                if entry is not None:
+                    entry.done(journal.ESWITCH)
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                # NOTE: VF state in the snapshot is stale after unbind
+                unbound_addrs = [vf.pci_addr for vf in
+                                 bind_policy.select(pf, unbound_vfs)]
+                try:
+                    if rebind and unbound_addrs:
+                        with report.timer("rebind-vfs", pf=pf.pci_addr):
+                            refreshed = snapshot.refresh(unbound_addrs)
+                            bound_vfs = bind_vfs(
+                                [refreshed[pci_addr]
+                                 for pci_addr in unbound_addrs
+                                 if pci_addr in refreshed],
+                                executor=executor)
+                        report.count("vfs-bound", len(bound_vfs))
+                    # NOTE: VFs are back, whether or not the eswitch changed
+                    if entry is not None:
+                        entry.discard()
+                except Exception as e:
+                    _rebind_failed(pf, e, failed)
+
+
+def switch_pf_autoprobe(pf: topology.PCIFunction,
+                        snapshot: topology.Topology,
+                        eswitches: 'devlink.EswitchCache',
+                        rebind: bool = False,
+                        executor: 'concurrent.futures.Executor' = None,
+                        eswitch_config: typing.Dict[str, str] = None,
+                        bind_policy: config.BindPolicy = None,
+                        run_journal: journal.Journal = None):
+    """Configure a single PF into switchdev mode without probing VFs twice
+
+    VF probing is disabled through sriov_drivers_autoprobe on the PF for
+    the duration of the mode change. VFs which are still unbound, because
+    they were created while autoprobe was disabled, are therefore never
+    probed in legacy mode and do not need to be removed again. VFs that
+    are already bound have to be unbound as with switch_pf(). Once in
+    switchdev mode, VFs are probed explicitly when ``rebind`` is set.
+
+    This only avoids probing VFs twice if whatever created them disabled
+    autoprobe beforehand, as provision_pf() does. VFs created with
+    autoprobe enabled, e.g. by a udev rule writing sriov_numvfs, were
+    probed already and the strategy does the same work as switch_pf(),
+    which is why it is not the default.
+
+    :param pf: PF to configure
+    :type: topology.PCIFunction
+    :param snapshot: topology the PF was discovered in
+    :type: topology.Topology
+    :param eswitches: eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :param rebind: bind all VFs to mlx5_core driver after the switch
+    :type: bool
+    :param executor: executor for VF unbind and bind operations
+    :type: concurrent.futures.Executor
+    :param eswitch_config: see switch_pf()
+    :type: typing.Dict[str, str]
+    :param bind_policy: see switch_pf()
+    :type: config.BindPolicy
+    :param run_journal: see switch_pf()
+    :type: journal.Journal
+    """
+    bind_policy = bind_policy or config.BindPolicy()
+    vfs = snapshot.vfs(pf)
+    print("{}: {}".format(pf, [str(vf) for vf in vfs]))
+    if not vfs:
+        return
+    changes = devlink.eswitch_changes(
+        eswitches.get(pf.devlink_handle),
+        eswitch_config or devlink.DEFAULT_ESWITCH_CONFIG)
+    if "mode" not in changes:
+        if changes:
+            PCIDevice(pf.pci_addr).eswitch_set(changes)
+            eswitches.update(pf.devlink_handle, changes)
+        return
+    pcidev = PCIDevice(pf.pci_addr)
+    autoprobe = pcidev.read_attr("sriov_drivers_autoprobe")
+    bound_vfs = [vf for vf in vfs if vf.bound]
+    entry = None
+    if run_journal is not None:
+        entry = run_journal.begin(
+            pf.pci_addr, "switch", vfs=[vf.pci_addr for vf in bound_vfs],
+            eswitch=changes,
+            rebind=([vf.pci_addr for vf in bind_policy.select(pf, vfs)]
+                    if rebind else []),
+            autoprobe=autoprobe)
     unbound_vfs = []
-    for vf in vfs:
-        if vf.bound:
-            with open(
-                "/sys/bus/pci/drivers/mlx5_core/unbind",
-                "wt",
-            ) as f:
-                f.write(vf.pci_addr)
-                unbound_vfs.append(vf)
-    return unbound_vfs
-
-
-def bind():
-    """Bind VFs of devices in switchdev mode to mlx5_core driver."""
-    for pci_addr in os.listdir("/sys/bus/pci/devices"):
-        pcidev = PCIDevice(pci_addr)
-        if pcidev.driver == "mlx5_core" and pcidev.is_pf:
-            bound_vfs = bind_vfs(pcidev.vfs)
-            print("{}: bound {} VFs".format(pcidev, len(bound_vfs)))
-
-
-def switch(werror=False, rebind=False):
-    """Configure capable devices into switchdev mode"""
-    for pci_addr in os.listdir("/sys/bus/pci/devices"):
-        pcidev = PCIDevice(pci_addr)
-        if pcidev.driver == "mlx5_core":
-            if not pcidev.is_pf:
-                if not pcidev.is_vf:
+    switched = False
+    failed = False
+    pcidev.write_attr("sriov_drivers_autoprobe", "0")
+    try:
+        try:
+            if bound_vfs:
+                print("{}: {} VFs were probed before the switch to "
+                      "switchdev mode, disable sriov_drivers_autoprobe "
+                      "before creating VFs to avoid unbinding them"
+                      .format(pf, len(bound_vfs)))
+                try:
+                    with report.timer("unbind-vfs", pf=pf.pci_addr):
+                        unbound_vfs = unbind_vfs(bound_vfs,
+                                                 executor=executor)
+                except VFOperationError as e:
+                    unbound_vfs = e.completed
+                    raise
+                finally:
+                    report.count("vfs-unbound", len(unbound_vfs))
+            if entry is not None:
+                entry.done(journal.UNBIND)
+            pcidev.eswitch_set(changes)
+            eswitches.update(pf.devlink_handle, changes)
+            switched = True
+            if entry is not None:
+                entry.done(journal.ESWITCH)
+        finally:
+            pcidev.write_attr("sriov_drivers_autoprobe", autoprobe)
+            if entry is not None:
+                entry.done(journal.AUTOPROBE)
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        # NOTE: if the switch failed only the VFs unbound for it are bound
+        # again, VFs which were never probed are left alone
+        rebind_addrs = [vf.pci_addr for vf in bind_policy.select(
+            pf, vfs if switched else unbound_vfs)]
+        try:
+            if rebind and rebind_addrs:
+                with report.timer("rebind-vfs", pf=pf.pci_addr):
+                    refreshed = snapshot.refresh(rebind_addrs)
+                    bound_vfs = bind_vfs([refreshed[pci_addr]
+                                          for pci_addr in rebind_addrs
+                                          if pci_addr in refreshed],
+                                         executor=executor)
+                report.count("vfs-bound", len(bound_vfs))
+            if entry is not None:
+                entry.discard()
+        except Exception as e:
+            _rebind_failed(pf, e, failed)
+
+
+def wait_representors(pf_addrs: typing.Iterable[str],
+                      eswitches: 'devlink.EswitchCache', timeout: float):
+    """Wait for the representors of PFs in switchdev mode to appear
+
+    :param pf_addrs: PCI addresses of PFs
+    :type: typing.Iterable[str]
+    :param eswitches: eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :param timeout: seconds to wait at most
+    :type: float
+    :raises: representors.RepresentorTimeout if representors are missing
+    """
+    from mlnx_switchdev_mode import representors
+    pfs = []
+    for pf_addr in sorted(set(pf_addrs)):
+        props = eswitches.peek("pci/{}".format(pf_addr)) or {}
+        if props.get("mode") != "switchdev":
+            continue
+        try:
+            # NOTE: re-read, VFs may have been created by this run
+            pf = topology.read_function(topology.SYSFS_ROOT, pf_addr,
+                                        netdevs=())
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        if pf.vf_addrs:
+            pfs.append(pf)
+    if pfs:
+        with report.timer("wait-representors"):
+            representors.wait_for_representors(
+                pfs, max(0.0, deadline.current().bound(timeout)))
+
+
+def load_eswitches(eswitches: 'devlink.EswitchCache',
+                   handles: typing.Iterable[str]):
+    """Query the eswitch configuration of devices in one bulk query
+
+    :param eswitches: cache to fill
+    :type: devlink.EswitchCache
+    :param handles: devlink device handles
+    :type: typing.Iterable[str]
+    :raises: deadline.DeadlineExceeded if the query did not complete in
+             time
+    """
+    with report.timer("devlink-query"):
+        deadline.call("devlink eswitch show", eswitches.load, handles,
+                      timeout=deadline.DEVLINK_TIMEOUT)
+
+
+def _timed(phase: str, pf: str, func: typing.Callable, *args, **kwargs):
+    with report.timer(phase, pf=pf):
+        return func(*args, **kwargs)
+
+
+# Strategies for switching a PF into switchdev mode
+SWITCH_STRATEGIES = collections.OrderedDict([
+    ("unbind", switch_pf),
+    ("autoprobe", switch_pf_autoprobe),
+])
+
+
+def _existing(pci_addrs: typing.Iterable[str]) -> typing.List[PCIDevice]:
+    devices = [PCIDevice(pci_addr) for pci_addr in pci_addrs]
+    return [device for device in devices if os.path.isdir(device.path)]
+
+
+def recover_pf(entry: journal.JournalEntry, jobs: int = 1):
+    """Complete the switch of a PF a run left half done, or roll it back
+
+    Only the PF and the VFs recorded in the journal are touched and steps
+    recorded as completed are not repeated. The eswitch is queried again
+    unless its step was recorded, as the run may have died between setting
+    it and the record. Recorded VFs are bound again in any case, so when
+    setting the eswitch fails the PF is rolled back to its state before
+    the interrupted run. The record is dropped once the VFs are back.
+
+    :param entry: record of the interrupted switch
+    :type: journal.JournalEntry
+    :param jobs: number of VFs to unbind and bind concurrently
+    :type: int
+    """
+    pcidev = PCIDevice(entry.pf)
+    if not os.path.isdir(pcidev.path):
+        print("{}: gone, dropping record of interrupted {} run"
+              .format(pcidev, entry.command))
+        entry.discard()
+        return
+    print("{}: recovering from interrupted {} run, completed: {}".format(
+        pcidev, entry.command, ", ".join(entry.completed) or "nothing"))
+    failed = False
+    try:
+        if not entry.is_done(journal.ESWITCH):
+            changes = devlink.eswitch_changes(pcidev.devlink_get("eswitch"),
+                                              entry.eswitch)
+            if "mode" in changes:
+                with report.timer("unbind-vfs", pf=entry.pf):
+                    unbound_vfs = unbind_vfs(_existing(entry.vfs), jobs=jobs)
+                report.count("vfs-unbound", len(unbound_vfs))
+            if changes:
+                pcidev.eswitch_set(changes)
+            entry.done(journal.ESWITCH)
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        try:
+            if (entry.autoprobe is not None and
+                    not entry.is_done(journal.AUTOPROBE)):
+                pcidev.write_attr("sriov_drivers_autoprobe",
+                                  entry.autoprobe)
+                entry.done(journal.AUTOPROBE)
+            with report.timer("rebind-vfs", pf=entry.pf):
+                bound_vfs = bind_vfs(_existing(entry.rebind), jobs=jobs)
+            report.count("vfs-bound", len(bound_vfs))
+            # NOTE: VFs are back, whether the switch was completed or not
+            entry.discard()
+        except Exception as e:
+            _rebind_failed(pcidev, e, failed)
+
+
+def recover(jobs: int = 1, run_journal: journal.Journal = None,
+            pf_addrs: typing.Iterable[str] = None):
+    """Recover PFs from runs which died half way through their switch
+
+    Costs a single directory listing when no run was interrupted. A PF
+    whose VFs cannot be bound again keeps its record, to be retried by the
+    next run.
+
+    :param jobs: number of VFs to unbind and bind concurrently
+    :type: int
+    :param run_journal: journal to recover from, defaults to the journal
+                        in state.STATE_DIR
+    :type: journal.Journal
+    :param pf_addrs: only recover these PFs, all by default
+    :type: typing.Iterable[str]
+    """
+    for entry in (run_journal or journal.Journal()).entries():
+        if pf_addrs and entry.pf not in pf_addrs:
+            continue
+        report.count("pfs-recovered")
+        try:
+            _timed("recover-pf", entry.pf, recover_pf, entry, jobs=jobs)
+        except Exception as e:
+            print("{}: failed to recover: {}".format(entry.pf, e))
+
+
+def mlx5_pfs(snapshot: topology.Topology,
+             werror: bool = False) -> typing.List[topology.PCIFunction]:
+    """PFs of mlx5_core cards, warning about cards not in SR-IOV mode
+
+    :param snapshot: topology
+    :type: topology.Topology
+    :param werror: raise instead of warning
+    :type: bool
+    :return: PFs ordered by PCI address
+    :rtype: typing.List[topology.PCIFunction]
+    :raises: SRIOVModeNotEnabled with ``werror`` set
+    """
+    pfs = []
+    for function in snapshot:
+        if function.driver == "mlx5_core":
+            if not function.is_pf:
+                if not function.is_vf:
                     # We have found a MLX5 card that does not appear to be in
                     # SR-IOV mode. This is a pre-requisite for this to work so
                     # print a warning or raise an error.
                     msg = ('SR-IOV mode not enabled for card {}'
-                           .format(pci_addr))
+                           .format(function))
                     if werror:
                         raise SRIOVModeNotEnabled(msg)
                     print(msg)
                 continue
-            print("{}: {}".format(pcidev, pcidev.vfs))
-            if pcidev.vfs:
-                if pcidev.devlink_get("eswitch")["mode"] == "legacy":
-                    unbound_vfs = []
-                    try:
-                        unbound_vfs = unbind_vfs(pcidev.vfs)
-                        pcidev.devlink_set("eswitch", "mode", "switchdev")
-                    finally:
-                        if rebind:
-                            bind_vfs(unbound_vfs)
+            pfs.append(function)
+    return pfs
+
+
+def switch(werror=False, rebind=False, jobs=1, strategy="unbind",
+           cache=False, representor_timeout=None, eswitch_config=None,
+           pin_numa=False, bind_policy=None, use_journal=False,
+           pf_addrs=None):
+    """Configure capable devices into switchdev mode
+
+    PFs are switched by a pool of ``jobs`` workers, VFs of all PFs are
+    unbound and rebound by a second pool of ``jobs`` workers. A failure on
+    one PF does not affect the others; all failures are reported once every
+    PF has been processed. ``strategy`` selects one of SWITCH_STRATEGIES
+    for the per PF work. With ``cache`` set nothing is done when the
+    topology did not change since the last successful run. With
+    ``representor_timeout`` set, returns only once the representors of all
+    PFs in switchdev mode exist, waiting that many seconds at most.
+    ``eswitch_config`` is the complete eswitch configuration to set, by
+    default only the mode, see switch_pf(). With ``pin_numa`` set the VFs
+    of each PF are unbound and rebound by a pool of ``jobs`` workers per
+    NUMA node, pinned to the CPUs of the node of the PF. Only the VFs
+    selected by ``bind_policy`` are rebound, all of them by default. With
+    ``use_journal`` set, PFs an earlier run left half switched are
+    recovered first and the steps of this run are journaled, see
+    recover(). With ``pf_addrs`` set only these PFs are switched, and only
+    these PFs and their VFs are read from sysfs, so that units of single
+    PFs can run in parallel.
+    """
+    import concurrent.futures
+    switch_pf_func = SWITCH_STRATEGIES[strategy]
+    run_journal = None
+    if use_journal:
+        run_journal = journal.Journal()
+        recover(jobs=jobs, run_journal=run_journal, pf_addrs=pf_addrs)
+    state_cache = pf_state_cache("switch", pf_addrs) if cache else None
+    eswitch_config = eswitch_config or devlink.DEFAULT_ESWITCH_CONFIG
+    bind_policy = bind_policy or config.BindPolicy()
+    run_config = {"eswitch": eswitch_config}
+    if rebind:
+        run_config["bind-policy"] = bind_policy.to_dict()
+    # NOTE: binding of VFs has no influence on the work to do, the eswitch
+    # mode does and may change without any change to the topology.
+    eswitches = devlink.EswitchCache()
+    if state_cache is not None and state_unchanged(
+            state_cache, ("boot_id", "sysfs_root", "devices"),
+            config=run_config, pf_addrs=pf_addrs or None,
+            eswitches=eswitches):
+        return
+    with report.timer("scan"):
+        if pf_addrs:
+            snapshot = topology.scan_pfs(pf_addrs)
+        else:
+            snapshot = topology.scan()
+    if pf_addrs:
+        pfs = requested_pfs(snapshot, pf_addrs)
+    else:
+        pfs = mlx5_pfs(snapshot, werror=werror)
+
+    # NOTE: query the eswitch mode of all PFs with VFs up front, on an
+    # already switched host this is the only devlink interaction.
+    handles = [pf.devlink_handle for pf in pfs if pf.vf_addrs]
+    if handles:
+        load_eswitches(eswitches, handles)
+    report.count("pfs", len(pfs))
+    notify.status("Switching {} PFs to switchdev mode".format(len(pfs)))
+
+    failed = []
+    with numa.NodeExecutors(jobs, pin=pin_numa) as vf_executors, \
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_timed, "switch-pf", pf.pci_addr,
+                            switch_pf_func, pf, snapshot, eswitches,
+                            rebind=rebind,
+                            executor=vf_executors.executor_for(pf.pci_addr),
+                            eswitch_config=eswitch_config,
+                            bind_policy=bind_policy,
+                            run_journal=run_journal): pf
+            for pf in pfs
+        }
+        for done, future in enumerate(
+                concurrent.futures.as_completed(futures), 1):
+            pf = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print("{}: failed to switch to switchdev mode: {}"
+                      .format(pf, e))
+                failed.append(str(pf))
+            notify.status("Switched {}/{} PFs to switchdev mode{}".format(
+                done - len(failed), len(pfs),
+                ", {} failed".format(len(failed)) if failed else ""))
+    if failed:
+        raise SwitchError('Failed to switch {} to switchdev mode'
+                          .format(', '.join(sorted(failed))))
+    if representor_timeout is not None:
+        notify.status("Waiting for representors")
+        wait_representors([pf.pci_addr for pf in pfs], eswitches,
+                          representor_timeout)
+    if state_cache is not None:
+        save_state(state_cache, pfs, eswitches, config=run_config,
+                   pf_addrs=pf_addrs or None)
+
+
+def print_plan(operations: 'typing.List[plan.Operation]', jobs: int = 1):
+    """Print operations per PF with their cost and an estimate of the total
+
+    :param operations: operations, see plan.prune()
+    :type: typing.List[plan.Operation]
+    :param jobs: number of concurrent workers to estimate duration for
+    :type: int
+    """
+    from mlnx_switchdev_mode import plan
+    for pf, stages in plan.schedule(operations).items():
+        print("{}:".format(pf))
+        for stage in stages:
+            for operation in stage:
+                print("  {}\t{}".format(
+                    operation, plan.format_duration(operation.cost)))
+    estimate = plan.estimate(operations, jobs=jobs)
+    print("{} operations on {} PFs, estimated {} serially, {} with {} jobs"
+          .format(estimate["operations"], estimate["pfs"],
+                  plan.format_duration(estimate["serial"]),
+                  plan.format_duration(estimate["parallel"]), jobs))
+
+
+def _load_plan_eswitches(snapshot: topology.Topology,
+                         pf_addrs: typing.Iterable[str]
+                         ) -> 'devlink.EswitchCache':
+    eswitches = devlink.EswitchCache()
+    handles = sorted(snapshot[pf_addr].devlink_handle
+                     for pf_addr in set(pf_addrs) if pf_addr in snapshot)
+    if handles:
+        load_eswitches(eswitches, handles)
+    return eswitches
+
+
+def plan_switch(rebind=False, jobs=1, reports=(), plan_path=None,
+                eswitch_config=None):
+    """Plan the operations of a switch to switchdev mode without doing them
+
+    :param rebind: plan rebinding of VFs to mlx5_core driver
+    :type: bool
+    :param jobs: number of concurrent workers to estimate duration for
+    :type: int
+    :param reports: JSON reports of earlier runs to estimate costs from
+    :type: typing.Iterable[str]
+    :param plan_path: path to write the plan to, for apply_plan()
+    :type: str
+    :param eswitch_config: see switch_pf()
+    :type: typing.Dict[str, str]
+    """
+    from mlnx_switchdev_mode import plan
+    costs = plan.load_costs(reports)
+    with report.timer("scan"):
+        snapshot = topology.scan()
+    eswitches = _load_plan_eswitches(
+        snapshot, [pf.pci_addr for pf in snapshot.pfs(driver="mlx5_core")
+                   if pf.vf_addrs])
+    operations = plan.prune(
+        plan.build_plan(snapshot, eswitches, rebind=rebind, costs=costs,
+                        eswitch_config=eswitch_config),
+        snapshot, eswitches)
+    print_plan(operations, jobs=jobs)
+    if plan_path:
+        plan.write_plan(plan_path, operations, jobs=jobs)
+
+
+class ApplyError(Exception):
+    pass
+
+
+def apply_pf(pf_addr: str, stages: 'typing.List[typing.List[plan.Operation]]',
+             snapshot: topology.Topology, eswitches: 'devlink.EswitchCache',
+             executor: 'concurrent.futures.Executor' = None,
+             run_journal: journal.Journal = None):
+    """Carry out the stages of operations on a single PF
+
+    When unbinding VFs or setting the eswitch mode fails, the remaining
+    stages are skipped except that VFs unbound by this run are bound again
+    if the plan binds them. With ``run_journal`` set, the operations are
+    recorded before the first VF is unbound, see switch_pf().
+
+    :param pf_addr: PCI address of PF
+    :type: str
+    :param stages: stages of operations, see plan.schedule()
+    :type: typing.List[typing.List[plan.Operation]]
+    :param snapshot: current topology
+    :type: topology.Topology
+    :param eswitches: eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :param executor: executor for VF unbind and bind operations
+    :type: concurrent.futures.Executor
+    :param run_journal: journal to record the steps of the switch in
+    :type: journal.Journal
+    """
+    from mlnx_switchdev_mode import plan
+    entry = None
+    if run_journal is not None:
+        ops = {action: [] for action in plan.STAGES}
+        for stage in stages:
+            ops[stage[0].action].extend(stage)
+        eswitch = {}
+        for op in ops[plan.SET_ESWITCH_MODE]:
+            eswitch.update(op.value)
+        if ops[plan.UNBIND_VF] or eswitch:
+            entry = run_journal.begin(
+                pf_addr, "apply",
+                vfs=[op.target for op in ops[plan.UNBIND_VF]],
+                eswitch=eswitch,
+                rebind=[op.target for op in ops[plan.BIND_VF]])
+    unbound_addrs = set()
+    bind_addrs = []
+    failed = False
+    try:
+        for stage in stages:
+            action = stage[0].action
+            if action == plan.UNBIND_VF:
+                unbound_vfs = []
+                try:
+                    with report.timer("unbind-vfs", pf=pf_addr):
+                        unbound_vfs = unbind_vfs(
+                            [snapshot[op.target] for op in stage],
+                            executor=executor)
+                except VFOperationError as e:
+                    unbound_vfs = e.completed
+                    raise
+                finally:
+                    unbound_addrs.update(vf.pci_addr for vf in unbound_vfs)
+                    report.count("vfs-unbound", len(unbound_vfs))
+                if entry is not None:
+                    entry.done(journal.UNBIND)
+            elif action == plan.SET_ESWITCH_MODE:
+                for op in stage:
+                    PCIDevice(op.target).eswitch_set(op.value)
+                    eswitches.update(snapshot[op.target].devlink_handle,
+                                     op.value)
+                if entry is not None:
+                    entry.done(journal.ESWITCH)
+            elif action == plan.BIND_VF:
+                bind_addrs = [op.target for op in stage]
+    except BaseException:
+        stages = [stage for stage in stages
+                  if stage[0].action == plan.BIND_VF]
+        bind_addrs = [op.target for stage in stages for op in stage
+                      if op.target in unbound_addrs]
+        failed = True
+        raise
+    finally:
+        try:
+            if bind_addrs:
+                with report.timer("bind-vfs", pf=pf_addr):
+                    # NOTE: VF state in the snapshot is stale after unbind
+                    refreshed = snapshot.refresh(bind_addrs)
+                    bound_vfs = bind_vfs([refreshed[pci_addr]
+                                          for pci_addr in bind_addrs
+                                          if pci_addr in refreshed],
+                                         executor=executor)
+                report.count("vfs-bound", len(bound_vfs))
+            if entry is not None:
+                entry.discard()
+        except Exception as e:
+            _rebind_failed(pf_addr, e, failed)
+
+
+def apply_plan(plan_path, jobs=1, representor_timeout=None,
+               use_journal=False):
+    """Carry out a plan written by plan_switch()
+
+    The plan is pruned against the current state first, so applying it
+    again, or after the state changed, only does the operations which are
+    still required. PFs are handled by a pool of ``jobs`` workers, VF
+    operations of all PFs by a second pool of ``jobs`` workers. See
+    switch() for ``representor_timeout`` and ``use_journal``.
+    """
+    import concurrent.futures
+    from mlnx_switchdev_mode import plan
+    run_journal = None
+    if use_journal:
+        run_journal = journal.Journal()
+        recover(jobs=jobs, run_journal=run_journal)
+    operations = plan.read_plan(plan_path)
+    with report.timer("scan"):
+        snapshot = topology.scan()
+    eswitches = _load_plan_eswitches(snapshot,
+                                     [op.pf for op in operations])
+    pruned = plan.prune(operations, snapshot, eswitches)
+    report.count("operations", len(pruned))
+    if len(pruned) < len(operations):
+        print("Skipping {} operations which are no longer required"
+              .format(len(operations) - len(pruned)))
+    print_plan(pruned, jobs=jobs)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs) as vf_executor, \
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_timed, "apply-pf", pf_addr, apply_pf, pf_addr,
+                            stages, snapshot, eswitches,
+                            executor=vf_executor,
+                            run_journal=run_journal): pf_addr
+            for pf_addr, stages in plan.schedule(pruned).items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            pf_addr = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print("{}: failed to apply plan: {}".format(pf_addr, e))
+                failed.append(pf_addr)
+    if failed:
+        raise ApplyError('Failed to apply plan to {}'
+                         .format(', '.join(sorted(failed))))
+    if representor_timeout is not None:
+        wait_representors([op.target for op in pruned
+                           if op.action == plan.SET_ESWITCH_MODE],
+                          eswitches, representor_timeout)
+
+
+class ProvisionError(Exception):
+    pass
+
+
+def _begin_provision(run_journal: journal.Journal, pf: topology.PCIFunction,
+                     vfs: typing.List[topology.PCIFunction],
+                     changes: typing.Dict[str, str],
+                     bind_policy: typing.Optional[config.BindPolicy],
+                     autoprobe: str) -> journal.JournalEntry:
+    return run_journal.begin(
+        pf.pci_addr, "provision",
+        vfs=[vf.pci_addr for vf in vfs if vf.bound], eswitch=changes,
+        rebind=([vf.pci_addr for vf in bind_policy.select(pf, vfs)]
+                if bind_policy is not None else []),
+        autoprobe=autoprobe)
+
+
+def provision_pf(pf: topology.PCIFunction, num_vfs: int,
+                 snapshot: topology.Topology,
+                 eswitches: 'devlink.EswitchCache', bind: bool = True,
+                 executor: 'concurrent.futures.Executor' = None,
+                 eswitch_config: typing.Dict[str, str] = None,
+                 bind_policy: config.BindPolicy = None,
+                 run_journal: journal.Journal = None):
+    """Create VFs on a PF, switch it to switchdev mode and bind its VFs
+
+    VFs are created with sriov_drivers_autoprobe disabled, so that they are
+    probed only once, after the PF is in switchdev mode. VFs of a PF which
+    already has the requested number of VFs are kept, those which are bound
+    are unbound for the switch as by switch_pf_autoprobe(), and bound again
+    if the switch fails.
+
+    With ``run_journal`` set, the steps are recorded before autoprobe is
+    disabled, and recorded again once new VFs were created, see switch_pf().
+    recover() does not create VFs, a PF left with the wrong number of VFs
+    gets them from the next run of provision.
+
+    :param pf: PF to provision
+    :type: topology.PCIFunction
+    :param num_vfs: number of VFs the PF should have
+    :type: int
+    :param snapshot: topology the PF was discovered in
+    :type: topology.Topology
+    :param eswitches: eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :param bind: bind VFs to mlx5_core driver after the switch
+    :type: bool
+    :param executor: executor for VF unbind and bind operations
+    :type: concurrent.futures.Executor
+    :param eswitch_config: see switch_pf()
+    :type: typing.Dict[str, str]
+    :param bind_policy: VFs to bind, defaults to all
+    :type: config.BindPolicy
+    :param run_journal: see switch_pf()
+    :type: journal.Journal
+    """
+    eswitch_config = eswitch_config or devlink.DEFAULT_ESWITCH_CONFIG
+    bind_policy = bind_policy or config.BindPolicy()
+    pcidev = PCIDevice(pf.pci_addr)
+    changes = {}
+    if pf.vf_addrs:
+        changes = devlink.eswitch_changes(eswitches.get(pf.devlink_handle),
+                                          eswitch_config)
+    entry = None
+    unbound_vfs = []
+    failed = False
+    try:
+        if len(pf.vf_addrs) == num_vfs and "mode" not in changes:
+            print("{}: {} VFs already provisioned".format(pf, num_vfs))
+            if changes:
+                pcidev.eswitch_set(changes)
+                eswitches.update(pf.devlink_handle, changes)
+        else:
+            autoprobe = pcidev.read_attr("sriov_drivers_autoprobe")
+            if run_journal is not None:
+                # NOTE: VFs about to be removed are not recorded
+                entry = _begin_provision(
+                    run_journal, pf,
+                    snapshot.vfs(pf) if len(pf.vf_addrs) == num_vfs else [],
+                    changes, bind_policy if bind else None, autoprobe)
+            pcidev.write_attr("sriov_drivers_autoprobe", "0")
+            try:
+                created = len(pf.vf_addrs) != num_vfs
+                if created:
+                    print("{}: {} -> {} VFs".format(pf, len(pf.vf_addrs),
+                                                    num_vfs))
+                    with report.timer("create-vfs", pf=pf.pci_addr):
+                        # NOTE: the kernel only accepts a new number of VFs
+                        # once the existing ones are gone
+                        if pf.vf_addrs:
+                            pcidev.write_attr("sriov_numvfs", "0")
+                        if num_vfs:
+                            pcidev.write_attr("sriov_numvfs", str(num_vfs))
+                    report.count("vfs-created", num_vfs)
+                    snapshot = snapshot.refresh([pf.pci_addr])
+                    pf = snapshot[pf.pci_addr]
+                    snapshot = snapshot.refresh(pf.vf_addrs)
+                    eswitches.invalidate(pf.devlink_handle)
+                vfs = snapshot.vfs(pf)
+                changes = {}
+                if vfs:
+                    changes = devlink.eswitch_changes(
+                        eswitches.get(pf.devlink_handle), eswitch_config)
+                if entry is not None and created:
+                    entry = _begin_provision(
+                        run_journal, pf, vfs, changes,
+                        bind_policy if bind else None, autoprobe)
+                if "mode" in changes:
+                    bound_vfs = [vf for vf in vfs if vf.bound]
+                    if bound_vfs:
+                        try:
+                            with report.timer("unbind-vfs", pf=pf.pci_addr):
+                                unbound_vfs = unbind_vfs(bound_vfs,
+                                                         executor=executor)
+                        except VFOperationError as e:
+                            unbound_vfs = e.completed
+                            raise
+                        finally:
+                            report.count("vfs-unbound", len(unbound_vfs))
+                if entry is not None:
+                    entry.done(journal.UNBIND)
+                if changes:
+                    pcidev.eswitch_set(changes)
+                    eswitches.update(pf.devlink_handle, changes)
+                if entry is not None:
+                    entry.done(journal.ESWITCH)
+            finally:
+                pcidev.write_attr("sriov_drivers_autoprobe", autoprobe)
+                if entry is not None:
+                    entry.done(journal.AUTOPROBE)
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        try:
+            if failed:
+                # NOTE: only the VFs unbound for the switch are bound again
+                rebind_addrs = [vf.pci_addr for vf in
+                                bind_policy.select(pf, unbound_vfs)]
+                if bind and rebind_addrs:
+                    with report.timer("rebind-vfs", pf=pf.pci_addr):
+                        refreshed = snapshot.refresh(rebind_addrs)
+                        bound_vfs = bind_vfs([refreshed[pci_addr]
+                                              for pci_addr in rebind_addrs
+                                              if pci_addr in refreshed],
+                                             executor=executor)
+                    report.count("vfs-bound", len(bound_vfs))
+            elif bind and pf.vf_addrs:
+                with report.timer("bind-vfs", pf=pf.pci_addr):
+                    snapshot = snapshot.refresh(pf.vf_addrs)
+                    bound_vfs = bind_vfs(
+                        bind_policy.select(pf, snapshot.vfs(pf)),
+                        executor=executor)
+                report.count("vfs-bound", len(bound_vfs))
+                print("{}: bound {} VFs".format(pf, len(bound_vfs)))
+            # NOTE: the record is kept for recover() to restore autoprobe
+            if entry is not None and entry.is_done(journal.AUTOPROBE):
+                entry.discard()
+        except Exception as e:
+            _rebind_failed(pf, e, failed)
+
+
+def provision(config_path=None, bind=True, jobs=1, representor_timeout=None,
+              eswitch_config=None, bind_policy=None, use_journal=False):
+    """Provision VFs of PFs and configure them into switchdev mode
+
+    Creates the number of VFs configured for each PF in ``config_path``,
+    see config.parse_vf_config(), then switches the PF to switchdev mode
+    and binds its VFs in one pass, see provision_pf(). PFs are provisioned
+    by a pool of ``jobs`` workers, VFs of all PFs are bound by a second
+    pool of ``jobs`` workers. See switch() for ``representor_timeout``,
+    ``eswitch_config``, ``bind_policy`` and ``use_journal``.
+    """
+    import concurrent.futures
+    run_journal = None
+    if use_journal:
+        run_journal = journal.Journal()
+        recover(jobs=jobs, run_journal=run_journal)
+    vf_config = config.read_vf_config(config_path)
+    with report.timer("scan"):
+        snapshot = topology.scan()
+    pfs = config.resolve_pfs(vf_config, snapshot)
+    report.count("pfs", len(pfs))
+    eswitches = devlink.EswitchCache()
+    handles = [pf.devlink_handle for pf, _ in pfs if pf.vf_addrs]
+    if handles:
+        load_eswitches(eswitches, handles)
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs) as vf_executor, \
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_timed, "provision-pf", pf.pci_addr,
+                            provision_pf, pf, num_vfs, snapshot, eswitches,
+                            bind=bind, executor=vf_executor,
+                            eswitch_config=eswitch_config,
+                            bind_policy=bind_policy,
+                            run_journal=run_journal): pf
+            for pf, num_vfs in pfs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            pf = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print("{}: failed to provision: {}".format(pf, e))
+                failed.append(str(pf))
+    if failed:
+        raise ProvisionError('Failed to provision {}'
+                             .format(', '.join(sorted(failed))))
+    if representor_timeout is not None:
+        wait_representors([pf.pci_addr for pf, _ in pfs], eswitches,
+                          representor_timeout)
+
+
+def uevent_pf(event: 'uevent.UEvent') -> typing.Optional[str]:
+    """PF that needs attention after a kernel uevent
+
+    VFs being added, and mlx5_core PFs being added or bound again after a
+    reset, require work on the PF. Bind and unbind of VFs are ignored as
+    these are caused by the switch itself.
+
+    :param event: kernel uevent
+    :type: uevent.UEvent
+    :return: PCI address of PF or None if no work is required
+    :rtype: typing.Optional[str]
+    """
+    if event.pci_addr is None or event.action not in ("add", "bind"):
+        return None
+    try:
+        function = topology.read_function(topology.SYSFS_ROOT,
+                                          event.pci_addr)
+    except (FileNotFoundError, NotADirectoryError):
+        # NOTE: function went away again before we got to it
+        return None
+    if function.is_vf:
+        return function.physfn if event.action == "add" else None
+    if function.is_pf and function.driver == "mlx5_core":
+        return function.pci_addr
+    return None
+
+
+def switch_changed_pfs(pf_addrs: typing.Iterable[str],
+                       snapshot: topology.Topology,
+                       eswitches: 'devlink.EswitchCache',
+                       rebind: bool = False, strategy: str = "unbind",
+                       executor: 'concurrent.futures.Executor' = None,
+                       eswitch_config: typing.Dict[str, str] = None,
+                       bind_policy: config.BindPolicy = None,
+                       run_journal: journal.Journal = None
+                       ) -> topology.Topology:
+    """Switch PFs whose VFs changed and bind their new VFs
+
+    Only the given PFs and their VFs are re-read from sysfs and only their
+    eswitch mode is queried. PFs still in legacy mode are switched with
+    the selected strategy, when ``rebind`` is set VFs created on PFs which
+    already are in switchdev mode are bound to mlx5_core.
+
+    :param pf_addrs: PCI addresses of PFs that changed
+    :type: typing.Iterable[str]
+    :param snapshot: topology before the change
+    :type: topology.Topology
+    :param eswitches: eswitch configuration of devices
+    :type: devlink.EswitchCache
+    :param rebind: bind VFs to mlx5_core driver
+    :type: bool
+    :param strategy: one of SWITCH_STRATEGIES
+    :type: str
+    :param executor: executor for VF unbind and bind operations
+    :type: concurrent.futures.Executor
+    :param eswitch_config: see switch_pf()
+    :type: typing.Dict[str, str]
+    :param bind_policy: VFs to bind, defaults to all
+    :type: config.BindPolicy
+    :param run_journal: see switch_pf()
+    :type: journal.Journal
+    :return: topology with the changed PFs and their VFs re-read
+    :rtype: topology.Topology
+    """
+    snapshot = snapshot.refresh(pf_addrs)
+    pfs = [snapshot[pci_addr] for pci_addr in sorted(pf_addrs)
+           if pci_addr in snapshot]
+    pfs = [pf for pf in pfs
+           if pf.driver == "mlx5_core" and pf.is_pf and pf.vf_addrs]
+    snapshot = snapshot.refresh(
+        [vf_addr for pf in pfs for vf_addr in pf.vf_addrs])
+    # NOTE: a reset PF comes back in legacy mode, forget what we knew
+    for pf in pfs:
+        eswitches.invalidate(pf.devlink_handle)
+    if pfs:
+        load_eswitches(eswitches, [pf.devlink_handle for pf in pfs])
+    for pf in pfs:
+        report.count("pfs")
+        try:
+            if devlink.eswitch_changes(
+                    eswitches.get(pf.devlink_handle),
+                    eswitch_config or devlink.DEFAULT_ESWITCH_CONFIG):
+                _timed("switch-pf", pf.pci_addr, SWITCH_STRATEGIES[strategy],
+                       pf, snapshot, eswitches, rebind=rebind,
+                       executor=executor, eswitch_config=eswitch_config,
+                       bind_policy=bind_policy, run_journal=run_journal)
+            elif rebind:
+                vfs = (bind_policy or config.BindPolicy()).select(
+                    pf, snapshot.vfs(pf))
+                with report.timer("bind-vfs", pf=pf.pci_addr):
+                    bound_vfs = bind_vfs(vfs, executor=executor)
+                report.count("vfs-bound", len(bound_vfs))
+                if bound_vfs:
+                    print("{}: bound {} VFs".format(pf, len(bound_vfs)))
+        except Exception as e:
+            print("{}: failed to switch to switchdev mode: {}"
+                  .format(pf, e))
+    return snapshot
+
+
+def watch(rebind=False, jobs=1, strategy="unbind", settle=1.0,
+          source=None, eswitch_config=None, bind_policy=None,
+          use_journal=False):
+    """Switch PFs to switchdev mode as VFs are created on them
+
+    Kernel uevents are collected until none requiring work arrived for
+    ``settle`` seconds, so the creation of all VFs of a PF is handled in
+    one go. Only the PFs named by the events are then processed, see
+    switch_changed_pfs(). When uevents were lost all PFs are read again and
+    processed. Runs until the uevent source is exhausted, which never
+    happens for the kernel uevent socket.
+
+    :param rebind: bind VFs to mlx5_core driver
+    :type: bool
+    :param jobs: number of VFs to unbind and bind concurrently
+    :type: int
+    :param strategy: one of SWITCH_STRATEGIES
+    :type: str
+    :param settle: seconds without new events before work is started
+    :type: float
+    :param source: uevent source, defaults to the kernel uevent socket
+    :type: typing.Union[uevent.UEventSocket, uevent.UEventReplay]
+    :param eswitch_config: see switch_pf()
+    :type: typing.Dict[str, str]
+    :param bind_policy: VFs to bind, defaults to all
+    :type: config.BindPolicy
+    :param use_journal: see switch()
+    :type: bool
+    """
+    import concurrent.futures
+    from mlnx_switchdev_mode import uevent
+    # NOTE: listen before the scan, so no change can go unnoticed
+    if source is None:
+        source = uevent.UEventSocket()
+    try:
+        run_journal = None
+        if use_journal:
+            run_journal = journal.Journal()
+            recover(jobs=jobs, run_journal=run_journal)
+        with report.timer("scan"):
+            snapshot = topology.scan()
+        eswitches = devlink.EswitchCache()
+        notify.ready("Watching for VFs created on PFs")
+        pending = set()
+        settle_at = None
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs) as vf_executor:
+            while True:
+                timeout = None
+                if pending:
+                    timeout = max(0.0, settle_at - time.monotonic())
+                try:
+                    event = source.recv(timeout)
+                except EOFError:
+                    break
+                except uevent.UEventsLost as e:
+                    # NOTE: any PF may have changed, look at all of them
+                    report.count("uevents-lost")
+                    with report.timer("scan"):
+                        snapshot = topology.scan()
+                    pfs = snapshot.pfs(driver="mlx5_core")
+                    print("{}, rescanning {} PFs".format(e, len(pfs)),
+                          flush=True)
+                    pending.update(pf.pci_addr for pf in pfs)
+                    settle_at = time.monotonic() + settle
+                    continue
+                if event is None:
+                    snapshot = switch_changed_pfs(
+                        pending, snapshot, eswitches, rebind=rebind,
+                        strategy=strategy, executor=vf_executor,
+                        eswitch_config=eswitch_config,
+                        bind_policy=bind_policy, run_journal=run_journal)
+                    pending = set()
+                    continue
+                report.count("uevents")
+                pf_addr = uevent_pf(event)
+                if pf_addr is not None:
+                    if pf_addr not in pending:
+                        print("{}: changed by {}".format(pf_addr, event),
+                              flush=True)
+                    pending.add(pf_addr)
+                    settle_at = time.monotonic() + settle
+            if pending:
+                switch_changed_pfs(pending, snapshot, eswitches,
+                                   rebind=rebind, strategy=strategy,
+                                   executor=vf_executor,
+                                   eswitch_config=eswitch_config,
+                                   bind_policy=bind_policy,
+                                   run_journal=run_journal)
+    finally:
+        source.close()
+
+
+def serve(socket_path=None, group=None):
+    """Answer topology queries over a Unix socket, see server.serve()"""
+    from mlnx_switchdev_mode import server
+    server.serve(socket_path=socket_path, group=group,
+                 ready=lambda: notify.ready("Answering topology queries"))
+
+
+def positive_float(value: str) -> float:
+    """Argument type for options taking a positive number of seconds
+
+    :param value: command line value
+    :type: str
+    :return: parsed value
+    :rtype: float
+    :raises: argparse.ArgumentTypeError if value is not a positive number
+    """
+    try:
+        fvalue = float(value)
+    except ValueError:
+        fvalue = 0.0
+    if not fvalue > 0:
+        raise argparse.ArgumentTypeError(
+            "invalid positive value: '{}'".format(value))
+    return fvalue
+
+
+def positive_int(value: str) -> int:
+    """Argument type for options taking a positive integer
+
+    :param value: command line value
+    :type: str
+    :return: parsed value
+    :rtype: int
+    :raises: argparse.ArgumentTypeError if value is not a positive integer
+    """
+    try:
+        ivalue = int(value)
+    except ValueError:
+        ivalue = 0
+    if ivalue < 1:
+        raise argparse.ArgumentTypeError(
+            "invalid positive integer value: '{}'".format(value))
+    return ivalue
+
+
+def non_negative_int(value: str) -> int:
+    """Argument type for options taking a count which may be zero
+
+    :param value: command line value
+    :type: str
+    :return: parsed value
+    :rtype: int
+    :raises: argparse.ArgumentTypeError if value is negative or no integer
+    """
+    try:
+        ivalue = int(value)
+    except ValueError:
+        ivalue = -1
+    if ivalue < 0:
+        raise argparse.ArgumentTypeError(
+            "invalid non-negative integer value: '{}'".format(value))
+    return ivalue
 
 
 def main():
     parser = argparse.ArgumentParser("mlnx-switchdev-mode")
     parser.set_defaults(prog=parser.prog)
+    parser.add_argument('--sysfs-root', dest='sysfs_root',
+                        default=topology.SYSFS_ROOT,
+                        help=('Mount point of sysfs, e.g. a synthetic tree '
+                              'for testing'))
+    parser.add_argument('--devlink-backend', dest='devlink_backend',
+                        choices=('auto', 'netlink', 'subprocess'),
+                        default='auto',
+                        help=('Interface used to configure devices through '
+                              'devlink. With auto, generic netlink is used '
+                              'when available and /sbin/devlink otherwise.'))
+    # NOTE: options of the subcommands run at boot, bounding their duration
+    deadline_parser = argparse.ArgumentParser(add_help=False)
+    deadline_parser.add_argument('--deadline', dest='deadline',
+                                 type=positive_float, metavar='SECONDS',
+                                 help=('Give up on all remaining work after '
+                                       'SECONDS, PFs not done by then are '
+                                       'reported as failed'))
+    deadline_parser.add_argument('--devlink-timeout', dest='devlink_timeout',
+                                 type=positive_float, metavar='SECONDS',
+                                 help=('Give up on a single devlink call '
+                                       'after SECONDS, failing its PF'))
+    deadline_parser.add_argument('--vf-timeout', dest='vf_timeout',
+                                 type=positive_float, metavar='SECONDS',
+                                 help=('Give up on binding or unbinding a '
+                                       'single VF after SECONDS, failing '
+                                       'its PF'))
+    deadline_parser.add_argument('--retries', dest='retries',
+                                 type=non_negative_int, metavar='N',
+                                 default=retry.RETRIES,
+                                 help=('Retry devlink calls and VF binds '
+                                       'and unbinds failing with EBUSY or '
+                                       'EAGAIN up to N times, with growing '
+                                       'delays (default: %(default)s)'))
+    deadline_parser.add_argument('--retry-timeout', dest='retry_timeout',
+                                 type=positive_float, metavar='SECONDS',
+                                 default=retry.TIMEOUT,
+                                 help=('Stop retrying a single operation '
+                                       'once retries would take longer '
+                                       'than SECONDS (default: '
+                                       '%(default)s)'))
+    # NOTE: options of the subcommands changing devices, which recover PFs
+    # a run left half switched
+    journal_parser = argparse.ArgumentParser(add_help=False)
+    journal_parser.add_argument('--no-journal', dest='use_journal',
+                                action='store_false',
+                                help=('Neither recover PFs an interrupted '
+                                      'run left half switched nor record '
+                                      'the steps of the switch in {}'
+                                      .format(os.path.join(state.STATE_DIR,
+                                                           'journal'))))
+    # NOTE: eswitch properties set along with the mode, in the same request
+    eswitch_parser = argparse.ArgumentParser(add_help=False)
+    eswitch_parser.add_argument('--inline-mode', dest='inline_mode',
+                                choices=('none', 'link', 'network',
+                                         'transport'),
+                                help=('Minimum packet headers inlined by '
+                                      'the driver for the eswitch to match '
+                                      'on, required by some adapters for '
+                                      'offloads'))
+    eswitch_parser.add_argument('--encap', dest='encap',
+                                choices=('enable', 'disable'),
+                                help=('Enable or disable offload of tunnel '
+                                      'encapsulation on the eswitch'))
+    # NOTE: options of the subcommands binding VFs, selecting which
+    bind_policy_parser = argparse.ArgumentParser(add_help=False)
+    bind_policy_parser.add_argument('--bind-policy', dest='bind_policy_path',
+                                    metavar='FILE',
+                                    help=('File selecting the VFs of each PF '
+                                          'to bind, by VF index, default: {} '
+                                          'if it exists, all VFs otherwise'
+                                          .format(config.BIND_POLICY_PATH)))
+    bind_policy_parser.add_argument('--bind-first', dest='bind_first',
+                                    type=non_negative_int, metavar='N',
+                                    help=('Bind only the first N VFs of PFs '
+                                          'not named in the bind policy, '
+                                          'e.g. those used by the host, and '
+                                          'leave the others to be bound on '
+                                          'demand'))
     subparsers = parser.add_subparsers(
+        dest="command",
         title="subcommands",
         description="valid subcommands",
         help="sub-command help",
@@ -351,11 +2163,30 @@ def main():
     show_subparser = subparsers.add_parser(
         "show", help="Show details of installed network adapters"
     )
-    show_subparser.set_defaults(func=show)
+    show_subparser.add_argument('--eswitch', dest='eswitch',
+                                action='store_true',
+                                help='Show eswitch mode of PFs')
+    show_subparser.add_argument('--format', dest='fmt',
+                                choices=sorted(output.WRITERS),
+                                default='text', help='Output format')
+    show_rows_group = show_subparser.add_mutually_exclusive_group()
+    show_rows_group.add_argument('--rollup', dest='rollup',
+                                 action='store_true',
+                                 help=('Show one line per PF with its number '
+                                       'of VFs, of VFs bound to mlx5_core '
+                                       'and its eswitch mode'))
+    show_rows_group.add_argument('--representors', dest='vf_ports',
+                                 action='store_true',
+                                 help=('Show one line per VF with its PF, VF '
+                                       'index, PCI address, netdev and '
+                                       'representor netdev'))
+    show_subparser.set_defaults(func=show, eswitch=False)
 
     switch_subparser = subparsers.add_parser(
         "switch",
         help="Switch switchdev capable network adapters to switchdev mode",
+        parents=[deadline_parser, journal_parser, eswitch_parser,
+                 bind_policy_parser],
     )
     switch_subparser.add_argument('--warning-as-error', dest='werror',
                                   action='store_true',
@@ -367,22 +2198,302 @@ def main():
                                         'when bonding/VF LAG is in use, do '
                                         'manual rebinding after bonding '
                                         'configured instead.'))
+    switch_subparser.add_argument('--jobs', '-j', dest='jobs',
+                                  type=positive_int, default=1,
+                                  help=('Number of PFs to switch to switchdev '
+                                        'mode, and of VFs to unbind and '
+                                        'rebind, concurrently'))
+    switch_subparser.add_argument('--strategy', dest='strategy',
+                                  choices=list(SWITCH_STRATEGIES),
+                                  default='unbind',
+                                  help=('How VFs are kept away from the '
+                                        'mlx5_core driver during the switch. '
+                                        'unbind: unbind bound VFs and rebind '
+                                        'them afterwards. autoprobe: disable '
+                                        'sriov_drivers_autoprobe on the PF so '
+                                        'unbound VFs are only probed once, '
+                                        'after the switch. This only helps if '
+                                        'the VFs were created with autoprobe '
+                                        'disabled, e.g. by provision.'))
+    switch_subparser.add_argument('--report', dest='report',
+                                  metavar='FILE',
+                                  help=('Write a JSON report with timings of '
+                                        'each phase of the run to FILE'))
+    switch_subparser.add_argument('--no-cache', dest='cache',
+                                  action='store_false',
+                                  help=('Do the work even if nothing changed '
+                                        'since the last successful run, as '
+                                        'recorded in {}'
+                                        .format(state.STATE_DIR)))
+    switch_subparser.add_argument('--wait-representors',
+                                  dest='representor_timeout',
+                                  type=positive_float, metavar='SECONDS',
+                                  help=('Wait up to SECONDS for the '
+                                        'representors of all VFs of PFs in '
+                                        'switchdev mode to appear before '
+                                        'exiting'))
+    switch_subparser.add_argument('--numa', dest='pin_numa',
+                                  action='store_true',
+                                  help=('Unbind and rebind the VFs of each PF '
+                                        'from workers pinned to the CPUs of '
+                                        'the NUMA node of the PF, --jobs '
+                                        'workers per node'))
+    switch_subparser.add_argument('--pf', dest='pf_addrs', metavar='ADDR',
+                                  action='append',
+                                  help=('Switch only the PF with PCI address '
+                                        'ADDR, may be repeated, e.g. from the '
+                                        'mlnx-switchdev-mode@ADDR unit'))
     switch_subparser.set_defaults(func=switch, werror=False, rebind=False)
 
     bind_subparser = subparsers.add_parser(
         "bind",
         help="Bind unbound VFs back to mlx5_core driver.",
+        parents=[deadline_parser, journal_parser, bind_policy_parser],
     )
+    bind_subparser.add_argument('--jobs', '-j', dest='jobs',
+                                type=positive_int, default=1,
+                                help='Number of VFs to bind concurrently')
+    bind_subparser.add_argument('--report', dest='report', metavar='FILE',
+                                help=('Write a JSON report with timings of '
+                                      'each phase of the run to FILE'))
+    bind_subparser.add_argument('--no-cache', dest='cache',
+                                action='store_false',
+                                help=('Do the work even if nothing changed '
+                                      'since the last successful run, as '
+                                      'recorded in {}'
+                                      .format(state.STATE_DIR)))
+    bind_subparser.add_argument('--numa', dest='pin_numa',
+                                action='store_true',
+                                help=('Bind the VFs of each PF from workers '
+                                      'pinned to the CPUs of the NUMA node '
+                                      'of the PF, so that the memory the '
+                                      'driver allocates for them is local '
+                                      'to the PF'))
+    bind_vfs_group = bind_subparser.add_mutually_exclusive_group()
+    bind_vfs_group.add_argument('--vf', dest='vf_addrs', metavar='ADDR',
+                                action='append',
+                                help=('Bind the VF with PCI address ADDR '
+                                      'regardless of the bind policy, may be '
+                                      'repeated'))
+    bind_vfs_group.add_argument('--pf', dest='pf_addrs', metavar='ADDR',
+                                action='append',
+                                help=('Bind only VFs of the PF with PCI '
+                                      'address ADDR, may be repeated, e.g. '
+                                      'from the mlnx-bind-vfs@ADDR unit'))
     bind_subparser.set_defaults(func=bind)
 
+    plan_subparser = subparsers.add_parser(
+        "plan",
+        help=("Show the operations a switch to switchdev mode would do, "
+              "with an estimate of their duration"),
+        parents=[eswitch_parser],
+    )
+    plan_subparser.add_argument('--rebind-vfs', dest='rebind',
+                                action='store_true',
+                                help='Plan rebinding of VFs after the switch')
+    plan_subparser.add_argument('--jobs', '-j', dest='jobs',
+                                type=positive_int, default=1,
+                                help=('Number of concurrent workers to '
+                                      'estimate the duration for'))
+    plan_subparser.add_argument('--costs-from', dest='reports',
+                                metavar='REPORT', action='append',
+                                default=[],
+                                help=('Estimate the cost of operations from '
+                                      'the timings in a report written with '
+                                      '--report, may be repeated'))
+    plan_subparser.add_argument('--output', '-o', dest='plan_path',
+                                metavar='FILE',
+                                help='Write the plan to FILE for apply')
+    plan_subparser.set_defaults(func=plan_switch)
+
+    apply_subparser = subparsers.add_parser(
+        "apply",
+        help="Carry out the operations of a plan that are still required",
+        parents=[deadline_parser, journal_parser],
+    )
+    apply_subparser.add_argument('--plan', dest='plan_path', metavar='FILE',
+                                 required=True,
+                                 help='Plan written by plan --output')
+    apply_subparser.add_argument('--jobs', '-j', dest='jobs',
+                                 type=positive_int, default=1,
+                                 help=('Number of PFs, and of VFs to unbind '
+                                       'and bind, to handle concurrently'))
+    apply_subparser.add_argument('--report', dest='report', metavar='FILE',
+                                 help=('Write a JSON report with timings of '
+                                       'each phase of the run to FILE'))
+    apply_subparser.add_argument('--wait-representors',
+                                 dest='representor_timeout',
+                                 type=positive_float, metavar='SECONDS',
+                                 help=('Wait up to SECONDS for the '
+                                       'representors of all VFs of PFs in '
+                                       'switchdev mode to appear before '
+                                       'exiting'))
+    apply_subparser.set_defaults(func=apply_plan)
+
+    provision_subparser = subparsers.add_parser(
+        "provision",
+        help=("Create VFs, switch network adapters to switchdev mode and "
+              "bind VFs in one pass"),
+        parents=[deadline_parser, journal_parser, eswitch_parser,
+                 bind_policy_parser],
+    )
+    provision_subparser.add_argument('--config', dest='config_path',
+                                     metavar='FILE',
+                                     default=config.VF_CONFIG_PATH,
+                                     help=('File with a PF, by PCI address '
+                                           'or netdev name, and its number '
+                                           'of VFs per line (default: '
+                                           '%(default)s)'))
+    provision_subparser.add_argument('--no-bind-vfs', dest='bind',
+                                     action='store_false',
+                                     help=('Leave VFs unbound after the '
+                                           'switch to switchdev mode, e.g. '
+                                           'when bonding/VF LAG is in use'))
+    provision_subparser.add_argument('--jobs', '-j', dest='jobs',
+                                     type=positive_int, default=1,
+                                     help=('Number of PFs to provision, and '
+                                           'of VFs to unbind and bind, '
+                                           'concurrently'))
+    provision_subparser.add_argument('--report', dest='report',
+                                     metavar='FILE',
+                                     help=('Write a JSON report with timings '
+                                           'of each phase of the run to '
+                                           'FILE'))
+    provision_subparser.add_argument('--wait-representors',
+                                     dest='representor_timeout',
+                                     type=positive_float, metavar='SECONDS',
+                                     help=('Wait up to SECONDS for the '
+                                           'representors of all VFs of PFs in '
+                                           'switchdev mode to appear before '
+                                           'exiting'))
+    provision_subparser.set_defaults(func=provision)
+
+    watch_subparser = subparsers.add_parser(
+        "watch",
+        help=("Switch network adapters to switchdev mode as VFs are created "
+              "on them"),
+        parents=[journal_parser, eswitch_parser, bind_policy_parser],
+    )
+    watch_subparser.add_argument('--rebind-vfs', dest='rebind',
+                                 action='store_true',
+                                 help=('Rebind VFs to mlx5_core driver after '
+                                       'switch to switchdev mode, and bind '
+                                       'VFs created on PFs already in '
+                                       'switchdev mode'))
+    watch_subparser.add_argument('--jobs', '-j', dest='jobs',
+                                 type=positive_int, default=1,
+                                 help=('Number of VFs to unbind and rebind '
+                                       'concurrently'))
+    watch_subparser.add_argument('--strategy', dest='strategy',
+                                 choices=list(SWITCH_STRATEGIES),
+                                 default='unbind',
+                                 help='See the switch subcommand')
+    watch_subparser.add_argument('--settle', dest='settle',
+                                 type=positive_float, default=1.0,
+                                 metavar='SECONDS',
+                                 help=('Wait for SECONDS without new uevents '
+                                       'before acting on them'))
+    watch_subparser.add_argument('--replay', dest='replay', metavar='FILE',
+                                 type=argparse.FileType('rt'),
+                                 help=('Act on uevents recorded with '
+                                       '"udevadm monitor --kernel --property" '
+                                       'in FILE, or - for stdin, instead of '
+                                       'listening for kernel uevents, and '
+                                       'exit at its end'))
+    watch_subparser.set_defaults(func=watch)
+
+    serve_subparser = subparsers.add_parser(
+        "serve",
+        help=("Answer topology queries over a Unix socket, keeping the "
+              "topology up to date from kernel uevents"),
+    )
+    serve_subparser.add_argument('--socket', dest='socket_path',
+                                 metavar='PATH',
+                                 help=('Path of the Unix socket to listen on, '
+                                       'default: the socket clients connect '
+                                       'to'))
+    serve_subparser.add_argument('--socket-group', dest='socket_group',
+                                 metavar='GROUP',
+                                 help=('Let members of GROUP connect to the '
+                                       'socket, only root may by default'))
+    serve_subparser.set_defaults(func=serve)
+
     args = parser.parse_args()
 
-    logging.basicConfig(level=logging.DEBUG)
+    devlink.BACKEND = args.devlink_backend
+    topology.SYSFS_ROOT = args.sysfs_root
+    deadline.DEVLINK_TIMEOUT = getattr(args, "devlink_timeout", None)
+    deadline.VF_TIMEOUT = getattr(args, "vf_timeout", None)
+    retry.RETRIES = getattr(args, "retries", retry.RETRIES)
+    retry.TIMEOUT = getattr(args, "retry_timeout", retry.TIMEOUT)
+    deadline.activate(deadline.Deadline(getattr(args, "deadline", None)))
+    run_report = report.activate(report.RunReport(args.command))
+    eswitch_config = None
+    if hasattr(args, "inline_mode"):
+        eswitch_config = dict(devlink.DEFAULT_ESWITCH_CONFIG)
+        for prop, value in (("inline-mode", args.inline_mode),
+                            ("encap", args.encap)):
+            if value is not None:
+                eswitch_config[prop] = value
 
     try:
+        bind_policy = None
+        if hasattr(args, "bind_policy_path"):
+            bind_policy = config.read_bind_policy(args.bind_policy_path)
+            if args.bind_first is not None:
+                bind_policy.selections[config.DEFAULT_PF] = (
+                    config.VFSelection(args.bind_first, None))
         if args.func == switch:
-            args.func(werror=args.werror, rebind=args.rebind)
+            args.func(werror=args.werror, rebind=args.rebind,
+                      jobs=args.jobs, strategy=args.strategy,
+                      cache=args.cache,
+                      representor_timeout=args.representor_timeout,
+                      eswitch_config=eswitch_config,
+                      pin_numa=args.pin_numa, bind_policy=bind_policy,
+                      use_journal=args.use_journal, pf_addrs=args.pf_addrs)
+        elif args.func == bind:
+            args.func(jobs=args.jobs, cache=args.cache,
+                      pin_numa=args.pin_numa, bind_policy=bind_policy,
+                      vf_addrs=args.vf_addrs, use_journal=args.use_journal,
+                      pf_addrs=args.pf_addrs)
+        elif args.func == show:
+            args.func(eswitch=args.eswitch, fmt=args.fmt,
+                      rollup=args.rollup, vf_ports=args.vf_ports)
+        elif args.func == plan_switch:
+            args.func(rebind=args.rebind, jobs=args.jobs,
+                      reports=args.reports, plan_path=args.plan_path,
+                      eswitch_config=eswitch_config)
+        elif args.func == apply_plan:
+            args.func(plan_path=args.plan_path, jobs=args.jobs,
+                      representor_timeout=args.representor_timeout,
+                      use_journal=args.use_journal)
+        elif args.func == provision:
+            args.func(config_path=args.config_path, bind=args.bind,
+                      jobs=args.jobs,
+                      representor_timeout=args.representor_timeout,
+                      eswitch_config=eswitch_config, bind_policy=bind_policy,
+                      use_journal=args.use_journal)
+        elif args.func == watch:
+            source = None
+            if args.replay:
+                from mlnx_switchdev_mode import uevent
+                source = uevent.UEventReplay(
+                    uevent.read_uevents(args.replay))
+            args.func(rebind=args.rebind, jobs=args.jobs,
+                      strategy=args.strategy, settle=args.settle,
+                      source=source, eswitch_config=eswitch_config,
+                      bind_policy=bind_policy, use_journal=args.use_journal)
+        elif args.func == serve:
+            args.func(socket_path=args.socket_path, group=args.socket_group)
         else:
             args.func()
+        # NOTE: units of Type=notify ordered after ours start from here,
+        # the services tell once they are ready themselves
+        if args.func not in (watch, serve):
+            notify.ready("Done")
     except Exception as e:
+        notify.status("Failed: {}".format(e))
         raise SystemExit("{prog}: {msg}".format(prog=args.prog, msg=e))
+    finally:
+        if getattr(args, "report", None):
+            run_report.write(args.report)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""State of the last successful run, to skip work when nothing changed"""
+
+import hashlib
+import json
+import os
+import typing
+
+from mlnx_switchdev_mode import topology
+
+
+STATE_DIR = "/run/mlnx-switchdev-mode"
+STATE_VERSION = 1
+
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+
+
+def boot_id() -> str:
+    """Identifier of the running boot
+
+    :return: boot id or empty string if not available
+    :rtype: str
+    """
+    try:
+        with open(BOOT_ID_PATH, "rt") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def read_fingerprint(root: str = None, driver: str = "mlx5_core",
+                     pf_addrs: typing.Iterable[str] = None) -> typing.Dict:
+    """Cheap fingerprint of the PCI topology and of driver binding
+
+    Costs two directory scans regardless of the number of functions. PCI
+    functions are identified by address and by the inode of their sysfs
+    entry, which is allocated anew when a function is removed and created
+    again, e.g. on a reset of the PF or when VFs are recreated.
+
+    With ``pf_addrs`` set only these PFs and their VFs are covered, at the
+    cost of a directory scan per function, so that changes to other
+    devices do not count. The driver and netdevs of each of the functions
+    are recorded as ``functions`` then.
+
+    :param root: sysfs mount point, defaults to topology.SYSFS_ROOT
+    :type: str
+    :param driver: driver to record bound functions of
+    :type: str
+    :param pf_addrs: PCI addresses of the PFs to cover, all functions if
+                     None
+    :type: typing.Iterable[str]
+    :return: fingerprint
+    :rtype: typing.Dict
+    """
+    root = root or topology.SYSFS_ROOT
+    fingerprint = {
+        "boot_id": boot_id(),
+        "sysfs_root": root,
+    }
+    devices = hashlib.sha256()
+    if pf_addrs is None:
+        with os.scandir(os.path.join(root, "bus/pci/devices")) as entries:
+            for name, inode in sorted((entry.name, entry.inode())
+                                      for entry in entries):
+                devices.update("{} {}\n".format(name, inode).encode("utf-8"))
+        fingerprint["devices"] = devices.hexdigest()
+        fingerprint["bound"] = sorted(topology.read_bound(driver, root))
+        return fingerprint
+    functions = hashlib.sha256()
+    bound = []
+    for function in sorted(topology.scan_pfs(pf_addrs, root)):
+        try:
+            inode = os.lstat(os.path.join(root, "bus/pci/devices",
+                                          function.pci_addr)).st_ino
+        except FileNotFoundError:
+            continue
+        devices.update("{} {}\n".format(function.pci_addr, inode)
+                       .encode("utf-8"))
+        functions.update("{} {} {}\n".format(
+            function.pci_addr, function.driver, ",".join(function.netdevs))
+            .encode("utf-8"))
+        if function.driver == driver:
+            bound.append(function.pci_addr)
+    fingerprint["devices"] = devices.hexdigest()
+    fingerprint["bound"] = bound
+    fingerprint["functions"] = functions.hexdigest()
+    return fingerprint
+
+
+def write_json(path: str, data: typing.Dict):
+    """Atomically replace a JSON file
+
+    The data is written to a temporary file which is renamed over the
+    previous file, so readers never see a partial record.
+
+    :param path: path of file
+    :type: str
+    :param data: data to write
+    :type: typing.Dict
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(tmp_path, "wt") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+            f.write("\n")
+        os.rename(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class StateCache(object):
+    """Persistent record of the last successful run of a command"""
+
+    def __init__(self, command: str, state_dir: str = None):
+        """Initialise a new state cache
+
+        :param command: name of the subcommand the state belongs to
+        :type: str
+        :param state_dir: directory to keep state in, defaults to STATE_DIR
+        :type: str
+        """
+        self.command = command
+        self._state_dir = state_dir
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self._state_dir or STATE_DIR,
+                            "{}.json".format(self.command))
+
+    def load(self) -> typing.Optional[typing.Dict]:
+        """Load the recorded state
+
+        :return: state or None if there is no usable record
+        :rtype: typing.Optional[typing.Dict]
+        """
+        try:
+            with open(self.path, "rt") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (not isinstance(state, dict) or
+                state.get("version") != STATE_VERSION or
+                state.get("command") != self.command):
+            return None
+        return state
+
+    def is_current(self, fingerprint: typing.Dict,
+                   keys: typing.Iterable[str] = ("boot_id", "sysfs_root",
+                                                 "devices", "bound")
+                   ) -> bool:
+        """Determine if nothing changed since the recorded run
+
+        :param fingerprint: current fingerprint, see read_fingerprint()
+        :type: typing.Dict
+        :param keys: parts of the fingerprint that have to match
+        :type: typing.Iterable[str]
+        :return: whether the recorded fingerprint matches
+        :rtype: bool
+        """
+        state = self.load()
+        if state is None:
+            return False
+        recorded = state.get("fingerprint", {})
+        return all(key in recorded and recorded[key] == fingerprint[key]
+                   for key in keys)
+
+    def save(self, fingerprint: typing.Dict,
+             pfs: typing.Dict[str, typing.Dict]):
+        """Record the state after a successful run
+
+        The record is replaced atomically, see write_json().
+
+        :param fingerprint: fingerprint after the run
+        :type: typing.Dict
+        :param pfs: PCI address to PF state mappings, for information
+        :type: typing.Dict[str, typing.Dict]
+        """
+        write_json(self.path, {
+            "version": STATE_VERSION,
+            "command": self.command,
+            "fingerprint": fingerprint,
+            "pfs": pfs,
+        })
+
+    def invalidate(self):
+        """Drop the recorded state"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,489 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scaling benchmarks of the subcommands against generated sysfs trees
+
+Run with::
+
+    python -m mlnx_switchdev_mode.tests.benchmark --pfs 2 8 --vfs 16 127
+
+Filesystem calls are counted at the Python os and io layer, which is
+where every sysfs access of mlnx_switchdev_mode is made.
+
+With --strategies the switch strategies are instead compared against a
+simulated kernel, see fakekernel, whose operations take as long as given
+with --latency::
+
+    python -m mlnx_switchdev_mode.tests.benchmark --strategies \
+        --pfs 2 --vfs 32 --jobs 8 --latency bind=0.05 unbind=0.02
+
+With --startup the start up cost of the command is measured instead, in
+fresh interpreters, from the import of the package to a no-op bind on a
+host where nothing changed since the last run.
+"""
+
+import argparse
+import builtins
+import collections
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import report
+from mlnx_switchdev_mode import sriovify
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode.tests import fakedevlink
+from mlnx_switchdev_mode.tests import fakekernel
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+COUNTED_CALLS = (
+    (os, "scandir"),
+    (os, "listdir"),
+    (os, "readlink"),
+    (os, "stat"),
+    (os, "lstat"),
+    (builtins, "open"),
+)
+
+Result = collections.namedtuple(
+    "Result", ["command", "pfs", "vfs", "others", "wall", "calls"])
+
+StrategyResult = collections.namedtuple(
+    "StrategyResult", ["strategy", "jobs", "vfs_bound", "pfs", "vfs", "wall",
+                       "operations"])
+
+# Operations of the simulated kernel shown in strategy comparisons
+COMPARED_OPERATIONS = ("unbind", "bind", "eswitch-set")
+
+StartupResult = collections.namedtuple(
+    "StartupResult", ["name", "wall", "imports", "modules"])
+
+# Code run in fresh interpreters by the startup benchmark, each printing
+# the names of the modules loaded. A no-op bind runs against the tree and
+# state directory given as arguments.
+STARTUP_SCRIPTS = collections.OrderedDict([
+    ("python", ""),
+    ("import", "import mlnx_switchdev_mode.sriovify"),
+    ("bind", """
+from mlnx_switchdev_mode import state
+state.STATE_DIR = sys.argv[1]
+from mlnx_switchdev_mode import sriovify
+sys.argv = ["mlnx-switchdev-mode", "--sysfs-root", sys.argv[2], "bind"]
+with contextlib.redirect_stdout(io.StringIO()):
+    sriovify.main()
+"""),
+])
+
+_STARTUP_EPILOGUE = """
+print(" ".join(sorted(sys.modules)))
+"""
+
+# Latencies in seconds of the simulated kernel by default, in the order of
+# magnitude of those of ConnectX-5 adapters
+DEFAULT_LATENCIES = {
+    "bind": 0.05,
+    "unbind": 0.02,
+    "eswitch-set": 0.5,
+    "representors": 0.1,
+}
+
+
+@contextlib.contextmanager
+def count_calls() -> typing.Iterator[collections.Counter]:
+    """Count filesystem calls made in the body
+
+    :return: counter of calls by function name, filled on exit of the body
+    :rtype: typing.Iterator[collections.Counter]
+    """
+    counter = collections.Counter()
+
+    def wrap(name, func):
+        def wrapper(*args, **kwargs):
+            counter[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    with contextlib.ExitStack() as stack:
+        for module, name in COUNTED_CALLS:
+            stack.enter_context(mock.patch.object(
+                module, name, wrap(name, getattr(module, name))))
+        yield counter
+
+
+def run_command(command: str, root: str, pfs: typing.List[str], vfs: int,
+                jobs: int = 1) -> typing.Tuple[float, collections.Counter]:
+    """Run a subcommand against a generated tree
+
+    :param command: name of subcommand, one of show, switch or bind
+    :type: str
+    :param root: path to root of generated sysfs tree
+    :type: str
+    :param pfs: PCI addresses of the PFs in the tree
+    :type: typing.List[str]
+    :param vfs: number of VFs per PF
+    :type: int
+    :param jobs: number of VFs or PFs operated on concurrently
+    :type: int
+    :return: wall time and filesystem calls of the run
+    :rtype: typing.Tuple[float, collections.Counter]
+    """
+    kernel = fakedevlink.FakeDevlinkKernel({
+        "pci/{}".format(pf): {"mode": "legacy"} for pf in pfs})
+    backend = devlink.NetlinkDevlink(socket_factory=kernel.connect)
+    func = {
+        "show": lambda: sriovify.show(),
+        "switch": lambda: sriovify.switch(jobs=jobs),
+        "bind": lambda: sriovify.bind(jobs=jobs),
+    }[command]
+    report.activate(report.RunReport(command))
+    try:
+        with mock.patch.object(topology, "SYSFS_ROOT", root), \
+                mock.patch.object(devlink, "get_backend",
+                                  return_value=backend), \
+                contextlib.redirect_stdout(io.StringIO()):
+            # NOTE: resolve the family before timing, as a long running
+            # process would have done so already
+            backend.family_id
+            with count_calls() as calls:
+                start = time.perf_counter()
+                func()
+                wall = time.perf_counter() - start
+    finally:
+        backend.close()
+    return wall, calls
+
+
+def benchmark(pfs: typing.Iterable[int], vfs: typing.Iterable[int],
+              others: int = 100, jobs: int = 1,
+              commands: typing.Iterable[str] = ("show", "switch", "bind")
+              ) -> typing.Iterator[Result]:
+    """Benchmark subcommands on trees of growing size
+
+    :param pfs: numbers of PFs to generate trees with
+    :type: typing.Iterable[int]
+    :param vfs: numbers of VFs per PF to generate trees with
+    :type: typing.Iterable[int]
+    :param others: number of unrelated PCI devices in every tree
+    :type: int
+    :param jobs: number of VFs or PFs operated on concurrently
+    :type: int
+    :param commands: subcommands to benchmark
+    :type: typing.Iterable[str]
+    :return: results as they become available
+    :rtype: typing.Iterator[Result]
+    """
+    for num_pfs in pfs:
+        for num_vfs in vfs:
+            for command in commands:
+                root = tempfile.mkdtemp(prefix="sriovify-bench-")
+                try:
+                    pf_addrs = fakesysfs.generate(
+                        root, pfs=num_pfs, vfs=num_vfs, others=others,
+                        # NOTE: bind only has work to do on unbound VFs
+                        vfs_bound=command != "bind")
+                    wall, calls = run_command(command, root, pf_addrs,
+                                              num_vfs, jobs=jobs)
+                finally:
+                    shutil.rmtree(root)
+                yield Result(command, num_pfs, num_vfs, others, wall, calls)
+
+
+def format_result(result: Result) -> str:
+    """Format a benchmark result as a table row
+
+    :param result: benchmark result
+    :type: Result
+    :return: table row
+    :rtype: str
+    """
+    return "{:<8}{:>5}{:>5}{:>7}{:>10.3f}{:>8}  {}".format(
+        result.command, result.pfs, result.vfs, result.others,
+        result.wall * 1000, sum(result.calls.values()),
+        " ".join("{}={}".format(name, result.calls[name])
+                 for _, name in COUNTED_CALLS if result.calls[name]))
+
+
+def run_strategy(strategy: str, jobs: int, vfs_bound: bool, pfs: int,
+                 vfs: int, latencies: typing.Dict[str, float]
+                 ) -> StrategyResult:
+    """Switch a simulated kernel with a strategy and rebind its VFs
+
+    :param strategy: one of sriovify.SWITCH_STRATEGIES
+    :type: str
+    :param jobs: number of VFs or PFs operated on concurrently
+    :type: int
+    :param vfs_bound: whether VFs were probed when created
+    :type: bool
+    :param pfs: number of PFs
+    :type: int
+    :param vfs: number of VFs per PF
+    :type: int
+    :param latencies: operation to seconds mappings, see fakekernel
+    :type: typing.Dict[str, float]
+    :return: result of the run
+    :rtype: StrategyResult
+    """
+    root = tempfile.mkdtemp(prefix="sriovify-bench-")
+    try:
+        kernel = fakekernel.FakeKernel(root, pfs=pfs, vfs=vfs,
+                                       vfs_bound=vfs_bound,
+                                       latencies=latencies)
+        try:
+            with kernel.activate(), \
+                    contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                sriovify.switch(rebind=True, jobs=jobs, strategy=strategy,
+                                representor_timeout=60)
+                wall = time.perf_counter() - start
+        finally:
+            kernel.close()
+    finally:
+        shutil.rmtree(root)
+    return StrategyResult(strategy, jobs, vfs_bound, pfs, vfs, wall,
+                          collections.Counter({
+                              operation: kernel.count(operation)
+                              for operation in COMPARED_OPERATIONS}))
+
+
+def compare_strategies(pfs: typing.Iterable[int], vfs: typing.Iterable[int],
+                       jobs: int = 1,
+                       latencies: typing.Dict[str, float] = None
+                       ) -> typing.Iterator[StrategyResult]:
+    """Compare switch strategies on simulated kernels of growing size
+
+    Each tree is switched serially and with ``jobs`` workers by the unbind
+    strategy, and with ``jobs`` workers by the autoprobe strategy on VFs
+    created with and without autoprobe.
+
+    :param pfs: numbers of PFs to simulate
+    :type: typing.Iterable[int]
+    :param vfs: numbers of VFs per PF to simulate
+    :type: typing.Iterable[int]
+    :param jobs: number of VFs or PFs operated on concurrently
+    :type: int
+    :param latencies: operation to seconds mappings, defaults to
+                      DEFAULT_LATENCIES
+    :type: typing.Dict[str, float]
+    :return: results as they become available
+    :rtype: typing.Iterator[StrategyResult]
+    """
+    if latencies is None:
+        latencies = DEFAULT_LATENCIES
+    runs = [("unbind", 1, True), ("unbind", jobs, True),
+            ("autoprobe", jobs, True), ("autoprobe", jobs, False)]
+    for num_pfs in pfs:
+        for num_vfs in vfs:
+            for strategy, strategy_jobs, vfs_bound in runs:
+                yield run_strategy(strategy, strategy_jobs, vfs_bound,
+                                   num_pfs, num_vfs, latencies)
+
+
+def format_strategy_result(result: StrategyResult) -> str:
+    """Format a strategy comparison result as a table row
+
+    :param result: strategy comparison result
+    :type: StrategyResult
+    :return: table row
+    :rtype: str
+    """
+    return "{:<10}{:>5}{:>8}{:>5}{:>5}{:>10.3f}  {}".format(
+        result.strategy, result.jobs, "yes" if result.vfs_bound else "no",
+        result.pfs, result.vfs, result.wall,
+        " ".join("{}={}".format(operation, result.operations[operation])
+                 for operation in COMPARED_OPERATIONS))
+
+
+def run_startup(name: str, args: typing.List[str], runs: int
+                ) -> StartupResult:
+    """Run a startup script in fresh interpreters
+
+    :param name: name of script in STARTUP_SCRIPTS
+    :type: str
+    :param args: arguments of script
+    :type: typing.List[str]
+    :param runs: number of runs, the fastest is kept
+    :type: int
+    :return: result of the fastest run
+    :rtype: StartupResult
+    """
+    # NOTE: the prologue is loaded by any interpreter anyway
+    code = "import contextlib, io, sys\n{}\n{}".format(
+        STARTUP_SCRIPTS[name], _STARTUP_EPILOGUE)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(sriovify.__file__))] +
+        ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    walls = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        modules = subprocess.check_output(
+            [sys.executable, "-c", code] + args, env=env,
+            universal_newlines=True).split()
+        walls.append(time.perf_counter() - start)
+    imports = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code] + args, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True).stderr
+    return StartupResult(name, min(walls), parse_importtime(imports),
+                         modules)
+
+
+def parse_importtime(output: str) -> typing.Dict[str, float]:
+    """Cumulative import times of the mlnx_switchdev_mode modules
+
+    :param output: standard error of python -X importtime
+    :type: str
+    :return: module to seconds mappings, including imports by the module
+    :rtype: typing.Dict[str, float]
+    """
+    imports = {}
+    for line in output.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        module = fields[2].strip()
+        if module.split(".")[0] == "mlnx_switchdev_mode":
+            imports[module] = int(fields[1]) / 1000000
+    return imports
+
+
+def startup(runs: int = 10) -> typing.Iterator[StartupResult]:
+    """Measure the start up cost of the command
+
+    :param runs: number of runs of each script, the fastest is kept
+    :type: int
+    :return: results as they become available
+    :rtype: typing.Iterator[StartupResult]
+    """
+    root = tempfile.mkdtemp(prefix="sriovify-bench-")
+    try:
+        state_dir = os.path.join(root, "state")
+        sysfs_root = os.path.join(root, "sys")
+        fakesysfs.generate(sysfs_root, pfs=2, vfs=8)
+        for name in STARTUP_SCRIPTS:
+            if name == "bind":
+                # NOTE: record the state the no-op runs compare against
+                run_startup(name, [state_dir, sysfs_root], 1)
+            yield run_startup(name, [state_dir, sysfs_root], runs)
+    finally:
+        shutil.rmtree(root)
+
+
+def format_startup_result(result: StartupResult) -> str:
+    """Format a startup result as a table row
+
+    :param result: startup result
+    :type: StartupResult
+    :return: table row
+    :rtype: str
+    """
+    package = [name for name in result.modules
+               if name.split(".")[0] == "mlnx_switchdev_mode"]
+    return "{:<8}{:>10.1f}{:>9}  {}".format(
+        result.name, result.wall * 1000, len(result.modules),
+        " ".join("{}={:.1f}".format(name.split(".")[-1],
+                                    result.imports.get(name, 0) * 1000)
+                 for name in package))
+
+
+def latency(value: str) -> typing.Tuple[str, float]:
+    """Argument type of operation latencies
+
+    :param value: argument of the form OPERATION=SECONDS
+    :type: str
+    :return: operation and seconds
+    :rtype: typing.Tuple[str, float]
+    :raises: argparse.ArgumentTypeError on invalid values
+    """
+    operation, _, seconds = value.partition("=")
+    if operation not in fakekernel.OPERATIONS:
+        raise argparse.ArgumentTypeError(
+            "unknown operation {}, one of {}".format(
+                operation, ", ".join(fakekernel.OPERATIONS)))
+    try:
+        seconds = float(seconds)
+        if seconds < 0:
+            raise ValueError(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid latency: {}".format(value))
+    return operation, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark subcommands against generated sysfs trees")
+    parser.add_argument("--pfs", type=sriovify.positive_int, nargs="+",
+                        default=[1, 2, 4, 8], help="Numbers of PFs")
+    parser.add_argument("--vfs", type=sriovify.positive_int, nargs="+",
+                        default=[8, 32, 127], help="Numbers of VFs per PF")
+    parser.add_argument("--others", type=int, default=100,
+                        help="Number of unrelated PCI devices")
+    parser.add_argument("--jobs", "-j", type=sriovify.positive_int,
+                        default=1, help="Number of concurrent operations")
+    parser.add_argument("--command", dest="commands", action="append",
+                        choices=["show", "switch", "bind"],
+                        help="Subcommand to benchmark, may be repeated")
+    parser.add_argument("--strategies", action="store_true",
+                        help="Compare switch strategies against a simulated "
+                             "kernel instead")
+    parser.add_argument("--latency", dest="latencies", type=latency,
+                        nargs="+", metavar="OPERATION=SECONDS",
+                        help="Latencies of simulated kernel operations, "
+                             "with --strategies")
+    parser.add_argument("--startup", action="store_true",
+                        help="Measure the start up cost of the command "
+                             "instead")
+    parser.add_argument("--runs", type=sriovify.positive_int, default=10,
+                        help="Number of runs of each measurement, with "
+                             "--startup")
+    args = parser.parse_args()
+    if args.startup:
+        print("{:<8}{:>10}{:>9}  {}".format(
+            "run", "wall(ms)", "modules", "package imports(ms)"))
+        for result in startup(args.runs):
+            print(format_startup_result(result), flush=True)
+        return
+    if args.strategies:
+        latencies = dict(DEFAULT_LATENCIES)
+        latencies.update(args.latencies or ())
+        print("{:<10}{:>5}{:>8}{:>5}{:>5}{:>10}  {}".format(
+            "strategy", "jobs", "probed", "pfs", "vfs", "wall(s)",
+            "operations"))
+        for result in compare_strategies(args.pfs, args.vfs, jobs=args.jobs,
+                                         latencies=latencies):
+            print(format_strategy_result(result), flush=True)
+        return
+    print("{:<8}{:>5}{:>5}{:>7}{:>10}{:>8}  {}".format(
+        "command", "pfs", "vfs", "others", "wall(ms)", "calls", "by call"))
+    for result in benchmark(args.pfs, args.vfs, others=args.others,
+                            jobs=args.jobs,
+                            commands=args.commands or ("show", "switch",
+                                                       "bind")):
+        print(format_result(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fake devlink generic netlink responder for testing"""
+
+import errno
+import socket
+import struct
+import threading
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode.devlink import NetlinkSocket
+
+
+DEVLINK_FAMILY_ID = 0x15
+
+_NLMSGHDR = struct.Struct("=LHHLL")
+_GENLMSGHDR = struct.Struct("=BBH")
+
+
+class FakeDevlinkKernel(object):
+    """Answers devlink generic netlink requests from in-memory state"""
+
+    def __init__(self, devices: dict = None):
+        """Initialise a new fake devlink responder
+
+        :param devices: devlink handle to eswitch properties mappings
+        :type: dict
+        """
+        self.devices = devices or {}
+        self.requests = []
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def connect(self) -> NetlinkSocket:
+        """Open a new socket connected to this responder
+
+        :return: client end of connection
+        :rtype: NetlinkSocket
+        """
+        client, server = socket.socketpair(socket.AF_UNIX,
+                                           socket.SOCK_SEQPACKET)
+        thread = threading.Thread(target=self._serve, args=(server,))
+        thread.daemon = True
+        thread.start()
+        return NetlinkSocket(sock=client)
+
+    def _serve(self, sock: socket.socket):
+        with sock:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                for msg_type, flags, seq, payload in devlink.parse_messages(
+                        data):
+                    for reply in self._handle(msg_type, flags, seq, payload):
+                        sock.send(reply)
+
+    def _reply(self, msg_type: int, seq: int, cmd: int,
+               attrs: bytes) -> bytes:
+        return devlink.pack_message(msg_type, 0, seq, cmd, 1, attrs)
+
+    def _error(self, seq: int, error: int) -> bytes:
+        payload = struct.pack("=i", -error) + _NLMSGHDR.pack(
+            0, 0, 0, seq, 0)
+        return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload),
+                              devlink.NLMSG_ERROR, 0, seq, 0) + payload
+
+    def _handle(self, msg_type, flags, seq, payload):
+        cmd = _GENLMSGHDR.unpack_from(payload)[0]
+        attrs = devlink.parse_attrs(payload[_GENLMSGHDR.size:])
+        if msg_type == devlink.GENL_ID_CTRL:
+            name = devlink.parse_string(
+                attrs[devlink.CTRL_ATTR_FAMILY_NAME])
+            if name != devlink.DEVLINK_GENL_NAME:
+                return [self._error(seq, errno.ENOENT)]
+            return [
+                self._reply(msg_type, seq, cmd, devlink.pack_attr(
+                    devlink.CTRL_ATTR_FAMILY_ID,
+                    struct.pack("=H", DEVLINK_FAMILY_ID))),
+                self._error(seq, 0),
+            ]
+        if cmd == devlink.DEVLINK_CMD_GET and flags & devlink.NLM_F_DUMP:
+            replies = []
+            with self._lock:
+                self.requests.append((cmd, None))
+                handles = sorted(self.devices)
+            for handle in handles:
+                bus_name, dev_name = handle.split("/", 1)
+                replies.append(self._reply(
+                    msg_type, seq, cmd,
+                    devlink.pack_string(devlink.DEVLINK_ATTR_BUS_NAME,
+                                        bus_name) +
+                    devlink.pack_string(devlink.DEVLINK_ATTR_DEV_NAME,
+                                        dev_name)))
+            replies.append(_NLMSGHDR.pack(_NLMSGHDR.size + 4,
+                                          devlink.NLMSG_DONE, 0, seq, 0) +
+                           struct.pack("=i", 0))
+            return replies
+        handle = "{}/{}".format(
+            devlink.parse_string(attrs[devlink.DEVLINK_ATTR_BUS_NAME]),
+            devlink.parse_string(attrs[devlink.DEVLINK_ATTR_DEV_NAME]))
+        with self._lock:
+            self.requests.append((cmd, handle))
+            error = self.errors.get((cmd, handle))
+            if error:
+                return [self._error(seq, error)]
+            if handle not in self.devices:
+                return [self._error(seq, errno.ENODEV)]
+            eswitch = self.devices[handle]
+            if cmd == devlink.DEVLINK_CMD_ESWITCH_SET:
+                for prop, (attr_type, fmt, values) in (
+                        devlink.ESWITCH_ATTRS.items()):
+                    if attr_type in attrs:
+                        eswitch[prop] = values[
+                            struct.unpack_from(fmt, attrs[attr_type])[0]]
+                return [self._error(seq, 0)]
+            reply = devlink.pack_string(
+                devlink.DEVLINK_ATTR_BUS_NAME, handle.split("/")[0])
+            for prop, (attr_type, fmt, values) in (
+                    devlink.ESWITCH_ATTRS.items()):
+                if prop in eswitch:
+                    number = {v: k for k, v in values.items()}[eswitch[prop]]
+                    reply += devlink.pack_attr(attr_type,
+                                               struct.pack(fmt, number))
+            return [self._reply(msg_type, seq, cmd, reply),
+                    self._error(seq, 0)]
@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Simulated mlx5 kernel behind a fake sysfs tree and devlink backend
+
+The simulator keeps a tree generated by fakesysfs consistent with the
+state of the PFs it holds: binding and unbinding of VFs, creation of VFs
+through sriov_numvfs honouring sriov_drivers_autoprobe, and the eswitch
+configuration with the representors of a PF in switchdev mode. Like the
+mlx5 driver it refuses a change of eswitch mode while VFs are bound.
+
+Every operation takes a configurable time, during which it blocks its
+caller as the kernel does, and can be made to fail::
+
+    kernel = FakeKernel(root, pfs=2, vfs=8,
+                        latencies={"bind": 0.01, "eswitch-set": 0.1})
+    kernel.fail("eswitch-set", errno.EBUSY, target="0000:03:00.1")
+    with kernel.activate():
+        sriovify.switch(rebind=True, jobs=4)
+
+Operations are named "bind", "unbind", "probe", "sriov_numvfs",
+"eswitch-get", "eswitch-set" and "representors". "probe" is the probe of
+a new VF by sriov_numvfs with sriov_drivers_autoprobe enabled and takes
+as long as "bind" unless configured. "representors" is the delay before
+the representors of a PF appear after its switch to switchdev mode.
+
+The death of the process, e.g. by SIGKILL, is simulated by kill(): from
+the given operation on every operation raises Killed, so clean up of the
+run in finally clauses never reaches the kernel, until revive().
+"""
+
+import collections
+import contextlib
+import errno
+import os
+import socket
+import threading
+import time
+import typing
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import representors
+from mlnx_switchdev_mode import sriovify
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+OPERATIONS = ("bind", "unbind", "probe", "sriov_numvfs", "eswitch-get",
+              "eswitch-set", "representors")
+
+DRIVER = "mlx5_core"
+
+# NOTE: representors.LinkMonitor is replaced while the simulator is active
+_LinkMonitor = representors.LinkMonitor
+
+# Bus of the VFs created through sriov_numvfs of the PF with index 0
+VF_BUS_BASE = 0x40
+
+
+class Killed(BaseException):
+    """The process was killed, see FakeKernel.kill()"""
+
+
+Event = collections.namedtuple(
+    "Event", ["operation", "target", "start", "duration", "error"])
+
+
+class PFState(object):
+    """State of a simulated PF"""
+
+    def __init__(self, index: int, pci_addr: str, netdev: str, port: int,
+                 vf_addrs: typing.Sequence[str]):
+        self.index = index
+        self.pci_addr = pci_addr
+        self.netdev = netdev
+        self.port = port
+        self.vf_addrs = list(vf_addrs)
+        self.eswitch = {"mode": "legacy", "inline-mode": "none",
+                        "encap": "disable"}
+        self.representors = False
+
+    @property
+    def uplink(self) -> str:
+        return "{}np{}".format(self.netdev, self.port)
+
+    def representor(self, vf_index: int) -> str:
+        return "{}npf{}vf{}".format(self.netdev, self.port, vf_index)
+
+    def vf_netdev(self, vf_index: int) -> str:
+        return "{}v{}".format(self.netdev, vf_index)
+
+
+class FakeKernel(object):
+    """Simulated mlx5 driver, PCI core and devlink of a generated tree"""
+
+    def __init__(self, root: str, pfs: int = 2, vfs: int = 4,
+                 others: int = 0, vfs_bound: bool = True,
+                 numa_nodes: int = 1, latencies: typing.Dict = None):
+        """Generate a tree and initialise the simulator for it
+
+        :param root: path to root of fake sysfs tree to generate
+        :type: str
+        :param pfs: number of PFs, all in legacy mode
+        :type: int
+        :param vfs: number of VFs per PF
+        :type: int
+        :param others: number of unrelated PCI devices
+        :type: int
+        :param vfs_bound: whether VFs are bound, i.e. were created with
+                          autoprobe enabled
+        :type: bool
+        :param numa_nodes: number of NUMA nodes PFs are spread across
+        :type: int
+        :param latencies: operation, or operation and PCI address, to
+                          seconds mappings
+        :type: typing.Dict
+        """
+        self.root = root
+        self.latencies = dict(latencies or {})
+        self.events = []
+        self.max_active = collections.Counter()
+        self._active = collections.Counter()
+        self._faults = []
+        self._kill_at = None
+        self._killed = False
+        self._monitors = []
+        self._ifindex = 100
+        self._timers = []
+        self._lock = threading.RLock()
+        self.pfs = collections.OrderedDict()
+        self._vf_pfs = {}
+        pf_addrs = fakesysfs.generate(root, pfs=pfs, vfs=vfs, others=others,
+                                      vfs_bound=vfs_bound,
+                                      numa_nodes=numa_nodes)
+        snapshot = topology.scan(root)
+        for index, pf_addr in enumerate(pf_addrs):
+            pf = snapshot[pf_addr]
+            self.pfs[pf_addr] = PFState(index, pf_addr, pf.netdevs[0],
+                                        index % 2, pf.vf_addrs)
+            for vf_addr in pf.vf_addrs:
+                self._vf_pfs[vf_addr] = pf_addr
+        if not vfs_bound:
+            for pf_addr in pf_addrs:
+                self._write_sysfs(pf_addr, "sriov_drivers_autoprobe", "0")
+
+    # Fault and latency injection
+
+    def latency(self, operation: str, target: str = None) -> float:
+        """Time an operation takes
+
+        :param operation: name of operation, one of OPERATIONS
+        :type: str
+        :param target: PCI address operated on
+        :type: str
+        :return: seconds
+        :rtype: float
+        """
+        for key in ((operation, target), operation):
+            if key in self.latencies:
+                return self.latencies[key]
+        if operation == "probe":
+            return self.latency("bind", target)
+        return 0.0
+
+    def fail(self, operation: str, error: int = errno.EBUSY,
+             target: str = None, count: int = 1):
+        """Make the next calls of an operation fail
+
+        :param operation: name of operation, one of OPERATIONS
+        :type: str
+        :param error: errno the operation fails with
+        :type: int
+        :param target: PCI address of the function the operation has to
+                       be on to fail, any function if None
+        :type: str
+        :param count: number of calls to fail, all calls if None
+        :type: int
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(operation)
+        with self._lock:
+            self._faults.append([operation, target, error, count])
+
+    def kill(self, operation: str, target: str = None):
+        """Simulate the death of the process on the next call of an operation
+
+        :param operation: name of operation, one of OPERATIONS
+        :type: str
+        :param target: PCI address of the function the operation has to
+                       be on, any function if None
+        :type: str
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(operation)
+        with self._lock:
+            self._kill_at = (operation, target)
+
+    def revive(self):
+        """Let operations through again, as for the next run"""
+        with self._lock:
+            self._kill_at = None
+            self._killed = False
+
+    def _check_alive(self, operation: str, target: str):
+        with self._lock:
+            if (self._kill_at is not None and
+                    self._kill_at[0] == operation and
+                    self._kill_at[1] in (None, target)):
+                self._killed = True
+            if self._killed:
+                raise Killed("{} {}".format(operation, target))
+
+    def _take_fault(self, operation: str, target: str) -> int:
+        for fault in self._faults:
+            if fault[0] == operation and fault[1] in (None, target):
+                if fault[3] is not None:
+                    fault[3] -= 1
+                    if fault[3] <= 0:
+                        self._faults.remove(fault)
+                return fault[2]
+        return 0
+
+    @contextlib.contextmanager
+    def _operation(self, operation: str, target: str):
+        """Account, delay and possibly fail an operation of the body"""
+        self._check_alive(operation, target)
+        start = time.monotonic()
+        with self._lock:
+            self._active[operation] += 1
+            self.max_active[operation] = max(self.max_active[operation],
+                                             self._active[operation])
+            error = self._take_fault(operation, target)
+        try:
+            time.sleep(self.latency(operation, target))
+            if error:
+                raise OSError(error, os.strerror(error))
+            with self._lock:
+                yield
+        except OSError as e:
+            self._log(operation, target, start, e)
+            raise
+        finally:
+            with self._lock:
+                self._active[operation] -= 1
+        self._log(operation, target, start, None)
+
+    def _log(self, operation, target, start, error):
+        with self._lock:
+            self.events.append(Event(operation, target, start,
+                                     time.monotonic() - start, error))
+
+    def count(self, operation: str, failed: bool = False) -> int:
+        """Number of calls of an operation so far
+
+        :param operation: name of operation
+        :type: str
+        :param failed: count failed instead of successful calls
+        :type: bool
+        :return: number of calls
+        :rtype: int
+        """
+        return sum(1 for event in self.events
+                   if event.operation == operation and
+                   (event.error is not None) == failed)
+
+    # sysfs
+
+    def _path(self, pci_addr: str, attr: str) -> str:
+        return os.path.join(self.root, "bus/pci/devices", pci_addr, attr)
+
+    def _write_sysfs(self, pci_addr: str, attr: str, value: str):
+        with open(self._path(pci_addr, attr), "wt") as f:
+            f.write("{}\n".format(value))
+
+    def _read_sysfs(self, pci_addr: str, attr: str) -> str:
+        with open(self._path(pci_addr, attr), "rt") as f:
+            return f.read().strip()
+
+    def bound(self, pci_addr: str) -> bool:
+        """Determine if a function is bound to mlx5_core
+
+        :param pci_addr: PCI address of function
+        :type: str
+        :return: whether function is bound
+        :rtype: bool
+        """
+        return os.path.lexists(self._path(pci_addr, "driver"))
+
+    def write(self, path: str, value: str):
+        """Write to a sysfs attribute, replaces sriovify._write_file
+
+        :param path: path of attribute in the tree
+        :type: str
+        :param value: value written
+        :type: str
+        :raises: OSError as the kernel would fail the write
+        """
+        relpath = os.path.relpath(path, self.root)
+        value = value.strip()
+        self._check_alive("write", relpath)
+        if relpath == "bus/pci/drivers/{}/bind".format(DRIVER):
+            self.bind(value)
+        elif relpath == "bus/pci/drivers/{}/unbind".format(DRIVER):
+            self.unbind(value)
+        elif os.path.basename(relpath) == "sriov_numvfs":
+            self.set_numvfs(os.path.basename(os.path.dirname(relpath)),
+                            int(value))
+        else:
+            with open(path, "wt") as f:
+                f.write(value)
+
+    def bind(self, pci_addr: str):
+        """Probe a VF, as a write to the bind attribute of mlx5_core
+
+        :param pci_addr: PCI address of VF
+        :type: str
+        :raises: OSError ENODEV for unknown VFs, EBUSY for bound ones
+        """
+        with self._operation("bind", pci_addr):
+            if pci_addr not in self._vf_pfs:
+                raise OSError(errno.ENODEV, os.strerror(errno.ENODEV))
+            if self.bound(pci_addr):
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+            self._probe(pci_addr)
+
+    def _probe(self, pci_addr: str):
+        pf = self.pfs[self._vf_pfs[pci_addr]]
+        netdev = pf.vf_netdev(pf.vf_addrs.index(pci_addr))
+        fakesysfs.create_function(
+            self.root, pci_addr, driver=DRIVER, physfn=pf.pci_addr,
+            netdevs=[netdev], numa_node=self._numa_node(pf.pci_addr))
+        self._announce([netdev])
+
+    def _numa_node(self, pci_addr: str) -> int:
+        return int(self._read_sysfs(pci_addr, "numa_node"))
+
+    def unbind(self, pci_addr: str):
+        """Remove a VF from its driver, as a write to unbind of mlx5_core
+
+        :param pci_addr: PCI address of VF
+        :type: str
+        :raises: OSError ENODEV for unknown or unbound VFs
+        """
+        with self._operation("unbind", pci_addr):
+            if pci_addr not in self._vf_pfs or not self.bound(pci_addr):
+                raise OSError(errno.ENODEV, os.strerror(errno.ENODEV))
+            self._remove_driver(pci_addr)
+
+    def _remove_driver(self, pci_addr: str):
+        net_path = self._path(pci_addr, "net")
+        if os.path.isdir(net_path):
+            for netdev in os.listdir(net_path):
+                fakesysfs.remove_netdev(self.root, pci_addr, netdev)
+        fakesysfs.create_function(self.root, pci_addr,
+                                  physfn=self._vf_pfs[pci_addr],
+                                  numa_node=self._numa_node(pci_addr))
+
+    def set_numvfs(self, pf_addr: str, num_vfs: int):
+        """Create or remove VFs, as a write to sriov_numvfs of a PF
+
+        New VFs are probed one after the other when sriov_drivers_autoprobe
+        of the PF is enabled, the write returns once all are probed.
+
+        :param pf_addr: PCI address of PF
+        :type: str
+        :param num_vfs: number of VFs
+        :type: int
+        :raises: OSError EBUSY when changing the number of existing VFs
+        """
+        pf = self.pfs[pf_addr]
+        with self._operation("sriov_numvfs", pf_addr):
+            if num_vfs == len(pf.vf_addrs):
+                return
+            if num_vfs and pf.vf_addrs:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY))
+            if num_vfs:
+                autoprobe = self._read_sysfs(pf_addr,
+                                             "sriov_drivers_autoprobe")
+                pf.vf_addrs = [
+                    fakesysfs.pci_addr(VF_BUS_BASE + pf.index, vf_index)
+                    for vf_index in range(num_vfs)]
+                for vf_index, vf_addr in enumerate(pf.vf_addrs):
+                    self._vf_pfs[vf_addr] = pf_addr
+                    fakesysfs.create_function(
+                        self.root, vf_addr, physfn=pf_addr,
+                        numa_node=self._numa_node(pf_addr))
+                    os.symlink("../{}".format(vf_addr), self._path(
+                        pf_addr, "virtfn{}".format(vf_index)))
+            else:
+                autoprobe = "0"
+                for vf_index, vf_addr in enumerate(pf.vf_addrs):
+                    if self.bound(vf_addr):
+                        self._remove_driver(vf_addr)
+                    os.unlink(self._path(pf_addr,
+                                         "virtfn{}".format(vf_index)))
+                    fakesysfs.remove_function(self.root, vf_addr)
+                    del self._vf_pfs[vf_addr]
+                pf.vf_addrs = []
+            self._write_sysfs(pf_addr, "sriov_numvfs", num_vfs)
+            self._update_netdevs(pf)
+        if autoprobe == "1":
+            for vf_addr in pf.vf_addrs:
+                with self._operation("probe", vf_addr):
+                    self._probe(vf_addr)
+
+    # devlink
+
+    def eswitch_get(self, pf_addr: str) -> typing.Dict[str, str]:
+        with self._operation("eswitch-get", pf_addr):
+            if pf_addr not in self.pfs:
+                raise devlink.DevlinkError(errno.ENODEV,
+                                           os.strerror(errno.ENODEV))
+            return dict(self.pfs[pf_addr].eswitch)
+
+    def eswitch_set(self, pf_addr: str, props: typing.Dict[str, str]):
+        """Change the eswitch configuration of a PF
+
+        :param pf_addr: PCI address of PF
+        :type: str
+        :param props: eswitch properties
+        :type: typing.Dict[str, str]
+        :raises: devlink.DevlinkError EBUSY on a change of mode while VFs
+                 are bound
+        """
+        with self._operation("eswitch-set", pf_addr):
+            if pf_addr not in self.pfs:
+                raise devlink.DevlinkError(errno.ENODEV,
+                                           os.strerror(errno.ENODEV))
+            pf = self.pfs[pf_addr]
+            mode = props.get("mode", pf.eswitch["mode"])
+            if mode != pf.eswitch["mode"] and any(
+                    self.bound(vf_addr) for vf_addr in pf.vf_addrs):
+                raise devlink.DevlinkError(errno.EBUSY,
+                                           os.strerror(errno.EBUSY))
+            pf.eswitch.update(props)
+            pf.representors = False
+            self._update_netdevs(pf)
+        if pf.eswitch["mode"] == "switchdev":
+            timer = threading.Timer(self.latency("representors", pf_addr),
+                                    self._create_representors, args=(pf,))
+            timer.daemon = True
+            self._timers.append(timer)
+            timer.start()
+
+    def _create_representors(self, pf: PFState):
+        with self._lock:
+            if pf.eswitch["mode"] != "switchdev" or pf.representors:
+                return
+            pf.representors = True
+            self._log("representors", pf.pci_addr, time.monotonic(), None)
+            self._update_netdevs(pf)
+
+    def _update_netdevs(self, pf: PFState):
+        """Bring the netdevs of a PF in line with its state"""
+        if pf.eswitch["mode"] == "switchdev":
+            netdevs = {pf.uplink: "p{}".format(pf.port)}
+            if pf.representors:
+                netdevs.update(
+                    (pf.representor(vf_index),
+                     "pf{}vf{}".format(pf.port, vf_index))
+                    for vf_index in range(len(pf.vf_addrs)))
+        else:
+            netdevs = {pf.netdev: None}
+        net_path = self._path(pf.pci_addr, "net")
+        existing = set(os.listdir(net_path)) if os.path.isdir(
+            net_path) else set()
+        for netdev in existing.difference(netdevs):
+            fakesysfs.remove_netdev(self.root, pf.pci_addr, netdev)
+        created = sorted(set(netdevs).difference(existing))
+        for netdev in created:
+            fakesysfs.create_netdev(self.root, pf.pci_addr, netdev,
+                                    phys_port_name=netdevs[netdev])
+        self._announce(created)
+
+    def wait_idle(self, timeout: float = 10.0):
+        """Wait for representors still being created
+
+        :param timeout: seconds to wait at most for each PF
+        :type: float
+        """
+        for timer in list(self._timers):
+            timer.join(timeout)
+
+    # rtnetlink
+
+    def link_monitor(self) -> representors.LinkMonitor:
+        """Subscribe to netdev creation, replaces representors.LinkMonitor
+
+        :return: link monitor receiving RTM_NEWLINK for netdevs created by
+                 the simulator
+        :rtype: representors.LinkMonitor
+        """
+        client, server = socket.socketpair(socket.AF_UNIX,
+                                           socket.SOCK_SEQPACKET)
+        # NOTE: never block the simulator on a monitor which is not read,
+        # a full queue wakes up the reader just as well
+        server.setblocking(False)
+        with self._lock:
+            self._monitors.append(server)
+        return _LinkMonitor(sock=client)
+
+    def _announce(self, netdevs: typing.Iterable[str]):
+        for netdev in netdevs:
+            self._ifindex += 1
+            message = representors.pack_newlink(self._ifindex, netdev)
+            for sock in list(self._monitors):
+                try:
+                    sock.send(message)
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    # NOTE: monitor was closed
+                    self._monitors.remove(sock)
+                    sock.close()
+
+    def close(self):
+        """Release the resources of the simulator"""
+        self.wait_idle()
+        with self._lock:
+            for sock in self._monitors:
+                sock.close()
+            del self._monitors[:]
+
+    @contextlib.contextmanager
+    def activate(self) -> typing.Iterator['FakeKernel']:
+        """Make mlnx_switchdev_mode operate on the simulator in the body
+
+        :return: the simulator
+        :rtype: typing.Iterator[FakeKernel]
+        """
+        backend = FakeKernelDevlink(self)
+        with mock.patch.object(topology, "SYSFS_ROOT", self.root), \
+                mock.patch.object(sriovify, "_write_file", self.write), \
+                mock.patch.object(devlink, "get_backend",
+                                  return_value=backend), \
+                mock.patch.object(representors, "LinkMonitor",
+                                  side_effect=self.link_monitor):
+            yield self
+
+
+class FakeKernelDevlink(object):
+    """devlink backend on a simulated kernel, see devlink.get_backend()"""
+
+    def __init__(self, kernel: FakeKernel):
+        self.kernel = kernel
+
+    def get(self, obj_name: str, handle: str) -> typing.Dict[str, str]:
+        if obj_name != "eswitch":
+            raise devlink.DevlinkError(errno.EOPNOTSUPP,
+                                       os.strerror(errno.EOPNOTSUPP))
+        return self.kernel.eswitch_get(handle.split("/", 1)[1])
+
+    def set(self, obj_name: str, handle: str, prop: str, value: str):
+        if obj_name != "eswitch":
+            raise devlink.DevlinkError(errno.EOPNOTSUPP,
+                                       os.strerror(errno.EOPNOTSUPP))
+        self.kernel.eswitch_set(handle.split("/", 1)[1], {prop: value})
+
+    def eswitch_set(self, handle: str, props: typing.Dict[str, str]):
+        self.kernel.eswitch_set(handle.split("/", 1)[1], props)
+
+    def dev_list(self) -> typing.List[str]:
+        return ["pci/{}".format(pf_addr) for pf_addr in self.kernel.pfs]
+
+    def eswitch_show_all(self, handles: typing.Iterable[str] = None
+                         ) -> typing.Dict[str, typing.Dict[str, str]]:
+        if handles is None:
+            handles = self.dev_list()
+        return {handle: self.get("eswitch", handle) for handle in handles}
+
+    def close(self):
+        pass
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for building fake sysfs trees on the local file system"""
+
+import collections
+import os
+import shutil
+import typing
+
+
+def _makedirs(path: str):
+    os.makedirs(path, exist_ok=True)
+
+
+def _symlink(target: str, path: str):
+    if os.path.lexists(path):
+        os.unlink(path)
+    os.symlink(target, path)
+
+
+def pci_addr(bus: int, devfn: int, domain: int = 0) -> str:
+    """Format a PCI address
+
+    :param bus: bus number
+    :type: int
+    :param devfn: combined device and function number
+    :type: int
+    :param domain: PCI domain
+    :type: int
+    :return: PCI address
+    :rtype: str
+    """
+    return "{:04x}:{:02x}:{:02x}.{:x}".format(domain, bus, devfn >> 3,
+                                              devfn & 7)
+
+
+def create_function(root: str, pci_addr: str, driver: str = None,
+                    physfn: str = None, vfs: typing.Sequence[str] = (),
+                    netdevs: typing.Sequence[str] = (), sriov: bool = False,
+                    numa_node: int = -1):
+    """Create a PCI function in a fake sysfs tree
+
+    :param root: path to root of fake sysfs tree
+    :type: str
+    :param pci_addr: PCI address of function
+    :type: str
+    :param driver: kernel driver function is bound to
+    :type: str
+    :param physfn: PCI address of PF if function is a VF
+    :type: str
+    :param vfs: PCI addresses of VFs if function is a PF
+    :type: typing.Sequence[str]
+    :param netdevs: names of netdevs of function
+    :type: typing.Sequence[str]
+    :param sriov: whether function is SR-IOV capable
+    :type: bool
+    :param numa_node: NUMA node the function is attached to
+    :type: int
+    """
+    path = os.path.join(root, "bus/pci/devices", pci_addr)
+    _makedirs(path)
+    with open(os.path.join(path, "vendor"), "wt") as f:
+        f.write("0x15b3\n")
+    with open(os.path.join(path, "numa_node"), "wt") as f:
+        f.write("{}\n".format(numa_node))
+    if driver:
+        driver_path = os.path.join(root, "bus/pci/drivers", driver)
+        _makedirs(driver_path)
+        for attr in ("bind", "unbind"):
+            if not os.path.exists(os.path.join(driver_path, attr)):
+                open(os.path.join(driver_path, attr), "wt").close()
+        _symlink("../../../../bus/pci/drivers/{}".format(driver),
+                 os.path.join(path, "driver"))
+        _symlink("../../devices/{}".format(pci_addr),
+                 os.path.join(driver_path, pci_addr))
+    elif os.path.lexists(os.path.join(path, "driver")):
+        old_driver = os.path.basename(
+            os.readlink(os.path.join(path, "driver")))
+        os.unlink(os.path.join(path, "driver"))
+        os.unlink(os.path.join(root, "bus/pci/drivers", old_driver,
+                               pci_addr))
+    if physfn:
+        _symlink("../{}".format(physfn), os.path.join(path, "physfn"))
+    if sriov or vfs:
+        with open(os.path.join(path, "sriov_totalvfs"), "wt") as f:
+            f.write("127\n")
+        with open(os.path.join(path, "sriov_numvfs"), "wt") as f:
+            f.write("{}\n".format(len(vfs)))
+        with open(os.path.join(path, "sriov_drivers_autoprobe"), "wt") as f:
+            f.write("1\n")
+    for index, vf_addr in enumerate(vfs):
+        _symlink("../{}".format(vf_addr),
+                 os.path.join(path, "virtfn{}".format(index)))
+    for netdev in netdevs:
+        create_netdev(root, pci_addr, netdev)
+
+
+def remove_function(root: str, pci_addr: str):
+    """Remove a PCI function and its netdevs from a fake sysfs tree
+
+    :param root: path to root of fake sysfs tree
+    :type: str
+    :param pci_addr: PCI address of function
+    :type: str
+    """
+    path = os.path.join(root, "bus/pci/devices", pci_addr)
+    if os.path.isdir(os.path.join(path, "net")):
+        for netdev in os.listdir(os.path.join(path, "net")):
+            remove_netdev(root, pci_addr, netdev)
+    create_function(root, pci_addr)
+    shutil.rmtree(path)
+
+
+def create_netdev(root: str, pci_addr: str, netdev: str,
+                  phys_port_name: str = None):
+    """Create a netdev of a PCI function in a fake sysfs tree
+
+    :param root: path to root of fake sysfs tree
+    :type: str
+    :param pci_addr: PCI address of function
+    :type: str
+    :param netdev: name of netdev
+    :type: str
+    :param phys_port_name: port name of netdev, e.g. of a representor
+    :type: str
+    """
+    path = os.path.join(root, "bus/pci/devices", pci_addr, "net", netdev)
+    _makedirs(path)
+    _symlink("../../../{}".format(pci_addr), os.path.join(path, "device"))
+    if phys_port_name is not None:
+        with open(os.path.join(path, "phys_port_name"), "wt") as f:
+            f.write("{}\n".format(phys_port_name))
+    _makedirs(os.path.join(root, "class/net"))
+    _symlink("../../bus/pci/devices/{}/net/{}".format(pci_addr, netdev),
+             os.path.join(root, "class/net", netdev))
+
+
+def remove_netdev(root: str, pci_addr: str, netdev: str):
+    """Remove a netdev of a PCI function from a fake sysfs tree
+
+    :param root: path to root of fake sysfs tree
+    :type: str
+    :param pci_addr: PCI address of function
+    :type: str
+    :param netdev: name of netdev
+    :type: str
+    """
+    if os.path.lexists(os.path.join(root, "class/net", netdev)):
+        os.unlink(os.path.join(root, "class/net", netdev))
+    shutil.rmtree(os.path.join(root, "bus/pci/devices", pci_addr, "net",
+                               netdev), ignore_errors=True)
+
+
+def create_representors(root: str, pf_addr: str, vfs: int,
+                        pf_netdev: str, pfnum: int = 0
+                        ) -> typing.Tuple[str, typing.List[str]]:
+    """Create the uplink and VF representor netdevs of a switchdev PF
+
+    Netdevs are named as by systemd's predictable naming of representors.
+
+    :param root: path to root of fake sysfs tree
+    :type: str
+    :param pf_addr: PCI address of PF
+    :type: str
+    :param vfs: number of VFs of PF
+    :type: int
+    :param pf_netdev: name of the PF netdev in legacy mode
+    :type: str
+    :param pfnum: PF number on the adapter
+    :type: int
+    :return: names of the uplink and of the representors of VFs by index
+    :rtype: typing.Tuple[str, typing.List[str]]
+    """
+    port_names = collections.OrderedDict()
+    port_names["{}np{}".format(pf_netdev, pfnum)] = "p{}".format(pfnum)
+    for index in range(vfs):
+        port_names["{}npf{}vf{}".format(pf_netdev, pfnum, index)] = (
+            "pf{}vf{}".format(pfnum, index))
+    remove_netdev(root, pf_addr, pf_netdev)
+    for netdev, port_name in port_names.items():
+        create_netdev(root, pf_addr, netdev, phys_port_name=port_name)
+    netdevs = list(port_names)
+    return netdevs[0], netdevs[1:]
+
+
+def create_numa_node(root: str, node: int, cpulist: str):
+    """Create a NUMA node in a fake sysfs tree
+
+    :param root: path to root of fake sysfs tree
+    :type: str
+    :param node: node number
+    :type: int
+    :param cpulist: CPUs of node, e.g. 0-3,8-11
+    :type: str
+    """
+    path = os.path.join(root, "devices/system/node/node{}".format(node))
+    _makedirs(path)
+    with open(os.path.join(path, "cpulist"), "wt") as f:
+        f.write("{}\n".format(cpulist))
+
+
+def generate(root: str, pfs: int = 2, vfs: int = 4, others: int = 0,
+             vfs_bound: bool = True, numa_nodes: int = 1
+             ) -> typing.List[str]:
+    """Generate a realistic fake sysfs tree
+
+    PFs are laid out as dual port mlx5_core cards, each with its own bus
+    shared with its VFs, and are spread across NUMA nodes. Unrelated devices
+    are modelled on the uncore devices found in large numbers on Xeon
+    systems, which have no driver and no netdev.
+
+    :param root: path to root of fake sysfs tree
+    :type: str
+    :param pfs: number of PFs
+    :type: int
+    :param vfs: number of VFs per PF
+    :type: int
+    :param others: number of unrelated PCI devices
+    :type: int
+    :param vfs_bound: whether VFs are bound to mlx5_core and have netdevs
+    :type: bool
+    :param numa_nodes: number of NUMA nodes PFs are spread across
+    :type: int
+    :return: PCI addresses of the PFs
+    :rtype: typing.List[str]
+    """
+    pf_addrs = []
+    for index in range(others):
+        create_function(root, pci_addr(0xff - index // 256, index % 256))
+    for pf_index in range(pfs):
+        card, port = divmod(pf_index, 2)
+        bus = 0x03 + card
+        numa_node = card % numa_nodes
+        pf_addr = pci_addr(bus, port)
+        # NOTE: with ARI, VFs of both ports follow the PFs on the same bus
+        vf_addrs = [pci_addr(bus, 2 + port * vfs + vf_index)
+                    for vf_index in range(vfs)]
+        for vf_index, vf_addr in enumerate(vf_addrs):
+            create_function(
+                root, vf_addr,
+                driver="mlx5_core" if vfs_bound else None,
+                physfn=pf_addr,
+                netdevs=(["enp{}s0f{}v{}".format(bus, port, vf_index)]
+                         if vfs_bound else []),
+                numa_node=numa_node)
+        create_function(root, pf_addr, driver="mlx5_core", vfs=vf_addrs,
+                        netdevs=["enp{}s0f{}".format(bus, port)],
+                        sriov=True, numa_node=numa_node)
+        pf_addrs.append(pf_addr)
+    return pf_addrs
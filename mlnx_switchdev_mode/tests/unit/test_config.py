@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import config
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+class TestVFConfig(unittest.TestCase):
+
+    def test_parse_vf_config(self):
+        self.assertEqual(
+            list(config.parse_vf_config([
+                "# PF VFs\n",
+                "\n",
+                "0000:03:00.0\t16\n",
+                "  enp3s0f1 0  # spare\n",
+            ]).items()),
+            [("0000:03:00.0", 16), ("enp3s0f1", 0)])
+        for lines in (["enp3s0f1\n"], ["enp3s0f1 8 9\n"], ["enp3s0f1 -1\n"],
+                      ["enp3s0f1 many\n"], ["enp3s0f1 1\n", "enp3s0f1 2\n"]):
+            with self.assertRaises(config.ConfigError):
+                config.parse_vf_config(lines)
+
+    def test_read_vf_config(self):
+        with tempfile.NamedTemporaryFile("wt") as f:
+            f.write("enp3s0f1 bad\n")
+            f.flush()
+            with self.assertRaisesRegex(config.ConfigError,
+                                        "{}:1:".format(f.name)):
+                config.read_vf_config(f.name)
+        with self.assertRaises(config.ConfigError):
+            config.read_vf_config("/nonexistent")
+
+    def test_resolve_pfs(self):
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=1)
+            snapshot = topology.scan(root)
+        self.assertEqual(
+            [(str(pf), count) for pf, count in config.resolve_pfs(
+                {"enp3s0f1": 4, "0000:03:00.0": 2}, snapshot)],
+            [("0000:03:00.0", 2), ("0000:03:00.1", 4)])
+        for vfs in ({"enp9s0f0": 1}, {"enp3s0f0v0": 1},
+                    {"enp3s0f0": 1, "0000:03:00.0": 2}):
+            with self.assertRaises(config.ConfigError):
+                config.resolve_pfs(vfs, snapshot)
+
+
+class TestBindPolicy(unittest.TestCase):
+
+    def test_parse_vf_selection(self):
+        self.assertEqual(config.parse_vf_selection(["all"]), config.ALL_VFS)
+        self.assertEqual(config.parse_vf_selection(["none"]), config.NO_VFS)
+        self.assertEqual(config.parse_vf_selection(["first", "2"]),
+                         config.VFSelection(2, None))
+        selection = config.parse_vf_selection(["index", "0,4-6"])
+        self.assertEqual(selection.indexes, frozenset([0, 4, 5, 6]))
+        self.assertEqual(
+            [index for index in range(8) if selection.selects(index)],
+            [0, 4, 5, 6])
+        self.assertEqual(str(selection), "index 0,4,5,6")
+        for fields in ([], ["first"], ["first", "-1"], ["index", "3-1"],
+                       ["index", "a"], ["some"], ["all", "2"]):
+            with self.assertRaises(ValueError):
+                config.parse_vf_selection(fields)
+
+    def test_parse_bind_policy(self):
+        policy = config.parse_bind_policy([
+            "# PF VFs\n",
+            "*  first 2\n",
+            "0000:03:00.0 index 1,3  # host networking\n",
+            "enp4s0f0 none\n",
+        ])
+        self.assertEqual(policy.to_dict(), {
+            "*": "first 2", "0000:03:00.0": "index 1,3", "enp4s0f0": "none"})
+        for lines in (["enp3s0f1\n"], ["enp3s0f1 first\n"],
+                      ["* all\n", "* none\n"]):
+            with self.assertRaises(config.ConfigError):
+                config.parse_bind_policy(lines)
+
+    def test_select(self):
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=4, vfs=4)
+            snapshot = topology.scan(root)
+        policy = config.BindPolicy({
+            "*": config.VFSelection(2, None),
+            "0000:03:00.0": config.VFSelection(None, frozenset([1, 3])),
+            "enp4s0f0": config.NO_VFS,
+            "enp9s0f0": config.ALL_VFS,
+        })
+        self.assertEqual(
+            {pf.pci_addr: [vf.pci_addr for vf in policy.select(
+                pf, snapshot.vfs(pf))] for pf in snapshot.pfs()},
+            {"0000:03:00.0": ["0000:03:00.3", "0000:03:00.5"],
+             "0000:03:00.1": ["0000:03:00.6", "0000:03:00.7"],
+             "0000:04:00.0": [],
+             "0000:04:00.1": ["0000:04:00.6", "0000:04:00.7"]})
+        self.assertEqual(policy.unknown(snapshot), ["enp9s0f0"])
+        self.assertEqual(
+            [vf.pci_addr for vf in config.BindPolicy().select(
+                snapshot["0000:03:00.0"],
+                snapshot.vfs(snapshot["0000:03:00.0"]))],
+            ["0000:03:00.2", "0000:03:00.3", "0000:03:00.4", "0000:03:00.5"])
+
+    def test_read_bind_policy(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "bind-vfs.conf")
+            with mock.patch.object(config, "BIND_POLICY_PATH", path):
+                # NOTE: all VFs are bound without a policy
+                self.assertEqual(config.read_bind_policy().selections, {})
+                with self.assertRaises(config.ConfigError):
+                    config.read_bind_policy(path)
+                with open(path, "wt") as f:
+                    f.write("* first 1\n")
+                self.assertEqual(config.read_bind_policy().to_dict(),
+                                 {"*": "first 1"})
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import unittest
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import deadline
+from mlnx_switchdev_mode import report
+
+
+class TestDeadline(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(deadline, "_active", deadline.Deadline())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bound(self):
+        unbounded = deadline.Deadline()
+        self.assertIsNone(unbounded.remaining())
+        self.assertFalse(unbounded.expired)
+        self.assertIsNone(unbounded.bound())
+        self.assertEqual(unbounded.bound(3), 3)
+        bounded = deadline.Deadline(60)
+        self.assertLessEqual(bounded.bound(), 60)
+        self.assertGreater(bounded.bound(), 59)
+        self.assertEqual(bounded.bound(3), 3)
+        self.assertTrue(deadline.Deadline(0).expired)
+
+    def test_call(self):
+        # NOTE: called directly without timeout and deadline
+        self.assertEqual(deadline.call("op", threading.get_ident),
+                         threading.get_ident())
+        self.assertNotEqual(
+            deadline.call("op", threading.get_ident, timeout=5),
+            threading.get_ident())
+        with self.assertRaises(ValueError):
+            deadline.call("op", int, "x", timeout=5)
+        with self.assertRaises(TimeoutError) as cm:
+            deadline.call("op", mock.Mock(side_effect=TimeoutError("own")),
+                          timeout=5)
+        self.assertEqual(str(cm.exception), "own")
+
+    def test_call_abandoned(self):
+        hang = threading.Event()
+        self.addCleanup(hang.set)
+        run_report = report.RunReport()
+        with mock.patch.object(report, "_active", run_report):
+            with self.assertRaises(deadline.DeadlineExceeded) as cm:
+                deadline.call("0000:03:00.0: devlink eswitch set", hang.wait,
+                              timeout=0.01)
+        self.assertEqual(str(cm.exception),
+                         "0000:03:00.0: devlink eswitch set: did not complete "
+                         "within 0.0s, abandoned")
+        self.assertEqual(run_report.to_dict()["counters"], {"abandoned": 1})
+
+    def test_call_deadline(self):
+        deadline.activate(deadline.Deadline(0))
+        func = mock.Mock()
+        with self.assertRaises(deadline.DeadlineExceeded) as cm:
+            deadline.call("op", func, timeout=5)
+        self.assertEqual(str(cm.exception), "op: deadline of 0s exceeded")
+        self.assertFalse(func.called)
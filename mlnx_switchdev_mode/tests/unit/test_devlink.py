@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import io
+import json
+import subprocess
+import threading
+import unittest
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import deadline
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import report
+from mlnx_switchdev_mode import retry
+from mlnx_switchdev_mode.tests import fakedevlink
+
+
+class TestNetlinkHelpers(unittest.TestCase):
+
+    def test_pack_parse_attrs(self):
+        data = (devlink.pack_string(devlink.DEVLINK_ATTR_BUS_NAME, "pci") +
+                devlink.pack_attr(devlink.DEVLINK_ATTR_ESWITCH_MODE,
+                                  b"\x01\x00"))
+        self.assertEqual(len(data) % 4, 0)
+        attrs = devlink.parse_attrs(data)
+        self.assertEqual(
+            devlink.parse_string(attrs[devlink.DEVLINK_ATTR_BUS_NAME]),
+            "pci")
+        self.assertEqual(attrs[devlink.DEVLINK_ATTR_ESWITCH_MODE],
+                         b"\x01\x00")
+
+    def test_pack_parse_messages(self):
+        data = (devlink.pack_message(0x15, devlink.NLM_F_REQUEST, 1, 29, 1) +
+                devlink.pack_message(0x15, 0, 2, 30, 1, b"\0" * 8))
+        self.assertEqual(
+            devlink.parse_messages(data),
+            [
+                (0x15, devlink.NLM_F_REQUEST, 1, b"\x1d\x01\x00\x00"),
+                (0x15, 0, 2, b"\x1e\x01\x00\x00" + b"\0" * 8),
+            ])
+
+
+class TestNetlinkDevlink(unittest.TestCase):
+
+    def setUp(self):
+        self.kernel = fakedevlink.FakeDevlinkKernel({
+            "pci/0000:03:00.0": {"mode": "legacy", "inline-mode": "none",
+                                 "encap": "enable"},
+            "pci/0000:03:00.1": {"mode": "switchdev"},
+        })
+        self.backend = devlink.NetlinkDevlink(
+            socket_factory=self.kernel.connect)
+        self.addCleanup(self.backend.close)
+
+    def test_family_id(self):
+        self.assertEqual(self.backend.family_id,
+                         fakedevlink.DEVLINK_FAMILY_ID)
+
+    def test_eswitch_get(self):
+        self.assertEqual(
+            self.backend.get("eswitch", "pci/0000:03:00.0"),
+            {"mode": "legacy", "inline-mode": "none", "encap": "enable"})
+        self.assertEqual(
+            self.backend.get("eswitch", "pci/0000:03:00.1"),
+            {"mode": "switchdev"})
+
+    def test_eswitch_get_error(self):
+        with self.assertRaises(devlink.DevlinkError) as cm:
+            self.backend.get("eswitch", "pci/0000:04:00.0")
+        self.assertEqual(cm.exception.errno, errno.ENODEV)
+        self.kernel.errors[(devlink.DEVLINK_CMD_ESWITCH_SET,
+                            "pci/0000:03:00.0")] = errno.EBUSY
+        with self.assertRaises(devlink.DevlinkError) as cm:
+            self.backend.set("eswitch", "pci/0000:03:00.0", "mode",
+                             "switchdev")
+        self.assertEqual(cm.exception.errno, errno.EBUSY)
+
+    def test_eswitch_set(self):
+        self.backend.set("eswitch", "pci/0000:03:00.0", "mode", "switchdev")
+        self.assertEqual(self.kernel.devices["pci/0000:03:00.0"]["mode"],
+                         "switchdev")
+        self.backend.eswitch_set("pci/0000:03:00.1",
+                                 {"inline-mode": "transport",
+                                  "encap": "disable"})
+        self.assertEqual(self.kernel.devices["pci/0000:03:00.1"],
+                         {"mode": "switchdev", "inline-mode": "transport",
+                          "encap": "disable"})
+        with self.assertRaises(ValueError):
+            self.backend.set("eswitch", "pci/0000:03:00.0", "mode", "foo")
+        with self.assertRaises(ValueError):
+            self.backend.set("eswitch", "pci/0000:03:00.0", "foo", "bar")
+
+    def test_socket_reuse(self):
+        factory = mock.MagicMock(side_effect=self.kernel.connect)
+        backend = devlink.NetlinkDevlink(socket_factory=factory)
+        self.addCleanup(backend.close)
+        for _ in range(3):
+            backend.get("eswitch", "pci/0000:03:00.0")
+        self.assertEqual(factory.call_count, 1)
+        # NOTE: threads share idle sockets, e.g. those of timed calls
+        for _ in range(50):
+            deadline.call("eswitch-get", backend.get, "eswitch",
+                          "pci/0000:03:00.1", timeout=5)
+        thread = threading.Thread(
+            target=backend.get, args=("eswitch", "pci/0000:03:00.1"))
+        thread.start()
+        thread.join()
+        self.assertEqual(factory.call_count, 1)
+        # NOTE: concurrent requests get a socket of their own
+        with backend._socket():
+            backend.get("eswitch", "pci/0000:03:00.0")
+        self.assertEqual(factory.call_count, 2)
+
+    def test_dev_list(self):
+        self.assertEqual(self.backend.dev_list(),
+                         ["pci/0000:03:00.0", "pci/0000:03:00.1"])
+
+    def test_eswitch_show_all(self):
+        self.kernel.devices["pci/0000:05:00.0"] = {}
+        self.kernel.errors[(devlink.DEVLINK_CMD_ESWITCH_GET,
+                            "pci/0000:05:00.0")] = errno.EOPNOTSUPP
+        self.assertEqual(
+            self.backend.eswitch_show_all(),
+            {
+                "pci/0000:03:00.0": {"mode": "legacy",
+                                     "inline-mode": "none",
+                                     "encap": "enable"},
+                "pci/0000:03:00.1": {"mode": "switchdev"},
+            })
+        with mock.patch.object(devlink, "BULK_BATCH_SIZE", 1):
+            self.assertEqual(
+                list(self.backend.eswitch_show_all(["pci/0000:03:00.1"])),
+                ["pci/0000:03:00.1"])
+
+    @mock.patch.object(devlink.SubprocessDevlink, "get")
+    def test_fallback(self, _get):
+        self.backend.get("port", "pci/0000:03:00.0")
+        _get.assert_called_once_with("port", "pci/0000:03:00.0")
+
+
+class TestSubprocessDevlink(unittest.TestCase):
+
+    def test_parse_json_stream(self):
+        self.assertEqual(
+            devlink.parse_json_stream(
+                '{"dev":{"pci/0000:03:00.0":{"mode":"legacy"}}}\n'
+                '{"dev":{"pci/0000:03:00.1":{"mode":"switchdev"}}}\n'),
+            [{"dev": {"pci/0000:03:00.0": {"mode": "legacy"}}},
+             {"dev": {"pci/0000:03:00.1": {"mode": "switchdev"}}}])
+        self.assertEqual(
+            devlink.parse_json_stream(
+                '{"dev":{"pci/0000:03:00.0":{"mode":"legacy"}},'
+                '"dev":{"pci/0000:03:00.1":{"mode":"switchdev"}}}'),
+            [{"dev": {"pci/0000:03:00.0": {"mode": "legacy"},
+                      "pci/0000:03:00.1": {"mode": "switchdev"}}}])
+
+    @mock.patch("subprocess.run")
+    @mock.patch("subprocess.check_output")
+    def test_eswitch_show_all(self, _check_output, _run):
+        _check_output.return_value = json.dumps(
+            {"dev": {"pci/0000:03:00.0": {}, "pci/0000:03:00.1": {}}})
+        _run.return_value.stdout = (
+            b'{"dev":{"pci/0000:03:00.0":{"mode":"legacy"}}}'
+            b'{"dev":{"pci/0000:03:00.1":{"mode":"switchdev"}}}')
+        backend = devlink.SubprocessDevlink()
+        self.assertEqual(
+            backend.eswitch_show_all(),
+            {"pci/0000:03:00.0": {"mode": "legacy"},
+             "pci/0000:03:00.1": {"mode": "switchdev"}})
+        _run.return_value.stdout = (
+            b'{"dev":{"pci/0000:03:00.0":{"mode":"switchdev",'
+            b'"inline-mode":"none","encap-mode":"basic"}}}')
+        self.assertEqual(
+            backend.eswitch_show_all(["pci/0000:03:00.0"]),
+            {"pci/0000:03:00.0": {"mode": "switchdev", "inline-mode": "none",
+                                  "encap": "enable"}})
+        _run.assert_called_with(
+            ["/sbin/devlink", "--json", "--force", "--batch", "-"],
+            input=b"dev eswitch show pci/0000:03:00.0\n",
+            stdout=subprocess.PIPE)
+        _run.reset_mock()
+        backend.eswitch_show_all()
+        _run.assert_called_once_with(
+            ["/sbin/devlink", "--json", "--force", "--batch", "-"],
+            input=(b"dev eswitch show pci/0000:03:00.0\n"
+                   b"dev eswitch show pci/0000:03:00.1\n"),
+            stdout=subprocess.PIPE)
+        _run.reset_mock()
+        self.assertEqual(backend.eswitch_show_all([]), {})
+        self.assertFalse(_run.called)
+
+    @mock.patch("subprocess.run")
+    def test_eswitch_set(self, _run):
+        _run.return_value = subprocess.CompletedProcess([], 0, stdout="",
+                                                        stderr="")
+        devlink.SubprocessDevlink().eswitch_set(
+            "pci/0000:03:00.0", {"mode": "switchdev", "encap": "enable"})
+        _run.assert_called_once_with(
+            ["/sbin/devlink", "dev", "eswitch", "set", "pci/0000:03:00.0",
+             "mode", "switchdev", "encap", "enable"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+
+    @mock.patch("sys.stderr", new_callable=io.StringIO)
+    @mock.patch("subprocess.run")
+    def test_run_command_error(self, _run, _stderr):
+        _run.return_value = subprocess.CompletedProcess(
+            [], 1, stdout="",
+            stderr="kernel answers: Resource temporarily unavailable\n")
+        with self.assertRaises(devlink.DevlinkError) as cm:
+            devlink.run_command(["/sbin/devlink", "dev", "eswitch", "set"])
+        self.assertEqual(cm.exception.errno, errno.EAGAIN)
+        self.assertEqual(_stderr.getvalue(),
+                         "kernel answers: Resource temporarily unavailable\n")
+
+    def test_parse_error(self):
+        self.assertEqual(
+            devlink.parse_error("Error: mlx5_core: Device or resource busy.\n"
+                                "kernel answers: Device or resource busy\n"),
+            errno.EBUSY)
+        self.assertIsNone(devlink.parse_error("Error: unknown option\n"))
+        self.assertIsNone(devlink.parse_error(""))
+
+
+class TestEswitchChanges(unittest.TestCase):
+
+    def test_normalize_eswitch(self):
+        self.assertEqual(
+            devlink.normalize_eswitch({"mode": "legacy",
+                                       "encap-mode": "none"}),
+            {"mode": "legacy", "encap": "disable"})
+        self.assertEqual(devlink.normalize_eswitch({"encap": "enable"}),
+                         {"encap": "enable"})
+
+    def test_eswitch_changes(self):
+        desired = {"mode": "switchdev", "inline-mode": "transport",
+                   "encap": "enable"}
+        # NOTE: everything is set along with a change of mode
+        self.assertEqual(
+            devlink.eswitch_changes({"mode": "legacy",
+                                     "inline-mode": "transport"}, desired),
+            desired)
+        self.assertEqual(
+            devlink.eswitch_changes({"mode": "switchdev",
+                                     "inline-mode": "transport",
+                                     "encap": "disable"}, desired),
+            {"encap": "enable"})
+        self.assertEqual(devlink.eswitch_changes(desired, desired), {})
+        self.assertEqual(
+            devlink.eswitch_changes({}, devlink.DEFAULT_ESWITCH_CONFIG),
+            {"mode": "switchdev"})
+
+
+class TestEswitchCache(unittest.TestCase):
+
+    def test_cache(self):
+        backend = mock.MagicMock()
+        backend.eswitch_show_all.return_value = {
+            "pci/0000:03:00.0": {"mode": "legacy"}}
+        backend.get.return_value = {"mode": "switchdev"}
+        cache = devlink.EswitchCache(backend)
+        cache.load(["pci/0000:03:00.0"])
+        self.assertEqual(cache.get("pci/0000:03:00.0"), {"mode": "legacy"})
+        self.assertFalse(backend.get.called)
+        self.assertIsNone(cache.peek("pci/0000:03:00.1"))
+        self.assertEqual(cache.get("pci/0000:03:00.1"),
+                         {"mode": "switchdev"})
+        backend.get.assert_called_once_with("eswitch", "pci/0000:03:00.1")
+        cache.update("pci/0000:03:00.0", {"mode": "switchdev"})
+        self.assertEqual(cache.peek("pci/0000:03:00.0"),
+                         {"mode": "switchdev"})
+        cache.invalidate("pci/0000:03:00.0")
+        self.assertIsNone(cache.peek("pci/0000:03:00.0"))
+        cache.invalidate()
+        self.assertIsNone(cache.peek("pci/0000:03:00.1"))
+
+    def test_get_hang(self):
+        hang = threading.Event()
+        self.addCleanup(hang.set)
+        backend = mock.MagicMock()
+        backend.eswitch_show_all.return_value = {}
+        backend.get.side_effect = lambda obj_name, handle: hang.wait()
+        cache = devlink.EswitchCache(backend)
+        cache.load(["pci/0000:03:00.0"])
+        # NOTE: devices left out by the bulk query are bounded like any
+        # other devlink call
+        with mock.patch.object(deadline, "DEVLINK_TIMEOUT", 0.01):
+            with self.assertRaises(deadline.DeadlineExceeded) as cm:
+                cache.get("pci/0000:03:00.0")
+        self.assertEqual(str(cm.exception),
+                         "0000:03:00.0: devlink eswitch show: did not "
+                         "complete within 0.0s, abandoned")
+        self.assertIsNone(cache.peek("pci/0000:03:00.0"))
+
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    @mock.patch.object(retry.time, "sleep")
+    def test_get_retry(self, _sleep, _stdout):
+        backend = mock.MagicMock()
+        backend.get.side_effect = [
+            OSError(errno.EBUSY, "Device or resource busy"),
+            {"mode": "switchdev"}]
+        cache = devlink.EswitchCache(backend)
+        run_report = report.RunReport()
+        with mock.patch.object(report, "_active", run_report):
+            self.assertEqual(cache.get("pci/0000:03:00.0"),
+                             {"mode": "switchdev"})
+        self.assertEqual(backend.get.call_count, 2)
+        self.assertEqual(run_report.to_dict()["counters"], {"retries": 1})
+        self.assertEqual(
+            [(rec.phase, rec.pf) for rec in run_report.records],
+            [("retry", "0000:03:00.0"), ("devlink-get", "0000:03:00.0")])
+
+
+class TestGetBackend(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(devlink, "_backends", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_backend(self):
+        self.assertIsInstance(devlink.get_backend("subprocess"),
+                              devlink.SubprocessDevlink)
+        self.assertIs(devlink.get_backend("subprocess"),
+                      devlink.get_backend("subprocess"))
+        with self.assertRaises(ValueError):
+            devlink.get_backend("foo")
+
+    @mock.patch.object(devlink, "NetlinkSocket")
+    def test_get_backend_auto(self, _socket):
+        kernel = fakedevlink.FakeDevlinkKernel()
+        _socket.side_effect = kernel.connect
+        self.assertIsInstance(devlink.get_backend("auto"),
+                              devlink.NetlinkDevlink)
+
+    @mock.patch.object(devlink, "NetlinkSocket")
+    def test_get_backend_auto_fallback(self, _socket):
+        _socket.side_effect = OSError(errno.EAFNOSUPPORT, "not supported")
+        self.assertIsInstance(devlink.get_backend("auto"),
+                              devlink.SubprocessDevlink)
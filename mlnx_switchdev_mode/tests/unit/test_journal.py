@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from mlnx_switchdev_mode import journal
+from mlnx_switchdev_mode import state
+from mlnx_switchdev_mode import topology
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.journal = journal.Journal(os.path.join(self._tmpdir.name,
+                                                    "journal"))
+
+    def _begin(self, pf_addr="0000:03:00.0"):
+        return self.journal.begin(
+            pf_addr, "switch", vfs=["0000:03:00.2", "0000:03:00.3"],
+            eswitch={"mode": "switchdev"}, rebind=["0000:03:00.2"],
+            autoprobe="1")
+
+    def test_default_directory(self):
+        with mock.patch.object(state, "STATE_DIR", "/run/test"):
+            self.assertEqual(journal.Journal().directory, "/run/test/journal")
+
+    def test_begin(self):
+        entry = self._begin()
+        self.assertEqual(entry.path, self.journal.path("0000:03:00.0"))
+        entries = self.journal.entries()
+        self.assertEqual([e.pf for e in entries], ["0000:03:00.0"])
+        self.assertEqual(entries[0].command, "switch")
+        self.assertEqual(entries[0].vfs, ["0000:03:00.2", "0000:03:00.3"])
+        self.assertEqual(entries[0].eswitch, {"mode": "switchdev"})
+        self.assertEqual(entries[0].rebind, ["0000:03:00.2"])
+        self.assertEqual(entries[0].autoprobe, "1")
+        self.assertEqual(entries[0].completed, [])
+
+    def test_done(self):
+        entry = self._begin()
+        entry.done(journal.UNBIND)
+        entry.done(journal.ESWITCH)
+        entry.done(journal.UNBIND)
+        recorded, = self.journal.entries()
+        self.assertEqual(recorded.completed,
+                         [journal.UNBIND, journal.ESWITCH])
+        self.assertTrue(recorded.is_done(journal.ESWITCH))
+        self.assertFalse(recorded.is_done(journal.AUTOPROBE))
+        self.assertEqual(os.listdir(self.journal.directory),
+                         ["0000:03:00.0.json"])
+
+    def test_discard(self):
+        entry = self._begin()
+        entry.discard()
+        entry.discard()
+        self.assertEqual(self.journal.entries(), [])
+
+    def test_no_journal(self):
+        self.assertEqual(self.journal.entries(), [])
+
+    def test_other_boot(self):
+        self._begin()
+        with mock.patch.object(state, "boot_id", return_value="other"):
+            self.assertEqual(self.journal.entries(), [])
+        self.assertEqual(os.listdir(self.journal.directory), [])
+
+    def test_other_sysfs_root(self):
+        self._begin()
+        with mock.patch.object(topology, "SYSFS_ROOT", "/tmp/sys"):
+            self.assertEqual(self.journal.entries(), [])
+            self._begin("0000:03:00.1")
+            self.assertEqual([e.pf for e in self.journal.entries()],
+                             ["0000:03:00.1"])
+        self.assertEqual([e.pf for e in self.journal.entries()],
+                         ["0000:03:00.0"])
+        self.assertEqual(sorted(os.listdir(self.journal.directory)),
+                         ["0000:03:00.0.json", "0000:03:00.1.json"])
+
+    def test_unreadable(self):
+        self._begin("0000:03:00.0")
+        with open(self.journal.path("0000:03:00.1"), "wt") as f:
+            f.write("{")
+        self.assertEqual([e.pf for e in self.journal.entries()],
+                         ["0000:03:00.0"])
+        self.assertEqual(os.listdir(self.journal.directory),
+                         ["0000:03:00.0.json"])
+
+    def test_run_in_progress(self):
+        entry = self._begin()
+        with open(entry.path, "rt") as f:
+            record = json.load(f)
+        # NOTE: the parent of the test runner outlives it
+        record["pid"] = os.getppid()
+        state.write_json(entry.path, record)
+        self.assertEqual(self.journal.entries(), [])
+        with mock.patch.object(journal, "_process_exists",
+                               return_value=False):
+            self.assertEqual(len(self.journal.entries()), 1)
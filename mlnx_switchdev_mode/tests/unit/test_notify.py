@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from mlnx_switchdev_mode import notify
+
+
+class TestNotify(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.path = os.path.join(self._tmpdir.name, "notify")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(self.sock.close)
+        self.sock.bind(self.path)
+
+    def _environ(self, address):
+        return mock.patch.dict(os.environ, {"NOTIFY_SOCKET": address})
+
+    def test_ready(self):
+        with self._environ(self.path):
+            self.assertTrue(notify.ready())
+            self.assertTrue(notify.ready("Done"))
+        self.assertEqual(self.sock.recv(4096), b"READY=1")
+        self.assertEqual(self.sock.recv(4096), b"READY=1\nSTATUS=Done")
+
+    def test_status(self):
+        with self._environ(self.path):
+            self.assertTrue(notify.status("Switched 1/2 PFs"))
+        self.assertEqual(self.sock.recv(4096), b"STATUS=Switched 1/2 PFs")
+
+    def test_abstract_socket(self):
+        name = "mlnx-switchdev-mode-test-{}".format(os.getpid())
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.bind("\0" + name)
+            with self._environ("@" + name):
+                self.assertTrue(notify.ready())
+            self.assertEqual(sock.recv(4096), b"READY=1")
+
+    def test_not_notify_service(self):
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertFalse(notify.ready())
+
+    def test_unreachable(self):
+        with self._environ(os.path.join(self._tmpdir.name, "missing")):
+            self.assertFalse(notify.status("Done"))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import numa
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+class TestNuma(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.root = tmpdir.name
+        self.pf_addrs = fakesysfs.generate(self.root, pfs=4, vfs=1,
+                                           numa_nodes=2)
+        fakesysfs.create_numa_node(self.root, 0, "0-3,8-11")
+        fakesysfs.create_numa_node(self.root, 1, "4-7,12-15")
+
+    def test_parse_cpulist(self):
+        self.assertEqual(numa.parse_cpulist("0-2,8,10-11\n"),
+                         frozenset([0, 1, 2, 8, 10, 11]))
+        self.assertEqual(numa.parse_cpulist("\n"), frozenset())
+        with self.assertRaises(ValueError):
+            numa.parse_cpulist("0-a")
+
+    def test_read_numa_node(self):
+        self.assertEqual(
+            [numa.read_numa_node(pf_addr, self.root)
+             for pf_addr in self.pf_addrs],
+            [0, 0, 1, 1])
+        self.assertEqual(numa.read_numa_node("0000:05:00.0", self.root),
+                         numa.NO_NODE)
+        self.assertEqual(numa.read_node_cpus(1, self.root),
+                         frozenset([4, 5, 6, 7, 12, 13, 14, 15]))
+        self.assertEqual(numa.read_node_cpus(2, self.root), frozenset())
+
+    @mock.patch.object(numa.os, "sched_getaffinity",
+                       return_value=set(range(12)))
+    @mock.patch.object(numa.os, "sched_setaffinity")
+    def test_node_executors(self, _setaffinity, _getaffinity):
+        with numa.NodeExecutors(2, root=self.root) as executors:
+            node1 = executors.executor_for(self.pf_addrs[2])
+            self.assertIs(executors.executor_for(self.pf_addrs[3]), node1)
+            self.assertEqual(node1.submit(numa.current_node).result(), 1)
+            # NOTE: only CPUs the process may run on are used
+            _setaffinity.assert_called_once_with(
+                0, frozenset([4, 5, 6, 7]))
+            self.assertIsNot(executors.executor_for(self.pf_addrs[0]),
+                             node1)
+            # NOTE: devices on unknown nodes share an unpinned pool
+            shared = executors.executor(numa.NO_NODE)
+            self.assertIs(executors.executor(2), shared)
+            self.assertIsNone(shared.submit(numa.current_node).result())
+        self.assertIsNone(numa.current_node())
+
+        _setaffinity.reset_mock()
+        with numa.NodeExecutors(2, pin=False, root=self.root) as executors:
+            shared = executors.executor_for(self.pf_addrs[2])
+            self.assertIs(executors.executor_for(self.pf_addrs[0]), shared)
+            self.assertIsNone(shared.submit(numa.current_node).result())
+        self.assertFalse(_setaffinity.called)
+
+        # NOTE: a worker which can not be pinned still does the work
+        _setaffinity.side_effect = OSError("EINVAL")
+        with mock.patch("sys.stdout"), \
+                numa.NodeExecutors(1, root=self.root) as executors:
+            self.assertIsNone(
+                executors.executor(0).submit(numa.current_node).result())
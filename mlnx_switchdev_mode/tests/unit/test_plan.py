@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import plan
+from mlnx_switchdev_mode import report
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+class TestPlan(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.root = os.path.join(self._tmpdir.name, "sys")
+        fakesysfs.generate(self.root, pfs=3, vfs=2)
+        # NOTE: one VF of the first PF is unbound
+        fakesysfs.create_function(self.root, "0000:03:00.3",
+                                  physfn="0000:03:00.0")
+        self.snapshot = topology.scan(self.root)
+        self.backend = mock.MagicMock()
+        self.backend.eswitch_show_all.return_value = {
+            "pci/0000:03:00.0": {"mode": "legacy"},
+            "pci/0000:03:00.1": {"mode": "switchdev"},
+            "pci/0000:04:00.0": {"mode": "legacy"},
+        }
+        self.eswitches = devlink.EswitchCache(self.backend)
+        self.eswitches.load()
+
+    def test_build_plan(self):
+        operations = plan.build_plan(self.snapshot, self.eswitches,
+                                     rebind=True)
+        self.assertEqual([str(op) for op in operations], [
+            "unbind-vf 0000:03:00.2",
+            "set-eswitch-mode 0000:03:00.0 mode switchdev",
+            "bind-vf 0000:03:00.2",
+            "unbind-vf 0000:04:00.2",
+            "unbind-vf 0000:04:00.3",
+            "set-eswitch-mode 0000:04:00.0 mode switchdev",
+            "bind-vf 0000:04:00.2",
+            "bind-vf 0000:04:00.3",
+        ])
+        self.assertEqual(operations[0].pf, "0000:03:00.0")
+        self.assertEqual(operations[0].cost, plan.DEFAULT_COSTS["unbind-vf"])
+        self.assertEqual(
+            len(plan.build_plan(self.snapshot, self.eswitches)), 5)
+
+    def test_prune(self):
+        operations = plan.build_plan(self.snapshot, self.eswitches,
+                                     rebind=True)
+        self.assertEqual(
+            plan.prune(operations + operations[:2], self.snapshot,
+                       self.eswitches),
+            operations)
+        # NOTE: first PF was switched and its VF rebound, a VF of the
+        # second one went away and the other was unbound in the meantime
+        self.eswitches.update("pci/0000:03:00.0", {"mode": "switchdev"})
+        shutil.rmtree(
+            os.path.join(self.root, "bus/pci/devices/0000:04:00.2"))
+        fakesysfs.create_function(self.root, "0000:04:00.3",
+                                  physfn="0000:04:00.0")
+        self.assertEqual(
+            [str(op) for op in plan.prune(
+                operations, self.snapshot.refresh(), self.eswitches)],
+            [
+                "set-eswitch-mode 0000:04:00.0 mode switchdev",
+                "bind-vf 0000:04:00.3",
+            ])
+
+    def test_prune_eswitch_properties(self):
+        operations = plan.build_plan(
+            self.snapshot, self.eswitches, rebind=True,
+            eswitch_config={"mode": "switchdev", "inline-mode": "transport"})
+        # NOTE: first PF is in switchdev mode already, only its inline-mode
+        # differs, which does not need its VFs unbound
+        self.eswitches.update("pci/0000:03:00.0", {"mode": "switchdev"})
+        self.assertEqual(
+            [str(op) for op in plan.prune(
+                operations, self.snapshot, self.eswitches)],
+            [
+                "set-eswitch-mode 0000:03:00.0 inline-mode transport",
+                "set-eswitch-mode 0000:03:00.1 inline-mode transport",
+                "unbind-vf 0000:04:00.2",
+                "unbind-vf 0000:04:00.3",
+                "set-eswitch-mode 0000:04:00.0 mode switchdev "
+                "inline-mode transport",
+                "bind-vf 0000:04:00.2",
+                "bind-vf 0000:04:00.3",
+            ])
+
+    def test_schedule_estimate(self):
+        operations = plan.build_plan(self.snapshot, self.eswitches,
+                                     rebind=True)
+        stages = plan.schedule(operations)
+        self.assertEqual(list(stages), ["0000:03:00.0", "0000:04:00.0"])
+        self.assertEqual(
+            [[op.action for op in stage] for stage in stages["0000:04:00.0"]],
+            [["unbind-vf", "unbind-vf"], ["set-eswitch-mode"],
+             ["bind-vf", "bind-vf"]])
+        self.assertEqual(plan.estimate(operations), {
+            "serial": 10.0, "parallel": 10.0, "jobs": 1, "pfs": 2,
+            "operations": 8})
+        # NOTE: both PFs at once, VFs of the second one two at a time
+        self.assertEqual(plan.estimate(operations, jobs=2)["parallel"], 4.0)
+
+    def test_load_costs(self):
+        run_report = report.RunReport("switch")
+        run_report.record("unbind", 0.2)
+        run_report.record("unbind", 0.4)
+        run_report.record("devlink-set", 1.0)
+        path = os.path.join(self._tmpdir.name, "report.json")
+        run_report.write(path)
+        costs = plan.load_costs([path])
+        self.assertAlmostEqual(costs["unbind-vf"], 0.3)
+        self.assertEqual(costs["set-eswitch-mode"], 1.0)
+        self.assertEqual(costs["bind-vf"], plan.DEFAULT_COSTS["bind-vf"])
+        with self.assertRaises(plan.PlanError):
+            plan.load_costs([os.path.join(self._tmpdir.name, "missing")])
+
+    def test_read_write_plan(self):
+        operations = plan.build_plan(self.snapshot, self.eswitches)
+        path = os.path.join(self._tmpdir.name, "plan.json")
+        plan.write_plan(path, operations, jobs=4)
+        self.assertEqual(plan.read_plan(path), operations)
+        with open(path, "rt") as f:
+            data = json.load(f)
+        self.assertEqual(data["estimate"]["jobs"], 4)
+        eswitch_op = next(op for op in data["operations"]
+                          if op["action"] == plan.SET_ESWITCH_MODE)
+        eswitch_op["value"] = "switchdev"
+        with open(path, "wt") as f:
+            json.dump(data, f)
+        with self.assertRaises(plan.PlanError):
+            plan.read_plan(path)
+        data["operations"][0]["action"] = "reboot"
+        with open(path, "wt") as f:
+            json.dump(data, f)
+        with self.assertRaises(plan.PlanError):
+            plan.read_plan(path)
+        data["version"] = 0
+        with open(path, "wt") as f:
+            json.dump(data, f)
+        with self.assertRaises(plan.PlanError):
+            plan.read_plan(path)
+        plan.write_plan(path, operations)
+        with mock.patch.object(plan.topology, "SYSFS_ROOT", "/tmp/sys"):
+            with self.assertRaises(plan.PlanError):
+                plan.read_plan(path)
+
+    def test_format_duration(self):
+        self.assertEqual(plan.format_duration(1.25), "1.2s")
+        self.assertEqual(plan.format_duration(119.6), "2m00s")
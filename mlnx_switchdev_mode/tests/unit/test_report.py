@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import report
+
+
+class TestRunReport(unittest.TestCase):
+
+    def test_timer(self):
+        run_report = report.RunReport("switch")
+        with run_report.timer("scan"):
+            pass
+        with self.assertRaises(ValueError):
+            with run_report.timer("devlink-set", pf="0000:03:00.0"):
+                raise ValueError("EBUSY")
+        records = run_report.records
+        self.assertEqual([rec.phase for rec in records],
+                         ["scan", "devlink-set"])
+        self.assertIsNone(records[0].error)
+        self.assertEqual(records[1].pf, "0000:03:00.0")
+        self.assertEqual(records[1].error, "EBUSY")
+
+    def test_to_dict(self):
+        run_report = report.RunReport("bind")
+        run_report.record("bind", 0.5, pf="0000:03:00.0", vf="0000:03:00.2")
+        run_report.record("bind", 0.1, pf="0000:03:00.0", vf="0000:03:00.3",
+                          error=OSError("EIO"))
+        run_report.record("bind", 0.3, pf="0000:03:00.1", vf="0000:03:00.4",
+                          node=1)
+        run_report.count("vfs-bound", 2)
+        summary = run_report.to_dict(slowest=2)
+        self.assertEqual(summary["command"], "bind")
+        self.assertEqual(summary["counters"], {"vfs-bound": 2})
+        self.assertEqual(summary["phases"]["bind"]["count"], 3)
+        self.assertEqual(summary["phases"]["bind"]["failed"], 1)
+        self.assertAlmostEqual(summary["phases"]["bind"]["total"], 0.9)
+        self.assertAlmostEqual(summary["phases"]["bind"]["max"], 0.5)
+        self.assertAlmostEqual(summary["phases"]["bind"]["mean"], 0.3)
+        self.assertAlmostEqual(summary["pfs"]["0000:03:00.0"]["bind"], 0.6)
+        self.assertEqual(summary["nodes"],
+                         {"1": {"bind": {"count": 1, "total": 0.3,
+                                         "max": 0.3}}})
+        self.assertEqual([rec["vf"] for rec in summary["slowest"]],
+                         ["0000:03:00.2", "0000:03:00.4"])
+
+    def test_write(self):
+        run_report = report.RunReport("switch")
+        run_report.record("scan", 0.01)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "report.json")
+            run_report.write(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f)["phases"]["scan"]["count"], 1)
+
+    def test_active_report(self):
+        run_report = report.RunReport()
+        with mock.patch.object(report, "_active", report.current()):
+            self.assertIs(report.activate(run_report), run_report)
+            self.assertIs(report.current(), run_report)
+            with report.timer("scan"):
+                pass
+            report.record("bind", 0.1, vf="0000:03:00.2")
+            report.count("pfs")
+        self.assertEqual([rec.phase for rec in run_report.records],
+                         ["scan", "bind"])
+        self.assertEqual(run_report.to_dict()["counters"], {"pfs": 1})
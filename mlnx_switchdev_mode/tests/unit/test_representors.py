@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import mlnx_switchdev_mode
+from mlnx_switchdev_mode import representors
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+class TestRepresentors(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.root = self._tmpdir.name
+        self.pf_addrs = fakesysfs.generate(self.root, pfs=2, vfs=2)
+        patcher = mock.patch.object(topology, "SYSFS_ROOT", self.root)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pfs = [topology.read_function(self.root, pf_addr)
+                    for pf_addr in self.pf_addrs]
+        self.sock, self.peer = socket.socketpair(socket.AF_UNIX,
+                                                 socket.SOCK_SEQPACKET)
+        self.addCleanup(self.sock.close)
+        self.addCleanup(self.peer.close)
+        # NOTE: keep the socket open after monitors close it, so late
+        # notifications can still be sent
+        self.addCleanup(self.sock.dup().close)
+
+    def _add_representors(self, pf_addr, count):
+        fakesysfs.create_function(
+            self.root, pf_addr, driver="mlx5_core",
+            netdevs=["{}_{}".format(pf_addr[-4:], index)
+                     for index in range(count)])
+        for index in range(count):
+            self.peer.send(representors.pack_newlink(
+                100 + index, "{}_{}".format(pf_addr[-4:], index)))
+
+    def test_link_monitor(self):
+        monitor = representors.LinkMonitor(sock=self.sock)
+        with monitor:
+            self.assertEqual(monitor.recv(timeout=0), [])
+            self.peer.send(representors.pack_newlink(7, "eth7", seq=1) +
+                           representors.pack_newlink(8, "eth8", seq=2))
+            self.assertEqual(monitor.recv(timeout=1), ["eth7", "eth8"])
+
+    def test_count_netdevs(self):
+        pf = self.pfs[0]
+        self.assertEqual(representors.expected_netdevs(pf), 3)
+        self.assertEqual(representors.count_netdevs(pf), 1)
+        self._add_representors(pf.pci_addr, 2)
+        self.assertEqual(representors.count_netdevs(pf), 3)
+        os.rename(os.path.join(self.root, "bus/pci/devices", pf.pci_addr),
+                  os.path.join(self.root, "gone"))
+        self.assertEqual(representors.count_netdevs(pf), 0)
+
+    def test_wait_for_representors(self):
+        def register():
+            for pf in self.pfs:
+                self._add_representors(pf.pci_addr, 2)
+
+        thread = threading.Thread(target=register)
+        thread.start()
+        self.addCleanup(thread.join)
+        representors.wait_for_representors(
+            self.pfs, timeout=5,
+            monitor=representors.LinkMonitor(sock=self.sock))
+        for pf in self.pfs:
+            self.assertEqual(representors.count_netdevs(pf), 3)
+
+    def test_wait_for_representors_overflow(self):
+        def overflow(size):
+            # NOTE: the representors appear, their notifications are lost
+            for pf in self.pfs:
+                fakesysfs.create_function(
+                    self.root, pf.pci_addr, driver="mlx5_core",
+                    netdevs=["{}_{}".format(pf.pci_addr[-4:], index)
+                             for index in range(2)])
+            raise OSError(errno.ENOBUFS, os.strerror(errno.ENOBUFS))
+
+        self.peer.send(b"\0")
+        sock = mock.Mock(wraps=self.sock)
+        sock.recv.side_effect = overflow
+        representors.wait_for_representors(
+            self.pfs, timeout=5, monitor=representors.LinkMonitor(sock=sock))
+        sock.recv.assert_called_once_with(65536)
+        for pf in self.pfs:
+            self.assertEqual(representors.count_netdevs(pf), 3)
+
+    def test_wait_for_representors_timeout(self):
+        self._add_representors(self.pfs[0].pci_addr, 2)
+        with self.assertRaises(representors.RepresentorTimeout) as cm:
+            representors.wait_for_representors(
+                self.pfs, timeout=0.05,
+                monitor=representors.LinkMonitor(sock=self.sock))
+        self.assertEqual(str(cm.exception),
+                         "Representors missing after 0.05s: "
+                         "0000:03:00.1 (1/3)")
+        representors.wait_for_representors([], timeout=0)
+
+    def test_read_index(self):
+        # NOTE: first PF in switchdev mode, second one in legacy mode
+        uplink, reps = fakesysfs.create_representors(
+            self.root, "0000:03:00.0", 2, "enp3s0f0")
+        with open(os.path.join(self.root, "class/net/enp3s0f1",
+                               "phys_port_name"), "wt") as f:
+            f.write("p1\n")
+        self.assertEqual(
+            (uplink, reps),
+            ("enp3s0f0np0", ["enp3s0f0npf0vf0", "enp3s0f0npf0vf1"]))
+        index = mlnx_switchdev_mode.read_representor_index(self.root)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.pfs(), ["0000:03:00.0", "0000:03:00.1"])
+        self.assertEqual(index.vfs("0000:03:00.0"), [
+            mlnx_switchdev_mode.VFPort(
+                "0000:03:00.0", "enp3s0f0np0", 0, "0000:03:00.2",
+                "enp3s0f0v0", "enp3s0f0npf0vf0"),
+            mlnx_switchdev_mode.VFPort(
+                "0000:03:00.0", "enp3s0f0np0", 1, "0000:03:00.3",
+                "enp3s0f0v1", "enp3s0f0npf0vf1"),
+        ])
+        self.assertEqual(index.representor("0000:03:00.0", 1),
+                         "enp3s0f0npf0vf1")
+        self.assertIsNone(index.representor("0000:03:00.1", 1))
+        for name in ("0000:03:00.3", "enp3s0f0v1", "enp3s0f0npf0vf1"):
+            self.assertEqual(index[name].vf_index, 1)
+        self.assertEqual(index["enp3s0f1v0"].pf_netdev, "enp3s0f1")
+        self.assertNotIn("enp3s0f0np0", index)
+        self.assertEqual(index.vfs("0000:04:00.0"), [])
+
+    def test_read_vf_port_index(self):
+        fakesysfs.create_representors(self.root, "0000:03:00.0", 1,
+                                      "enp3s0f0")
+        self.assertEqual(
+            representors.read_vf_port_index("enp3s0f0npf0vf0"), 0)
+        self.assertIsNone(representors.read_vf_port_index("enp3s0f0np0"))
+        self.assertIsNone(representors.read_vf_port_index("enp3s0f1"))
+        # NOTE: older kernels name representor ports by VF index only
+        with open(os.path.join(self.root, "class/net/enp3s0f0npf0vf0",
+                               "phys_port_name"), "wt") as f:
+            f.write("12\n")
+        self.assertEqual(
+            representors.read_vf_port_index("enp3s0f0npf0vf0"), 12)
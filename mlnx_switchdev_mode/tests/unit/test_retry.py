@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import errno
+import io
+import unittest
+import unittest.mock as mock
+
+from mlnx_switchdev_mode import deadline
+from mlnx_switchdev_mode import report
+from mlnx_switchdev_mode import retry
+
+
+def busy():
+    return OSError(errno.EBUSY, "Device or resource busy")
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.report = report.RunReport()
+        for patcher in (
+                mock.patch.object(deadline, "_active", deadline.Deadline()),
+                mock.patch.object(report, "_active", self.report),
+                mock.patch.object(retry.time, "sleep"),
+                mock.patch("sys.stdout", new_callable=io.StringIO)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_backoff(self):
+        self.assertEqual(retry.backoff(busy(), 1), 0.05)
+        self.assertEqual(retry.backoff(busy(), 3), 0.2)
+        self.assertEqual(retry.backoff(busy(), 10), retry.MAX_DELAY)
+        self.assertEqual(
+            retry.backoff(OSError(errno.EAGAIN, "Try again"), 1), 0.01)
+        self.assertIsNone(retry.backoff(OSError(errno.EIO, "EIO"), 1))
+        self.assertIsNone(retry.backoff(ValueError("x"), 1))
+        self.assertIsNone(retry.backoff(deadline.DeadlineExceeded("x"), 1))
+
+    def test_call(self):
+        func = mock.Mock(side_effect=[busy(), busy(), "done"])
+        self.assertEqual(
+            retry.call("op", func, 1, key="value", pf="0000:03:00.0",
+                       vf="0000:03:00.2"),
+            "done")
+        func.assert_called_with(1, key="value")
+        self.assertEqual(func.call_count, 3)
+        retry.time.sleep.assert_has_calls([mock.call(0.05), mock.call(0.1)])
+        self.assertEqual(
+            [(rec.phase, rec.duration, rec.pf, rec.vf)
+             for rec in self.report.records],
+            [("retry", 0.05, "0000:03:00.0", "0000:03:00.2"),
+             ("retry", 0.1, "0000:03:00.0", "0000:03:00.2")])
+        self.assertEqual(self.report.to_dict()["counters"], {"retries": 2})
+
+    def test_call_permanent(self):
+        func = mock.Mock(side_effect=OSError(errno.EIO, "EIO"))
+        with self.assertRaises(OSError):
+            retry.call("op", func)
+        self.assertEqual(func.call_count, 1)
+        self.assertFalse(retry.time.sleep.called)
+
+    def test_call_exhausted(self):
+        func = mock.Mock(side_effect=busy())
+        with mock.patch.object(retry, "RETRIES", 2):
+            with self.assertRaises(OSError) as cm:
+                retry.call("op", func)
+        self.assertEqual(cm.exception.errno, errno.EBUSY)
+        self.assertEqual(func.call_count, 3)
+
+    def test_call_timeout(self):
+        func = mock.Mock(side_effect=busy())
+        with mock.patch.object(retry, "TIMEOUT", 0.12):
+            with self.assertRaises(OSError):
+                retry.call("op", func)
+        # NOTE: sleeps are mocked, delays of 0.05 and 0.1 fit in the time
+        # allowed, 0.2 does not
+        self.assertEqual(func.call_count, 3)
+
+    def test_call_deadline(self):
+        deadline.activate(deadline.Deadline(0.03))
+        func = mock.Mock(side_effect=busy())
+        with self.assertRaises(OSError):
+            retry.call("op", func)
+        self.assertEqual(func.call_count, 1)
+        self.assertFalse(retry.time.sleep.called)
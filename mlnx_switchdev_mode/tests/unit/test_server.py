@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import grp
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock as mock
+
+import mlnx_switchdev_mode
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import server
+from mlnx_switchdev_mode import uevent
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+def _pci_event(action, pci_addr):
+    return uevent.make_uevent(
+        action, "/devices/pci0000:00/0000:00:02.0/" + pci_addr,
+        SUBSYSTEM="pci", PCI_SLOT_NAME=pci_addr)
+
+
+def _net_event(action, pci_addr, netdev):
+    return uevent.make_uevent(
+        action, "/devices/pci0000:00/0000:00:02.0/{}/net/{}"
+        .format(pci_addr, netdev), SUBSYSTEM="net", INTERFACE=netdev)
+
+
+class TestTopologyState(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.root = self._tmpdir.name
+        fakesysfs.generate(self.root, pfs=2, vfs=2, others=1)
+        self.backend = mock.MagicMock()
+        self.backend.eswitch_show_all.return_value = {
+            "pci/0000:03:00.0": {"mode": "legacy"},
+        }
+        self.state = server.TopologyState(
+            root=self.root, eswitches=devlink.EswitchCache(self.backend))
+        self.state.load()
+
+    def test_uevent_function(self):
+        self.assertEqual(
+            server.uevent_function(_pci_event("add", "0000:03:00.2")),
+            "0000:03:00.2")
+        self.assertEqual(
+            server.uevent_function(
+                _net_event("add", "0000:03:00.0", "enp3s0f0npf0vf0")),
+            "0000:03:00.0")
+        self.assertIsNone(server.uevent_function(uevent.make_uevent(
+            "add", "/devices/virtual/net/eth0", SUBSYSTEM="net",
+            INTERFACE="eth0")))
+
+    def test_query(self):
+        self.assertEqual(len(self.state.query({"query": "functions"})), 7)
+        self.assertEqual([pf["pci_addr"]
+                          for pf in self.state.query({"query": "pfs"})],
+                         ["0000:03:00.0", "0000:03:00.1"])
+        self.assertEqual(
+            self.state.query({"query": "function", "name": "enp3s0f1v1"}),
+            {"pci_addr": "0000:03:00.5", "driver": "mlx5_core",
+             "physfn": "0000:03:00.1", "vf_addrs": [],
+             "netdevs": ["enp3s0f1v1"], "sriov": False})
+        self.assertEqual(
+            [vf["pci_addr"]
+             for vf in self.state.query({"query": "vfs", "pf": "enp3s0f0"})],
+            ["0000:03:00.2", "0000:03:00.3"])
+        # NOTE: devices without eswitch are only queried once
+        for _ in range(2):
+            self.assertEqual(self.state.query({"query": "eswitch"}),
+                             {"0000:03:00.0": "legacy",
+                              "0000:03:00.1": None})
+        self.backend.eswitch_show_all.assert_called_once_with(
+            ["pci/0000:03:00.0", "pci/0000:03:00.1"])
+        for request in ({"query": "function", "name": "eth0"},
+                        {"query": "function", "name": []},
+                        {"query": "function"},
+                        {"query": "vfs", "pf": {}},
+                        {"query": "representors", "pf": [1]},
+                        {"query": "nope"}, ["status"]):
+            with self.assertRaises(server.QueryError):
+                self.state.query(request)
+        self.assertEqual(self.state.handle_request(b"{"),
+                         b'{"error": "Invalid request: Expecting property '
+                         b'name enclosed in double quotes: line 1 column 2 '
+                         b'(char 1)"}\n')
+
+    def test_handle_request_failure(self):
+        self.backend.eswitch_show_all.side_effect = OSError(
+            "Operation not permitted")
+        self.assertEqual(
+            self.state.handle_request(b'{"query": "eswitch"}'),
+            b'{"error": "Failed to answer query: Operation not '
+            b'permitted"}\n')
+        self.assertEqual(
+            self.state.handle_request(b'{"query": "vfs", "pf": {}}'),
+            b'{"error": "{}: not a PCI address or netdev name"}\n')
+
+    def test_handle_uevent(self):
+        self.state.query({"query": "eswitch"})
+        self.state.query({"query": "representors"})
+        # NOTE: PF 0000:03:00.0 switched to switchdev mode
+        fakesysfs.create_representors(self.root, "0000:03:00.0", 2,
+                                      "enp3s0f0")
+        self.state.handle_uevent(
+            _net_event("add", "0000:03:00.0", "enp3s0f0npf0vf1"))
+        self.backend.eswitch_show_all.return_value = {
+            "pci/0000:03:00.0": {"mode": "switchdev"},
+        }
+        self.assertEqual(self.state.query({"query": "eswitch"}),
+                         {"0000:03:00.0": "switchdev",
+                          "0000:03:00.1": None})
+        ports = self.state.query({"query": "representors",
+                                  "pf": "0000:03:00.0"})
+        self.assertEqual([port["representor"] for port in ports],
+                         ["enp3s0f0npf0vf0", "enp3s0f0npf0vf1"])
+        # NOTE: new VF of 0000:03:00.1, the PF gains a virtfn link
+        fakesysfs.create_function(self.root, "0000:03:00.6",
+                                  physfn="0000:03:00.1")
+        os.symlink("../0000:03:00.6", os.path.join(
+            self.root, "bus/pci/devices/0000:03:00.1/virtfn2"))
+        self.state.handle_uevent(_pci_event("add", "0000:03:00.6"))
+        self.assertEqual(
+            self.state.query({"query": "function", "name": "0000:03:00.1"})
+            ["vf_addrs"], ["0000:03:00.4", "0000:03:00.5", "0000:03:00.6"])
+        self.state.handle_uevent(uevent.make_uevent(
+            "add", "/devices/virtual/net/eth0", SUBSYSTEM="net",
+            INTERFACE="eth0"))
+        status = self.state.query({"query": "status"})
+        self.assertEqual((status["uevents"], status["refreshes"],
+                          status["functions"]), (3, 2, 8))
+
+
+class TestServe(unittest.TestCase):
+
+    def test_serve(self):
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=2)
+            socket_path = os.path.join(root, "run", "query.sock")
+            backend = mock.MagicMock()
+            backend.eswitch_show_all.return_value = {}
+            state = server.TopologyState(
+                root=root, eswitches=devlink.EswitchCache(backend))
+            source, injector = uevent.connect_pair()
+            ready = threading.Event()
+            thread = threading.Thread(
+                target=server.serve,
+                kwargs=dict(socket_path=socket_path, source=source,
+                            state=state, ready=ready.set))
+            thread.start()
+            try:
+                self.assertTrue(ready.wait(5))
+                client = mlnx_switchdev_mode.TopologyClient(socket_path)
+                with client:
+                    snapshot = client.scan()
+                    self.assertEqual(len(snapshot), 6)
+                    self.assertEqual(snapshot.root, root)
+                    self.assertEqual(client.function("enp3s0f1"),
+                                     snapshot["0000:03:00.1"])
+                    self.assertEqual(
+                        [vf.pci_addr for vf in client.vfs("0000:03:00.1")],
+                        ["0000:03:00.4", "0000:03:00.5"])
+                    self.assertEqual(
+                        [pf.pci_addr for pf in client.pfs()],
+                        ["0000:03:00.0", "0000:03:00.1"])
+                    self.assertEqual(client.eswitch_modes(),
+                                     {"0000:03:00.0": None,
+                                      "0000:03:00.1": None})
+                    with self.assertRaises(server.QueryError):
+                        client.function("eth0")
+
+                    fakesysfs.create_representors(root, "0000:03:00.1", 2,
+                                                  "enp3s0f1", pfnum=1)
+                    injector.send(uevent.format_uevent(_net_event(
+                        "add", "0000:03:00.1", "enp3s0f1npf1vf1")))
+                    deadline = time.monotonic() + 5
+                    while (client.status()["refreshes"] < 1 and
+                           time.monotonic() < deadline):
+                        time.sleep(0.01)
+                    index = client.representors()
+                    self.assertEqual(
+                        index.representor("0000:03:00.1", 1),
+                        "enp3s0f1npf1vf1")
+                    self.assertIsNone(index.representor("0000:03:00.0", 1))
+                    self.assertEqual(
+                        len(client.representors(pf="enp3s0f1np1")), 2)
+            finally:
+                injector.close()
+                thread.join(5)
+            self.assertFalse(thread.is_alive())
+            self.assertFalse(os.path.exists(socket_path))
+
+    def test_serve_client_failure(self):
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=1, vfs=2)
+            socket_path = os.path.join(root, "run", "query.sock")
+            state = server.TopologyState(
+                root=root, eswitches=devlink.EswitchCache(mock.MagicMock()))
+            source, injector = uevent.connect_pair()
+            ready = threading.Event()
+            thread = threading.Thread(
+                target=server.serve,
+                kwargs=dict(socket_path=socket_path, source=source,
+                            state=state, ready=ready.set))
+            handle_request = state.handle_request
+            failures = [RuntimeError("boom")]
+
+            def fail_once(line):
+                if failures:
+                    raise failures.pop()
+                return handle_request(line)
+
+            try:
+                with mock.patch.object(state, "handle_request",
+                                       side_effect=fail_once):
+                    thread.start()
+                    self.assertTrue(ready.wait(5))
+                    with mlnx_switchdev_mode.TopologyClient(
+                            socket_path) as client:
+                        with self.assertRaises(ConnectionResetError):
+                            client.status()
+                    # NOTE: the failing client is dropped, others are served
+                    with mlnx_switchdev_mode.TopologyClient(
+                            socket_path) as client:
+                        self.assertEqual(len(client.query("pfs")), 1)
+            finally:
+                injector.close()
+                thread.join(5)
+            self.assertFalse(thread.is_alive())
+
+    def test_serve_socket_removed(self):
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=1, vfs=1)
+            socket_path = os.path.join(root, "run", "query.sock")
+            state = server.TopologyState(
+                root=root, eswitches=devlink.EswitchCache(mock.MagicMock()))
+            source, injector = uevent.connect_pair()
+            self.addCleanup(injector.close)
+
+            def ready():
+                os.unlink(socket_path)
+                raise RuntimeError("not ready")
+
+            # NOTE: the error stopping the service is the one raised
+            with self.assertRaisesRegex(RuntimeError, "not ready"):
+                server.serve(socket_path=socket_path, source=source,
+                             state=state, ready=ready)
+
+    def test_listen(self):
+        with tempfile.TemporaryDirectory() as root:
+            socket_path = os.path.join(root, "run", "query.sock")
+            group = grp.getgrgid(os.getgid()).gr_name
+            with server.listen(socket_path, group=group):
+                stat = os.stat(socket_path)
+                self.assertEqual(stat.st_mode & 0o777, server.SOCKET_MODE)
+                self.assertEqual(stat.st_gid, os.getgid())
+            with self.assertRaises(ValueError):
+                server.listen(socket_path, group="no-such-group-here")
+
+    def test_serve_slow_client(self):
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=8)
+            socket_path = os.path.join(root, "run", "query.sock")
+            state = server.TopologyState(
+                root=root, eswitches=devlink.EswitchCache(mock.MagicMock()))
+            source, injector = uevent.connect_pair()
+            ready = threading.Event()
+            thread = threading.Thread(
+                target=server.serve,
+                kwargs=dict(socket_path=socket_path, source=source,
+                            state=state, ready=ready.set))
+            try:
+                with mock.patch.object(server, "CLIENT_TIMEOUT", 0.5):
+                    thread.start()
+                    self.assertTrue(ready.wait(5))
+                    # NOTE: a client sending requests without reading the
+                    # responses, until neither side takes more
+                    slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    self.addCleanup(slow.close)
+                    slow.connect(socket_path)
+                    slow.setblocking(False)
+                    requests = 0
+                    with self.assertRaises(BlockingIOError):
+                        while True:
+                            requests += slow.send(
+                                b'{"query": "status"}\n' * 64) // 20
+                    with mlnx_switchdev_mode.TopologyClient(
+                            socket_path, timeout=2) as client:
+                        self.assertEqual(len(client.pfs()), 2)
+                    # NOTE: the slow client is dropped after the timeout,
+                    # without the responses to all of its requests
+                    time.sleep(1)
+                    slow.setblocking(True)
+                    responses = 0
+                    with contextlib.suppress(ConnectionResetError):
+                        while True:
+                            data = slow.recv(1 << 20)
+                            if not data:
+                                break
+                            responses += data.count(b"\n")
+                    self.assertLess(responses, requests)
+            finally:
+                injector.close()
+                thread.join(5)
+            self.assertFalse(thread.is_alive())
@@ -14,14 +14,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
 import functools
 import io
 import json
 import os
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
 import unittest.mock as mock
 
+from mlnx_switchdev_mode import representors
+from mlnx_switchdev_mode import server
 from mlnx_switchdev_mode import sriovify
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode import uevent
+from mlnx_switchdev_mode.tests import fakesysfs
 
 
 PCI_DEVICES = {
@@ -184,6 +194,11 @@ class TestPCIDevice(unittest.TestCase):
     _sriov_device = sriovify.PCIDevice("0000:03:00.3")
     _nonpf_device = sriovify.PCIDevice("0000:01:00.0")
 
+    def setUp(self):
+        patcher = mock.patch.object(sriovify.devlink, "BACKEND", "subprocess")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test___str__(self):
         self.assertEqual(str(self._device), "0000:03:00.1")
 
@@ -229,12 +244,26 @@ class TestPCIDevice(unittest.TestCase):
         self.assertEqual(self._nonpf_device.vf_addrs, [])
         self.assertEqual(len(self._device.vfs), 2)
 
-    @mock.patch("subprocess.check_output")
-    def test_devlink_get(self, _check_output):
+    @mock.patch("builtins.open", new_callable=mock.mock_open,
+                read_data="1\n")
+    def test_read_write_attr(self, _open):
+        self.assertEqual(
+            self._device.read_attr("sriov_drivers_autoprobe"), "1")
+        _open.assert_called_once_with(
+            "/sys/bus/pci/devices/0000:03:00.1/sriov_drivers_autoprobe", "rt")
+        _open.reset_mock()
+        self._device.write_attr("sriov_drivers_autoprobe", "0")
+        _open.assert_called_once_with(
+            "/sys/bus/pci/devices/0000:03:00.1/sriov_drivers_autoprobe", "wt")
+        _open().write.assert_called_once_with("0")
+
+    @mock.patch("subprocess.run")
+    def test_devlink_get(self, _run):
         _test_data = {"dev": {"pci/0000:03:00.1": {"test": "data"}}}
-        _check_output.return_value = json.dumps(_test_data)
+        _run.return_value = subprocess.CompletedProcess(
+            [], 0, stdout=json.dumps(_test_data), stderr="")
         self.assertEqual(self._device.devlink_get("eswitch"), {"test": "data"})
-        _check_output.assert_called_once_with(
+        _run.assert_called_once_with(
             [
                 "/sbin/devlink",
                 "dev",
@@ -242,13 +271,17 @@ class TestPCIDevice(unittest.TestCase):
                 "show",
                 "pci/0000:03:00.1",
                 "--json",
-            ]
+            ],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True,
         )
 
-    @mock.patch("subprocess.check_call")
-    def test_devlink_set(self, _check_call):
+    @mock.patch("subprocess.run")
+    def test_devlink_set(self, _run):
+        _run.return_value = subprocess.CompletedProcess([], 0, stdout="",
+                                                        stderr="")
         self._device.devlink_set("eswitch", "foo", "bar")
-        _check_call.assert_called_once_with(
+        _run.assert_called_once_with(
             [
                 "/sbin/devlink",
                 "dev",
@@ -257,26 +290,90 @@ class TestPCIDevice(unittest.TestCase):
                 "pci/0000:03:00.1",
                 "foo",
                 "bar",
-            ]
+            ],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True,
         )
 
+    @mock.patch.object(sriovify.retry.time, "sleep")
+    @mock.patch("sys.stderr", new_callable=io.StringIO)
+    @mock.patch("subprocess.run")
+    def test_devlink_set_retry(self, _run, _stderr, _sleep):
+        busy = subprocess.CompletedProcess(
+            [], 1, stdout="",
+            stderr="kernel answers: Device or resource busy\n")
+        _run.side_effect = [busy, busy, subprocess.CompletedProcess(
+            [], 0, stdout="", stderr="")]
+        self._device.eswitch_set({"mode": "switchdev"})
+        self.assertEqual(_run.call_count, 3)
+        self.assertEqual(_sleep.call_count, 2)
+        self.assertIn("Device or resource busy", _stderr.getvalue())
+        _run.reset_mock()
+        _run.side_effect = [subprocess.CompletedProcess(
+            [], 1, stdout="", stderr="Error: unknown option\n")]
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._device.eswitch_set({"mode": "switchdev"})
+        self.assertEqual(_run.call_count, 1)
+
 
-EXPECTED_OUTPUT = """0000:01:00.0\t/sys/class/net/eno1\tixgbe\t
-0000:01:00.1\t/sys/class/net/eno2\tixgbe\t
-0000:03:00.0\t/sys/class/net/enp3s0f0\tmlx5_core\tPF
-0000:03:00.1\t/sys/class/net/enp3s0f1\tmlx5_core\tPF
-0000:03:00.2\t/sys/class/net/enp3s0f2\tmlx5_core\tVF of /sys/class/net/enp3s0f0
-0000:03:00.3\t/sys/class/net/enp3s0f3\tmlx5_core\tVF of /sys/class/net/enp3s0f1
-0000:05:00.0\t/sys/class/net/eno3\tigb\t
-0000:05:00.1\t/sys/class/net/eno4\tigb\t
-0000:82:00.0\t/sys/class/net/enp130s0f0\tixgbe\tPF
-0000:82:00.1\t/sys/class/net/enp130s0f1\tixgbe\tPF
+EXPECTED_OUTPUT = """0000:01:00.0\teno1\tixgbe\t
+0000:01:00.1\teno2\tixgbe\t
+0000:03:00.0\tenp3s0f0\tmlx5_core\tPF
+0000:03:00.1\tenp3s0f1\tmlx5_core\tPF
+0000:03:00.2\tenp3s0f2\tmlx5_core\tVF of enp3s0f0
+0000:03:00.3\tenp3s0f3\tmlx5_core\tVF of enp3s0f1
+0000:05:00.0\teno3\tigb\t
+0000:05:00.1\teno4\tigb\t
+0000:82:00.0\tenp130s0f0\tixgbe\tPF
+0000:82:00.1\tenp130s0f1\tixgbe\tPF
 """
 
 
+def _function(pci_addr, driver="mlx5_core", physfn=None, vf_addrs=(),
+              netdevs=(), sriov=False):
+    return topology.PCIFunction(
+        pci_addr=pci_addr,
+        driver=driver,
+        physfn=physfn,
+        vf_addrs=tuple(vf_addrs),
+        netdevs=tuple(netdevs),
+        sriov=sriov,
+    )
+
+
+# NOTE: 0000:03:00.0 has VFs in legacy mode, 0000:03:00.1 is already in
+# switchdev mode, 0000:04:00.0 does not have SR-IOV mode enabled at all
+SNAPSHOT = topology.Topology([
+    _function("0000:01:00.0", driver="igbxe", sriov=True),
+    _function("0000:03:00.0", vf_addrs=["0000:03:00.2", "0000:03:00.4"],
+              sriov=True),
+    _function("0000:03:00.1", vf_addrs=["0000:03:00.3"], sriov=True),
+    _function("0000:03:00.2", physfn="0000:03:00.0"),
+    _function("0000:03:00.3", physfn="0000:03:00.1"),
+    _function("0000:03:00.4", physfn="0000:03:00.0"),
+    _function("0000:04:00.0"),
+])
+
+
 class TestCommands(unittest.TestCase):
 
     def setUp(self):
+        self.eswitches = {
+            "pci/0000:03:00.0": {"mode": "legacy"},
+            "pci/0000:03:00.1": {"mode": "switchdev"},
+        }
+        self.backend = mock.MagicMock()
+        self.backend.eswitch_show_all.side_effect = (
+            lambda handles=None: {
+                handle: dict(eswitch)
+                for handle, eswitch in self.eswitches.items()
+                if handles is None or handle in handles
+            })
+        patcher = mock.patch.object(sriovify.devlink, "get_backend",
+                                    return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         self.mockPCIDeviceVF = mock.MagicMock()
         self.mockPCIDeviceVF.driver = "mlx5_core"
         self.mockPCIDeviceVF.is_pf = False
@@ -385,28 +482,71 @@ class TestCommands(unittest.TestCase):
             ],
         )
 
+    @mock.patch.object(sriovify, "driver_operation")
+    def test_run_vf_operation(self, _driver_operation):
+        lock = threading.Lock()
+        active = []
+        peak = []
+
+        def _operation(operation, vf):
+            with lock:
+                active.append(vf)
+                peak.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.remove(vf)
+            return sriovify.VFResult(vf, operation, None, 0.01)
+
+        _driver_operation.side_effect = _operation
+        vfs = ["0000:03:00.{}".format(i) for i in range(2, 8)]
+        results = sriovify.run_vf_operation("bind", vfs, jobs=3)
+        self.assertEqual([result.vf for result in results], vfs)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertLessEqual(max(peak), 3)
+        self.assertGreater(max(peak), 1)
+
+    @mock.patch("builtins.open", new_callable=mock.mock_open)
+    def test_bind_vfs_error(self, _open):
+        self.mockPCIDeviceVF.bound = False
+        self.mockPCIDeviceVF3.bound = False
+        _open.return_value.write.side_effect = [
+            None, OSError(errno.EIO, "Input/output error")]
+        with self.assertRaises(sriovify.VFOperationError) as cm:
+            sriovify.bind_vfs(self.mockPCIDevicePF.vfs, jobs=1)
+        self.assertEqual(cm.exception.completed, [self.mockPCIDeviceVF])
+        self.assertEqual(
+            [result.ok for result in cm.exception.results], [True, False])
+        self.assertIn("0000:03:00.4", str(cm.exception))
+        self.assertEqual(cm.exception.results[1].operation, "bind")
+        records = [rec for rec in sriovify.report.current().records
+                   if rec.vf == "0000:03:00.4"]
+        self.assertEqual(records[-1].phase, "bind")
+        self.assertIsNotNone(records[-1].error)
+        self.assertGreaterEqual(cm.exception.results[1].duration, 0)
+
     @mock.patch.object(sriovify, "bind_vfs")
-    @mock.patch("os.listdir")
-    @mock.patch.object(sriovify, "PCIDevice")
-    def test_bind(self, _pcidevice, _listdir, _bind_vfs):
-        # NOTE: PF's and VF's
-        _listdir.return_value = [
-            "0000:01:00.0",
-            "0000:03:00.0",
-            "0000:03:00.1",
-            "0000:03:00.2",
-            "0000:03:00.3",
-            "0000:03:00.4",
-        ]
-        _pcidevice.side_effect = [
-            self.mockPCIDevicePFAlt,
-            self.mockPCIDevicePF,
-            self.mockPCIDevicePF2,
-            self.mockPCIDevicePF3,
-            self.mockPCIDeviceVF,
-            self.mockPCIDeviceVF2,
-            self.mockPCIDeviceVF3,
+    @mock.patch.object(sriovify.topology, "scan")
+    def test_bind_error(self, _scan, _bind_vfs):
+        _scan.return_value = SNAPSHOT
+        _bind_vfs.side_effect = [
+            sriovify.VFOperationError("bind", [
+                sriovify.VFResult(SNAPSHOT["0000:03:00.2"], "bind",
+                                  None, 0.1),
+                sriovify.VFResult(SNAPSHOT["0000:03:00.4"], "bind",
+                                  OSError(errno.EIO, "EIO"), 0.1),
+            ]),
+            [SNAPSHOT["0000:03:00.3"]],
         ]
+        with self.assertRaises(sriovify.BindError) as cm:
+            sriovify.bind(jobs=4)
+        self.assertIn("0000:03:00.0", str(cm.exception))
+        self.assertNotIn("0000:03:00.1", str(cm.exception))
+        self.assertEqual(_bind_vfs.call_count, 2)
+
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch.object(sriovify.topology, "scan")
+    def test_bind(self, _scan, _bind_vfs):
+        _scan.return_value = SNAPSHOT
         # for printing accurate number of bound VFs during test
         _bind_vfs.side_effect = [
             [1, 1],
@@ -414,91 +554,784 @@ class TestCommands(unittest.TestCase):
         ]
         sriovify.bind()
         _bind_vfs.assert_has_calls([
-            mock.call([self.mockPCIDeviceVF, self.mockPCIDeviceVF3]),
-            mock.call([self.mockPCIDeviceVF2]),
+            mock.call([SNAPSHOT["0000:03:00.2"], SNAPSHOT["0000:03:00.4"]],
+                      jobs=1),
+            mock.call([SNAPSHOT["0000:03:00.3"]], jobs=1),
         ], any_order=True)
 
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_bind_policy(self, _stdout, _bind_vfs):
+        _bind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        policy = sriovify.config.BindPolicy({
+            "*": sriovify.config.VFSelection(1, None),
+            "0000:03:00.1": sriovify.config.NO_VFS,
+        })
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = os.path.join(tmpdir, "sys")
+            fakesysfs.generate(root, pfs=2, vfs=2, vfs_bound=False)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root), \
+                    mock.patch.object(sriovify.state, "STATE_DIR",
+                                      os.path.join(tmpdir, "run")):
+                sriovify.bind(cache=True, bind_policy=policy)
+                self.assertEqual(
+                    [[vf.pci_addr for vf in call[0][0]]
+                     for call in _bind_vfs.call_args_list],
+                    [["0000:03:00.2"], []])
+                self.assertIn("0000:03:00.1: left 2 VFs unbound by policy",
+                              _stdout.getvalue())
+                sriovify.bind(cache=True, bind_policy=policy)
+                self.assertEqual(_bind_vfs.call_count, 2)
+                # NOTE: a change of policy invalidates the state
+                sriovify.bind(cache=True)
+                self.assertEqual(_bind_vfs.call_count, 4)
+
+                # NOTE: VFs left unbound are bound on demand
+                _bind_vfs.reset_mock()
+                sriovify.bind(bind_policy=policy,
+                              vf_addrs=["0000:03:00.5", "0000:03:00.4",
+                                        "0000:03:00.5"])
+                _bind_vfs.assert_called_once_with(mock.ANY, jobs=1)
+                self.assertEqual(
+                    [vf.pci_addr for vf in _bind_vfs.call_args[0][0]],
+                    ["0000:03:00.5", "0000:03:00.4"])
+                for vf_addr in ("0000:03:00.0", "0000:09:00.2"):
+                    with self.assertRaises(sriovify.BindError):
+                        sriovify.bind(vf_addrs=[vf_addr])
+
     @mock.patch.object(sriovify, "unbind_vfs")
     @mock.patch.object(sriovify, "bind_vfs")
-    @mock.patch("os.listdir")
-    @mock.patch.object(sriovify, "PCIDevice")
-    def test_switch(self, _pcidevice, _listdir, _bind_vfs, _unbind_vfs):
-        # NOTE: PF's and VF's
-        _listdir.return_value = [
-            "0000:01:00.0",
-            "0000:03:00.0",
-            "0000:03:00.1",
-            "0000:03:00.2",
-            "0000:03:00.3",
-            "0000:03:00.4",
-        ]
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_switch_bind_policy(self, _stdout, _bind_vfs, _unbind_vfs):
+        _bind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        _unbind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        self.eswitches["pci/0000:03:00.1"] = {"mode": "legacy"}
+        policy = sriovify.config.BindPolicy({
+            "*": sriovify.config.VFSelection(1, None)})
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=2)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root):
+                sriovify.switch(rebind=True, bind_policy=policy)
+                # NOTE: all VFs are unbound for the switch, only the
+                # selected ones are bound again
+                self.assertEqual(
+                    sorted(vf.pci_addr for call in _unbind_vfs.call_args_list
+                           for vf in call[0][0]),
+                    ["0000:03:00.2", "0000:03:00.3", "0000:03:00.4",
+                     "0000:03:00.5"])
+                self.assertEqual(
+                    sorted(vf.pci_addr for call in _bind_vfs.call_args_list
+                           for vf in call[0][0]),
+                    ["0000:03:00.2", "0000:03:00.4"])
 
-        _pcidevice.side_effect = [
-            self.mockPCIDevicePF3,
-        ]
+                _bind_vfs.reset_mock()
+                sriovify.switch(rebind=True, strategy="autoprobe",
+                                bind_policy=policy)
+                self.assertEqual(
+                    sorted(vf.pci_addr for call in _bind_vfs.call_args_list
+                           for vf in call[0][0]),
+                    ["0000:03:00.2", "0000:03:00.4"])
+
+    @mock.patch.object(sriovify.numa.os, "sched_getaffinity",
+                       return_value={0, 1})
+    @mock.patch.object(sriovify.numa.os, "sched_setaffinity")
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_bind_numa(self, _stdout, _setaffinity, _getaffinity):
+        run_report = sriovify.report.RunReport("bind")
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=4, vfs=2, vfs_bound=False,
+                               numa_nodes=2)
+            fakesysfs.create_numa_node(root, 0, "0")
+            fakesysfs.create_numa_node(root, 1, "1")
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root), \
+                    mock.patch.object(sriovify.report, "_active",
+                                      run_report):
+                sriovify.bind(jobs=2, pin_numa=True)
+        self.assertEqual(
+            set(call[0][1] for call in _setaffinity.call_args_list),
+            {frozenset([0]), frozenset([1])})
+        nodes = run_report.to_dict()["nodes"]
+        self.assertEqual(sorted(nodes), ["0", "1"])
+        for node in nodes.values():
+            self.assertEqual(node["bind"]["count"], 4)
+            self.assertEqual(node["bind-vfs"]["count"], 2)
+
+    def _pcidevice(self, pci_addr):
+        return {
+            "0000:03:00.0": self.mockPCIDevicePF,
+            "0000:03:00.1": self.mockPCIDevicePF2,
+        }[pci_addr]
+
+    @mock.patch.object(sriovify.topology.Topology, "refresh")
+    @mock.patch.object(sriovify, "unbind_vfs")
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch.object(sriovify.topology, "scan")
+    @mock.patch.object(sriovify, "PCIDevice")
+    def test_switch(self, _pcidevice, _scan, _bind_vfs, _unbind_vfs,
+                    _refresh):
+        _scan.return_value = SNAPSHOT
+        _pcidevice.side_effect = self._pcidevice
+        _unbind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        refreshed = topology.Topology([
+            _function("0000:03:00.2", driver="", physfn="0000:03:00.0"),
+            _function("0000:03:00.4", driver="", physfn="0000:03:00.0"),
+        ])
+        _refresh.return_value = refreshed
 
         with self.assertRaises(sriovify.SRIOVModeNotEnabled):
             sriovify.switch(werror=True)
+        self.assertFalse(_unbind_vfs.called)
 
-        _pcidevice.side_effect = [
-            self.mockPCIDevicePFAlt,
-            self.mockPCIDevicePF,
-            self.mockPCIDevicePF2,
-            self.mockPCIDevicePF3,
-            self.mockPCIDeviceVF,
-            self.mockPCIDeviceVF2,
-            self.mockPCIDeviceVF3,
-        ]
         sriovify.switch()
 
+        # NOTE: eswitch mode of all PFs is queried in one call
+        self.backend.eswitch_show_all.assert_called_once_with(
+            ["pci/0000:03:00.0", "pci/0000:03:00.1"])
+        self.assertFalse(self.backend.get.called)
         _unbind_vfs.assert_called_once_with([
-            self.mockPCIDeviceVF,
-            self.mockPCIDeviceVF3,
-        ])
+            SNAPSHOT["0000:03:00.2"],
+            SNAPSHOT["0000:03:00.4"],
+        ], executor=mock.ANY)
         self.assertFalse(_bind_vfs.called)
-        self.mockPCIDevicePF.devlink_set.assert_called_with(
-            "eswitch", "mode", "switchdev"
-        )
+        self.mockPCIDevicePF.eswitch_set.assert_called_with(
+            {"mode": "switchdev"})
 
         # NOTE: device already in switchdev mode
-        self.mockPCIDevicePF2.devlink_set.assert_not_called()
+        self.mockPCIDevicePF2.eswitch_set.assert_not_called()
         # NOTE: not a mlx5_core driven device
-        self.mockPCIDevicePFAlt.devlink_set.assert_not_called()
+        self.assertNotIn(mock.call("0000:01:00.0"), _pcidevice.mock_calls)
 
         # Test with rebind
         _unbind_vfs.reset_mock()
         self.mockPCIDevicePF.reset_mock()
         self.mockPCIDevicePF2.reset_mock()
-        self.mockPCIDevicePFAlt.reset_mock()
-        _pcidevice.side_effect = [
-            self.mockPCIDevicePFAlt,
-            self.mockPCIDevicePF,
-            self.mockPCIDevicePF2,
-            self.mockPCIDevicePF3,
-            self.mockPCIDeviceVF,
-            self.mockPCIDeviceVF2,
-            self.mockPCIDeviceVF3,
-        ]
         sriovify.switch(rebind=True)
 
         _unbind_vfs.assert_called_once_with([
-            self.mockPCIDeviceVF,
-            self.mockPCIDeviceVF3,
+            SNAPSHOT["0000:03:00.2"],
+            SNAPSHOT["0000:03:00.4"],
+        ], executor=mock.ANY)
+        self.mockPCIDevicePF.eswitch_set.assert_called_with(
+            {"mode": "switchdev"})
+        # NOTE: VFs are rebound based on refreshed state
+        _refresh.assert_called_once_with(["0000:03:00.2", "0000:03:00.4"])
+        _bind_vfs.assert_called_once_with([
+            refreshed["0000:03:00.2"],
+            refreshed["0000:03:00.4"],
+        ], executor=mock.ANY)
+
+        # NOTE: device already in switchdev mode
+        self.mockPCIDevicePF2.eswitch_set.assert_not_called()
+
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_show(self, _stdout):
+        with tempfile.TemporaryDirectory() as root:
+            for netdev, subpaths in NETDEV_DEVICES.items():
+                fakesysfs.create_function(
+                    root,
+                    os.path.basename(subpaths["device"]),
+                    driver=os.path.basename(subpaths["device/driver"]),
+                    physfn=(os.path.basename(subpaths["device/physfn"])
+                            if "device/physfn" in subpaths else None),
+                    netdevs=[os.path.basename(netdev)],
+                    sriov="device/sriov_numvfs" in subpaths,
+                )
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root):
+                sriovify.show()
+                self.assertEqual(_stdout.getvalue(), EXPECTED_OUTPUT)
+                _stdout.seek(0)
+                _stdout.truncate()
+                sriovify.show(eswitch=True)
+        lines = _stdout.getvalue().splitlines()
+        self.assertEqual(
+            lines[2], "0000:03:00.0\tenp3s0f0\tmlx5_core\tPF\tlegacy")
+        self.assertEqual(
+            lines[3], "0000:03:00.1\tenp3s0f1\tmlx5_core\tPF\tswitchdev")
+        self.assertEqual(
+            lines[4],
+            "0000:03:00.2\tenp3s0f2\tmlx5_core\tVF of enp3s0f0\t")
+        self.backend.eswitch_show_all.assert_called_once_with(None)
+
+    @mock.patch.object(representors, "wait_for_representors")
+    def test_wait_representors(self, _wait_for_representors):
+        eswitches = sriovify.devlink.EswitchCache(self.backend)
+        eswitches.load()
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=2)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root):
+                sriovify.wait_representors(["0000:03:00.0"], eswitches, 5)
+                self.assertFalse(_wait_for_representors.called)
+                sriovify.wait_representors(
+                    ["0000:03:00.1", "0000:03:00.0", "0000:03:00.1"],
+                    eswitches, 5)
+        # NOTE: only PFs in switchdev mode have representors
+        pfs, timeout = _wait_for_representors.call_args[0]
+        self.assertEqual([pf.pci_addr for pf in pfs], ["0000:03:00.1"])
+        self.assertEqual(pfs[0].vf_addrs, ("0000:03:00.4", "0000:03:00.5"))
+        self.assertEqual(timeout, 5)
+
+    def test_show_formats(self):
+        stream = io.StringIO()
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=2, others=2)
+            # NOTE: unbind a VF, its netdev goes away
+            fakesysfs.create_function(root, "0000:03:00.5",
+                                      physfn="0000:03:00.1")
+            os.unlink(os.path.join(root, "class/net/enp3s0f1v1"))
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root):
+                sriovify.show(fmt="json", eswitch=True, stream=stream)
+                rows = json.loads(stream.getvalue())
+                stream = io.StringIO()
+                sriovify.show(fmt="csv", stream=stream)
+                lines = stream.getvalue().splitlines()
+                stream = io.StringIO()
+                sriovify.show(fmt="json", rollup=True, stream=stream)
+                rollups = json.loads(stream.getvalue())
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0], {
+            "pci_addr": "0000:03:00.0", "netdev": "enp3s0f0",
+            "driver": "mlx5_core", "function": "PF", "physfn": None,
+            "physfn_netdev": None, "eswitch_mode": "legacy"})
+        self.assertEqual(rows[2], {
+            "pci_addr": "0000:03:00.2", "netdev": "enp3s0f0v0",
+            "driver": "mlx5_core", "function": "VF",
+            "physfn": "0000:03:00.0", "physfn_netdev": "enp3s0f0",
+            "eswitch_mode": None})
+        self.assertEqual(lines[0],
+                         "pci_addr,netdev,driver,function,physfn,"
+                         "physfn_netdev")
+        self.assertEqual(lines[5],
+                         "0000:03:00.4,enp3s0f1v0,mlx5_core,VF,0000:03:00.1,"
+                         "enp3s0f1")
+        self.assertEqual(rollups, [
+            {"pci_addr": "0000:03:00.0", "netdev": "enp3s0f0",
+             "driver": "mlx5_core", "vfs": 2, "bound_vfs": 2,
+             "eswitch_mode": "legacy"},
+            {"pci_addr": "0000:03:00.1", "netdev": "enp3s0f1",
+             "driver": "mlx5_core", "vfs": 2, "bound_vfs": 1,
+             "eswitch_mode": "switchdev"},
         ])
-        self.mockPCIDevicePF.devlink_set.assert_called_with(
-            "eswitch", "mode", "switchdev"
-        )
-        _bind_vfs.assert_called_once_with(_unbind_vfs())
+        stream = io.StringIO()
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=0, others=1)
+            os.makedirs(os.path.join(root, "class/net"))
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root):
+                sriovify.show(fmt="json", stream=stream)
+        self.assertEqual(json.loads(stream.getvalue()), [])
 
+    def test_show_representors(self):
+        stream = io.StringIO()
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=1)
+            fakesysfs.create_representors(root, "0000:03:00.1", 1,
+                                          "enp3s0f1", pfnum=1)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root):
+                sriovify.show(fmt="json", vf_ports=True, stream=stream)
+                text_stream = io.StringIO()
+                sriovify.show(stream=text_stream)
+        # NOTE: one row per PCI function, with all of its netdevs
+        self.assertEqual(text_stream.getvalue().splitlines()[:2], [
+            "0000:03:00.0\tenp3s0f0\tmlx5_core\tPF",
+            "0000:03:00.1\tenp3s0f1np1,enp3s0f1npf1vf0\tmlx5_core\tPF",
+        ])
+        self.assertEqual(json.loads(stream.getvalue()), [
+            {"pf": "0000:03:00.0", "pf_netdev": "enp3s0f0", "vf_index": 0,
+             "vf_pci_addr": "0000:03:00.2", "vf_netdev": "enp3s0f0v0",
+             "representor": None},
+            {"pf": "0000:03:00.1", "pf_netdev": "enp3s0f1np1",
+             "vf_index": 0, "vf_pci_addr": "0000:03:00.3",
+             "vf_netdev": "enp3s0f1v0", "representor": "enp3s0f1npf1vf0"},
+        ])
+
+    @mock.patch.object(sriovify.topology.Topology, "refresh")
+    @mock.patch.object(sriovify, "unbind_vfs")
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch.object(sriovify.topology, "scan")
+    @mock.patch.object(sriovify, "PCIDevice")
+    def test_switch_jobs(self, _pcidevice, _scan, _bind_vfs, _unbind_vfs,
+                         _refresh):
+        _scan.return_value = SNAPSHOT
+        _pcidevice.side_effect = self._pcidevice
+        _unbind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        _refresh.return_value = SNAPSHOT
+        self.eswitches["pci/0000:03:00.1"] = {"mode": "legacy"}
+        self.mockPCIDevicePF2.eswitch_set.side_effect = Exception("EBUSY")
+        with self.assertRaises(sriovify.SwitchError) as cm:
+            sriovify.switch(rebind=True, jobs=2)
+        self.assertIn("0000:03:00.1", str(cm.exception))
+        self.assertNotIn("0000:03:00.0", str(cm.exception))
+        # NOTE: failure on one PF does not prevent switch of the other
+        self.mockPCIDevicePF.eswitch_set.assert_called_once_with(
+            {"mode": "switchdev"})
+        self.mockPCIDevicePF2.eswitch_set.assert_called_once_with(
+            {"mode": "switchdev"})
+        # NOTE: VFs are rebound for both PFs, including the failed one
+        self.assertEqual(_bind_vfs.call_count, 2)
+
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_switch_timeouts(self, _stdout):
+        hang = threading.Event()
+        self.addCleanup(hang.set)
+        self.eswitches["pci/0000:03:00.1"] = {"mode": "legacy"}
+
+        def _set(handle, props):
+            if handle == "pci/0000:03:00.0":
+                hang.wait()
+
+        self.backend.eswitch_set.side_effect = _set
+        run_report = sriovify.report.RunReport("switch")
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=2)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root), \
+                    mock.patch.object(sriovify.deadline, "DEVLINK_TIMEOUT",
+                                      0.05), \
+                    mock.patch.object(sriovify.deadline, "_active",
+                                      sriovify.deadline.Deadline(60)), \
+                    mock.patch.object(sriovify.report, "_active",
+                                      run_report):
+                with self.assertRaises(sriovify.SwitchError) as cm:
+                    sriovify.switch(rebind=True, jobs=2)
+                # NOTE: the other PF is switched regardless
+                self.assertEqual(str(cm.exception),
+                                 "Failed to switch 0000:03:00.0 to "
+                                 "switchdev mode")
+                self.assertEqual(self.backend.eswitch_set.call_count, 2)
+                self.assertEqual(run_report.to_dict()["counters"]
+                                 ["abandoned"], 1)
+                self.assertIn("0000:03:00.0: devlink eswitch set mode "
+                              "switchdev: did not complete within 0.1s, "
+                              "abandoned", _stdout.getvalue())
+
+                # NOTE: deadline expired before the switch started
+                with mock.patch.object(sriovify.deadline, "_active",
+                                       sriovify.deadline.Deadline(0)):
+                    with self.assertRaises(
+                            sriovify.deadline.DeadlineExceeded):
+                        sriovify.switch()
+
+    @mock.patch.object(sriovify.topology.Topology, "refresh")
+    @mock.patch.object(sriovify, "unbind_vfs")
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch.object(sriovify.topology, "scan")
+    @mock.patch.object(sriovify, "PCIDevice")
+    def test_switch_unbind_error(self, _pcidevice, _scan, _bind_vfs,
+                                 _unbind_vfs, _refresh):
+        _scan.return_value = SNAPSHOT
+        _pcidevice.side_effect = self._pcidevice
+        _refresh.return_value = SNAPSHOT
+        _unbind_vfs.side_effect = sriovify.VFOperationError("unbind", [
+            sriovify.VFResult(SNAPSHOT["0000:03:00.2"], "unbind", None, 0.1),
+            sriovify.VFResult(SNAPSHOT["0000:03:00.4"], "unbind",
+                              OSError(errno.EIO, "EIO"), 0.1),
+        ])
+        _bind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        run_report = sriovify.report.RunReport("switch")
+        with mock.patch.object(sriovify.report, "_active", run_report):
+            with self.assertRaises(sriovify.SwitchError):
+                sriovify.switch(rebind=True, jobs=2)
+        summary = run_report.to_dict()
+        for phase in ("scan", "devlink-query", "switch-pf", "unbind-vfs",
+                      "rebind-vfs"):
+            self.assertIn(phase, summary["phases"])
+        self.assertEqual(summary["phases"]["switch-pf"]["count"], 2)
+        self.assertEqual(summary["phases"]["switch-pf"]["failed"], 1)
+        self.assertEqual(summary["counters"],
+                         {"pfs": 2, "vfs-unbound": 1, "vfs-bound": 1})
+        self.mockPCIDevicePF.eswitch_set.assert_not_called()
+        # NOTE: VFs which were unbound are bound again
+        _refresh.assert_called_once_with(["0000:03:00.2"])
+        _bind_vfs.assert_called_once_with([SNAPSHOT["0000:03:00.2"]],
+                                          executor=mock.ANY)
+
+    @mock.patch.object(sriovify, "unbind_vfs")
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_switch_eswitch_config(self, _stdout, _bind_vfs, _unbind_vfs):
+        _bind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        _unbind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        self.eswitches["pci/0000:03:00.1"].update(
+            {"inline-mode": "none", "encap": "disable"})
+        eswitch_config = {"mode": "switchdev", "inline-mode": "transport",
+                          "encap": "enable"}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = os.path.join(tmpdir, "sys")
+            fakesysfs.generate(root, pfs=2, vfs=2)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root), \
+                    mock.patch.object(sriovify.state, "STATE_DIR",
+                                      os.path.join(tmpdir, "run")):
+                sriovify.switch(rebind=True, cache=True,
+                                eswitch_config=eswitch_config)
+                # NOTE: all properties are set in a single request, VFs of
+                # a PF already in switchdev mode stay bound
+                self.assertEqual(
+                    sorted(self.backend.eswitch_set.mock_calls),
+                    [mock.call("pci/0000:03:00.0", eswitch_config),
+                     mock.call("pci/0000:03:00.1",
+                               {"inline-mode": "transport",
+                                "encap": "enable"})])
+                self.assertFalse(self.backend.set.called)
+                _unbind_vfs.assert_called_once_with(mock.ANY,
+                                                    executor=mock.ANY)
+                self.assertEqual(
+                    [vf.pci_addr for vf in _unbind_vfs.call_args[0][0]],
+                    ["0000:03:00.2", "0000:03:00.3"])
+
+                # NOTE: nothing to do once in the desired state
+                for handle in self.eswitches:
+                    self.eswitches[handle] = dict(eswitch_config)
+                self.backend.reset_mock()
+                sriovify.switch(rebind=True, eswitch_config=eswitch_config)
+                self.assertFalse(self.backend.eswitch_set.called)
+
+                # NOTE: a change of configuration invalidates the state
+                self.backend.reset_mock()
+                sriovify.switch(rebind=True, cache=True,
+                                eswitch_config=eswitch_config)
+                self.assertFalse(self.backend.eswitch_set.called)
+                self.backend.eswitch_show_all.assert_called_once_with(
+                    ["pci/0000:03:00.0", "pci/0000:03:00.1"])
+                self.backend.reset_mock()
+                sriovify.switch(rebind=True, cache=True)
+                self.assertTrue(self.backend.eswitch_show_all.called)
+
+    @mock.patch.object(sriovify.topology.Topology, "refresh")
+    @mock.patch.object(sriovify, "unbind_vfs")
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch.object(sriovify.topology, "scan")
+    @mock.patch.object(sriovify, "PCIDevice")
+    def test_switch_autoprobe(self, _pcidevice, _scan, _bind_vfs,
+                              _unbind_vfs, _refresh):
+        # NOTE: VFs of 0000:03:00.0 were created with autoprobe disabled
+        snapshot = topology.Topology([
+            _function("0000:03:00.0",
+                      vf_addrs=["0000:03:00.2", "0000:03:00.4"],
+                      sriov=True),
+            _function("0000:03:00.1", vf_addrs=["0000:03:00.3"],
+                      sriov=True),
+            _function("0000:03:00.2", driver="", physfn="0000:03:00.0"),
+            _function("0000:03:00.3", physfn="0000:03:00.1"),
+            _function("0000:03:00.4", driver="", physfn="0000:03:00.0"),
+        ])
+        _scan.return_value = snapshot
+        _refresh.return_value = snapshot
+        _pcidevice.side_effect = self._pcidevice
+        self.mockPCIDevicePF.read_attr.return_value = "1"
+        sriovify.switch(rebind=True, strategy="autoprobe")
+
+        self.assertFalse(_unbind_vfs.called)
+        self.mockPCIDevicePF.eswitch_set.assert_called_once_with(
+            {"mode": "switchdev"})
+        self.assertEqual(
+            self.mockPCIDevicePF.write_attr.mock_calls,
+            [
+                mock.call("sriov_drivers_autoprobe", "0"),
+                mock.call("sriov_drivers_autoprobe", "1"),
+            ])
+        _refresh.assert_called_once_with(["0000:03:00.2", "0000:03:00.4"])
+        _bind_vfs.assert_called_once_with(
+            [snapshot["0000:03:00.2"], snapshot["0000:03:00.4"]],
+            executor=mock.ANY)
         # NOTE: device already in switchdev mode
-        self.mockPCIDevicePF2.devlink_set.assert_not_called()
-        # NOTE: not a mlx5_core driven device
-        self.mockPCIDevicePFAlt.devlink_set.assert_not_called()
+        self.mockPCIDevicePF2.write_attr.assert_not_called()
+        self.mockPCIDevicePF2.eswitch_set.assert_not_called()
+
+        # NOTE: VFs which were probed have to be unbound, autoprobe is
+        # restored on failure
+        _scan.return_value = SNAPSHOT
+        self.mockPCIDevicePF.reset_mock()
+        self.mockPCIDevicePF.eswitch_set.side_effect = Exception("EBUSY")
+        with self.assertRaises(sriovify.SwitchError):
+            sriovify.switch(strategy="autoprobe")
+        _unbind_vfs.assert_called_once_with(
+            [SNAPSHOT["0000:03:00.2"], SNAPSHOT["0000:03:00.4"]],
+            executor=mock.ANY)
+        self.mockPCIDevicePF.write_attr.assert_called_with(
+            "sriov_drivers_autoprobe", "1")
+
+    @mock.patch.object(sriovify, "unbind_vfs")
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch.object(sriovify, "PCIDevice")
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_plan_apply(self, _stdout, _pcidevice, _bind_vfs, _unbind_vfs):
+        _pcidevice.side_effect = self._pcidevice
+        _bind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        _unbind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = os.path.join(tmpdir, "sys")
+            plan_path = os.path.join(tmpdir, "plan.json")
+            fakesysfs.generate(root, pfs=2, vfs=2)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root):
+                sriovify.plan_switch(rebind=True, jobs=2,
+                                     plan_path=plan_path)
+                self.assertFalse(_unbind_vfs.called)
+                self.assertFalse(self.mockPCIDevicePF.eswitch_set.called)
+                self.assertIn("5 operations on 1 PFs, estimated 6.0s "
+                              "serially, 4.0s with 2 jobs",
+                              _stdout.getvalue())
+
+                sriovify.apply_plan(plan_path)
+                _unbind_vfs.assert_called_once_with(mock.ANY,
+                                                    executor=mock.ANY)
+                self.assertEqual(
+                    [vf.pci_addr for vf in _unbind_vfs.call_args[0][0]],
+                    ["0000:03:00.2", "0000:03:00.3"])
+                self.mockPCIDevicePF.eswitch_set.assert_called_once_with(
+                    {"mode": "switchdev"})
+                self.assertEqual(
+                    [vf.pci_addr for vf in _bind_vfs.call_args[0][0]],
+                    ["0000:03:00.2", "0000:03:00.3"])
+
+                # NOTE: nothing left to do once applied
+                _unbind_vfs.reset_mock()
+                self.eswitches["pci/0000:03:00.0"]["mode"] = "switchdev"
+                sriovify.apply_plan(plan_path)
+                self.assertFalse(_unbind_vfs.called)
+                self.assertIn("Skipping 5 operations", _stdout.getvalue())
+
+                # NOTE: VFs which were unbound are rebound on failure
+                self.eswitches["pci/0000:03:00.0"]["mode"] = "legacy"
+                self.mockPCIDevicePF.eswitch_set.side_effect = OSError(
+                    "EBUSY")
+                _bind_vfs.reset_mock()
+                with self.assertRaises(sriovify.ApplyError):
+                    sriovify.apply_plan(plan_path)
+                self.assertEqual(
+                    [vf.pci_addr for vf in _bind_vfs.call_args[0][0]],
+                    ["0000:03:00.2", "0000:03:00.3"])
+
+                # NOTE: a failure to rebind does not hide the original one
+                _bind_vfs.side_effect = sriovify.VFOperationError("bind", [
+                    sriovify.VFResult("0000:03:00.2", "bind",
+                                      OSError(errno.EIO, "EIO"), 0.1),
+                ])
+                with self.assertRaises(sriovify.ApplyError):
+                    sriovify.apply_plan(plan_path)
+                self.assertIn("failed to bind VFs again after failed switch",
+                              _stdout.getvalue())
+                self.assertIn("failed to apply plan: EBUSY",
+                              _stdout.getvalue())
+
+                # NOTE: VFs are rebound when the run is interrupted as well
+                _bind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+                _bind_vfs.reset_mock()
+                self.mockPCIDevicePF.eswitch_set.side_effect = (
+                    KeyboardInterrupt)
+                with self.assertRaises(KeyboardInterrupt):
+                    sriovify.apply_plan(plan_path)
+                self.assertEqual(
+                    [vf.pci_addr for vf in _bind_vfs.call_args[0][0]],
+                    ["0000:03:00.2", "0000:03:00.3"])
 
+    @mock.patch.object(sriovify, "bind_vfs")
     @mock.patch("sys.stdout", new_callable=io.StringIO)
-    @mock.patch("os.listdir", return_value=NETDEV_DEVICES.keys())
-    @mock.patch("os.path.exists", side_effect=netdev_exists_helper)
-    @mock.patch("os.readlink", side_effect=netdev_readlink_helper)
-    def test_show(self, _readlink, _exists, _listdir, _stdout):
-        sriovify.show()
-        self.assertEqual(_stdout.getvalue(), EXPECTED_OUTPUT)
+    def test_provision(self, _stdout, _bind_vfs):
+        _bind_vfs.side_effect = lambda vfs, **kwargs: list(vfs)
+        self.backend.get.side_effect = (
+            lambda obj_name, handle: dict(self.eswitches[handle]))
+        writes = []
+
+        def _write_attr(pcidev, attr, value):
+            # NOTE: VFs appear as the kernel creates them, unprobed as
+            # autoprobe is disabled
+            writes.append((pcidev.pci_addr, attr, value))
+            if attr == "sriov_numvfs" and int(value):
+                vf_addrs = ["0000:03:01.{}".format(i)
+                            for i in range(int(value))]
+                for vf_addr in vf_addrs:
+                    fakesysfs.create_function(root, vf_addr,
+                                              physfn=pcidev.pci_addr)
+                fakesysfs.create_function(root, pcidev.pci_addr,
+                                          driver="mlx5_core", vfs=vf_addrs)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = os.path.join(tmpdir, "sys")
+            fakesysfs.generate(root, pfs=2, vfs=0)
+            config_path = os.path.join(tmpdir, "sriov-vfs.conf")
+            with open(config_path, "wt") as f:
+                f.write("enp3s0f0 2\n0000:03:00.1 0  # spare\n")
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root), \
+                    mock.patch.object(sriovify.PCIDevice, "write_attr",
+                                      autospec=True,
+                                      side_effect=_write_attr):
+                sriovify.provision(config_path=config_path, jobs=2)
+                self.assertEqual(writes, [
+                    ("0000:03:00.0", "sriov_drivers_autoprobe", "0"),
+                    ("0000:03:00.0", "sriov_numvfs", "2"),
+                    ("0000:03:00.0", "sriov_drivers_autoprobe", "1"),
+                ])
+                self.backend.eswitch_set.assert_called_once_with(
+                    "pci/0000:03:00.0", {"mode": "switchdev"})
+                _bind_vfs.assert_called_once_with(mock.ANY,
+                                                  executor=mock.ANY)
+                self.assertEqual(
+                    [vf.pci_addr for vf in _bind_vfs.call_args[0][0]],
+                    ["0000:03:01.0", "0000:03:01.1"])
+
+                # NOTE: nothing to do but binding VFs once provisioned
+                del writes[:]
+                self.backend.reset_mock()
+                _bind_vfs.reset_mock()
+                self.eswitches["pci/0000:03:00.0"]["mode"] = "switchdev"
+                sriovify.provision(config_path=config_path, bind=False)
+                self.assertEqual(writes, [])
+                self.assertFalse(self.backend.eswitch_set.called)
+                self.assertFalse(_bind_vfs.called)
+
+                with open(config_path, "wt") as f:
+                    f.write("enp9s0f0 2\n")
+                with self.assertRaises(sriovify.config.ConfigError):
+                    sriovify.provision(config_path=config_path)
+
+                self.backend.eswitch_set.side_effect = OSError("EBUSY")
+                self.eswitches["pci/0000:03:00.0"]["mode"] = "legacy"
+                with open(config_path, "wt") as f:
+                    f.write("0000:03:00.0 4\n")
+                with self.assertRaises(sriovify.ProvisionError):
+                    sriovify.provision(config_path=config_path)
+                # NOTE: existing VFs are removed first, autoprobe is
+                # restored on failure
+                self.assertEqual(writes, [
+                    ("0000:03:00.0", "sriov_drivers_autoprobe", "0"),
+                    ("0000:03:00.0", "sriov_numvfs", "0"),
+                    ("0000:03:00.0", "sriov_numvfs", "4"),
+                    ("0000:03:00.0", "sriov_drivers_autoprobe", "1"),
+                ])
+
+                # NOTE: bound VFs unbound for the switch are bound again
+                # when it fails
+                for i in range(4):
+                    fakesysfs.create_function(
+                        root, "0000:03:01.{}".format(i), driver="mlx5_core",
+                        physfn="0000:03:00.0")
+                _bind_vfs.reset_mock()
+                with mock.patch.object(sriovify, "unbind_vfs") as _unbind:
+                    _unbind.side_effect = lambda vfs, **kwargs: list(vfs)
+                    with self.assertRaises(sriovify.ProvisionError):
+                        sriovify.provision(config_path=config_path)
+                self.assertEqual(
+                    [vf.pci_addr for vf in _bind_vfs.call_args[0][0]],
+                    ["0000:03:01.{}".format(i) for i in range(4)])
+
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_bind_switch_cache(self, _stdout, _bind_vfs):
+        _bind_vfs.return_value = []
+        with tempfile.TemporaryDirectory() as tmpdir:
+            root = os.path.join(tmpdir, "sys")
+            fakesysfs.generate(root, pfs=2, vfs=2)
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root), \
+                    mock.patch.object(sriovify.state, "STATE_DIR",
+                                      os.path.join(tmpdir, "run")):
+                sriovify.bind(cache=True)
+                self.assertEqual(_bind_vfs.call_count, 2)
+                sriovify.bind(cache=True)
+                self.assertEqual(_bind_vfs.call_count, 2)
+                sriovify.bind()
+                self.assertEqual(_bind_vfs.call_count, 4)
+
+                sriovify.switch(cache=True)
+                self.assertEqual(
+                    sriovify.state.StateCache("switch").load()["pfs"],
+                    {
+                        "0000:03:00.0": {"vfs": 2, "bound-vfs": 2,
+                                         "mode": "switchdev"},
+                        "0000:03:00.1": {"vfs": 2, "bound-vfs": 2,
+                                         "mode": "switchdev"},
+                    })
+                # NOTE: a cache hit costs a single bulk query of the modes
+                for eswitch in self.eswitches.values():
+                    eswitch["mode"] = "switchdev"
+                self.backend.reset_mock()
+                sriovify.switch(cache=True)
+                self.backend.eswitch_show_all.assert_called_once_with(
+                    ["pci/0000:03:00.0", "pci/0000:03:00.1"])
+                self.assertFalse(self.backend.get.called)
+
+                # NOTE: any change to the topology invalidates the state
+                fakesysfs.create_function(root, "0000:05:00.0")
+                sriovify.bind(cache=True)
+                self.assertEqual(_bind_vfs.call_count, 6)
+                sriovify.switch(cache=True)
+                self.assertTrue(self.backend.eswitch_show_all.called)
+
+    @mock.patch.object(sriovify, "bind_vfs")
+    @mock.patch("sys.stdout", new_callable=io.StringIO)
+    def test_watch(self, _stdout, _bind_vfs):
+        _switch_pf = mock.MagicMock()
+        _bind_vfs.return_value = []
+
+        def _add(pci_addr, action="add"):
+            return uevent.make_uevent(
+                action, "/devices/pci0000:00/0000:00:02.0/" + pci_addr,
+                SUBSYSTEM="pci", PCI_SLOT_NAME=pci_addr)
+
+        with tempfile.TemporaryDirectory() as root:
+            fakesysfs.generate(root, pfs=2, vfs=2, others=1)
+            source = uevent.UEventReplay([
+                _add("0000:03:00.2"),
+                _add("0000:03:00.2", action="bind"),
+                _add("0000:03:00.3"),
+                _add("0000:03:00.4"),
+                _add("0000:ff:00.0"),
+                uevent.make_uevent("add", "/devices/virtual/net/eth0",
+                                   SUBSYSTEM="net", INTERFACE="eth0"),
+            ])
+            with mock.patch.object(sriovify.topology, "SYSFS_ROOT", root), \
+                    mock.patch.dict(sriovify.SWITCH_STRATEGIES,
+                                    {"unbind": _switch_pf}):
+                sriovify.watch(rebind=True, source=source)
+                _switch_pf.assert_called_once_with(
+                    mock.ANY, mock.ANY, mock.ANY, rebind=True,
+                    eswitch_config=None, bind_policy=None, executor=mock.ANY,
+                    run_journal=None)
+                pf, snapshot, _ = _switch_pf.call_args[0]
+                self.assertEqual(pf.pci_addr, "0000:03:00.0")
+                self.assertEqual([vf.pci_addr for vf in snapshot.vfs(pf)],
+                                 ["0000:03:00.2", "0000:03:00.3"])
+                # NOTE: PF already in switchdev mode, new VFs are bound
+                _bind_vfs.assert_called_once_with(
+                    [snapshot["0000:03:00.4"], snapshot["0000:03:00.5"]],
+                    executor=mock.ANY)
+                self.backend.eswitch_show_all.assert_called_once_with(
+                    ["pci/0000:03:00.0", "pci/0000:03:00.1"])
+
+                # NOTE: VF bind events are caused by the switch itself
+                _switch_pf.reset_mock()
+                sriovify.watch(source=uevent.UEventReplay([
+                    _add("0000:03:00.2", action="bind"),
+                    _add("0000:03:00.2", action="remove"),
+                ]))
+                self.assertFalse(_switch_pf.called)
+
+                # NOTE: after lost uevents all PFs are looked at again
+                _bind_vfs.reset_mock()
+                source = mock.MagicMock()
+                source.recv.side_effect = [
+                    uevent.UEventsLost("uevents lost"), None, EOFError()]
+                sriovify.watch(rebind=True, source=source)
+                self.assertEqual(_switch_pf.call_args[0][0].pci_addr,
+                                 "0000:03:00.0")
+                _bind_vfs.assert_called_once_with(
+                    [snapshot["0000:03:00.4"], snapshot["0000:03:00.5"]],
+                    executor=mock.ANY)
+                self.assertIn("uevents lost, rescanning 2 PFs",
+                              _stdout.getvalue())
+
+    @mock.patch.object(sriovify.notify, "ready")
+    @mock.patch.object(server, "serve")
+    def test_serve(self, _serve, _ready):
+        with mock.patch("sys.argv", ["mlnx-switchdev-mode", "serve",
+                                     "--socket-group", "netdev"]):
+            sriovify.main()
+        _serve.assert_called_once_with(socket_path=None, group="netdev",
+                                       ready=mock.ANY)
+        # NOTE: ready once queries are answered, not once the service ends
+        self.assertFalse(_ready.called)
+        _serve.call_args[1]["ready"]()
+        _ready.assert_called_once_with("Answering topology queries")
+
+    def test_positive_int(self):
+        self.assertEqual(sriovify.positive_int("4"), 4)
+        for value in ("0", "-1", "foo"):
+            with self.assertRaises(sriovify.argparse.ArgumentTypeError):
+                sriovify.positive_int(value)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mlnx_switchdev_mode
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+# Modules only some subcommands import, a no-op run of the command must not
+# load them
+HEAVY_MODULES = (
+    "concurrent.futures",
+    "csv",
+    "logging",
+    "mlnx_switchdev_mode.plan",
+    "mlnx_switchdev_mode.server",
+    "mlnx_switchdev_mode.uevent",
+    "subprocess",
+)
+
+
+class TestStartup(unittest.TestCase):
+
+    def _env(self):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(
+            os.path.dirname(mlnx_switchdev_mode.__file__))
+        return env
+
+    def test_package_exports(self):
+        from mlnx_switchdev_mode import client
+        from mlnx_switchdev_mode import representors
+        self.assertIs(mlnx_switchdev_mode.TopologyClient,
+                      client.TopologyClient)
+        self.assertIs(mlnx_switchdev_mode.read_representor_index,
+                      representors.read_index)
+        self.assertIs(mlnx_switchdev_mode.VFPort, representors.VFPort)
+
+    def test_startup_imports(self):
+        code = ("import sys\n"
+                "import mlnx_switchdev_mode.sriovify\n"
+                "print(' '.join(sys.modules))\n")
+        modules = subprocess.check_output(
+            [sys.executable, "-c", code], env=self._env(),
+            universal_newlines=True).split()
+        self.assertIn("mlnx_switchdev_mode.sriovify", modules)
+        for name in HEAVY_MODULES:
+            self.assertNotIn(name, modules)
+
+    def test_concurrent_workers(self):
+        # NOTE: workers of a fresh interpreter binding VFs of several PFs at
+        # once, none of them may see a module half imported
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        fakesysfs.generate(tmpdir.name, pfs=4, vfs=32, vfs_bound=False)
+        for _ in range(5):
+            result = subprocess.run(
+                [sys.executable, "-m", "mlnx_switchdev_mode",
+                 "--sysfs-root", tmpdir.name, "bind", "--jobs", "16",
+                 "--no-cache", "--no-journal"],
+                env=self._env(), cwd=tmpdir.name, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE, universal_newlines=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
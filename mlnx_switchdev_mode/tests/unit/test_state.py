@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+from mlnx_switchdev_mode import state
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+class TestState(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.root = os.path.join(self._tmpdir.name, "sys")
+        self.state_dir = os.path.join(self._tmpdir.name, "run")
+        fakesysfs.generate(self.root, pfs=2, vfs=2, others=2,
+                           vfs_bound=False)
+
+    def test_read_fingerprint(self):
+        fingerprint = state.read_fingerprint(self.root)
+        self.assertEqual(fingerprint["sysfs_root"], self.root)
+        self.assertEqual(fingerprint["bound"],
+                         ["0000:03:00.0", "0000:03:00.1"])
+        self.assertEqual(state.read_fingerprint(self.root), fingerprint)
+        fakesysfs.create_function(self.root, "0000:03:00.6",
+                                  driver="mlx5_core", physfn="0000:03:00.0")
+        changed = state.read_fingerprint(self.root)
+        self.assertNotEqual(changed["devices"], fingerprint["devices"])
+        self.assertEqual(changed["bound"],
+                         ["0000:03:00.0", "0000:03:00.1", "0000:03:00.6"])
+        fakesysfs.create_function(self.root, "0000:05:00.0")
+        self.assertNotEqual(state.read_fingerprint(self.root)["devices"],
+                            changed["devices"])
+
+    def test_read_pf_fingerprint(self):
+        fingerprint = state.read_fingerprint(self.root,
+                                             pf_addrs=["0000:03:00.0"])
+        self.assertEqual(fingerprint["bound"], ["0000:03:00.0"])
+        # NOTE: other devices, and the other PF and its VFs, do not count
+        fakesysfs.create_function(self.root, "0000:05:00.0")
+        fakesysfs.create_function(self.root, "0000:03:00.4",
+                                  driver="mlx5_core", physfn="0000:03:00.1",
+                                  netdevs=["enp3s0f1v0"])
+        self.assertEqual(state.read_fingerprint(self.root,
+                                                pf_addrs=["0000:03:00.0"]),
+                         fingerprint)
+        self.assertNotEqual(state.read_fingerprint(self.root)["devices"],
+                            fingerprint["devices"])
+        fakesysfs.create_function(self.root, "0000:03:00.2",
+                                  driver="mlx5_core", physfn="0000:03:00.0")
+        changed = state.read_fingerprint(self.root,
+                                         pf_addrs=["0000:03:00.0"])
+        self.assertEqual(changed["devices"], fingerprint["devices"])
+        self.assertEqual(changed["bound"], ["0000:03:00.0", "0000:03:00.2"])
+        fakesysfs.create_function(self.root, "0000:03:00.2",
+                                  driver="mlx5_core", physfn="0000:03:00.0",
+                                  netdevs=["enp3s0f0v0"])
+        self.assertNotEqual(
+            state.read_fingerprint(self.root,
+                                   pf_addrs=["0000:03:00.0"])["functions"],
+            changed["functions"])
+
+    def test_state_cache(self):
+        cache = state.StateCache("switch", state_dir=self.state_dir)
+        fingerprint = state.read_fingerprint(self.root)
+        self.assertIsNone(cache.load())
+        self.assertFalse(cache.is_current(fingerprint))
+        cache.save(fingerprint, {"0000:03:00.0": {"vfs": 2}})
+        self.assertEqual(os.listdir(self.state_dir), ["switch.json"])
+        self.assertEqual(cache.load()["pfs"], {"0000:03:00.0": {"vfs": 2}})
+        self.assertTrue(cache.is_current(fingerprint))
+        changed = dict(fingerprint, bound=[])
+        self.assertFalse(cache.is_current(changed))
+        self.assertTrue(cache.is_current(changed, keys=("devices",)))
+        # NOTE: state of other commands is kept apart
+        self.assertIsNone(
+            state.StateCache("bind", state_dir=self.state_dir).load())
+        cache.invalidate()
+        self.assertIsNone(cache.load())
+        cache.invalidate()
+
+    def test_state_cache_corrupt(self):
+        cache = state.StateCache("switch", state_dir=self.state_dir)
+        os.makedirs(self.state_dir)
+        with open(cache.path, "wt") as f:
+            f.write("{")
+        self.assertIsNone(cache.load())
+        with open(cache.path, "wt") as f:
+            f.write('{"version": 0, "command": "switch"}')
+        self.assertIsNone(cache.load())
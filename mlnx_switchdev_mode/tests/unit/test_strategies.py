@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import errno
+import io
+import os
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from mlnx_switchdev_mode import devlink
+from mlnx_switchdev_mode import journal
+from mlnx_switchdev_mode import report
+from mlnx_switchdev_mode import retry
+from mlnx_switchdev_mode import sriovify
+from mlnx_switchdev_mode import state
+from mlnx_switchdev_mode.tests import fakekernel
+
+
+class TestStrategies(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.root = self._tmpdir.name
+        patcher = mock.patch("sys.stdout", new_callable=io.StringIO)
+        self.stdout = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(state, "STATE_DIR",
+                                    os.path.join(self.root, "run"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _kernel(self, **kwargs):
+        kernel = fakekernel.FakeKernel(self.root, **kwargs)
+        self.addCleanup(kernel.close)
+        activation = kernel.activate()
+        activation.__enter__()
+        self.addCleanup(activation.__exit__, None, None, None)
+        return kernel
+
+    def _modes(self, kernel):
+        return {pf_addr: pf.eswitch["mode"]
+                for pf_addr, pf in kernel.pfs.items()}
+
+    def _bound(self, kernel, pf_addr):
+        return [kernel.bound(vf_addr)
+                for vf_addr in kernel.pfs[pf_addr].vf_addrs]
+
+    def _autoprobe(self, pf_addr):
+        with open(os.path.join(self.root, "bus/pci/devices", pf_addr,
+                               "sriov_drivers_autoprobe")) as f:
+            return f.read().strip()
+
+    def _operations(self, kernel, since, pf_addr):
+        targets = [pf_addr] + kernel.pfs[pf_addr].vf_addrs
+        return [event.operation for event in kernel.events[since:]
+                if event.target in targets and
+                event.operation != "representors"]
+
+    def test_unbind_serial(self):
+        kernel = self._kernel(pfs=2, vfs=4)
+        sriovify.switch(rebind=True, jobs=1)
+        self.assertEqual(set(self._modes(kernel).values()), {"switchdev"})
+        self.assertEqual(kernel.count("unbind"), 8)
+        self.assertEqual(kernel.count("bind"), 8)
+        self.assertEqual(kernel.max_active["bind"], 1)
+        self.assertEqual(kernel.max_active["eswitch-set"], 1)
+        for pf_addr in kernel.pfs:
+            self.assertEqual(self._bound(kernel, pf_addr), [True] * 4)
+
+    def test_unbind_parallel(self):
+        kernel = self._kernel(pfs=1, vfs=8, latencies={"bind": 0.02,
+                                                       "unbind": 0.02})
+        sriovify.switch(rebind=True, jobs=4)
+        self.assertEqual(kernel.count("bind"), 8)
+        self.assertEqual(kernel.max_active["unbind"], 4)
+        self.assertEqual(kernel.max_active["bind"], 4)
+
+    def test_autoprobe_unprobed(self):
+        kernel = self._kernel(pfs=2, vfs=4, vfs_bound=False)
+        sriovify.switch(rebind=True, jobs=2, strategy="autoprobe")
+        self.assertEqual(set(self._modes(kernel).values()), {"switchdev"})
+        self.assertEqual(kernel.count("unbind"), 0)
+        self.assertEqual(kernel.count("bind"), 8)
+        self.assertEqual(kernel.count("bind", failed=True), 0)
+        for pf_addr in kernel.pfs:
+            self.assertEqual(self._bound(kernel, pf_addr), [True] * 4)
+            with open(os.path.join(self.root, "bus/pci/devices", pf_addr,
+                                   "sriov_drivers_autoprobe")) as f:
+                self.assertEqual(f.read().strip(), "0")
+
+    def test_autoprobe_eswitch_fault(self):
+        kernel = self._kernel(pfs=1, vfs=4)
+        pf_addr = next(iter(kernel.pfs))
+        vf_addrs = kernel.pfs[pf_addr].vf_addrs
+        kernel.unbind(vf_addrs[3])
+        kernel.fail("eswitch-set", errno.EIO, count=None)
+        with self.assertRaises(sriovify.SwitchError):
+            sriovify.switch(rebind=True, strategy="autoprobe")
+        self.assertEqual(self._modes(kernel), {pf_addr: "legacy"})
+        self.assertEqual(self._autoprobe(pf_addr), "1")
+        # NOTE: VFs unbound for the switch are back, the others untouched
+        self.assertEqual(self._bound(kernel, pf_addr),
+                         [True, True, True, False])
+        self.assertEqual(kernel.count("bind"), 3)
+
+    def _eswitch_fault_rebind_fault(self, strategy):
+        kernel = self._kernel(pfs=1, vfs=2)
+        pf_addr = next(iter(kernel.pfs))
+        kernel.fail("eswitch-set", errno.EIO, count=None)
+        kernel.fail("bind", errno.ENOMEM, count=None)
+        with self.assertRaises(sriovify.SwitchError):
+            sriovify.switch(rebind=True, strategy=strategy, use_journal=True)
+        # NOTE: the failure of the switch is reported, not the rebind
+        output = self.stdout.getvalue()
+        self.assertIn("{}: failed to bind VFs again after failed switch"
+                      .format(pf_addr), output)
+        self.assertIn("{}: failed to switch to switchdev mode: [Errno {}]"
+                      .format(pf_addr, errno.EIO), output)
+        self.assertEqual(self._bound(kernel, pf_addr), [False, False])
+        # NOTE: the VFs are left for the next run to bind
+        self.assertEqual([entry.rebind for entry in
+                          journal.Journal().entries()],
+                         [kernel.pfs[pf_addr].vf_addrs])
+
+    def test_eswitch_fault_rebind_fault(self):
+        self._eswitch_fault_rebind_fault("unbind")
+
+    def test_autoprobe_eswitch_fault_rebind_fault(self):
+        self._eswitch_fault_rebind_fault("autoprobe")
+
+    def test_mode_change_with_bound_vfs(self):
+        kernel = self._kernel(pfs=1, vfs=2)
+        pf_addr = next(iter(kernel.pfs))
+        with self.assertRaises(devlink.DevlinkError) as cm:
+            devlink.get_backend().eswitch_set("pci/{}".format(pf_addr),
+                                              {"mode": "switchdev"})
+        self.assertEqual(cm.exception.errno, errno.EBUSY)
+        self.assertEqual(self._modes(kernel), {pf_addr: "legacy"})
+        devlink.get_backend().eswitch_set("pci/{}".format(pf_addr),
+                                          {"inline-mode": "transport"})
+        self.assertEqual(kernel.pfs[pf_addr].eswitch["inline-mode"],
+                         "transport")
+        # NOTE: other devlink objects are not simulated, callers see them
+        # fail like an unsupported request
+        with self.assertRaises(devlink.DevlinkError) as cm:
+            devlink.get_backend().get("port", "pci/{}/1".format(pf_addr))
+        self.assertEqual(cm.exception.errno, errno.EOPNOTSUPP)
+
+    def test_eswitch_fault(self):
+        kernel = self._kernel(pfs=2, vfs=4)
+        failing, switched = kernel.pfs
+        kernel.fail("eswitch-set", errno.EIO, target=failing)
+        with self.assertRaises(sriovify.SwitchError):
+            sriovify.switch(rebind=True, jobs=2)
+        self.assertEqual(self._modes(kernel),
+                         {failing: "legacy", switched: "switchdev"})
+        self.assertEqual(kernel.count("eswitch-set", failed=True), 1)
+        self.assertEqual(self._bound(kernel, failing), [True] * 4)
+        self.assertEqual(self._bound(kernel, switched), [True] * 4)
+        sriovify.switch(rebind=True, jobs=2)
+        self.assertEqual(self._modes(kernel)[failing], "switchdev")
+
+    def test_eswitch_transient_fault(self):
+        kernel = self._kernel(pfs=2, vfs=2)
+        busy = next(iter(kernel.pfs))
+        kernel.fail("eswitch-set", errno.EBUSY, target=busy, count=2)
+        run_report = report.RunReport("switch")
+        with mock.patch.object(report, "_active", run_report):
+            sriovify.switch(rebind=True, jobs=2)
+        self.assertEqual(set(self._modes(kernel).values()), {"switchdev"})
+        self.assertEqual(kernel.count("eswitch-set", failed=True), 2)
+        retries = [rec for rec in run_report.records if rec.phase == "retry"]
+        self.assertEqual([(rec.pf, rec.duration) for rec in retries],
+                         [(busy, retry.BACKOFF[errno.EBUSY]),
+                          (busy, retry.BACKOFF[errno.EBUSY] * 2)])
+        self.assertEqual(run_report.to_dict()["counters"]["retries"], 2)
+
+    def test_sriov_numvfs(self):
+        kernel = self._kernel(pfs=1, vfs=2)
+        pf_addr = next(iter(kernel.pfs))
+        with self.assertRaises(OSError) as cm:
+            sriovify.PCIDevice(pf_addr).write_attr("sriov_numvfs", "4")
+        self.assertEqual(cm.exception.errno, errno.EBUSY)
+        sriovify.PCIDevice(pf_addr).write_attr("sriov_numvfs", "0")
+        self.assertEqual(kernel.pfs[pf_addr].vf_addrs, [])
+        sriovify.PCIDevice(pf_addr).write_attr("sriov_numvfs", "3")
+        self.assertEqual(self._bound(kernel, pf_addr), [True] * 3)
+        self.assertEqual(kernel.count("probe"), 3)
+
+    def test_provision(self):
+        kernel = self._kernel(pfs=2, vfs=2)
+        config_path = os.path.join(self.root, "vfs.conf")
+        with open(config_path, "wt") as f:
+            f.write("\n".join("{} 6".format(pf_addr)
+                              for pf_addr in kernel.pfs))
+        sriovify.provision(config_path=config_path, jobs=2,
+                           representor_timeout=5)
+        self.assertEqual(set(self._modes(kernel).values()), {"switchdev"})
+        # NOTE: VFs are created unprobed and bound once in switchdev mode
+        self.assertEqual(kernel.count("probe"), 0)
+        self.assertEqual(kernel.count("bind"), 12)
+        for pf_addr in kernel.pfs:
+            self.assertEqual(self._bound(kernel, pf_addr), [True] * 6)
+            self.assertEqual(len(os.listdir(os.path.join(
+                self.root, "bus/pci/devices", pf_addr, "net"))), 7)
+
+    def test_late_representors(self):
+        kernel = self._kernel(pfs=2, vfs=2,
+                              latencies={"representors": 0.2})
+        sriovify.switch(rebind=True, jobs=2, representor_timeout=5)
+        for pf_addr, pf in kernel.pfs.items():
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(
+                    self.root, "bus/pci/devices", pf_addr, "net"))),
+                [pf.uplink, pf.representor(0), pf.representor(1)])
+        self.assertEqual(kernel.count("representors"), 2)
+
+    def test_journal_recover_killed(self):
+        kernel = self._kernel(pfs=2, vfs=2)
+        killed, other = kernel.pfs
+        kernel.kill("eswitch-set", target=killed)
+        with self.assertRaises(fakekernel.Killed):
+            sriovify.switch(rebind=True, use_journal=True)
+        self.assertEqual(self._modes(kernel),
+                         {killed: "legacy", other: "legacy"})
+        self.assertEqual(self._bound(kernel, killed), [False, False])
+        self.assertEqual(self._bound(kernel, other), [True, True])
+        kernel.revive()
+        since = len(kernel.events)
+        sriovify.recover(pf_addrs=[other])
+        self.assertEqual(self._bound(kernel, killed), [False, False])
+        sriovify.recover()
+        self.assertEqual(self._modes(kernel),
+                         {killed: "switchdev", other: "legacy"})
+        self.assertEqual(self._bound(kernel, killed), [True, True])
+        # NOTE: steps completed by the killed run are not repeated and the
+        # PF the run had not touched yet is left alone
+        self.assertEqual(self._operations(kernel, since, killed),
+                         ["eswitch-get", "eswitch-set", "bind", "bind"])
+        self.assertEqual(self._operations(kernel, since, other), [])
+        self.assertEqual(journal.Journal().entries(), [])
+        sriovify.switch(rebind=True, use_journal=True)
+        self.assertEqual(set(self._modes(kernel).values()), {"switchdev"})
+        self.assertEqual(self._bound(kernel, other), [True, True])
+
+    def test_journal_rollback(self):
+        kernel = self._kernel(pfs=1, vfs=2)
+        pf_addr = next(iter(kernel.pfs))
+        kernel.kill("eswitch-set")
+        with self.assertRaises(fakekernel.Killed):
+            sriovify.switch(rebind=True, use_journal=True)
+        kernel.revive()
+        kernel.fail("eswitch-set", errno.EIO, count=None)
+        sriovify.recover()
+        self.assertIn("{}: failed to recover".format(pf_addr),
+                      self.stdout.getvalue())
+        self.assertEqual(self._modes(kernel), {pf_addr: "legacy"})
+        self.assertEqual(self._bound(kernel, pf_addr), [True, True])
+        self.assertEqual(journal.Journal().entries(), [])
+
+    def test_journal_recover_autoprobe(self):
+        kernel = self._kernel(pfs=1, vfs=2)
+        pf_addr = next(iter(kernel.pfs))
+        kernel.kill("eswitch-set")
+        with self.assertRaises(fakekernel.Killed):
+            sriovify.switch(rebind=True, strategy="autoprobe",
+                            use_journal=True)
+        self.assertEqual(self._autoprobe(pf_addr), "0")
+        kernel.revive()
+        run_report = report.RunReport("switch")
+        with mock.patch.object(report, "_active", run_report):
+            sriovify.switch(rebind=True, strategy="autoprobe",
+                            use_journal=True)
+        self.assertEqual(self._modes(kernel), {pf_addr: "switchdev"})
+        self.assertEqual(self._autoprobe(pf_addr), "1")
+        self.assertEqual(self._bound(kernel, pf_addr), [True, True])
+        self.assertEqual(run_report.to_dict()["counters"]["pfs-recovered"],
+                         1)
+        self.assertEqual(journal.Journal().entries(), [])
+
+    def test_journal_recover_provision(self):
+        kernel = self._kernel(pfs=1, vfs=2)
+        pf_addr = next(iter(kernel.pfs))
+        config_path = os.path.join(self.root, "vfs.conf")
+        with open(config_path, "wt") as f:
+            f.write("{} 4\n".format(pf_addr))
+        kernel.kill("eswitch-set")
+        with self.assertRaises(fakekernel.Killed):
+            sriovify.provision(config_path=config_path, use_journal=True)
+        self.assertEqual(self._autoprobe(pf_addr), "0")
+        # NOTE: the VFs created by the killed run are recorded, not the
+        # ones it removed
+        self.assertEqual([entry.rebind for entry in
+                          journal.Journal().entries()],
+                         [kernel.pfs[pf_addr].vf_addrs])
+        kernel.revive()
+        sriovify.recover()
+        self.assertEqual(self._modes(kernel), {pf_addr: "switchdev"})
+        self.assertEqual(self._autoprobe(pf_addr), "1")
+        self.assertEqual(self._bound(kernel, pf_addr), [True] * 4)
+        self.assertEqual(kernel.count("probe"), 0)
+        self.assertEqual(journal.Journal().entries(), [])
+
+    def test_journal_recover_apply(self):
+        kernel = self._kernel(pfs=1, vfs=2)
+        pf_addr = next(iter(kernel.pfs))
+        plan_path = os.path.join(self.root, "plan.json")
+        sriovify.plan_switch(rebind=True, plan_path=plan_path)
+        kernel.kill("eswitch-set")
+        with self.assertRaises(fakekernel.Killed):
+            sriovify.apply_plan(plan_path, use_journal=True)
+        self.assertEqual(self._bound(kernel, pf_addr), [False, False])
+        self.assertEqual(
+            [entry.command for entry in journal.Journal().entries()],
+            ["apply"])
+        kernel.revive()
+        sriovify.apply_plan(plan_path, use_journal=True)
+        self.assertEqual(self._modes(kernel), {pf_addr: "switchdev"})
+        self.assertEqual(self._bound(kernel, pf_addr), [True, True])
+        self.assertEqual(journal.Journal().entries(), [])
+
+    def test_switch_pf(self):
+        kernel = self._kernel(pfs=3, vfs=2, others=10)
+        pf_addr = list(kernel.pfs)[1]
+        notify_path = os.path.join(self.root, "notify")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.bind(notify_path)
+            with mock.patch.dict(os.environ, {"NOTIFY_SOCKET": notify_path}):
+                sriovify.switch(rebind=True, cache=True, pf_addrs=[pf_addr])
+            self.assertEqual(sock.recv(4096),
+                             b"STATUS=Switching 1 PFs to switchdev mode")
+            self.assertEqual(sock.recv(4096),
+                             b"STATUS=Switched 1/1 PFs to switchdev mode")
+        self.assertEqual([pf_addr for pf_addr, mode in
+                          self._modes(kernel).items() if mode == "switchdev"],
+                         [pf_addr])
+        self.assertEqual(self._bound(kernel, pf_addr), [True, True])
+        self.assertEqual(kernel.count("eswitch-get"), 1)
+        self.assertTrue(os.path.exists(os.path.join(
+            state.STATE_DIR, "switch@{}.json".format(pf_addr))))
+        sriovify.switch(rebind=True, cache=True, pf_addrs=[pf_addr])
+        self.assertIn("Nothing changed", self.stdout.getvalue())
+
+    def test_switch_cache_mode_changed(self):
+        kernel = self._kernel(pfs=2, vfs=2)
+        first, second = kernel.pfs
+        sriovify.switch(cache=True)
+        self.assertEqual(set(self._modes(kernel).values()), {"switchdev"})
+        sriovify.switch(cache=True)
+        self.assertEqual(self.stdout.getvalue().count("Nothing changed"), 1)
+        # NOTE: set back to legacy mode without touching the topology
+        devlink.get_backend().eswitch_set("pci/{}".format(second),
+                                          {"mode": "legacy"})
+        sriovify.switch(cache=True)
+        self.assertIn("{}: eswitch mode changed".format(second),
+                      self.stdout.getvalue())
+        self.assertEqual(self.stdout.getvalue().count("Nothing changed"), 1)
+        self.assertEqual(self._modes(kernel),
+                         {first: "switchdev", second: "switchdev"})
+        sriovify.switch(cache=True)
+        self.assertEqual(self.stdout.getvalue().count("Nothing changed"), 2)
+
+    def test_switch_unknown_pf(self):
+        kernel = self._kernel(pfs=1, vfs=2, others=1)
+        pf_addr = next(iter(kernel.pfs))
+        for pci_addr in (kernel.pfs[pf_addr].vf_addrs[0], "0000:ff:00.0",
+                         "0000:09:00.0"):
+            with self.assertRaises(sriovify.UnknownPFError):
+                sriovify.switch(pf_addrs=[pf_addr, pci_addr])
+        self.assertEqual(self._modes(kernel), {pf_addr: "legacy"})
+
+    def test_bind_pf(self):
+        kernel = self._kernel(pfs=2, vfs=2, vfs_bound=False)
+        first, second = kernel.pfs
+        sriovify.switch(strategy="autoprobe")
+        sriovify.bind(pf_addrs=[second], cache=True)
+        self.assertEqual(self._bound(kernel, first), [False, False])
+        self.assertEqual(self._bound(kernel, second), [True, True])
+        # NOTE: binding the VFs of another PF leaves the state of this one
+        sriovify.bind(pf_addrs=[first], cache=True)
+        sriovify.bind(pf_addrs=[second], cache=True)
+        self.assertEqual(self.stdout.getvalue().count("Nothing changed"), 1)
+        self.assertEqual(kernel.count("bind"), 4)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+from mlnx_switchdev_mode import topology
+from mlnx_switchdev_mode.tests import fakesysfs
+
+
+class TestTopology(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmpdir.cleanup)
+        self.root = self._tmpdir.name
+        fakesysfs.create_function(self.root, "0000:00:00.0")
+        fakesysfs.create_function(self.root, "0000:01:00.0", driver="igb",
+                                  netdevs=["eno1"])
+        fakesysfs.create_function(
+            self.root, "0000:03:00.0", driver="mlx5_core",
+            vfs=["0000:03:00.2", "0000:03:00.3"],
+            netdevs=["enp3s0f0"])
+        fakesysfs.create_function(self.root, "0000:03:00.2",
+                                  physfn="0000:03:00.0")
+        fakesysfs.create_function(self.root, "0000:03:00.3",
+                                  driver="mlx5_core", physfn="0000:03:00.0",
+                                  netdevs=["enp3s0f3"])
+        fakesysfs.create_function(self.root, "0000:04:00.0",
+                                  driver="mlx5_core", netdevs=["enp4s0"])
+
+    def test_scan(self):
+        snapshot = topology.scan(self.root)
+        self.assertEqual(snapshot.root, self.root)
+        self.assertEqual(len(snapshot), 6)
+        self.assertEqual(
+            [str(function) for function in snapshot],
+            ["0000:00:00.0", "0000:01:00.0", "0000:03:00.0",
+             "0000:03:00.2", "0000:03:00.3", "0000:04:00.0"])
+        self.assertEqual(
+            snapshot["0000:03:00.0"],
+            topology.PCIFunction(
+                pci_addr="0000:03:00.0",
+                driver="mlx5_core",
+                physfn=None,
+                vf_addrs=("0000:03:00.2", "0000:03:00.3"),
+                netdevs=("enp3s0f0",),
+                sriov=True,
+            ))
+        self.assertFalse(snapshot["0000:00:00.0"].bound)
+        self.assertFalse(snapshot["0000:03:00.2"].bound)
+        self.assertTrue(snapshot["0000:03:00.2"].is_vf)
+        self.assertFalse(snapshot["0000:04:00.0"].is_pf)
+        self.assertFalse(snapshot["0000:04:00.0"].is_vf)
+        self.assertEqual(
+            dict(snapshot.netdevs),
+            {
+                "eno1": "0000:01:00.0",
+                "enp3s0f0": "0000:03:00.0",
+                "enp3s0f3": "0000:03:00.3",
+                "enp4s0": "0000:04:00.0",
+            })
+
+    def test_pfs_vfs(self):
+        snapshot = topology.scan(self.root)
+        self.assertEqual(
+            [str(pf) for pf in snapshot.pfs()], ["0000:03:00.0"])
+        self.assertEqual(snapshot.pfs(driver="igb"), [])
+        pf = snapshot.pfs(driver="mlx5_core")[0]
+        self.assertEqual(
+            [str(vf) for vf in snapshot.vfs(pf)],
+            ["0000:03:00.2", "0000:03:00.3"])
+
+    def test_immutable(self):
+        snapshot = topology.scan(self.root)
+        with self.assertRaises(TypeError):
+            snapshot.netdevs["foo"] = "0000:00:00.0"
+        with self.assertRaises(AttributeError):
+            snapshot["0000:03:00.0"].driver = "vfio-pci"
+
+    def test_refresh(self):
+        snapshot = topology.scan(self.root)
+        fakesysfs.create_function(self.root, "0000:03:00.2",
+                                  driver="mlx5_core", physfn="0000:03:00.0",
+                                  netdevs=["enp3s0f2"])
+        fakesysfs.create_function(self.root, "0000:03:00.3",
+                                  physfn="0000:03:00.0")
+        refreshed = snapshot.refresh(["0000:03:00.2"])
+        # NOTE: the original snapshot is left untouched
+        self.assertFalse(snapshot["0000:03:00.2"].bound)
+        self.assertTrue(refreshed["0000:03:00.2"].bound)
+        self.assertEqual(refreshed.netdevs["enp3s0f2"], "0000:03:00.2")
+        # NOTE: only the requested function is re-read
+        self.assertTrue(refreshed["0000:03:00.3"].bound)
+        self.assertFalse(refreshed.refresh()["0000:03:00.3"].bound)
+        self.assertNotIn("0000:05:00.0",
+                         refreshed.refresh(["0000:05:00.0"]))
+
+    def test_scan_generated(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        root = tmpdir.name
+        pfs = fakesysfs.generate(root, pfs=3, vfs=10, others=20)
+        self.assertEqual(pfs, ["0000:03:00.0", "0000:03:00.1",
+                               "0000:04:00.0"])
+        snapshot = topology.scan(root)
+        self.assertEqual(len(snapshot), 3 + 3 * 10 + 20)
+        self.assertEqual([str(pf) for pf in snapshot.pfs("mlx5_core")], pfs)
+        vfs = snapshot.vfs(snapshot["0000:03:00.1"])
+        self.assertEqual(len(vfs), 10)
+        self.assertEqual(vfs[0].pci_addr, "0000:03:01.4")
+        self.assertEqual(vfs[0].netdevs, ("enp3s0f1v0",))
+        self.assertEqual(snapshot.netdevs["enp4s0f0v9"], "0000:04:01.3")
+
+    def test_scan_pfs(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        root = tmpdir.name
+        fakesysfs.generate(root, pfs=3, vfs=2, others=20)
+        snapshot = topology.scan_pfs(["0000:03:00.1", "0000:09:00.0"], root)
+        self.assertEqual([function.pci_addr for function in snapshot],
+                         ["0000:03:00.1", "0000:03:00.4", "0000:03:00.5"])
+        self.assertEqual(snapshot.root, root)
+        self.assertEqual(
+            [vf.netdevs for vf in snapshot.vfs(snapshot["0000:03:00.1"])],
+            [("enp3s0f1v0",), ("enp3s0f1v1",)])
+
+    def test_read_netdevs(self):
+        os.makedirs(os.path.join(self.root, "devices/virtual/net/lo"))
+        os.symlink("../../devices/virtual/net/lo",
+                   os.path.join(self.root, "class/net/lo"))
+        self.assertEqual(topology.read_netdevs(self.root), [
+            ("0000:01:00.0", "eno1"),
+            ("0000:03:00.0", "enp3s0f0"),
+            ("0000:03:00.3", "enp3s0f3"),
+            ("0000:04:00.0", "enp4s0"),
+        ])
+        self.assertEqual(topology.read_bound("mlx5_core", self.root),
+                         {"0000:03:00.0", "0000:03:00.3", "0000:04:00.0"})
+        self.assertEqual(topology.read_bound("vfio-pci", self.root),
+                         frozenset())
+
+    def test_read_function_known(self):
+        function = topology.read_function(self.root, "0000:03:00.0",
+                                          netdevs=["foo"], vfs=False)
+        self.assertEqual(function.netdevs, ("foo",))
+        self.assertEqual(function.vf_addrs, ())
+        self.assertTrue(function.is_pf)
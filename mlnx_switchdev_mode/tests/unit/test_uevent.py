@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import io
+import os
+import unittest
+from unittest import mock
+
+from mlnx_switchdev_mode import uevent
+
+
+UDEVADM_MONITOR_OUTPUT = """\
+monitor will print the received events for:
+KERNEL - the kernel uevent
+
+KERNEL[1234.567890] add /devices/pci0000:00/0000:00:02.0/0000:03:00.2 (pci)
+ACTION=add
+DEVPATH=/devices/pci0000:00/0000:00:02.0/0000:03:00.2
+SUBSYSTEM=pci
+PCI_SLOT_NAME=0000:03:00.2
+SEQNUM=4242
+
+KERNEL[1234.567891] add /devices/virtual/net/eth0 (net)
+ACTION=add
+DEVPATH=/devices/virtual/net/eth0
+SUBSYSTEM=net
+INTERFACE=eth0
+"""
+
+
+class TestUEvent(unittest.TestCase):
+
+    def test_parse_format(self):
+        event = uevent.make_uevent(
+            "add", "/devices/pci0000:00/0000:00:02.0/0000:03:00.2",
+            SUBSYSTEM="pci", PCI_SLOT_NAME="0000:03:00.2")
+        self.assertEqual(event.pci_addr, "0000:03:00.2")
+        data = uevent.format_uevent(event)
+        self.assertTrue(data.startswith(
+            b"add@/devices/pci0000:00/0000:00:02.0/0000:03:00.2\0"))
+        self.assertEqual(uevent.parse_uevent(data), event)
+        net_event = uevent.make_uevent("add", "/devices/virtual/net/eth0",
+                                       SUBSYSTEM="net", INTERFACE="eth0")
+        self.assertIsNone(net_event.pci_addr)
+        with self.assertRaises(ValueError):
+            uevent.parse_uevent(b"libudev\0\xfe\xed")
+
+    def test_read_uevents(self):
+        events = list(uevent.read_uevents(
+            io.StringIO(UDEVADM_MONITOR_OUTPUT)))
+        self.assertEqual([str(event) for event in events], [
+            "add@/devices/pci0000:00/0000:00:02.0/0000:03:00.2",
+            "add@/devices/virtual/net/eth0",
+        ])
+        self.assertEqual(events[0].env["SEQNUM"], "4242")
+        self.assertEqual(events[1].subsystem, "net")
+
+    def test_socket_injection(self):
+        sock, injector = uevent.connect_pair()
+        self.addCleanup(sock.close)
+        self.assertIsNone(sock.recv(timeout=0))
+        event = uevent.make_uevent("remove", "/devices/foo",
+                                   SUBSYSTEM="pci", PCI_SLOT_NAME="foo")
+        injector.send(b"libudev\0\xfe\xed")
+        injector.send(uevent.format_uevent(event))
+        self.assertEqual(sock.recv(timeout=1), event)
+        injector.close()
+        with self.assertRaises(EOFError):
+            sock.recv()
+
+    def test_socket_overflow(self):
+        sock, injector = uevent.connect_pair()
+        self.addCleanup(sock.close)
+        self.addCleanup(injector.close)
+        injector.send(b"\0")
+        wrapped = mock.Mock(wraps=sock._sock)
+        wrapped.recv.side_effect = OSError(errno.ENOBUFS,
+                                           os.strerror(errno.ENOBUFS))
+        overflowed = uevent.UEventSocket(sock=wrapped)
+        with self.assertRaises(uevent.UEventsLost):
+            overflowed.recv(timeout=1)
+        wrapped.recv.side_effect = OSError(errno.EBADF,
+                                           os.strerror(errno.EBADF))
+        with self.assertRaises(OSError) as cm:
+            overflowed.recv(timeout=1)
+        self.assertEqual(cm.exception.errno, errno.EBADF)
+
+    def test_replay(self):
+        event = uevent.make_uevent("add", "/devices/foo")
+        replay = uevent.UEventReplay([event])
+        self.assertEqual(replay.recv(), event)
+        with self.assertRaises(EOFError):
+            replay.recv()
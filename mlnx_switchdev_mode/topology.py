@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import os
+import re
+import types
+import typing
+
+
+SYSFS_ROOT = "/sys"
+
+PCI_ADDR_RE = re.compile(r"^[0-9a-f]{4,}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]$")
+
+
+class PCIFunction(collections.namedtuple(
+        "PCIFunction",
+        ["pci_addr", "driver", "physfn", "vf_addrs", "netdevs", "sriov"])):
+    """Immutable snapshot of the state of a PCI function"""
+
+    __slots__ = ()
+
+    @property
+    def bound(self) -> bool:
+        """Determine if function was bound to a kernel driver
+
+        :return: whether function was bound to a kernel driver
+        :rtype: bool
+        """
+        return bool(self.driver)
+
+    @property
+    def is_pf(self) -> bool:
+        """Determine if function is a SR-IOV Physical Function
+
+        :return: whether function is a PF
+        :rtype: bool
+        """
+        return self.sriov
+
+    @property
+    def is_vf(self) -> bool:
+        """Determine if function is a SR-IOV Virtual Function
+
+        :return: whether function is a VF
+        :rtype: bool
+        """
+        return self.physfn is not None
+
+    @property
+    def devlink_handle(self) -> str:
+        """devlink handle for function
+
+        :return: devlink device handle
+        :rtype: str
+        """
+        return "pci/{}".format(self.pci_addr)
+
+    def __str__(self) -> str:
+        """String represenation of object
+
+        :return: PCI address of function
+        :rtype: str
+        """
+        return self.pci_addr
+
+
+def _link_name(path: str) -> str:
+    """Name of the target of a sysfs symlink
+
+    :param path: path of symlink
+    :type: str
+    :return: basename of symlink target
+    :rtype: str
+    """
+    return os.path.basename(os.readlink(path))
+
+
+def read_function(root: str, pci_addr: str,
+                  netdevs: typing.Sequence[str] = None,
+                  vfs: bool = True) -> PCIFunction:
+    """Read the state of a single PCI function from sysfs
+
+    All required information is gathered from a single directory scan of
+    the device, only symlinks which are present are resolved.
+
+    :param root: sysfs mount point
+    :type: str
+    :param pci_addr: PCI address of function
+    :type: str
+    :param netdevs: netdevs of function when already known, saves listing
+                    them
+    :type: typing.Sequence[str]
+    :param vfs: resolve the addresses of the VFs of a PF, vf_addrs is left
+                empty otherwise
+    :type: bool
+    :return: snapshot of function
+    :rtype: PCIFunction
+    :raises: FileNotFoundError if the function does not exist
+    """
+    driver = ""
+    physfn = None
+    sriov = False
+    virtfns = {}
+    known_netdevs = netdevs is not None
+    netdevs = tuple(sorted(netdevs)) if known_netdevs else ()
+    path = os.path.join(root, "bus/pci/devices", pci_addr)
+    with os.scandir(path) as entries:
+        for entry in entries:
+            name = entry.name
+            try:
+                if name == "driver":
+                    driver = _link_name(entry.path)
+                elif name == "physfn":
+                    physfn = _link_name(entry.path)
+                elif name == "sriov_numvfs":
+                    sriov = True
+                elif vfs and name.startswith("virtfn"):
+                    virtfns[int(name[len("virtfn"):])] = _link_name(
+                        entry.path)
+                elif name == "net" and not known_netdevs:
+                    netdevs = tuple(sorted(os.listdir(entry.path)))
+            except (FileNotFoundError, NotADirectoryError, ValueError):
+                # NOTE: attribute went away during the scan, e.g. the
+                # driver was unbound, or has an unexpected name.
+                continue
+    return PCIFunction(
+        pci_addr=pci_addr,
+        driver=driver,
+        physfn=physfn,
+        vf_addrs=tuple(virtfns[i] for i in sorted(virtfns)),
+        netdevs=netdevs,
+        sriov=sriov,
+    )
+
+
+def read_netdevs(root: str = None) -> typing.List[typing.Tuple[str, str]]:
+    """Netdevs of PCI functions from a single pass over /sys/class/net
+
+    The link of every netdev points into the directory of its device, so
+    a single readlink per netdev gives its PCI address. Netdevs of other
+    buses and virtual netdevs are skipped.
+
+    :param root: sysfs mount point, defaults to SYSFS_ROOT
+    :type: str
+    :return: PCI address and netdev name pairs, sorted
+    :rtype: typing.List[typing.Tuple[str, str]]
+    """
+    root = root or SYSFS_ROOT
+    netdevs = []
+    with os.scandir(os.path.join(root, "class/net")) as entries:
+        for entry in entries:
+            try:
+                target = os.readlink(entry.path)
+            except OSError:
+                # NOTE: netdev went away during the scan, or is not a link
+                continue
+            parent, net = os.path.split(os.path.dirname(target))
+            pci_addr = os.path.basename(parent)
+            if net == "net" and PCI_ADDR_RE.match(pci_addr):
+                netdevs.append((pci_addr, entry.name))
+    netdevs.sort()
+    return netdevs
+
+
+def read_bound(driver: str, root: str = None) -> typing.FrozenSet[str]:
+    """PCI functions bound to a driver
+
+    :param driver: name of driver
+    :type: str
+    :param root: sysfs mount point, defaults to SYSFS_ROOT
+    :type: str
+    :return: PCI addresses of bound functions
+    :rtype: typing.FrozenSet[str]
+    """
+    root = root or SYSFS_ROOT
+    try:
+        return frozenset(
+            name for name in os.listdir(
+                os.path.join(root, "bus/pci/drivers", driver))
+            if PCI_ADDR_RE.match(name))
+    except FileNotFoundError:
+        return frozenset()
+
+
+class Topology(object):
+    """Immutable snapshot of the PCI function to netdev topology"""
+
+    def __init__(self, functions: typing.Iterable[PCIFunction],
+                 root: str = None):
+        """Initialise a new topology snapshot
+
+        :param functions: PCI functions in snapshot
+        :type: typing.Iterable[PCIFunction]
+        :param root: sysfs mount point snapshot was taken from
+        :type: str
+        """
+        self._root = root or SYSFS_ROOT
+        self._functions = types.MappingProxyType(
+            collections.OrderedDict(
+                (function.pci_addr, function)
+                for function in sorted(functions,
+                                       key=lambda f: f.pci_addr)
+            )
+        )
+        self._netdevs = types.MappingProxyType({
+            netdev: function.pci_addr
+            for function in self._functions.values()
+            for netdev in function.netdevs
+        })
+
+    @property
+    def root(self) -> str:
+        """sysfs mount point snapshot was taken from
+
+        :return: path to sysfs
+        :rtype: str
+        """
+        return self._root
+
+    @property
+    def netdevs(self) -> typing.Mapping[str, str]:
+        """Netdev name to PCI address mappings
+
+        :return: netdev to PCI address mappings
+        :rtype: typing.Mapping[str, str]
+        """
+        return self._netdevs
+
+    def __getitem__(self, pci_addr: str) -> PCIFunction:
+        return self._functions[pci_addr]
+
+    def __contains__(self, pci_addr: str) -> bool:
+        return pci_addr in self._functions
+
+    def __iter__(self) -> typing.Iterator[PCIFunction]:
+        return iter(self._functions.values())
+
+    def __len__(self) -> int:
+        return len(self._functions)
+
+    def pfs(self, driver: str = None) -> typing.List[PCIFunction]:
+        """SR-IOV Physical Functions in snapshot
+
+        :param driver: only return PFs bound to this driver
+        :type: str
+        :return: PFs ordered by PCI address
+        :rtype: typing.List[PCIFunction]
+        """
+        return [
+            function for function in self
+            if function.is_pf and (driver is None or
+                                   function.driver == driver)
+        ]
+
+    def vfs(self, pf: PCIFunction) -> typing.List[PCIFunction]:
+        """SR-IOV Virtual Functions of a Physical Function
+
+        :param pf: Physical Function
+        :type: PCIFunction
+        :return: VFs ordered by VF index
+        :rtype: typing.List[PCIFunction]
+        """
+        return [
+            self._functions[vf_addr] for vf_addr in pf.vf_addrs
+            if vf_addr in self._functions
+        ]
+
+    def refresh(self, pci_addrs: typing.Iterable[str] = None) -> 'Topology':
+        """Take a new snapshot after an operation that changed state
+
+        :param pci_addrs: only re-read these functions, all other functions
+                          are carried over from this snapshot. Default is to
+                          rescan the complete topology.
+        :type: typing.Iterable[str]
+        :return: new topology snapshot
+        :rtype: Topology
+        """
+        if pci_addrs is None:
+            return scan(self._root)
+        functions = dict(self._functions)
+        for pci_addr in pci_addrs:
+            try:
+                functions[pci_addr] = read_function(self._root, pci_addr)
+            except (FileNotFoundError, NotADirectoryError):
+                functions.pop(pci_addr, None)
+        return Topology(functions.values(), root=self._root)
+
+
+def scan(root: str = None) -> Topology:
+    """Take a snapshot of the PCI function to netdev topology
+
+    :param root: sysfs mount point, defaults to SYSFS_ROOT
+    :type: str
+    :return: topology snapshot
+    :rtype: Topology
+    """
+    root = root or SYSFS_ROOT
+    functions = []
+    with os.scandir(os.path.join(root, "bus/pci/devices")) as entries:
+        for entry in entries:
+            try:
+                functions.append(read_function(root, entry.name))
+            except (FileNotFoundError, NotADirectoryError):
+                # NOTE: device was removed while scanning
+                continue
+    return Topology(functions, root=root)
+
+
+def scan_pfs(pf_addrs: typing.Iterable[str], root: str = None) -> Topology:
+    """Take a snapshot of some PFs and of their VFs only
+
+    Costs a directory scan per function rather than one per PCI function
+    of the host, for runs operating on given PFs.
+
+    :param pf_addrs: PCI addresses of PFs
+    :type: typing.Iterable[str]
+    :param root: sysfs mount point, defaults to SYSFS_ROOT
+    :type: str
+    :return: topology snapshot, without functions which do not exist
+    :rtype: Topology
+    """
+    snapshot = Topology([], root=root).refresh(pf_addrs)
+    return snapshot.refresh([vf_addr for pf in snapshot
+                             for vf_addr in pf.vf_addrs])
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#
+# Copyright 2019 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Kernel uevents from the kobject uevent netlink socket or a recording"""
+
+import collections
+import errno
+import select
+import socket
+import typing
+
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_GROUP_KERNEL = 1
+
+UEVENT_BUFFER_SIZE = 1 << 16
+# NOTE: a burst of VF creation emits several uevents per VF, make room for
+# them while the previous burst is being processed.
+UEVENT_RCVBUF_SIZE = 1 << 22
+
+
+class UEventsLost(Exception):
+    pass
+
+
+class UEvent(collections.namedtuple(
+        "UEvent", ["action", "devpath", "env"])):
+    """A single kernel uevent"""
+
+    __slots__ = ()
+
+    @property
+    def subsystem(self) -> str:
+        """Subsystem of the device the event is about
+
+        :return: subsystem name, e.g. pci or net
+        :rtype: str
+        """
+        return self.env.get("SUBSYSTEM")
+
+    @property
+    def pci_addr(self) -> str:
+        """PCI address of the function the event is about
+
+        :return: PCI address or None if not a PCI event
+        :rtype: str
+        """
+        if self.subsystem != "pci":
+            return None
+        return self.env.get("PCI_SLOT_NAME")
+
+    def __str__(self) -> str:
+        """String represenation of object
+
+        :return: action and device path
+        :rtype: str
+        """
+        return "{}@{}".format(self.action, self.devpath)
+
+
+def make_uevent(action: str, devpath: str, **env) -> UEvent:
+    """Create a uevent as the kernel would emit it
+
+    :param action: action, e.g. add, remove, bind
+    :type: str
+    :param devpath: sysfs path of the device, relative to the mount point
+    :type: str
+    :return: uevent
+    :rtype: UEvent
+    """
+    env = collections.OrderedDict(
+        [("ACTION", action), ("DEVPATH", devpath)] + sorted(env.items()))
+    return UEvent(action, devpath, env)
+
+
+def parse_uevent(data: bytes) -> UEvent:
+    """Parse a kernel uevent netlink message
+
+    :param data: message as received from the socket
+    :type: bytes
+    :return: uevent
+    :rtype: UEvent
+    :raises: ValueError if data is not a kernel uevent, e.g. one rebroadcast
+             by udev
+    """
+    fields = data.decode("utf-8", "replace").split("\0")
+    header = fields[0]
+    if "@" not in header:
+        raise ValueError("Not a kernel uevent: {!r}".format(header))
+    action, devpath = header.split("@", 1)
+    env = collections.OrderedDict()
+    for field in fields[1:]:
+        if "=" in field:
+            key, value = field.split("=", 1)
+            env[key] = value
+    return UEvent(env.get("ACTION", action), env.get("DEVPATH", devpath), env)
+
+
+def format_uevent(event: UEvent) -> bytes:
+    """Format a uevent as the kernel sends it on the netlink socket
+
+    :param event: uevent
+    :type: UEvent
+    :return: netlink message
+    :rtype: bytes
+    """
+    fields = ["{}@{}".format(event.action, event.devpath)]
+    fields.extend("{}={}".format(key, value)
+                  for key, value in event.env.items())
+    return "\0".join(fields).encode("utf-8") + b"\0"
+
+
+def read_uevents(stream: typing.TextIO) -> typing.Iterator[UEvent]:
+    """Read uevents recorded with ``udevadm monitor --kernel --property``
+
+    Events are blocks of KEY=VALUE lines separated by empty lines, other
+    lines such as the KERNEL[...] headers of udevadm are ignored.
+
+    :param stream: recording
+    :type: typing.TextIO
+    :return: recorded uevents
+    :rtype: typing.Iterator[UEvent]
+    """
+    env = collections.OrderedDict()
+    for line in stream:
+        line = line.strip()
+        if not line:
+            if "ACTION" in env and "DEVPATH" in env:
+                yield UEvent(env["ACTION"], env["DEVPATH"], env)
+            env = collections.OrderedDict()
+        elif "=" in line and not line.startswith(("KERNEL[", "UDEV[")):
+            key, value = line.split("=", 1)
+            env[key] = value
+    if "ACTION" in env and "DEVPATH" in env:
+        yield UEvent(env["ACTION"], env["DEVPATH"], env)
+
+
+class UEventSocket(object):
+    """Receives kernel uevents from the kobject uevent netlink socket"""
+
+    def __init__(self, sock: socket.socket = None):
+        """Initialise a new uevent socket
+
+        :param sock: connected socket to use instead of the netlink socket,
+                     used to inject synthetic uevents
+        :type: socket.socket
+        """
+        if sock is None:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                 NETLINK_KOBJECT_UEVENT)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                UEVENT_RCVBUF_SIZE)
+                sock.bind((0, UEVENT_GROUP_KERNEL))
+            except OSError:
+                sock.close()
+                raise
+        self._sock = sock
+
+    def recv(self, timeout: float = None) -> UEvent:
+        """Receive the next kernel uevent
+
+        :param timeout: seconds to wait for an event, forever if None
+        :type: float
+        :return: uevent or None if no event arrived before the timeout
+        :rtype: UEvent
+        :raises: EOFError if the peer of an injection socket went away
+        :raises: UEventsLost if uevents were dropped as the receive buffer
+                 overflowed, callers have to read the state they track
+                 from sysfs again
+        """
+        while True:
+            if timeout is not None:
+                readable, _, _ = select.select([self._sock], [], [], timeout)
+                if not readable:
+                    return None
+            try:
+                data = self._sock.recv(UEVENT_BUFFER_SIZE)
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                raise UEventsLost("uevents lost: {}".format(e))
+            if not data:
+                raise EOFError("uevent source closed")
+            try:
+                return parse_uevent(data)
+            except ValueError:
+                continue
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def close(self):
+        self._sock.close()
+
+
+class UEventReplay(object):
+    """Replays recorded uevents, with the interface of UEventSocket"""
+
+    def __init__(self, events: typing.Iterable[UEvent]):
+        """Initialise a new uevent replay
+
+        :param events: uevents to replay
+        :type: typing.Iterable[UEvent]
+        """
+        self._events = iter(events)
+
+    def recv(self, timeout: float = None) -> UEvent:
+        """Return the next recorded uevent
+
+        :param timeout: unused, recorded events are always available
+        :type: float
+        :return: uevent
+        :rtype: UEvent
+        :raises: EOFError once all events have been replayed
+        """
+        try:
+            return next(self._events)
+        except StopIteration:
+            raise EOFError("end of recorded uevents")
+
+    def close(self):
+        pass
+
+
+def connect_pair() -> typing.Tuple[UEventSocket, socket.socket]:
+    """Create a uevent socket fed by the returned injection socket
+
+    Messages sent on the injection socket, formatted with format_uevent(),
+    are received as kernel uevents. Closing the injection socket ends the
+    stream of uevents.
+
+    :return: uevent socket and injection socket
+    :rtype: typing.Tuple[UEventSocket, socket.socket]
+    """
+    client, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    return UEventSocket(sock=client), server